@@ -16,6 +16,10 @@ from modules.memory_management import *
 from modules.system_management import register_system_routes
 from modules.prompt_management import register_prompt_routes
 from modules.chat_instances import register_chat_instance_routes  
+from modules.conversation_search import register_search_routes
+from modules.jobs import register_job_routes, recover_jobs
+from modules.scenario_management import register_scenario_routes
+from modules.local_model import start_warm_up
 
 print(f"STATIC_FOLDER configured as: {Config.STATIC_FOLDER}")
 print(f"Does this path exist? {os.path.exists(Config.STATIC_FOLDER)}")
@@ -52,6 +56,9 @@ register_ai_routes(app)
 register_system_routes(app)
 register_prompt_routes(app)
 register_chat_instance_routes(app) 
+register_search_routes(app)
+register_job_routes(app)
+register_scenario_routes(app)
 
 # Verify critical API routes are registered
 @app.route('/api/check-routes', methods=['GET'])
@@ -75,6 +82,13 @@ def check_routes():
         "routes": status
     }
 
+def on_startup():
+    """Work done once when a server process starts serving (never when the app is only imported)"""
+    # Run the jobs again that were queued or running when the server stopped
+    recover_jobs()
+    # Load the local model now rather than on the first request that uses it (if LOCAL_MODEL_WARM_UP is set)
+    start_warm_up()
+
 # Main application entry point
 if __name__ == '__main__':
     # Verify critical API routes before starting
@@ -82,4 +96,8 @@ if __name__ == '__main__':
     for rule in app.url_map.iter_rules():
         print(f"Route: {rule} Methods: {rule.methods}")
     
+    # With the reloader (debug mode) only the child process serves requests
+    if not Config.DEBUG or os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        on_startup()
+    
     app.run(host=Config.HOST, port=Config.PORT, debug=Config.DEBUG)
\ No newline at end of file
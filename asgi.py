@@ -0,0 +1,534 @@
+"""
+ASGI entry point: serves the app from an asyncio event loop.
+
+    uvicorn asgi:app --host 0.0.0.0 --port 5000    (or any ASGI server, e.g. hypercorn)
+
+Chat turns and the generate-text, generate-json, generate-field and
+generate-fields endpoints run as coroutines: while they wait on the model
+they hold no thread, so one process can keep hundreds of turns in flight. Their blocking storage work
+runs in short worker-thread calls (asyncio.to_thread).
+
+Every other route is served by the Flask app from app.py on a pool of
+Config.ASGI_WSGI_THREADS threads, each response start to finish on one
+thread (streamed bodies such as the SSE routes keep their request context).
+Slow model calls never occupy that pool, so cheap endpoints like
+/api/characters stay responsive under load.
+`python app.py` still serves everything synchronously, as before.
+"""
+
+import asyncio
+import io
+import json
+import re
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from werkzeug.datastructures import Headers, MIMEAccept
+from werkzeug.http import parse_accept_header
+
+from config import Config
+from app import app as flask_app, on_startup
+from modules.ai_integration import (
+    get_openrouter_response_async, get_local_model_response_async,
+    stream_openrouter_response_async, stream_local_model_response_async,
+    process_llm_response, is_valid_json_response, validate_json_response,
+    build_field_prompts, clean_field_content
+)
+from modules.chat_locks import async_chat_lock, ChatLockTimeout
+from modules.llm_scheduler import LLMOverloaded, llm_priority, PRIORITY_INTERACTIVE
+from modules.chat_management import (
+    prepare_chat_turn, complete_chat_turn, clean_chat_response, turn_state, format_sse
+)
+from modules.response_cache import get_cache_mode, cached_generate_async, model_id
+from modules.response_parser import ResponseParser
+from modules.scene_tasks import get_scene, POLL_INTERVAL, SCENE_PENDING
+
+_wsgi_pool = ThreadPoolExecutor(max_workers=Config.ASGI_WSGI_THREADS, thread_name_prefix="wsgi")
+# Body chunks a Flask response may get ahead of the client by
+WSGI_BUFFERED_CHUNKS = 8
+# Shared by every generate-fields request; created on the server's event loop
+_field_slots = None
+
+
+class Request:
+    """The parts of an ASGI HTTP request the async routes need"""
+
+    def __init__(self, scope, body):
+        self.method = scope["method"]
+        self.path = scope["path"]
+        self.headers = Headers([(k.decode("latin-1"), v.decode("latin-1")) for k, v in scope["headers"]])
+        self.body = body
+
+    def json(self):
+        try:
+            return json.loads(self.body or b"null")
+        except ValueError:
+            return None
+
+    def wants_event_stream(self):
+        accept = parse_accept_header(self.headers.get("Accept"), MIMEAccept)
+        return accept.best_match(["application/json", "text/event-stream"]) == "text/event-stream"
+
+
+async def read_body(receive):
+    chunks = []
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            break
+        chunks.append(message.get("body", b""))
+        if not message.get("more_body"):
+            break
+    return b"".join(chunks)
+
+
+class ResponseSender:
+    """Wraps an ASGI send callable, tracking how far the response has got"""
+
+    def __init__(self, send):
+        self._send = send
+        self.started = False
+        self.finished = False
+        self.event_stream = False
+
+    async def __call__(self, message):
+        if message["type"] == "http.response.start":
+            self.started = True
+            self.event_stream = any(
+                name == b"content-type" and value.startswith(b"text/event-stream")
+                for name, value in message.get("headers", [])
+            )
+        elif message["type"] == "http.response.body" and not message.get("more_body"):
+            self.finished = True
+        await self._send(message)
+
+
+async def send_error(send, status, data, headers=None):
+    """
+    Report a failed request: as the response if none was started yet, or as
+    a final `error` event if an event stream was. A response start can only
+    be sent once, so a started response of another type cannot carry it.
+
+    Returns:
+        bool: Whether the error was reported
+    """
+    if not send.started:
+        await send_json(send, status, data, headers)
+        return True
+    if send.finished or not send.event_stream:
+        return False
+    event = format_sse("error", {"error": data.get("message", "")})
+    await send({"type": "http.response.body", "body": event.encode("utf-8")})
+    return True
+
+
+async def start_response(send, status, content_type, headers=None):
+    raw_headers = [(b"content-type", content_type.encode("latin-1"))]
+    for name, value in (headers or {}).items():
+        raw_headers.append((name.lower().encode("latin-1"), str(value).encode("latin-1")))
+    await send({"type": "http.response.start", "status": status, "headers": raw_headers})
+
+
+async def send_json(send, status, data, headers=None):
+    await start_response(send, status, "application/json", headers)
+    await send({"type": "http.response.body", "body": json.dumps(data).encode("utf-8")})
+
+
+def _in_app_context(func, *args):
+    """Run code that builds Flask responses (jsonify) outside of a Flask request"""
+    with flask_app.app_context():
+        return func(*args)
+
+
+async def send_flask_response(send, result):
+    """Send a (response, status) pair returned by shared Flask code"""
+    response, status = result
+    await start_response(send, status, response.content_type)
+    await send({"type": "http.response.body", "body": response.get_data()})
+
+
+# --- Chat ---
+
+async def wait_for_scene(chat_id, turn, wait):
+    """Poll for a background scene without holding a thread while waiting"""
+    deadline = asyncio.get_running_loop().time() + wait
+    while True:
+        scene = await asyncio.to_thread(get_scene, chat_id, turn)
+        if scene is None or scene["status"] != SCENE_PENDING:
+            return scene
+        if asyncio.get_running_loop().time() >= deadline:
+            return scene
+        await asyncio.sleep(POLL_INTERVAL)
+
+
+async def stream_chat_turn_async(turn, lock):
+    """asyncio version of chat_management.stream_chat_turn (same events)"""
+    parser = ResponseParser()
+    if turn["use_local_model"]:
+        stream = lambda system_prompt, message: stream_local_model_response_async(system_prompt, message, chat=turn["local_context"])
+    else:
+        stream = stream_openrouter_response_async
+
+    try:
+        async for delta in stream(turn["system_prompt"], turn["message"]):
+            text = parser.feed(delta)
+            if text:
+                yield format_sse("token", {"text": text})
+
+        processed_response = clean_chat_response(parser.close())
+        yield format_sse("state", turn_state(processed_response))
+
+        turn["result"] = await lock.run(complete_chat_turn, turn, processed_response)
+        yield format_sse("done", turn["result"])
+    except Exception as e:
+        print(f"Error streaming chat turn: {str(e)}")
+        yield format_sse("error", {"error": str(e)})
+
+
+async def chat(request, send, chat_id):
+    """POST /api/chat/<chat_id>: the same request and response as the Flask route"""
+    data = request.json()
+    streaming = request.wants_event_stream()
+
+    try:
+        with llm_priority(PRIORITY_INTERACTIVE, chat_id):
+            async with async_chat_lock(chat_id) as lock:
+                turn, error = await lock.run(_in_app_context, prepare_chat_turn, chat_id, data)
+                if error:
+                    return await send_flask_response(send, error)
+
+                if streaming:
+                    await start_response(send, 200, "text/event-stream", {
+                        "Cache-Control": "no-cache",
+                        "X-Accel-Buffering": "no"
+                    })
+                    async for event in stream_chat_turn_async(turn, lock):
+                        await send({"type": "http.response.body", "body": event.encode("utf-8"), "more_body": True})
+                else:
+                    if turn["use_local_model"]:
+                        response = await get_local_model_response_async(turn["system_prompt"], turn["message"],
+                                                                        chat=turn["local_context"])
+                    else:
+                        response = await get_openrouter_response_async(turn["system_prompt"], turn["message"])
+                    processed_response = clean_chat_response(process_llm_response(response))
+                    return await send_json(send, 200, await lock.run(complete_chat_turn, turn, processed_response))
+    except ChatLockTimeout:
+        return await send_json(send, 409, {"error": "This chat is busy with another request. Please try again."})
+
+    # The scene is saved under the chat's lock, so wait for it only after releasing it
+    result = turn.get("result")
+    if result and result["scene_status"] == SCENE_PENDING:
+        scene = await wait_for_scene(chat_id, result["turn"], Config.SCENE_DEADLINE + 1)
+        await send({"type": "http.response.body", "body": format_sse("scene", scene).encode("utf-8"), "more_body": True})
+    await send({"type": "http.response.body", "body": b""})
+
+
+# --- Generation ---
+
+def _text_request(data, default_system_prompt):
+    """Prompt, system prompt, temperature and max_tokens of a generate-text/json request"""
+    return (
+        data.get("prompt"),
+        data.get("system_prompt", default_system_prompt),
+        float(data.get("temperature", 0.7)),
+        data.get("max_tokens")
+    )
+
+
+async def generate_text(request, send):
+    """POST /api/generate-text (see ai_integration.generate_text)"""
+    data = request.json()
+    if not data or "prompt" not in data:
+        return await send_json(send, 400, {"success": False, "message": "Prompt is required"})
+
+    prompt, system_prompt, temperature, max_tokens = _text_request(data, "You are a helpful AI assistant.")
+    response, cache_status = await cached_generate_async(
+        get_cache_mode(data, temperature, request.headers),
+        lambda: get_openrouter_response_async(system_prompt, prompt, temperature, max_tokens),
+        model_id(), system_prompt, prompt, temperature, max_tokens
+    )
+    await send_json(send, 200, {"success": True, "text": response}, {"X-Response-Cache": cache_status})
+
+
+async def generate_json(request, send):
+    """POST /api/generate-json (see ai_integration.generate_json)"""
+    data = request.json()
+    if not data or "prompt" not in data:
+        return await send_json(send, 400, {"success": False, "message": "Prompt is required"})
+
+    prompt, system_prompt, temperature, max_tokens = _text_request(
+        data, "You are a helpful AI assistant. Respond with valid JSON only."
+    )
+    # Add instruction to respond with JSON only
+    if not prompt.lower().endswith("json"):
+        prompt += " Respond with valid JSON only."
+
+    response, cache_status = await cached_generate_async(
+        get_cache_mode(data, temperature, request.headers),
+        lambda: get_openrouter_response_async(system_prompt, prompt, temperature, max_tokens),
+        model_id(), system_prompt, prompt, temperature, max_tokens,
+        validate=is_valid_json_response
+    )
+    try:
+        json_data = validate_json_response(response)
+    except ValueError as e:
+        return await send_json(send, 400, {
+            "success": False,
+            "message": f"Failed to parse AI response as JSON: {str(e)}",
+            "raw_response": response
+        })
+    await send_json(send, 200, {"success": True, "data": json_data}, {"X-Response-Cache": cache_status})
+
+
+async def generate_field(request, send):
+    """POST /api/generate-field (see ai_integration.generate_field)"""
+    data = request.json()
+    if not data:
+        return await send_json(send, 400, {"success": False, "message": "Request data is required"})
+    if "prompt" not in data:
+        return await send_json(send, 400, {"success": False, "message": "Prompt is required"})
+    if "field_type" not in data:
+        return await send_json(send, 400, {"success": False, "message": "Field type is required"})
+
+    field_type = data["field_type"]
+    temperature = float(data.get("temperature", 0.7))
+    content, cache_status = await generate_field_content_async(
+        field_type, data["prompt"], data.get("use_local_model", False), temperature,
+        get_cache_mode(data, temperature, request.headers)
+    )
+    await send_json(send, 200, {
+        "success": True,
+        "content": content,
+        "field_type": field_type
+    }, {"X-Response-Cache": cache_status})
+
+
+async def generate_field_content_async(field_type, prompt, use_local_model, temperature, cache_mode):
+    """asyncio version of ai_integration.generate_field_content"""
+    system_prompt, formatted_prompt = build_field_prompts(field_type, prompt)
+    use_local_model = bool(use_local_model and Config.LOCAL_MODEL_ENDPOINT)
+    generate = get_local_model_response_async if use_local_model else get_openrouter_response_async
+
+    content, cache_status = await cached_generate_async(
+        cache_mode,
+        lambda: generate(system_prompt, formatted_prompt, temperature),
+        model_id(use_local_model), system_prompt, formatted_prompt, temperature
+    )
+    return clean_field_content(field_type, content), cache_status
+
+
+async def generate_fields(request, send):
+    """POST /api/generate-fields (see ai_integration.generate_fields)"""
+    global _field_slots
+    data = request.json()
+    if not data:
+        return await send_json(send, 400, {"success": False, "message": "Request data is required"})
+    if "prompt" not in data:
+        return await send_json(send, 400, {"success": False, "message": "Prompt is required"})
+    field_types = data.get("field_types")
+    if not isinstance(field_types, list) or not field_types or not all(isinstance(f, str) for f in field_types):
+        return await send_json(send, 400, {"success": False, "message": "A list of field types is required"})
+
+    temperature = float(data.get("temperature", 0.7))
+    cache_mode = get_cache_mode(data, temperature, request.headers)
+    if _field_slots is None:
+        _field_slots = asyncio.Semaphore(Config.FIELD_BATCH_CONCURRENCY)
+
+    async def generate_one(field_type):
+        async with _field_slots:
+            try:
+                content, _ = await generate_field_content_async(
+                    field_type, data["prompt"], data.get("use_local_model", False), temperature, cache_mode
+                )
+                return {"field_type": field_type, "content": content}
+            except Exception as e:
+                print(f"Error generating {field_type}: {str(e)}")
+                return {"field_type": field_type, "error": str(e)}
+
+    streaming = request.wants_event_stream()
+    if streaming:
+        await start_response(send, 200, "text/event-stream", {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+    fields, errors = {}, {}
+    tasks = [asyncio.ensure_future(generate_one(field_type)) for field_type in dict.fromkeys(field_types)]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            result = await next_done
+            if "error" in result:
+                errors[result["field_type"]] = result["error"]
+            else:
+                fields[result["field_type"]] = result["content"]
+            if streaming:
+                await send({"type": "http.response.body", "body": format_sse("field", result).encode("utf-8"),
+                            "more_body": True})
+    finally:
+        for task in tasks:
+            task.cancel()
+
+    payload = {"success": not errors, "fields": fields, "errors": errors}
+    if streaming:
+        await send({"type": "http.response.body", "body": format_sse("done", payload).encode("utf-8")})
+    else:
+        await send_json(send, 200, payload)
+
+
+# (method, path pattern, handler) of the routes served natively; everything else goes to Flask
+ASYNC_ROUTES = [
+    ("POST", re.compile(r"^/api/chat/(?P<chat_id>[^/]+)$"), chat),
+    ("POST", re.compile(r"^/api/generate-text$"), generate_text),
+    ("POST", re.compile(r"^/api/generate-json$"), generate_json),
+    ("POST", re.compile(r"^/api/generate-field$"), generate_field),
+    ("POST", re.compile(r"^/api/generate-fields$"), generate_fields),
+]
+
+
+# --- Flask bridge ---
+
+def _wsgi_environ(scope, body):
+    server = scope.get("server") or ("localhost", 80)
+    client = scope.get("client") or ("", 0)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", ""),
+        # WSGI carries the decoded path as latin-1 text
+        "PATH_INFO": scope["path"].encode("utf-8").decode("latin-1"),
+        "QUERY_STRING": scope.get("query_string", b"").decode("latin-1"),
+        "SERVER_NAME": server[0],
+        "SERVER_PORT": str(server[1]),
+        "SERVER_PROTOCOL": f"HTTP/{scope.get('http_version', '1.1')}",
+        "REMOTE_ADDR": client[0],
+        "CONTENT_LENGTH": str(len(body)),
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": io.BytesIO(body),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": True,
+        "wsgi.run_once": False
+    }
+    for raw_name, raw_value in scope["headers"]:
+        name = raw_name.decode("latin-1").upper().replace("-", "_")
+        value = raw_value.decode("latin-1")
+        if name == "CONTENT_TYPE":
+            environ["CONTENT_TYPE"] = value
+        elif name != "CONTENT_LENGTH":
+            key = f"HTTP_{name}"
+            environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+
+def _start_wsgi(environ):
+    """Call the Flask app; returns (status, headers, body iterator)"""
+    started = {}
+
+    def start_response(status, headers, exc_info=None):
+        started["status"] = int(status.split(" ", 1)[0])
+        started["headers"] = headers
+
+    body = flask_app(environ, start_response)
+    return started["status"], started["headers"], iter(body), body
+
+
+def _run_wsgi(environ, put, stopped):
+    """
+    Run a Flask response start to finish on this thread, handing each part
+    to put(): ("start", status, headers), ("body", chunk), then ("end",) or
+    ("error", exception). Flask's stream_with_context keeps the request
+    context in this thread's context, so a streamed body must not move to
+    another thread between chunks.
+    """
+    try:
+        status, headers, chunks, body_iterable = _start_wsgi(environ)
+    except Exception as e:
+        put(("error", e))
+        return
+    try:
+        put(("start", status, headers))
+        for chunk in chunks:
+            if stopped.is_set():
+                return
+            if chunk:
+                put(("body", chunk))
+        put(("end",))
+    except Exception as e:
+        put(("error", e))
+    finally:
+        if hasattr(body_iterable, "close"):
+            body_iterable.close()
+
+
+async def serve_with_flask(scope, body, send):
+    """Serve a request with the Flask app on one WSGI pool thread, streaming its body"""
+    loop = asyncio.get_running_loop()
+    parts = asyncio.Queue(maxsize=WSGI_BUFFERED_CHUNKS)
+    # Set when the response is abandoned (client gone, send failed): the thread stops at the next chunk
+    stopped = threading.Event()
+
+    def put(part):
+        # Waits for room, so a slow client slows the Flask response down
+        asyncio.run_coroutine_threadsafe(parts.put(part), loop).result()
+
+    loop.run_in_executor(_wsgi_pool, _run_wsgi, _wsgi_environ(scope, body), put, stopped)
+    try:
+        while True:
+            part = await parts.get()
+            if part[0] == "error":
+                raise part[1]
+            if part[0] == "start":
+                await send({
+                    "type": "http.response.start",
+                    "status": part[1],
+                    "headers": [(name.lower().encode("latin-1"), value.encode("latin-1")) for name, value in part[2]]
+                })
+            elif part[0] == "body":
+                await send({"type": "http.response.body", "body": part[1], "more_body": True})
+            else:
+                await send({"type": "http.response.body", "body": b""})
+                return
+    finally:
+        stopped.set()
+        # Make room for a part the thread may be waiting to put, so it can see it was stopped
+        while not parts.empty():
+            parts.get_nowait()
+
+
+async def app(scope, receive, send):
+    """The ASGI application"""
+    if scope["type"] == "lifespan":
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await asyncio.to_thread(on_startup)
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                _wsgi_pool.shutdown(wait=False)
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+    if scope["type"] != "http":
+        return
+
+    body = await read_body(receive)
+    send = ResponseSender(send)
+    for method, pattern, handler in ASYNC_ROUTES:
+        match = pattern.match(scope["path"])
+        if match and scope["method"] == method:
+            try:
+                return await handler(Request(scope, body), send, **match.groupdict())
+            except LLMOverloaded as e:
+                if not await send_error(send, 429, {"success": False, "error": str(e), "message": str(e)},
+                                        {"Retry-After": str(e.retry_after)}):
+                    raise
+                return
+            except Exception as e:
+                print(f"Error handling {scope['path']}: {str(e)}")
+                # Otherwise the server drops the connection, so the client sees the response fail
+                if not await send_error(send, 500, {"success": False, "message": str(e)}):
+                    raise
+                return
+
+    try:
+        await serve_with_flask(scope, body, send)
+    except Exception as e:
+        print(f"Error handling {scope['path']}: {str(e)}")
+        if not await send_error(send, 500, {"success": False, "message": str(e)}):
+            raise
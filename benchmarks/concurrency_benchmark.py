@@ -0,0 +1,218 @@
+"""
+Load test: concurrent chat turns on the threaded Flask app vs the ASGI app.
+
+A fake model server answers every completion after a fixed latency. At each
+concurrency level, that many chat turns (on separate chats) are sent at
+once to:
+
+- flask: app.py served by a fixed pool of worker threads, like
+  `gunicorn --threads N` (every turn holds a thread while it waits)
+- asgi:  asgi.py on one event loop (turns wait on sockets, not threads)
+
+GET /api/characters requests sent along with the turns show how a cheap
+endpoint fares next to slow turns. Both apps are driven in-process
+(WSGI test client / direct ASGI calls) so no HTTP server is needed; the
+model calls go over real sockets to the fake server.
+
+Usage:
+    python benchmarks/concurrency_benchmark.py
+    python benchmarks/concurrency_benchmark.py --latency 1 --threads 16 --concurrency 16,64,256
+"""
+
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import Config  # noqa: E402
+from benchmarks.storage_benchmark import point_config_at  # noqa: E402
+
+REPLY = {
+    "text": "Another ale, then? The rain won't let up tonight.",
+    "mood": "content",
+    "emotions": {"warmth": 0.6},
+    "opinion_of_user": "positive",
+    "action": "wiping a mug",
+    "location": "Tavern",
+    "scene_description": "Rain drums on the shutters as the innkeeper slides a mug across the bar."
+}
+
+
+def start_fake_model_server(latency):
+    """Serve OpenAI-style completions after `latency` seconds; returns the base URL"""
+    body = json.dumps({"choices": [{"message": {"content": json.dumps(REPLY)}}]}).encode("utf-8")
+    ready = threading.Event()
+    address = {}
+
+    async def handle(reader, writer):
+        try:
+            while True:
+                head = await reader.readuntil(b"\r\n\r\n")
+                length = 0
+                for line in head.split(b"\r\n"):
+                    if line.lower().startswith(b"content-length:"):
+                        length = int(line.split(b":", 1)[1])
+                await reader.readexactly(length)
+                await asyncio.sleep(latency)
+                writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n"
+                             b"Content-Length: %d\r\n\r\n%s" % (len(body), body))
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    def run():
+        loop = asyncio.new_event_loop()
+        server = loop.run_until_complete(asyncio.start_server(handle, "127.0.0.1", 0, backlog=1024))
+        address["port"] = server.sockets[0].getsockname()[1]
+        ready.set()
+        loop.run_forever()
+
+    threading.Thread(target=run, daemon=True).start()
+    ready.wait()
+    return f"http://127.0.0.1:{address['port']}"
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+
+def create_chats(client, count):
+    chat_ids = []
+    for _ in range(count):
+        response = client.post("/api/chats", json={"character_id": "bench", "title": "Bench"})
+        chat_ids.append(response.json["id"])
+    return chat_ids
+
+
+def run_flask(flask_app, chat_ids, threads, probes):
+    """
+    Send one turn per chat, then the probe requests, through a fixed thread pool.
+    Latencies run from when all requests were submitted, so they include queueing.
+    Returns (seconds, turn latencies, probe latencies).
+    """
+    pool = ThreadPoolExecutor(max_workers=threads)
+
+    def finished(method, path, body=None):
+        response = flask_app.test_client().open(path, method=method, json=body)
+        assert response.status_code == 200, response.data
+        return time.perf_counter()
+
+    begin = time.perf_counter()
+    turns = [pool.submit(finished, "POST", f"/api/chat/{chat_id}", {"message": "Another round?"})
+             for chat_id in chat_ids]
+    # Cheap requests arriving while the turns are in flight wait for the same threads
+    checks = [pool.submit(finished, "GET", "/api/characters") for _ in range(probes)]
+    turn_latencies = [future.result() - begin for future in turns]
+    probe_latencies = [future.result() - begin for future in checks]
+    elapsed = time.perf_counter() - begin
+    pool.shutdown()
+    return elapsed, turn_latencies, probe_latencies
+
+
+async def call_asgi(asgi_app, method, path, body=None):
+    """Make one request to an ASGI app in-process; returns (status, body)"""
+    payload = json.dumps(body).encode("utf-8") if body is not None else b""
+    scope = {
+        "type": "http", "method": method, "path": path, "query_string": b"", "root_path": "",
+        "headers": [(b"content-type", b"application/json"), (b"accept", b"application/json")],
+        "http_version": "1.1", "scheme": "http", "server": ("bench", 80), "client": ("127.0.0.1", 0)
+    }
+    received = False
+    result = {"body": []}
+
+    async def receive():
+        nonlocal received
+        if not received:
+            received = True
+            return {"type": "http.request", "body": payload, "more_body": False}
+        await asyncio.Event().wait()
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            result["status"] = message["status"]
+        else:
+            result["body"].append(message.get("body", b""))
+
+    await asgi_app(scope, receive, send)
+    return result["status"], b"".join(result["body"])
+
+
+async def run_asgi(asgi_app, chat_ids, probes):
+    """The same requests as run_flask, all started at once on the event loop"""
+    async def finished(method, path, body=None):
+        status, data = await call_asgi(asgi_app, method, path, body)
+        assert status == 200, data
+        return time.perf_counter()
+
+    begin = time.perf_counter()
+    turns = [finished("POST", f"/api/chat/{chat_id}", {"message": "Another round?"}) for chat_id in chat_ids]
+    checks = [finished("GET", "/api/characters") for _ in range(probes)]
+    results = await asyncio.gather(*turns, *checks)
+    elapsed = time.perf_counter() - begin
+    latencies = [end - begin for end in results]
+    return elapsed, latencies[:len(chat_ids)], latencies[len(chat_ids):]
+
+
+def report(name, concurrency, elapsed, turn_latencies, probe_latencies):
+    print(f"  {name:<6} {concurrency:>5} turns  {elapsed:7.2f} s  {concurrency / elapsed:7.1f} turns/s  "
+          f"turn p50 {statistics.median(turn_latencies):6.2f} s  p95 {percentile(turn_latencies, 0.95):6.2f} s  "
+          f"/api/characters p50 {statistics.median(probe_latencies):6.2f} s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare concurrent chat turns on the Flask and ASGI apps")
+    parser.add_argument("--latency", type=float, default=0.5, help="Seconds the fake model takes per completion")
+    parser.add_argument("--threads", type=int, default=8, help="Worker threads of the Flask server")
+    parser.add_argument("--concurrency", default="8,32,128,256", help="Comma-separated numbers of simultaneous turns")
+    parser.add_argument("--probes", type=int, default=5, help="Timed /api/characters requests per run")
+    args = parser.parse_args()
+
+    folder = tempfile.mkdtemp(prefix="concurrency-bench-")
+    try:
+        point_config_at(folder)
+        Config.OPENROUTER_API_KEY = "benchmark"
+        Config.DEFAULT_MODEL = "benchmark/model"
+        # One model call per turn, so both apps do the same upstream work
+        Config.SCENE_MODE = "combined"
+
+        from modules import http_client
+        http_client.OPENROUTER_CHAT_URL = start_fake_model_server(args.latency) + "/chat/completions"
+
+        from app import app as flask_app
+        import asgi
+        from modules.storage import get_storage
+
+        get_storage().save_character({"id": "bench", "name": "Innkeeper", "description": "Runs the tavern",
+                                      "personality": "Gruff but kind"})
+        client = flask_app.test_client()
+        levels = [int(level) for level in args.concurrency.split(",")]
+
+        print(f"model latency {args.latency} s, flask threads {args.threads}\n")
+        for concurrency in levels:
+            # The app logs every turn; keep only the report
+            with contextlib.redirect_stdout(io.StringIO()):
+                flask_result = run_flask(flask_app, create_chats(client, concurrency), args.threads, args.probes)
+                asgi_result = asyncio.run(run_asgi(asgi.app, create_chats(client, concurrency), args.probes))
+            report("flask", concurrency, *flask_result)
+            report("asgi", concurrency, *asgi_result)
+            print()
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
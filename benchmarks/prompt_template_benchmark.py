@@ -0,0 +1,214 @@
+"""
+Benchmark rendering the chat system prompt from compiled templates against
+the path it replaced (reading the template file through the data cache and
+a str.format call and concatenation per template), and the compiled
+player action instructions against the f-string they replaced: the render
+alone, and the player action work of a whole turn (which used to parse the
+action JSON once for the instructions and again for the message).
+
+Both paths are checked to produce the same text before they are timed.
+
+Usage:
+    python benchmarks/prompt_template_benchmark.py
+    python benchmarks/prompt_template_benchmark.py --repeat 20000
+"""
+
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import Config  # noqa: E402
+from modules.storage import get_storage  # noqa: E402
+from modules.player_actions import handle_player_action_prompt, parse_player_action  # noqa: E402
+from modules.prompt_prefix import MESSAGE_INSTRUCTIONS, build_prompt_prefix  # noqa: E402
+from modules.prompt_templates import get_templates  # noqa: E402
+from modules.token_budget import PromptBudget  # noqa: E402
+from modules.memory_management import create_system_prompt  # noqa: E402
+from storage_benchmark import point_config_at  # noqa: E402
+
+CHARACTER = {
+    "id": "bench",
+    "name": "Mira",
+    "description": "The keeper of the Gilded Hart, a tavern at the edge of the marsh.",
+    "personality": "Warm, sharp-tongued and impossible to lie to.",
+    "speaking_style": "Short sentences, marsh slang, the odd proverb.",
+    "appearance": "Tall, freckled, flour on her apron and a knife at her belt.",
+    "mood": "curious",
+    "emotions": {"curiosity": 0.7, "suspicion": 0.3},
+    "opinion_of_user": "cautiously positive",
+    "action": "wiping down the bar",
+    "location": "the Gilded Hart"
+}
+
+ACTION_MESSAGE = json.dumps({"action": "pick the lock of the cellar door", "relevantStat": "dexterity",
+                             "rollValue": 17, "difficultyClass": 15, "details": "with a bent hairpin"})
+
+
+def legacy_system_prompt(character):
+    """The system prompt rendered the way it was before templates were compiled"""
+    templates = get_storage().get_templates()
+
+    prompt = templates["base_prompt"].format(
+        name=character['name'],
+        description=character.get('description', ''),
+        personality=character.get('personality', '')
+    ) + "\n\n"
+    if character.get('speaking_style') and "speaking_style" in templates:
+        prompt += templates["speaking_style"].format(
+            speaking_style=character.get('speaking_style', '')
+        ) + "\n\n"
+    if character.get('appearance') and "appearance" in templates:
+        prompt += templates["appearance"].format(
+            appearance=character.get('appearance', '')
+        ) + "\n\n"
+    prompt += templates.get("roleplaying_instructions", "") + templates.get("response_format", "")
+    prompt += MESSAGE_INSTRUCTIONS
+
+    emotions_str = ", ".join([f"{k}: {v}" for k, v in character.get('emotions', {}).items()])
+    if "mood_emotions" in templates:
+        prompt += templates["mood_emotions"].format(
+            mood=character.get('mood', 'neutral'),
+            emotions_str=emotions_str
+        ) + "\n"
+    if "opinion" in templates:
+        prompt += templates["opinion"].format(
+            opinion_of_user=character.get('opinion_of_user', 'neutral')
+        ) + "\n\n"
+    prompt += f"Current action: {character.get('action', 'standing still')}\n"
+    prompt += f"Current location: {character.get('location', 'current location')}\n\n"
+    return prompt
+
+
+def compiled_system_prompt(character):
+    """The system prompt rendered from the compiled templates (prefix not taken from its cache)"""
+    prefix = build_prompt_prefix(character, get_templates())
+    return create_system_prompt(character, {}, "", PromptBudget(), prefix)
+
+
+def legacy_player_action_prompt(system_prompt, message, action_success):
+    """handle_player_action_prompt as it was: one big f-string per call"""
+    try:
+        # Parse the action data from message
+        action_data = json.loads(message)
+        action_text = action_data["action"]
+        relevant_stat = action_data.get("relevantStat", "strength")
+        roll_value = action_data.get("rollValue", 0)
+        difficulty_class = action_data.get("difficultyClass", 10)
+        details = action_data.get("details", "")
+    except:
+        # If parsing fails, use defaults
+        action_text = message
+        relevant_stat = "strength"
+        roll_value = 0
+        difficulty_class = 10
+        details = ""
+    
+    # Build player action context
+    player_action_context = f"""
+    The user is attempting to perform an action rather than speaking. Respond accordingly.
+    
+    Player Action: {action_text}
+    Action Outcome: {"Success" if action_success else "Failure"}
+    Relevant Ability: {relevant_stat.capitalize()}
+    Action Difficulty (DC): {difficulty_class}
+    Roll Result: {roll_value}
+    Details: {details}
+    
+    Please respond to this action attempt based on the outcome. If the action was successful,
+    describe how it succeeds and the positive consequences. If it failed, describe how it fails
+    and any negative consequences. Be realistic but dramatic in your description.
+    
+    Your response should acknowledge the player's action and its outcome, then describe your
+    character's reaction to it. Stay in character and maintain appropriate emotional reactions.
+    
+    In addition to your regular response, please include:
+    - 'action': A brief description of what you're physically doing in reaction to the player's action
+    - 'location': Where you currently are (be specific, and maintain consistency with previous locations)
+    
+    IMPORTANT LOCATION INSTRUCTIONS:
+    - If the your roleplay character's action involves moving to a new location AND the action is successful, UPDATE the location field to reflect this new location.
+    - If the your roleplay character tries to move somewhere but fails, keep the location the same.
+    - If the your roleplay character's action doesn't involve movement, keep the location the same.
+    - Never use "current location" as the value - always specify the actual location name.
+    
+    Your response should include:
+    1. A description of the outcome of the player's action (success or failure)
+    2. Your character's reaction to the action
+    3. How this affects the ongoing situation
+    
+    Format your response as a JSON object as follows:
+    {{
+    "text": "Your actual response to the user - this should be what you want to say directly",
+    "mood": "your current mood (happy, sad, angry, confused, etc.)",
+    "emotions": {{"joy": 0.8, "curiosity": 0.6}},
+    "opinion_of_user": "your opinion of the user (positive, negative, neutral, etc.)",
+    "action": "what you're physically doing as you speak",
+    "location": "where you currently are (specific location name)"
+    }}
+    
+    Important: For "text", include ONLY what you want to say to the user, not any descriptions or metadata.
+    DO NOT include JSON syntax in the "text" field itself. The "text" field should contain only your natural dialogue.
+    """
+    
+    # Append to the existing system prompt
+    enhanced_prompt = system_prompt + "\n\n" + player_action_context
+    
+    return enhanced_prompt
+
+
+def legacy_player_action_turn(message, action_success):
+    """Player action work of a turn before: instructions, then the message parsed again"""
+    instructions = legacy_player_action_prompt("", message, action_success)
+    action_data = json.loads(message)
+    return instructions, f"*Attempts to {action_data['action']}*"
+
+
+def compiled_player_action_turn(message, action_success):
+    """Player action work of a turn now: parsed once, compiled instructions"""
+    action_data = parse_player_action(message)
+    instructions = handle_player_action_prompt("", message, action_success, action_data)
+    return instructions, f"*Attempts to {action_data['action']}*"
+
+
+def time_per_call(func, args, repeat):
+    """Mean microseconds per call"""
+    begin = time.perf_counter()
+    for _ in range(repeat):
+        func(*args)
+    return (time.perf_counter() - begin) * 1e6 / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare template rendering paths")
+    parser.add_argument("--repeat", type=int, default=5000, help="Calls per path")
+    args = parser.parse_args()
+
+    folder = tempfile.mkdtemp()
+    try:
+        point_config_at(folder)
+        # Read templates from a file, as the app does
+        get_storage().save_templates(Config.DEFAULT_TEMPLATES)
+
+        cases = (
+            ("system prompt", legacy_system_prompt, compiled_system_prompt, (CHARACTER,)),
+            ("action prompt", legacy_player_action_prompt, handle_player_action_prompt, ("", ACTION_MESSAGE, True)),
+            ("action turn", legacy_player_action_turn, compiled_player_action_turn, (ACTION_MESSAGE, True))
+        )
+        print(f"{'render':<16} {'legacy us':>10} {'compiled us':>12} {'speedup':>8}  same text")
+        for name, legacy, compiled, call_args in cases:
+            same = legacy(*call_args) == compiled(*call_args)
+            legacy_us = time_per_call(legacy, call_args, args.repeat)
+            compiled_us = time_per_call(compiled, call_args, args.repeat)
+            print(f"{name:<16} {legacy_us:10.2f} {compiled_us:12.2f} {legacy_us / compiled_us:7.1f}x  {same}")
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
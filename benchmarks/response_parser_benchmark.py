@@ -0,0 +1,196 @@
+"""
+Benchmark the single-pass ResponseParser against the regex cascade that
+process_llm_response used before it.
+
+Runs both over a corpus of malformed model responses (code fences, prose
+around the object, truncation, raw newlines, trailing commas, ...), reports
+per-response time and how often each recovers the expected text, then
+times both on growing truncated outputs to show how they scale.
+
+Usage:
+    python benchmarks/response_parser_benchmark.py
+    python benchmarks/response_parser_benchmark.py --corpus my_responses.json --repeat 500
+
+A corpus is a JSON list of {"name", "response", "expected_text"} objects.
+"""
+
+import argparse
+import json
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from modules.response_parser import parse_response  # noqa: E402
+
+DEFAULT_CORPUS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "malformed_responses.json")
+
+
+def legacy_process_llm_response(response_text):
+    """The regex-cascade parser that ResponseParser replaced, kept for comparison"""
+    result = {
+        "text": response_text,
+        "mood": "neutral",
+        "emotions": {},
+        "opinion_of_user": "neutral",
+        "action": "standing still",
+        "location": "current location"
+    }
+    
+    try:
+        # First, try to parse the entire response as JSON
+        try:
+            parsed = json.loads(response_text)
+            if isinstance(parsed, dict):
+                # If it's a complete JSON object with the expected fields
+                if "text" in parsed:
+                    result["text"] = parsed.get("text", result["text"])
+                    result["mood"] = parsed.get("mood", result["mood"])
+                    result["emotions"] = parsed.get("emotions", result["emotions"])
+                    result["opinion_of_user"] = parsed.get("opinion_of_user", result["opinion_of_user"])
+                    result["action"] = parsed.get("action", result["action"])
+                    result["location"] = parsed.get("location", result["location"])
+                    return result
+        except:
+            pass  # Not a complete JSON response, try extracting JSON from text
+        
+        # Look for JSON object inside the text - various patterns
+        json_patterns = [
+            r'\{[\s\S]*\}',                   # Any JSON object
+            r'```json\s*([\s\S]*?)\s*```',    # JSON in code block with json tag
+            r'```\s*([\s\S]*?)\s*```',        # JSON in any code block
+            r'\{("text"|\'text\')[\s\S]*\}'   # JSON object with text field
+        ]
+        
+        for pattern in json_patterns:
+            try:
+                matches = re.findall(pattern, response_text)
+                for match in matches:
+                    # If the match is a capture group (from code block patterns)
+                    if isinstance(match, str) and match.strip().startswith('{'):
+                        try:
+                            parsed = json.loads(match.strip())
+                            if isinstance(parsed, dict) and "text" in parsed:
+                                # Extract all fields from the parsed JSON
+                                result["text"] = parsed.get("text", result["text"])
+                                result["mood"] = parsed.get("mood", result["mood"])
+                                result["emotions"] = parsed.get("emotions", result["emotions"])
+                                result["opinion_of_user"] = parsed.get("opinion_of_user", result["opinion_of_user"])
+                                result["action"] = parsed.get("action", result["action"])
+                                result["location"] = parsed.get("location", result["location"])
+                                return result
+                        except:
+                            continue
+                    # For patterns without capture groups
+                    elif not isinstance(match, str):
+                        try:
+                            parsed = json.loads(match[0])
+                            if isinstance(parsed, dict) and "text" in parsed:
+                                result["text"] = parsed.get("text", result["text"])
+                                result["mood"] = parsed.get("mood", result["mood"])
+                                result["emotions"] = parsed.get("emotions", result["emotions"])
+                                result["opinion_of_user"] = parsed.get("opinion_of_user", result["opinion_of_user"])
+                                result["action"] = parsed.get("action", result["action"])
+                                result["location"] = parsed.get("location", result["location"])
+                                return result
+                        except:
+                            continue
+            except:
+                continue  # Try the next pattern
+    except:
+        pass  # Fallback to heuristic approach
+    
+    # If JSON parsing completely failed, extract text fields using regex patterns
+    # Remove any JSON-like structures or code blocks from the text
+    cleaned_text = re.sub(r'\{[\s\S]*?\}', '', response_text)
+    cleaned_text = re.sub(r'```[\s\S]*?```', '', cleaned_text)
+    cleaned_text = cleaned_text.strip()
+    
+    # If we have cleaned text, use it
+    if cleaned_text:
+        result["text"] = cleaned_text
+    
+    # Look for actions enclosed in asterisks or parentheses
+    action_match = re.search(r'\*(.*?)\*|\((.*?)\)', response_text)
+    if action_match:
+        action = action_match.group(1) or action_match.group(2)
+        if action:
+            result["action"] = action.strip()
+    
+    # Check for location mentions
+    location_match = re.search(r'at (the|a) ([^\.]*)', response_text)
+    if location_match:
+        location = location_match.group(2)
+        if location:
+            result["location"] = location.strip()
+    
+    # Infer mood from language
+    if re.search(r'laugh|chuckle|grin|smile|happy|joy', response_text, re.IGNORECASE):
+        result["mood"] = "happy"
+    elif re.search(r'frown|sigh|sad|upset|depress', response_text, re.IGNORECASE):
+        result["mood"] = "sad"
+    elif re.search(r'angry|furious|mad|rage', response_text, re.IGNORECASE):
+        result["mood"] = "angry"
+    
+    return result
+
+
+def time_per_call(func, text, repeat):
+    """Mean milliseconds per call"""
+    begin = time.perf_counter()
+    for _ in range(repeat):
+        func(text)
+    return (time.perf_counter() - begin) * 1000 / repeat
+
+
+def run_corpus(corpus, repeat):
+    print(f"{'case':<28} {'legacy ms':>10} {'parser ms':>10}  legacy ok  parser ok")
+    totals = {"legacy": 0.0, "parser": 0.0}
+    correct = {"legacy": 0, "parser": 0}
+
+    for case in corpus:
+        row = []
+        for name, func in (("legacy", legacy_process_llm_response), ("parser", parse_response)):
+            ms = time_per_call(func, case["response"], repeat)
+            ok = func(case["response"])["text"] == case["expected_text"]
+            totals[name] += ms
+            correct[name] += ok
+            row.append((ms, ok))
+        print(f"{case['name'][:28]:<28} {row[0][0]:10.4f} {row[1][0]:10.4f}  {str(row[0][1]):>9}  {str(row[1][1]):>9}")
+
+    print(f"\n{'total':<28} {totals['legacy']:10.4f} {totals['parser']:10.4f}  "
+          f"{correct['legacy']:>6}/{len(corpus)}  {correct['parser']:>6}/{len(corpus)}")
+
+
+def run_scaling(sizes, repeat):
+    print(f"\n{'truncated output size':<28} {'legacy ms':>10} {'parser ms':>10}")
+    for size in sizes:
+        # A long response cut off before its closing braces, with unmatched
+        # braces in the text -- every "{" restarts the greedy patterns
+        body = ("She traced a {rune on the wall. " * (size // 32 + 1))[:size]
+        text = '```json\n{"text": "' + body
+        runs = max(1, repeat // 10)
+        legacy_ms = time_per_call(legacy_process_llm_response, text, runs)
+        parser_ms = time_per_call(parse_response, text, runs)
+        print(f"{size:<28} {legacy_ms:10.3f} {parser_ms:10.3f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare response parsers")
+    parser.add_argument("--corpus", default=DEFAULT_CORPUS)
+    parser.add_argument("--repeat", type=int, default=200, help="Calls per response when timing")
+    parser.add_argument("--sizes", default="1000,4000,16000",
+                        help="Comma-separated sizes (characters) for the scaling run")
+    args = parser.parse_args()
+
+    with open(args.corpus, "r", encoding="utf-8") as f:
+        corpus = json.load(f)
+
+    run_corpus(corpus, args.repeat)
+    run_scaling([int(size) for size in args.sizes.split(",")], args.repeat)
+
+
+if __name__ == '__main__':
+    main()
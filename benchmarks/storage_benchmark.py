@@ -0,0 +1,163 @@
+"""
+Benchmark the storage backends on a synthetic data set.
+
+Loads the same chats and turns into each backend (in a temporary folder),
+then times the operations on the chat path: reading a chat header, reading
+the recent turns for the prompt, appending a turn, paging history and
+listing chats.
+
+Usage:
+    python benchmarks/storage_benchmark.py --chats 10000 --turns 1000000
+    python benchmarks/storage_benchmark.py --chats 1000 --turns 50000 --backends sqlite,filesystem
+"""
+
+import argparse
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import Config  # noqa: E402
+from modules.storage import create_storage  # noqa: E402
+
+WORDS = ("the innkeeper raised an eyebrow and poured another ale while rain drummed "
+         "against the shutters and the fire crackled in the hearth beside the old sword").split()
+
+
+def point_config_at(folder):
+    """Redirect every data path to a scratch folder"""
+    Config.DATA_DIR = folder
+    Config.CHARACTERS_FOLDER = os.path.join(folder, "characters")
+    Config.MEMORY_FOLDER = os.path.join(folder, "memory")
+    Config.TEMPLATES_FOLDER = os.path.join(folder, "templates")
+    Config.CHAT_INSTANCES_FOLDER = os.path.join(folder, "chat_instances")
+    Config.SCENARIOS_FOLDER = os.path.join(folder, "scenarios")
+    Config.CHAT_INDEX_PATH = os.path.join(folder, "chat_index.json")
+    Config.LOCKS_FOLDER = os.path.join(folder, "locks")
+    Config.SQLITE_STORAGE_PATH = os.path.join(folder, "storage.db")
+    Config.SEARCH_INDEX_PATH = os.path.join(folder, "search_index.db")
+    Config.RESPONSE_CACHE_FOLDER = os.path.join(folder, "response_cache")
+    Config.MODEL_CATALOG_PATH = os.path.join(folder, "model_catalog.json")
+    Config.JOBS_FOLDER = os.path.join(folder, "jobs")
+
+
+def make_sentence(rng, length):
+    return " ".join(rng.choice(WORDS) for _ in range(length))
+
+
+def make_turns(rng, count, start):
+    for turn in range(1, count + 1):
+        yield {
+            "turn": turn,
+            "timestamp": (start + timedelta(minutes=turn)).isoformat(),
+            "user_message": make_sentence(rng, 12),
+            "character_response": make_sentence(rng, 40),
+            "mood": "neutral",
+            "emotions": {"curiosity": 0.5},
+            "action": "standing still",
+            "location": "Tavern",
+            "scene_description": make_sentence(rng, 60)
+        }
+
+
+def load_data(storage, chats, turns_per_chat, seed):
+    """Import the synthetic data set into a backend"""
+    rng = random.Random(seed)
+    start = datetime(2025, 1, 1)
+    chat_ids = []
+
+    def generate_chats():
+        for i in range(chats):
+            chat_id = f"chat-{i:06d}"
+            header = {
+                "id": chat_id,
+                "character_id": f"character-{i % 50}",
+                "title": f"Chat {i}",
+                "created_at": start.isoformat(),
+                "updated_at": (start + timedelta(seconds=i)).isoformat(),
+                "location": "Tavern",
+                "character_state": {"mood": "neutral", "emotions": {}, "opinion_of_user": "neutral",
+                                    "action": "standing idly"}
+            }
+            chat_ids.append(chat_id)
+            yield header, make_turns(rng, turns_per_chat, start)
+
+    storage.import_chats(generate_chats())
+    return chat_ids
+
+
+def time_operation(func, samples):
+    """Run func `samples` times and return (mean ms, p95 ms)"""
+    durations = []
+    for _ in range(samples):
+        begin = time.perf_counter()
+        func()
+        durations.append((time.perf_counter() - begin) * 1000)
+    durations.sort()
+    return statistics.mean(durations), durations[int(len(durations) * 0.95) - 1]
+
+
+def run_backend(name, chats, turns_per_chat, samples, seed):
+    folder = tempfile.mkdtemp(prefix=f"storage-bench-{name}-")
+    try:
+        point_config_at(folder)
+        storage = create_storage(name)
+
+        begin = time.perf_counter()
+        chat_ids = load_data(storage, chats, turns_per_chat, seed)
+        load_seconds = time.perf_counter() - begin
+
+        rng = random.Random(seed + 1)
+        pick = lambda: rng.choice(chat_ids)  # noqa: E731
+
+        def append_turn():
+            header = storage.get_chat(pick())
+            entry = next(make_turns(rng, 1, datetime(2026, 1, 1)))
+            storage.append_turn(header, entry)
+            header["updated_at"] = datetime.now().isoformat()
+            storage.save_chat(header, entry)
+
+        results = {
+            "load (s)": (load_seconds, None),
+            "get chat header": time_operation(lambda: storage.get_chat(pick()), samples),
+            "recent 5 turns": time_operation(lambda: storage.get_turns(pick(), limit=5), samples),
+            "history page (before)": time_operation(
+                lambda: storage.get_turns(pick(), before=max(turns_per_chat // 2, 1), limit=20), samples),
+            "append turn": time_operation(append_turn, samples),
+            "list 50 chats": time_operation(lambda: storage.list_chats(limit=50), samples),
+        }
+        return results
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare storage backends")
+    parser.add_argument("--chats", type=int, default=10000)
+    parser.add_argument("--turns", type=int, default=1000000, help="Total number of turns across all chats")
+    parser.add_argument("--samples", type=int, default=200, help="Timed samples per operation")
+    parser.add_argument("--backends", default="filesystem,sqlite,memory")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    turns_per_chat = max(args.turns // args.chats, 1)
+    print(f"{args.chats} chats x {turns_per_chat} turns = {args.chats * turns_per_chat} turns\n")
+
+    for name in args.backends.split(","):
+        print(f"== {name}")
+        for operation, (mean, p95) in run_backend(name, args.chats, turns_per_chat, args.samples, args.seed).items():
+            if p95 is None:
+                print(f"  {operation:<24} {mean:10.1f}")
+            else:
+                print(f"  {operation:<24} mean {mean:8.3f} ms   p95 {p95:8.3f} ms")
+        print()
+
+
+if __name__ == '__main__':
+    main()
@@ -13,7 +13,25 @@ class Config:
     
     # API and model settings
     DEFAULT_MODEL = os.getenv("DEFAULT_MODEL", "deepseek/deepseek-llm-7b-chat")
-    LOCAL_MODEL_URL = os.getenv("LOCAL_MODEL_URL", "http://localhost:11434/api/generate")
+    # Local model served by Ollama (modules/local_model.py); LOCAL_MODEL_URL is its /api/generate URL
+    LOCAL_MODEL_ENDPOINT = os.getenv("LOCAL_MODEL_ENDPOINT", "http://localhost:11434")
+    LOCAL_MODEL_NAME = os.getenv("LOCAL_MODEL_NAME", "llama2")
+    LOCAL_MODEL_URL = os.getenv("LOCAL_MODEL_URL", LOCAL_MODEL_ENDPOINT.rstrip("/") + "/api/generate")
+    # How long Ollama keeps the model loaded after a request (an Ollama duration such as "30m", or -1 for ever)
+    LOCAL_MODEL_KEEP_ALIVE = os.getenv("LOCAL_MODEL_KEEP_ALIVE", "30m")
+    # Load the model when the server starts (for setups that chat with the local model)
+    LOCAL_MODEL_WARM_UP = os.getenv("LOCAL_MODEL_WARM_UP", "False").lower() == "true"
+    # Continue chat turns from the context Ollama returned for the chat's previous turn
+    LOCAL_MODEL_CONTEXT_REUSE = os.getenv("LOCAL_MODEL_CONTEXT_REUSE", "True").lower() == "true"
+    
+    # Prompt size (in estimated tokens)
+    # Context window of the local model (sent to Ollama as num_ctx), and of OpenRouter models missing from the model catalog
+    LOCAL_MODEL_CONTEXT_LENGTH = int(os.getenv("LOCAL_MODEL_CONTEXT_LENGTH", "4096"))
+    DEFAULT_CONTEXT_LENGTH = int(os.getenv("DEFAULT_CONTEXT_LENGTH", "8192"))
+    # Left free in the context window for the reply
+    RESPONSE_TOKEN_RESERVE = int(os.getenv("RESPONSE_TOKEN_RESERVE", "1024"))
+    # Upper bound for the system prompt plus message, even on models with huge windows
+    PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "6000"))
     
     # Application metadata
     APP_NAME = os.getenv("APP_NAME", "AI Character Chat")
@@ -35,6 +53,89 @@ class Config:
     MEMORY_FOLDER = os.path.join(DATA_DIR, "memory")
     TEMPLATES_FOLDER = os.path.join(DATA_DIR, "templates")
     CHAT_INSTANCES_FOLDER = os.path.join(DATA_DIR, "chat_instances")
+    CHAT_INDEX_PATH = os.path.join(DATA_DIR, "chat_index.json")
+    LOCKS_FOLDER = os.path.join(DATA_DIR, "locks")
+    SEARCH_INDEX_PATH = os.path.join(DATA_DIR, "search_index.db")
+    
+    # Storage backend: "filesystem" (JSON files in DATA_DIR), "sqlite" or "memory"
+    STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "filesystem")
+    SQLITE_STORAGE_PATH = os.getenv("SQLITE_STORAGE_PATH", os.path.join(DATA_DIR, "storage.db"))
+    
+    # Outbound HTTP settings (shared keep-alive connection pool for model providers)
+    HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "5"))
+    HTTP_READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", "120"))
+    HTTP_POOL_CONNECTIONS = int(os.getenv("HTTP_POOL_CONNECTIONS", "4"))
+    HTTP_POOL_MAXSIZE = int(os.getenv("HTTP_POOL_MAXSIZE", "20"))
+    # Open connections per provider host for the asyncio client used by asgi.py
+    ASYNC_HTTP_MAX_CONNECTIONS = int(os.getenv("ASYNC_HTTP_MAX_CONNECTIONS", "256"))
+    
+    # ASGI server (asgi.py): threads serving the Flask routes that are not async
+    ASGI_WSGI_THREADS = int(os.getenv("ASGI_WSGI_THREADS", "16"))
+    
+    # Scene descriptions
+    # "background": generated after the reply is returned and fetched by turn id
+    # "inline": generated before the reply is returned (one response, twice the latency)
+    # "combined": returned by the same model call as the reply (one call, no second request)
+    # Chats can override this with their own "scene_mode"
+    SCENE_MODE = os.getenv("SCENE_MODE", "background")
+    # Seconds to wait for a background scene before storing the placeholder text
+    SCENE_DEADLINE = float(os.getenv("SCENE_DEADLINE", "30"))
+    SCENE_WORKERS = int(os.getenv("SCENE_WORKERS", "4"))
+    # Model calls run at the same time by /api/generate-fields and character_fields jobs (shared pool)
+    FIELD_BATCH_CONCURRENCY = int(os.getenv("FIELD_BATCH_CONCURRENCY", "3"))
+    
+    # Rolling chat summaries (modules/conversation_summary.py); off unless set, as each summary is an extra model call
+    SUMMARY_ENABLED = os.getenv("SUMMARY_ENABLED", "False").lower() == "true"
+    # Model that writes the summaries (default: DEFAULT_MODEL; "local" for the local model)
+    SUMMARY_MODEL = os.getenv("SUMMARY_MODEL", "")
+    # Estimated tokens of unsummarized turns before the older ones are folded into the summary
+    SUMMARY_TRIGGER_TOKENS = int(os.getenv("SUMMARY_TRIGGER_TOKENS", "1500"))
+    SUMMARY_MAX_TOKENS = int(os.getenv("SUMMARY_MAX_TOKENS", "400"))
+    SUMMARY_MAX_MEMORIES = int(os.getenv("SUMMARY_MAX_MEMORIES", "20"))
+    SUMMARY_WORKERS = int(os.getenv("SUMMARY_WORKERS", "1"))
+    
+    # Background jobs (long-running generation submitted to /api/jobs)
+    JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+    # Queued jobs beyond this are rejected with 503
+    JOB_QUEUE_LIMIT = int(os.getenv("JOB_QUEUE_LIMIT", "100"))
+    # Seconds a finished job's result is kept for polling
+    JOB_RESULT_TTL = float(os.getenv("JOB_RESULT_TTL", "3600"))
+    # Also keep jobs in JOBS_FOLDER, so queued and interrupted jobs run again after a restart
+    JOBS_PERSISTENT = os.getenv("JOBS_PERSISTENT", "False").lower() == "true"
+    JOBS_FOLDER = os.path.join(DATA_DIR, "jobs")
+    
+    # Model call scheduler (modules/llm_scheduler.py)
+    # Calls running at once per provider, and per model (0 for no per-model limit)
+    LLM_MAX_CONCURRENCY_OPENROUTER = int(os.getenv("LLM_MAX_CONCURRENCY_OPENROUTER", "32"))
+    LLM_MAX_CONCURRENCY_LOCAL = int(os.getenv("LLM_MAX_CONCURRENCY_LOCAL", "2"))
+    LLM_MAX_CONCURRENCY_PER_MODEL = int(os.getenv("LLM_MAX_CONCURRENCY_PER_MODEL", "0"))
+    # Calls started per second per provider (0 for no limit), with bursts of up to LLM_RATE_BURST
+    LLM_RATE_LIMIT_OPENROUTER = float(os.getenv("LLM_RATE_LIMIT_OPENROUTER", "0"))
+    LLM_RATE_LIMIT_LOCAL = float(os.getenv("LLM_RATE_LIMIT_LOCAL", "0"))
+    LLM_RATE_BURST = float(os.getenv("LLM_RATE_BURST", "10"))
+    # Calls waiting per provider beyond this are rejected with 429, as are calls waiting longer than the timeout (seconds)
+    LLM_QUEUE_LIMIT = int(os.getenv("LLM_QUEUE_LIMIT", "64"))
+    LLM_QUEUE_TIMEOUT = float(os.getenv("LLM_QUEUE_TIMEOUT", "30"))
+    
+    # Concurrency settings
+    # Seconds a request waits for another in-flight write on the same chat before returning 409
+    CHAT_LOCK_TIMEOUT = float(os.getenv("CHAT_LOCK_TIMEOUT", "60"))
+    
+    # Caching settings
+    # Maximum number of parsed character/scenario/template files kept in memory
+    DATA_CACHE_MAX_ENTRIES = int(os.getenv("DATA_CACHE_MAX_ENTRIES", "512"))
+    # Cache of generate endpoint responses (used with "cache": true, or at temperature 0)
+    RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "True").lower() == "true"
+    RESPONSE_CACHE_FOLDER = os.getenv("RESPONSE_CACHE_FOLDER", os.path.join(DATA_DIR, "response_cache"))
+    RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", str(7 * 24 * 3600)))
+    RESPONSE_CACHE_MEMORY_BYTES = int(os.getenv("RESPONSE_CACHE_MEMORY_BYTES", str(8 * 1024 * 1024)))
+    RESPONSE_CACHE_DISK_BYTES = int(os.getenv("RESPONSE_CACHE_DISK_BYTES", str(256 * 1024 * 1024)))
+    # OpenRouter model list; older copies are served while a fresh one is fetched
+    MODEL_CATALOG_PATH = os.path.join(DATA_DIR, "model_catalog.json")
+    MODEL_CATALOG_TTL = float(os.getenv("MODEL_CATALOG_TTL", "3600"))
+    
+    # Seconds between checks for prompt templates saved by another process (or edited by hand)
+    TEMPLATE_RELOAD_INTERVAL = float(os.getenv("TEMPLATE_RELOAD_INTERVAL", "5"))
     
     # Default prompt templates
     DEFAULT_TEMPLATES = {
@@ -116,6 +217,7 @@ ROLEPLAYING INSTRUCTIONS:
         os.makedirs(Config.TEMPLATES_FOLDER, exist_ok=True)
         os.makedirs(Config.CHAT_INSTANCES_FOLDER, exist_ok=True)
         os.makedirs(Config.SCENARIOS_FOLDER, exist_ok=True)  # Add this line
+        os.makedirs(Config.LOCKS_FOLDER, exist_ok=True)
 
 
         # Initialize templates if they don't exist
@@ -3,7 +3,7 @@
 
 # Import key functions to make them available when importing the package
 from .player_actions import handle_player_action_prompt
-from .memory_management import create_system_prompt, summarize_conversations
+from .memory_management import create_system_prompt
 from .scene_generation import generate_scene_description
 from .ai_integration import get_openrouter_response, get_local_model_response, process_llm_response
 
@@ -11,7 +11,6 @@ from .ai_integration import get_openrouter_response, get_local_model_response, p
 __all__ = [
     'handle_player_action_prompt',
     'create_system_prompt',
-    'summarize_conversations',
     'generate_scene_description',
     'get_openrouter_response',
     'get_local_model_response',
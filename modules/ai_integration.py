@@ -3,16 +3,27 @@ AI integration module for interacting with various language models.
 This module handles communication with AI services like OpenRouter.
 """
 
-from flask import jsonify, request, Blueprint
+from flask import jsonify, request, Blueprint, Response, stream_with_context
+import contextvars
 import json
 import requests
-import re
 import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from config import Config
+from . import http_client, async_http_client, local_model
+from .response_parser import parse_response
+from .model_catalog import get_model_catalog
+from .response_cache import get_cache_mode, cached_generate, with_cache_status, model_id, CACHE_OFF
+from .llm_scheduler import LLMOverloaded, llm_slot, llm_slot_async, PROVIDER_OPENROUTER
 
 # Create a blueprint for AI-specific routes
 ai_bp = Blueprint('ai', __name__)
 
+# Shared by every batch field request (see generate_fields_concurrently)
+_field_executor = None
+_field_executor_lock = threading.Lock()
+
 def register_ai_routes(app):
     """Register AI model-related routes with the Flask app"""
     
@@ -22,98 +33,8 @@ def register_ai_routes(app):
     # Legacy route registration (can be moved to the blueprint later)
     @app.route('/api/models', methods=['GET'])
     def get_models():
-        """Get available models from OpenRouter"""
-        try:
-            # Only make the API call if we have an API key
-            if not Config.OPENROUTER_API_KEY:
-                print("No OpenRouter API key found. Returning default models.")
-                # Return a minimal default set if no API key is available
-                return jsonify({
-                    "success": True,
-                    "models": [
-                        {"id": "openai/gpt-3.5-turbo", "name": "GPT-3.5 Turbo"},
-                        {"id": "openai/gpt-4", "name": "GPT-4"},
-                        {"id": "anthropic/claude-3-opus", "name": "Claude 3 Opus"},
-                        {"id": "anthropic/claude-3-sonnet", "name": "Claude 3 Sonnet"},
-                        {"id": "anthropic/claude-3-haiku", "name": "Claude 3 Haiku"},
-                        {"id": "local", "name": "Local Model"}
-                    ]
-                })
-            
-            print(f"Using OpenRouter API key: {Config.OPENROUTER_API_KEY[:4]}...")
-            
-            # Make request to OpenRouter
-            headers = {
-                "Authorization": f"Bearer {Config.OPENROUTER_API_KEY}",
-                "HTTP-Referer": "https://localhost:5000",  # Add referer to reduce API errors
-                "X-Title": "AI Character Chat",  # Identify your application
-                "Content-Type": "application/json"
-            }
-            
-            print("Requesting models from OpenRouter API...")
-            response = requests.get("https://openrouter.ai/api/v1/models", headers=headers)
-            
-            print(f"OpenRouter response status: {response.status_code}")
-            
-            if response.status_code != 200:
-                print(f"Error response from OpenRouter: {response.text}")
-                raise Exception(f"OpenRouter API returned status code {response.status_code}: {response.text}")
-            
-            # Process the response
-            response_data = response.json()
-            print(f"OpenRouter response keys: {response_data.keys()}")
-            openrouter_models = response_data.get("data", [])
-            print(f"Found {len(openrouter_models)} models from OpenRouter")
-            
-            # Format the models
-            models = []
-            
-            # Add each model from OpenRouter
-            for model in openrouter_models:
-                model_id = model.get("id")
-                model_name = model.get("name", model_id)
-                print(f"Processing model: {model_id} - {model_name}")
-                
-                # Modified filtering: Include models that at least have an ID
-                # This is less strict than the previous condition
-                if model_id:
-                    models.append({
-                        "id": model_id,
-                        "name": model_name,
-                        "context_length": model.get("context_length"),
-                        "pricing": model.get("pricing", {})
-                    })
-            
-            print(f"Filtered to {len(models)} chat models")
-            
-            # Always add the local model option
-            models.append({
-                "id": "local",
-                "name": "Local Model"
-            })
-            
-            return jsonify({
-                "success": True,
-                "models": models
-            })
-            
-        except Exception as e:
-            print(f"Error fetching models: {str(e)}")
-            import traceback
-            traceback.print_exc()
-            # Return a default list if there's an error
-            return jsonify({
-                "success": False,
-                "message": f"Error fetching models: {str(e)}",
-                "models": [
-                    {"id": "openai/gpt-3.5-turbo", "name": "GPT-3.5 Turbo"},
-                    {"id": "openai/gpt-4", "name": "GPT-4"},
-                    {"id": "anthropic/claude-3-opus", "name": "Claude 3 Opus"},
-                    {"id": "anthropic/claude-3-sonnet", "name": "Claude 3 Sonnet"},
-                    {"id": "anthropic/claude-3-haiku", "name": "Claude 3 Haiku"},
-                    {"id": "local", "name": "Local Model"}
-                ]
-            })
+        """Get available models from OpenRouter (cached, see model_catalog)"""
+        return jsonify(get_model_catalog())
 
 # New AI Blueprint routes
 @ai_bp.route('/api/generate-text', methods=['POST'])
@@ -126,6 +47,7 @@ def generate_text():
     - system_prompt (optional): The system prompt for the AI
     - temperature (optional): Temperature for generation
     - max_tokens (optional): Maximum tokens to generate
+    - cache (optional): Reuse the response to an identical request (default: only at temperature 0)
     
     Returns:
     - JSON with generated text
@@ -142,15 +64,21 @@ def generate_text():
         max_tokens = data.get('max_tokens')
         
         # Generate text
-        response = get_openrouter_response(
-            system_prompt=system_prompt,
-            user_message=prompt,
-            temperature=temperature,
-            max_tokens=max_tokens
+        response, cache_status = cached_generate(
+            get_cache_mode(data, temperature),
+            lambda: get_openrouter_response(
+                system_prompt=system_prompt,
+                user_message=prompt,
+                temperature=temperature,
+                max_tokens=max_tokens
+            ),
+            model_id(), system_prompt, prompt, temperature, max_tokens
         )
         
-        return jsonify({"success": True, "text": response})
+        return with_cache_status(jsonify({"success": True, "text": response}), cache_status)
             
+    except LLMOverloaded:
+        raise
     except Exception as e:
         return jsonify({"success": False, "message": str(e)}), 500
 
@@ -164,6 +92,7 @@ def generate_json():
     - system_prompt (optional): The system prompt for the AI
     - temperature (optional): Temperature for generation
     - max_tokens (optional): Maximum tokens to generate
+    - cache (optional): Reuse the response to an identical request (default: only at temperature 0)
     
     Returns:
     - JSON with the generated structured data
@@ -183,18 +112,23 @@ def generate_json():
         if not prompt.lower().endswith('json'):
             prompt += " Respond with valid JSON only."
         
-        # Generate JSON
-        response = get_openrouter_response(
-            system_prompt=system_prompt,
-            user_message=prompt,
-            temperature=temperature,
-            max_tokens=max_tokens
+        # Generate JSON; responses that don't parse are not cached
+        response, cache_status = cached_generate(
+            get_cache_mode(data, temperature),
+            lambda: get_openrouter_response(
+                system_prompt=system_prompt,
+                user_message=prompt,
+                temperature=temperature,
+                max_tokens=max_tokens
+            ),
+            model_id(), system_prompt, prompt, temperature, max_tokens,
+            validate=is_valid_json_response
         )
         
         # Parse and validate the JSON response
         try:
             json_data = validate_json_response(response)
-            return jsonify({"success": True, "data": json_data})
+            return with_cache_status(jsonify({"success": True, "data": json_data}), cache_status)
         except ValueError as e:
             return jsonify({
                 "success": False,
@@ -202,6 +136,8 @@ def generate_json():
                 "raw_response": response
             }), 400
             
+    except LLMOverloaded:
+        raise
     except Exception as e:
         return jsonify({"success": False, "message": str(e)}), 500
 
@@ -214,6 +150,8 @@ def generate_field():
     - prompt: The user's description of what they want
     - field_type: The type of field to generate (name, description, greeting, etc.)
     - use_local_model (optional): Whether to use the local model
+    - temperature (optional): Temperature for generation (default: 0.7)
+    - cache (optional): Reuse the response to an identical request (default: only at temperature 0)
     
     Returns:
     - JSON with the generated content
@@ -230,84 +168,21 @@ def generate_field():
         if 'field_type' not in data:
             return jsonify({"success": False, "message": "Field type is required"}), 400
         
-        prompt = data.get('prompt')
         field_type = data.get('field_type')
-        use_local_model = data.get('use_local_model', False)
-        
-        # Define appropriate system prompts based on field type
-        system_prompts = {
-            'name': "You are a creative writer specializing in character names. Generate a single name appropriate for the description. Respond with just the name, no explanation or additional text.",
-            'description': "You are a creative writer specializing in character backgrounds. Create a rich, detailed character description based on the prompt. Include background, motivations, and key life events. No meta-commentary.",
-            'greeting': "You are a creative writer specializing in character dialogue. Create a greeting message that this character would say when first meeting someone. Make it match their personality. First person perspective only. Keep it under 150 characters.",
-            'appearance': "You are a creative writer specializing in character descriptions. Create a detailed physical description of a character based on the prompt, including their clothing, distinctive features, physical build, and overall visual impression. No meta-commentary.",
-            'personality': "You are a creative writer specializing in character development. Create a detailed personality description based on the prompt, including traits, habits, likes, dislikes, quirks, fears, and values. No meta-commentary.",
-            'speaking-style': "You are a creative writer specializing in dialogue. Describe in detail how this character speaks, including any speech patterns, accents, vocabulary level, phrases they commonly use, and verbal mannerisms. No meta-commentary."
-        }
-        
-        # Set system prompt based on field type
-        system_prompt = system_prompts.get(field_type, "You are a creative writer. Generate content based on the prompt.")
-        
-        # Create field-specific prompt
-        field_prompts = {
-            'name': f"Generate a character name based on this description: {prompt}. Only respond with the name itself, no additional text.",
-            'description': f"Write a rich character background and description based on: {prompt}. Include their background story, current situation, and any defining life events.",
-            'greeting': f"Create a greeting message that this character would say when first meeting someone. Character info: {prompt}. Write ONLY the greeting message in first person, as if the character is speaking.",
-            'appearance': f"Describe the physical appearance of a character based on: {prompt}. Include body type, clothing style, facial features, and any distinctive characteristics.",
-            'personality': f"Create a detailed personality description for a character based on: {prompt}. Include their temperament, values, habits, likes, dislikes, and interpersonal style.",
-            'speaking-style': f"Describe in detail how this character speaks based on: {prompt}. Include their vocabulary, accent, speech patterns, and any verbal quirks or phrases they commonly use."
-        }
-        
-        formatted_prompt = field_prompts.get(field_type, prompt)
-        
-        # Generate content using appropriate API
-        if use_local_model and Config.LOCAL_MODEL_ENDPOINT:
-            content = get_local_model_response(
-                system_prompt=system_prompt,
-                user_message=formatted_prompt,
-                temperature=0.7
-            )
-        else:
-            content = get_openrouter_response(
-                system_prompt=system_prompt,
-                user_message=formatted_prompt,
-                temperature=0.7
-            )
-        
-        # Clean up the response
-        if field_type == 'name':
-            # Remove quotes and extra spaces for names
-            content = content.strip().strip('"\'').strip()
-            
-            # Limit to reasonable name length
-            if len(content) > 50:
-                content = content[:50]
-                
-            # Remove any additional text after a period or newline
-            period_index = content.find('.')
-            if period_index > 0:
-                content = content[:period_index]
-                
-            newline_index = content.find('\n')
-            if newline_index > 0:
-                content = content[:newline_index]
-        
-        elif field_type == 'greeting':
-            # For greetings, ensure it's not too long
-            lines = content.split('\n')
-            content = lines[0] if lines else content
-            
-            if len(content) > 200:
-                content = content[:197] + "..."
-                
-            # Remove any quotes that might surround the greeting
-            content = content.strip().strip('"\'').strip()
+        temperature = float(data.get('temperature', 0.7))
+        content, cache_status = generate_field_content(
+            field_type, data.get('prompt'), data.get('use_local_model', False), temperature,
+            get_cache_mode(data, temperature)
+        )
         
-        return jsonify({
+        return with_cache_status(jsonify({
             "success": True,
             "content": content,
             "field_type": field_type
-        })
+        }), cache_status)
             
+    except LLMOverloaded:
+        raise
     except Exception as e:
         import traceback
         traceback.print_exc()
@@ -316,21 +191,204 @@ def generate_field():
             "message": str(e)
         }), 500
 
-def get_openrouter_response(system_prompt, user_message, temperature=0.7, max_tokens=None):
+@ai_bp.route('/api/generate-fields', methods=['POST'])
+def generate_fields():
     """
-    Get a response from OpenRouter API.
+    Generate several character fields from one prompt. The model calls run
+    concurrently on a shared pool (at most Config.FIELD_BATCH_CONCURRENCY
+    at a time across all requests).
     
-    Args:
-        system_prompt (str): The system prompt for the AI
-        user_message (str): The user message to send to the AI
-        temperature (float): Controls randomness in the response
-        max_tokens (int): Maximum tokens to generate (default: None)
+    Expects JSON with:
+    - prompt: The user's description of the character
+    - field_types: The fields to generate (name, description, greeting, etc.)
+    - use_local_model, temperature, cache (optional): As for /api/generate-field
     
     Returns:
-        str: The AI response
+    - JSON with "fields" (field type -> content) and "errors" (field type -> message)
+    
+    With `Accept: text/event-stream` each field is sent as a `field` event
+    ({"field_type", "content"} or {"field_type", "error"}) as soon as it is
+    ready, followed by a `done` event with the same payload as the JSON response.
+    """
+    data = request.get_json(silent=True)
+    if not data:
+        return jsonify({"success": False, "message": "Request data is required"}), 400
+    if 'prompt' not in data:
+        return jsonify({"success": False, "message": "Prompt is required"}), 400
+    field_types = data.get('field_types')
+    if not isinstance(field_types, list) or not field_types or not all(isinstance(f, str) for f in field_types):
+        return jsonify({"success": False, "message": "A list of field types is required"}), 400
+    
+    temperature = float(data.get('temperature', 0.7))
+    results = generate_fields_concurrently(
+        field_types, data['prompt'], data.get('use_local_model', False), temperature,
+        get_cache_mode(data, temperature)
+    )
+    
+    if request.accept_mimetypes.best_match(["application/json", "text/event-stream"]) != "text/event-stream":
+        fields, errors = {}, {}
+        for field_type, content, error in results:
+            if error is None:
+                fields[field_type] = content
+            else:
+                errors[field_type] = error
+        return jsonify({"success": not errors, "fields": fields, "errors": errors})
+    
+    from .chat_management import format_sse
+    
+    def generate():
+        fields, errors = {}, {}
+        for field_type, content, error in results:
+            if error is None:
+                fields[field_type] = content
+                yield format_sse("field", {"field_type": field_type, "content": content})
+            else:
+                errors[field_type] = error
+                yield format_sse("field", {"field_type": field_type, "error": error})
+        yield format_sse("done", {"success": not errors, "fields": fields, "errors": errors})
+    
+    response = Response(stream_with_context(generate()), mimetype="text/event-stream")
+    response.headers["Cache-Control"] = "no-cache"
+    response.headers["X-Accel-Buffering"] = "no"
+    return response
+
+def generate_fields_concurrently(field_types, prompt, use_local_model=False, temperature=0.7, cache_mode=CACHE_OFF):
+    """
+    Generate several fields at once on the shared field pool, so at most
+    Config.FIELD_BATCH_CONCURRENCY model calls run at a time across all
+    requests (field types asked for twice are generated once).
+    
+    Yields:
+        tuple: (field type, content, None) or (field type, None, error message),
+        for each field as soon as it is done
+    """
+    field_types = list(dict.fromkeys(field_types))
+    executor = _get_field_executor()
+    # Each call runs in a copy of this context, so it keeps the caller's scheduling priority
+    futures = {
+        executor.submit(contextvars.copy_context().run, generate_field_content,
+                        field_type, prompt, use_local_model, temperature, cache_mode): field_type
+        for field_type in field_types
+    }
+    try:
+        for future in as_completed(futures):
+            field_type = futures[future]
+            try:
+                content, _ = future.result()
+            except Exception as e:
+                print(f"Error generating {field_type}: {str(e)}")
+                yield field_type, None, str(e)
+            else:
+                yield field_type, content, None
+    finally:
+        # The caller stopped early (client gone, job cancelled): skip fields not started yet
+        for future in futures:
+            future.cancel()
+
+def _get_field_executor():
+    global _field_executor
+    if _field_executor is None:
+        with _field_executor_lock:
+            if _field_executor is None:
+                _field_executor = ThreadPoolExecutor(max_workers=Config.FIELD_BATCH_CONCURRENCY, thread_name_prefix="fields")
+    return _field_executor
+
+def generate_field_content(field_type, prompt, use_local_model=False, temperature=0.7, cache_mode=CACHE_OFF):
+    """
+    Generate and clean up the content of one character field.
+    
+    Returns:
+        tuple: (content, response cache status)
+    """
+    system_prompt, formatted_prompt = build_field_prompts(field_type, prompt)
+    
+    # Generate content using appropriate API
+    use_local_model = bool(use_local_model and Config.LOCAL_MODEL_ENDPOINT)
+    if use_local_model:
+        generate = lambda: get_local_model_response(
+            system_prompt=system_prompt,
+            user_message=formatted_prompt,
+            temperature=temperature
+        )
+    else:
+        generate = lambda: get_openrouter_response(
+            system_prompt=system_prompt,
+            user_message=formatted_prompt,
+            temperature=temperature
+        )
+    content, cache_status = cached_generate(
+        cache_mode, generate,
+        model_id(use_local_model), system_prompt, formatted_prompt, temperature
+    )
+    return clean_field_content(field_type, content), cache_status
+
+def build_field_prompts(field_type, prompt):
     """
-    url = "https://openrouter.ai/api/v1/chat/completions"
+    Build the prompts for generating one character field.
+    
+    Returns:
+        tuple: (system prompt, user prompt)
+    """
+    # Define appropriate system prompts based on field type
+    system_prompts = {
+        'name': "You are a creative writer specializing in character names. Generate a single name appropriate for the description. Respond with just the name, no explanation or additional text.",
+        'description': "You are a creative writer specializing in character backgrounds. Create a rich, detailed character description based on the prompt. Include background, motivations, and key life events. No meta-commentary.",
+        'greeting': "You are a creative writer specializing in character dialogue. Create a greeting message that this character would say when first meeting someone. Make it match their personality. First person perspective only. Keep it under 150 characters.",
+        'appearance': "You are a creative writer specializing in character descriptions. Create a detailed physical description of a character based on the prompt, including their clothing, distinctive features, physical build, and overall visual impression. No meta-commentary.",
+        'personality': "You are a creative writer specializing in character development. Create a detailed personality description based on the prompt, including traits, habits, likes, dislikes, quirks, fears, and values. No meta-commentary.",
+        'speaking-style': "You are a creative writer specializing in dialogue. Describe in detail how this character speaks, including any speech patterns, accents, vocabulary level, phrases they commonly use, and verbal mannerisms. No meta-commentary."
+    }
+
+    # Set system prompt based on field type
+    system_prompt = system_prompts.get(field_type, "You are a creative writer. Generate content based on the prompt.")
+    
+    # Create field-specific prompt
+    field_prompts = {
+        'name': f"Generate a character name based on this description: {prompt}. Only respond with the name itself, no additional text.",
+        'description': f"Write a rich character background and description based on: {prompt}. Include their background story, current situation, and any defining life events.",
+        'greeting': f"Create a greeting message that this character would say when first meeting someone. Character info: {prompt}. Write ONLY the greeting message in first person, as if the character is speaking.",
+        'appearance': f"Describe the physical appearance of a character based on: {prompt}. Include body type, clothing style, facial features, and any distinctive characteristics.",
+        'personality': f"Create a detailed personality description for a character based on: {prompt}. Include their temperament, values, habits, likes, dislikes, and interpersonal style.",
+        'speaking-style': f"Describe in detail how this character speaks based on: {prompt}. Include their vocabulary, accent, speech patterns, and any verbal quirks or phrases they commonly use."
+    }
+
+    return system_prompt, field_prompts.get(field_type, prompt)
+
+def clean_field_content(field_type, content):
+    """Tidy up a generated field value (names and greetings are trimmed to one short line)"""
+    # Clean up the response
+    if field_type == 'name':
+        # Remove quotes and extra spaces for names
+        content = content.strip().strip('"\'').strip()
+        
+        # Limit to reasonable name length
+        if len(content) > 50:
+            content = content[:50]
+            
+        # Remove any additional text after a period or newline
+        period_index = content.find('.')
+        if period_index > 0:
+            content = content[:period_index]
+            
+        newline_index = content.find('\n')
+        if newline_index > 0:
+            content = content[:newline_index]
+    
+    elif field_type == 'greeting':
+        # For greetings, ensure it's not too long
+        lines = content.split('\n')
+        content = lines[0] if lines else content
+        
+        if len(content) > 200:
+            content = content[:197] + "..."
+            
+        # Remove any quotes that might surround the greeting
+        content = content.strip().strip('"\'').strip()
     
+    return content
+
+def _openrouter_request(system_prompt, user_message, temperature=0.7, max_tokens=None, stream=False, model=None):
+    """URL, headers and payload of an OpenRouter chat completion request"""
     # Get API key from config
     api_key = Config.OPENROUTER_API_KEY or os.environ.get("OPENROUTER_API_KEY")
     
@@ -348,7 +406,7 @@ def get_openrouter_response(system_prompt, user_message, temperature=0.7, max_to
         "X-Title": app_name
     }
     
-    model_name = Config.DEFAULT_MODEL or "openai/gpt-3.5-turbo"
+    model_name = model or Config.DEFAULT_MODEL or "openai/gpt-3.5-turbo"
     
     # Build request data
     data = {
@@ -360,24 +418,48 @@ def get_openrouter_response(system_prompt, user_message, temperature=0.7, max_to
         "temperature": temperature
     }
     
+    if stream:
+        data["stream"] = True
+    
     # Add max_tokens if specified
     if max_tokens:
         data["max_tokens"] = max_tokens
     
+    return http_client.OPENROUTER_CHAT_URL, headers, data
+
+def _completion_content(result):
+    """Extract the generated text from a chat completion response body"""
+    # This structure may need to be adjusted based on your local API
+    if "choices" in result and len(result["choices"]) > 0:
+        content = result["choices"][0]["message"]["content"]
+        return content.strip()
+    else:
+        raise ValueError("No valid response content found in the API response")
+
+def get_openrouter_response(system_prompt, user_message, temperature=0.7, max_tokens=None, model=None):
+    """
+    Get a response from OpenRouter API.
+    
+    Args:
+        system_prompt (str): The system prompt for the AI
+        user_message (str): The user message to send to the AI
+        temperature (float): Controls randomness in the response
+        max_tokens (int): Maximum tokens to generate (default: None)
+        model (str): OpenRouter model (default: Config.DEFAULT_MODEL)
+    
+    Returns:
+        str: The AI response
+    """
+    url, headers, data = _openrouter_request(system_prompt, user_message, temperature, max_tokens, model=model)
+    
     try:
         # Make API request
-        response = requests.post(url, json=data, headers=headers)
+        with llm_slot(PROVIDER_OPENROUTER, data.get("model")):
+            response = http_client.post(url, json=data, headers=headers)
         response.raise_for_status()  # Raise exception for failed requests
         
-        # Parse response
-        result = response.json()
-        
-        # Extract and return the content
-        if "choices" in result and len(result["choices"]) > 0:
-            content = result["choices"][0]["message"]["content"]
-            return content.strip()
-        else:
-            raise ValueError("No valid response content found in the API response")
+        # Parse response and extract the content
+        return _completion_content(response.json())
     
     except requests.exceptions.RequestException as e:
         error_detail = str(e)
@@ -390,71 +472,157 @@ def get_openrouter_response(system_prompt, user_message, temperature=0.7, max_to
         
         raise Exception(f"OpenRouter API request failed: {error_detail}")
 
-def get_local_model_response(system_prompt, user_message, temperature=0.7, max_tokens=None):
+def get_local_model_response(system_prompt, user_message, temperature=0.7, max_tokens=None, chat=None):
     """
-    Get a response from a locally hosted model (if available).
+    Get a response from the local model (Ollama).
     
     Args:
         system_prompt (str): The system prompt for the AI
         user_message (str): The user message to send to the AI
         temperature (float): Controls randomness in the response
         max_tokens (int): Maximum tokens to generate (default: None)
+        chat (local_model.ChatContext): For chat turns, to continue from the chat's previous turn
     
     Returns:
         str: The AI response
     """
-    # Check if local model is configured
-    if not Config.LOCAL_MODEL_ENDPOINT:
-        raise ValueError("Local model not configured. Please set LOCAL_MODEL_ENDPOINT in config.py")
+    return "".join(local_model.stream_chat(system_prompt, user_message, temperature, max_tokens, chat)).strip()
+
+def _parse_stream_line(line):
+    """
+    Parse one line of a streaming completion response.
     
-    url = Config.LOCAL_MODEL_ENDPOINT
+    Handles OpenAI-style Server-Sent Events ("data: {...}" lines ending with
+    "data: [DONE]") as well as Ollama's newline-delimited JSON chunks.
     
-    # Build request payload based on the API expected by your local model
-    # This is a general example for an Ollama-like API
-    data = {
-        "model": Config.LOCAL_MODEL_NAME or "llama2",
-        "messages": [
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": user_message}
-        ],
-        "temperature": temperature
-    }
-    
-    # Add max_tokens if specified and if your API supports it
-    if max_tokens:
-        data["max_tokens"] = max_tokens
+    Returns:
+        tuple: (generated text or None, whether this was the final chunk)
+    """
+    if not line or line.startswith(":"):
+        return None, False  # Keep-alive comment or event separator
+    if line.startswith("data:"):
+        line = line[5:].strip()
+        if line == "[DONE]":
+            return None, True
+    try:
+        chunk = json.loads(line)
+    except json.JSONDecodeError:
+        return None, False
+    
+    if "error" in chunk:
+        error = chunk["error"]
+        raise Exception(error.get("message", str(error)) if isinstance(error, dict) else str(error))
+    
+    text = None
+    if "choices" in chunk:
+        if chunk["choices"]:
+            delta = chunk["choices"][0].get("delta") or chunk["choices"][0].get("message") or {}
+            text = delta.get("content")
+    elif "message" in chunk:
+        text = chunk["message"].get("content")
+    else:
+        text = chunk.get("response")
+    
+    return text or None, bool(chunk.get("done"))
+
+def _iter_stream_deltas(response):
+    """Yield the generated text from a streaming completion response"""
+    # Event streams are UTF-8 but often arrive without a charset
+    response.encoding = "utf-8"
+    finished = False
+    for line in response.iter_lines(decode_unicode=True):
+        # After the final chunk keep reading to the end of the body so the
+        # connection can go back to the pool
+        if finished:
+            continue
+        text, finished = _parse_stream_line(line)
+        if text:
+            yield text
+
+def stream_openrouter_response(system_prompt, user_message, temperature=0.7, max_tokens=None):
+    """
+    Stream a response from OpenRouter API.
     
-    # Set appropriate headers for the local API
-    headers = {
-        "Content-Type": "application/json"
-    }
+    Takes the same arguments as get_openrouter_response and yields the
+    generated text in pieces as it is produced.
+    """
+    url, headers, data = _openrouter_request(system_prompt, user_message, temperature, max_tokens, stream=True)
     
     try:
-        # Make API request
-        response = requests.post(url, json=data, headers=headers)
-        response.raise_for_status()  # Raise exception for failed requests
-        
-        # Parse response (adjust based on your local model's API response structure)
-        result = response.json()
-        
-        # Extract the content from the response
-        # This structure may need to be adjusted based on your local API
-        if "choices" in result and len(result["choices"]) > 0:
-            content = result["choices"][0]["message"]["content"]
-            return content.strip()
-        else:
-            raise ValueError("No valid response content found in the API response")
-    
+        # The slot is held until the whole reply has been streamed
+        with llm_slot(PROVIDER_OPENROUTER, data.get("model")), \
+                http_client.post(url, json=data, headers=headers, stream=True) as response:
+            response.raise_for_status()
+            yield from _iter_stream_deltas(response)
     except requests.exceptions.RequestException as e:
+        raise Exception(f"OpenRouter API request failed: {str(e)}")
+
+def stream_local_model_response(system_prompt, user_message, temperature=0.7, max_tokens=None, chat=None):
+    """
+    Stream a response from the local model (Ollama).
+    
+    Takes the same arguments as get_local_model_response and yields the
+    generated text in pieces as it is produced.
+    """
+    return local_model.stream_chat(system_prompt, user_message, temperature, max_tokens, chat)
+
+# asyncio versions of the provider calls, used by the ASGI app (asgi.py).
+# They build the same requests but wait on the network without holding a thread.
+
+async def _post_async(url, headers, data, provider):
+    try:
+        async with llm_slot_async(PROVIDER_OPENROUTER, data.get("model")):
+            response = await async_http_client.post(url, json=data, headers=headers)
+        response.raise_for_status()
+        return _completion_content(response.json())
+    except async_http_client.HTTPStatusError as e:
         error_detail = str(e)
         try:
-            error_json = e.response.json()
-            if "error" in error_json:
-                error_detail = f"{error_json.get('error', 'Unknown error')}"
+            error = e.response.json()["error"]
+            error_detail = error.get("message", "Unknown error") if isinstance(error, dict) else str(error)
         except:
             pass
-        
-        raise Exception(f"Local model API request failed: {error_detail}")
+        raise Exception(f"{provider} request failed: {error_detail}")
+    except OSError as e:
+        raise Exception(f"{provider} request failed: {str(e)}")
+
+async def _stream_async(url, headers, data, provider):
+    try:
+        async with llm_slot_async(PROVIDER_OPENROUTER, data.get("model")), \
+                async_http_client.stream("POST", url, json=data, headers=headers) as response:
+            if response.status_code >= 400:
+                await response.read()
+                response.raise_for_status()
+            finished = False
+            async for line in response.aiter_lines():
+                # Read to the end of the body so the connection can be reused
+                if finished:
+                    continue
+                text, finished = _parse_stream_line(line)
+                if text:
+                    yield text
+    except (OSError, async_http_client.HTTPStatusError) as e:
+        raise Exception(f"{provider} request failed: {str(e)}")
+
+async def get_openrouter_response_async(system_prompt, user_message, temperature=0.7, max_tokens=None):
+    """asyncio version of get_openrouter_response"""
+    url, headers, data = _openrouter_request(system_prompt, user_message, temperature, max_tokens)
+    return await _post_async(url, headers, data, "OpenRouter API")
+
+async def get_local_model_response_async(system_prompt, user_message, temperature=0.7, max_tokens=None, chat=None):
+    """asyncio version of get_local_model_response"""
+    parts = [text async for text in local_model.stream_chat_async(system_prompt, user_message, temperature, max_tokens, chat)]
+    return "".join(parts).strip()
+
+async def stream_openrouter_response_async(system_prompt, user_message, temperature=0.7, max_tokens=None):
+    """asyncio version of stream_openrouter_response (an async generator)"""
+    url, headers, data = _openrouter_request(system_prompt, user_message, temperature, max_tokens, stream=True)
+    async for text in _stream_async(url, headers, data, "OpenRouter API"):
+        yield text
+
+def stream_local_model_response_async(system_prompt, user_message, temperature=0.7, max_tokens=None, chat=None):
+    """asyncio version of stream_local_model_response (an async generator)"""
+    return local_model.stream_chat_async(system_prompt, user_message, temperature, max_tokens, chat)
 
 def validate_json_response(response_text):
     """
@@ -487,110 +655,14 @@ def validate_json_response(response_text):
         else:
             raise ValueError("No JSON object found in the response")
 
+def is_valid_json_response(response_text):
+    """Whether validate_json_response can extract JSON from a response"""
+    try:
+        validate_json_response(response_text)
+        return True
+    except ValueError:
+        return False
+
 def process_llm_response(response_text):
     """Process the response from the LLM to extract structured data"""
-    result = {
-        "text": response_text,
-        "mood": "neutral",
-        "emotions": {},
-        "opinion_of_user": "neutral",
-        "action": "standing still",
-        "location": "current location"
-    }
-    
-    try:
-        # First, try to parse the entire response as JSON
-        try:
-            parsed = json.loads(response_text)
-            if isinstance(parsed, dict):
-                # If it's a complete JSON object with the expected fields
-                if "text" in parsed:
-                    result["text"] = parsed.get("text", result["text"])
-                    result["mood"] = parsed.get("mood", result["mood"])
-                    result["emotions"] = parsed.get("emotions", result["emotions"])
-                    result["opinion_of_user"] = parsed.get("opinion_of_user", result["opinion_of_user"])
-                    result["action"] = parsed.get("action", result["action"])
-                    result["location"] = parsed.get("location", result["location"])
-                    return result
-        except:
-            pass  # Not a complete JSON response, try extracting JSON from text
-        
-        # Look for JSON object inside the text - various patterns
-        json_patterns = [
-            r'\{[\s\S]*\}',                   # Any JSON object
-            r'```json\s*([\s\S]*?)\s*```',    # JSON in code block with json tag
-            r'```\s*([\s\S]*?)\s*```',        # JSON in any code block
-            r'\{("text"|\'text\')[\s\S]*\}'   # JSON object with text field
-        ]
-        
-        for pattern in json_patterns:
-            try:
-                matches = re.findall(pattern, response_text)
-                for match in matches:
-                    # If the match is a capture group (from code block patterns)
-                    if isinstance(match, str) and match.strip().startswith('{'):
-                        try:
-                            parsed = json.loads(match.strip())
-                            if isinstance(parsed, dict) and "text" in parsed:
-                                # Extract all fields from the parsed JSON
-                                result["text"] = parsed.get("text", result["text"])
-                                result["mood"] = parsed.get("mood", result["mood"])
-                                result["emotions"] = parsed.get("emotions", result["emotions"])
-                                result["opinion_of_user"] = parsed.get("opinion_of_user", result["opinion_of_user"])
-                                result["action"] = parsed.get("action", result["action"])
-                                result["location"] = parsed.get("location", result["location"])
-                                return result
-                        except:
-                            continue
-                    # For patterns without capture groups
-                    elif not isinstance(match, str):
-                        try:
-                            parsed = json.loads(match[0])
-                            if isinstance(parsed, dict) and "text" in parsed:
-                                result["text"] = parsed.get("text", result["text"])
-                                result["mood"] = parsed.get("mood", result["mood"])
-                                result["emotions"] = parsed.get("emotions", result["emotions"])
-                                result["opinion_of_user"] = parsed.get("opinion_of_user", result["opinion_of_user"])
-                                result["action"] = parsed.get("action", result["action"])
-                                result["location"] = parsed.get("location", result["location"])
-                                return result
-                        except:
-                            continue
-            except:
-                continue  # Try the next pattern
-    except:
-        pass  # Fallback to heuristic approach
-    
-    # If JSON parsing completely failed, extract text fields using regex patterns
-    # Remove any JSON-like structures or code blocks from the text
-    cleaned_text = re.sub(r'\{[\s\S]*?\}', '', response_text)
-    cleaned_text = re.sub(r'```[\s\S]*?```', '', cleaned_text)
-    cleaned_text = cleaned_text.strip()
-    
-    # If we have cleaned text, use it
-    if cleaned_text:
-        result["text"] = cleaned_text
-    
-    # Look for actions enclosed in asterisks or parentheses
-    action_match = re.search(r'\*(.*?)\*|\((.*?)\)', response_text)
-    if action_match:
-        action = action_match.group(1) or action_match.group(2)
-        if action:
-            result["action"] = action.strip()
-    
-    # Check for location mentions
-    location_match = re.search(r'at (the|a) ([^\.]*)', response_text)
-    if location_match:
-        location = location_match.group(2)
-        if location:
-            result["location"] = location.strip()
-    
-    # Infer mood from language
-    if re.search(r'laugh|chuckle|grin|smile|happy|joy', response_text, re.IGNORECASE):
-        result["mood"] = "happy"
-    elif re.search(r'frown|sigh|sad|upset|depress', response_text, re.IGNORECASE):
-        result["mood"] = "sad"
-    elif re.search(r'angry|furious|mad|rage', response_text, re.IGNORECASE):
-        result["mood"] = "angry"
-    
-    return result
\ No newline at end of file
+    return parse_response(response_text)
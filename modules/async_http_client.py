@@ -0,0 +1,304 @@
+"""
+asyncio HTTP client for model provider calls made from the ASGI app (asgi.py).
+
+A minimal HTTP/1.1 client on asyncio streams, so a slow completion only
+holds a socket, not a thread: one process can wait on hundreds of them.
+Connections are kept alive and pooled per host like http_client's, and use
+the same configured timeouts. Only what the provider calls need is
+supported: JSON request bodies, Content-Length, chunked or read-to-close
+responses, and line-by-line streaming.
+"""
+
+import asyncio
+import ssl
+import time
+from contextlib import asynccontextmanager
+from json import dumps as json_dumps, loads as json_loads
+from urllib.parse import urlsplit
+from config import Config
+
+_ssl_context = None
+# (scheme, host, port) -> _HostPool
+_pools = {}
+_stats = {
+    "requests": 0,
+    "errors": 0,
+    "timeouts": 0,
+    "connections_opened": 0,
+    "total_time_ms": 0.0,
+    "in_flight": 0
+}
+
+
+class HTTPStatusError(Exception):
+    """Raised by raise_for_status() for 4xx and 5xx responses"""
+
+    def __init__(self, message, response):
+        super().__init__(message)
+        self.response = response
+
+
+class _HostPool:
+    """Idle keep-alive connections to one host, with a cap on open connections"""
+
+    def __init__(self, loop):
+        self.loop = loop
+        self.idle = []
+        self.slots = asyncio.Semaphore(Config.ASYNC_HTTP_MAX_CONNECTIONS)
+
+
+class AsyncResponse:
+    """Status, headers and (once read) body of a response"""
+
+    def __init__(self, status_code, reason, headers, connection):
+        self.status_code = status_code
+        self.reason = reason
+        self.headers = headers
+        self.content = None
+        self._connection = connection
+
+    @property
+    def text(self):
+        return (self.content or b"").decode("utf-8", errors="replace")
+
+    def json(self):
+        return json_loads(self.text)
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise HTTPStatusError(f"{self.status_code} {self.reason}: {self.text[:500]}", self)
+
+    async def read(self):
+        """Read the whole body"""
+        if self.content is None:
+            chunks = []
+            async for chunk in self._connection.iter_body(self):
+                chunks.append(chunk)
+            self.content = b"".join(chunks)
+        return self.content
+
+    async def aiter_lines(self):
+        """Yield the body line by line (decoded as UTF-8) as it arrives"""
+        buffer = b""
+        async for chunk in self._connection.iter_body(self):
+            buffer += chunk
+            *lines, buffer = buffer.split(b"\n")
+            for line in lines:
+                yield line.rstrip(b"\r").decode("utf-8", errors="replace")
+        if buffer:
+            yield buffer.rstrip(b"\r").decode("utf-8", errors="replace")
+        self.content = b""
+
+
+class _Connection:
+    """One HTTP/1.1 connection"""
+
+    def __init__(self, reader, writer, read_timeout):
+        self.reader = reader
+        self.writer = writer
+        self.read_timeout = read_timeout
+        self.reusable = True
+        self.body_done = False
+
+    async def _read(self, coroutine):
+        return await asyncio.wait_for(coroutine, self.read_timeout)
+
+    async def send(self, method, target, host, headers, body):
+        lines = [f"{method} {target} HTTP/1.1", f"Host: {host}"]
+        lines += [f"{name}: {value}" for name, value in headers.items()]
+        lines.append(f"Content-Length: {len(body)}")
+        self.writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + body)
+        await self.writer.drain()
+
+    async def read_head(self):
+        self.body_done = False
+        status_line = await self._read(self.reader.readline())
+        if not status_line:
+            raise ConnectionResetError("Connection closed before the response")
+        _, status, *reason = status_line.decode("latin-1").rstrip("\r\n").split(" ", 2)
+
+        headers = {}
+        while True:
+            line = await self._read(self.reader.readline())
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        if headers.get("connection", "").lower() == "close":
+            self.reusable = False
+        return AsyncResponse(int(status), reason[0] if reason else "", headers, self)
+
+    async def iter_body(self, response):
+        headers = response.headers
+        if self.body_done:
+            return
+        if "chunked" in headers.get("transfer-encoding", "").lower():
+            while True:
+                size_line = await self._read(self.reader.readline())
+                size = int(size_line.split(b";")[0].strip() or b"0", 16)
+                if size == 0:
+                    # Trailers end with an empty line
+                    while (await self._read(self.reader.readline())) not in (b"\r\n", b"\n", b""):
+                        pass
+                    break
+                chunk = await self._read(self.reader.readexactly(size + 2))
+                yield chunk[:-2]
+        elif "content-length" in headers:
+            remaining = int(headers["content-length"])
+            while remaining > 0:
+                chunk = await self._read(self.reader.read(min(remaining, 65536)))
+                if not chunk:
+                    raise ConnectionResetError("Connection closed in the middle of the response")
+                remaining -= len(chunk)
+                yield chunk
+        elif response.status_code not in (204, 304):
+            # No length: the body runs to the end of the connection
+            self.reusable = False
+            while True:
+                chunk = await self._read(self.reader.read(65536))
+                if not chunk:
+                    break
+                yield chunk
+        self.body_done = True
+
+    def close(self):
+        self.reusable = False
+        self.writer.close()
+
+
+def _get_ssl_context():
+    global _ssl_context
+    if _ssl_context is None:
+        _ssl_context = ssl.create_default_context()
+    return _ssl_context
+
+
+def _get_pool(key):
+    # Connections belong to the event loop that opened them
+    loop = asyncio.get_running_loop()
+    pool = _pools.get(key)
+    if pool is None or pool.loop is not loop:
+        pool = _pools[key] = _HostPool(loop)
+    return pool
+
+
+async def _open(scheme, host, port, timeout):
+    connect_timeout, read_timeout = timeout
+    reader, writer = await asyncio.wait_for(
+        asyncio.open_connection(
+            host, port,
+            ssl=_get_ssl_context() if scheme == "https" else None,
+            server_hostname=host if scheme == "https" else None
+        ),
+        connect_timeout
+    )
+    _stats["connections_opened"] += 1
+    return _Connection(reader, writer, read_timeout)
+
+
+@asynccontextmanager
+async def stream(method, url, json=None, headers=None, timeout=None):
+    """
+    Send a request and yield the response once its headers have arrived.
+    Read the body with read() or aiter_lines() inside the block; the
+    connection goes back to the pool afterwards if it was fully read.
+
+    Args:
+        method (str): HTTP method
+        url (str): Full http(s) URL
+        json: Request body, sent as JSON
+        headers (dict): Extra request headers
+        timeout: Seconds, or a (connect, read) tuple; defaults to the configured timeouts
+    """
+    if timeout is None:
+        timeout = (Config.HTTP_CONNECT_TIMEOUT, Config.HTTP_READ_TIMEOUT)
+    elif not isinstance(timeout, tuple):
+        timeout = (timeout, timeout)
+
+    parts = urlsplit(url)
+    scheme = parts.scheme
+    port = parts.port or (443 if scheme == "https" else 80)
+    host = parts.hostname
+    target = parts.path or "/"
+    if parts.query:
+        target += "?" + parts.query
+
+    request_headers = {"Accept": "*/*", "Connection": "keep-alive"}
+    body = b""
+    if json is not None:
+        request_headers["Content-Type"] = "application/json"
+        body = json_dumps(json).encode("utf-8")
+    request_headers.update(headers or {})
+    host_header = host if port in (80, 443) else f"{host}:{port}"
+
+    pool = _get_pool((scheme, host, port))
+    start = time.perf_counter()
+    _stats["in_flight"] += 1
+    connection = None
+    try:
+        async with pool.slots:
+            # A pooled connection may have been closed by the server while idle;
+            # if it fails before any response arrives, retry on a new one
+            for attempt in range(2):
+                reused = attempt == 0 and bool(pool.idle)
+                if reused:
+                    connection = pool.idle.pop()
+                    connection.read_timeout = timeout[1]
+                else:
+                    connection = await _open(scheme, host, port, timeout)
+                try:
+                    await connection.send(method, target, host_header, request_headers, body)
+                    response = await connection.read_head()
+                    break
+                except (ConnectionError, asyncio.IncompleteReadError):
+                    connection.close()
+                    connection = None
+                    if not reused or attempt:
+                        raise
+
+            yield response
+
+            if connection.body_done and connection.reusable:
+                pool.idle.append(connection)
+            else:
+                connection.close()
+            connection = None
+    except asyncio.TimeoutError:
+        _stats["timeouts"] += 1
+        _stats["errors"] += 1
+        raise TimeoutError(f"Request to {host} timed out")
+    except (OSError, asyncio.IncompleteReadError, ValueError):
+        _stats["errors"] += 1
+        raise
+    finally:
+        if connection is not None:
+            connection.close()
+        _stats["in_flight"] -= 1
+        _stats["requests"] += 1
+        _stats["total_time_ms"] += (time.perf_counter() - start) * 1000
+
+
+async def request(method, url, **kwargs):
+    """Send a request and read the whole response (see stream() for the arguments)"""
+    async with stream(method, url, **kwargs) as response:
+        await response.read()
+        return response
+
+
+async def post(url, **kwargs):
+    """POST and read the whole response"""
+    return await request("POST", url, **kwargs)
+
+
+def get_pool_stats():
+    """Get request counters and idle connections per host"""
+    stats = dict(_stats)
+    stats["total_time_ms"] = round(stats["total_time_ms"], 2)
+    stats["avg_time_ms"] = round(stats["total_time_ms"] / stats["requests"], 2) if stats["requests"] else 0.0
+    stats["max_connections_per_host"] = Config.ASYNC_HTTP_MAX_CONNECTIONS
+    stats["hosts"] = [
+        {"host": f"{scheme}://{host}:{port}", "idle_connections": len(pool.idle)}
+        for (scheme, host, port), pool in list(_pools.items())
+    ]
+    return stats
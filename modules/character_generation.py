@@ -1,7 +1,21 @@
 from flask import jsonify, request
 import json
-import requests
 from config import Config
+from . import http_client, local_model
+from .response_cache import get_cache_mode, cached_generate, with_cache_status, model_id, CACHE_OFF
+from .llm_scheduler import LLMOverloaded, llm_slot, PROVIDER_OPENROUTER
+
+# Fields a generated character can include (description and personality always are)
+CHARACTER_FIELDS = ("description", "personality", "speaking_style", "appearance", "greeting")
+
+def validate_include_fields(include_fields):
+    """Check the include_fields of a character generation request; returns an error message or None"""
+    if not isinstance(include_fields, list) or not all(isinstance(field, str) for field in include_fields):
+        return "include_fields must be a list of field names"
+    unknown = [field for field in include_fields if field not in CHARACTER_FIELDS]
+    if unknown:
+        return f"Unknown fields: {', '.join(unknown)} (known fields: {', '.join(CHARACTER_FIELDS)})"
+    return None
 
 def register_character_generation_routes(app):
     """Register character generation routes with the Flask app"""
@@ -15,152 +29,185 @@ def register_character_generation_routes(app):
         
         if not prompt:
             return jsonify({"success": False, "message": "Prompt is required"}), 400
+        error = validate_include_fields(include_fields)
+        if error:
+            return jsonify({"success": False, "message": error}), 400
         
-        # Build system prompt for character generation
-        system_prompt = """You are a creative AI assistant specializing in character creation. 
-        Generate a detailed character profile based on the user's prompt.
-        Your response should be in JSON format with the following structure:
-        {
-            "description": "A detailed paragraph describing the character's background, appearance, and role",
-            "personality": "A detailed description of the character's personality traits, habits, likes, dislikes, quirks, strengths, and weaknesses"
-        """
+        use_local_model = data.get("use_local_model", False)
+        temperature = float(data.get("temperature", 0.7))
         
-        # Add additional fields as requested
-        if "speaking_style" in include_fields:
-            system_prompt += """,
-            "speaking_style": "A description of how the character speaks, their accent, vocabulary, catch phrases, speech patterns, and verbal mannerisms"
-        """
-        
-        if "appearance" in include_fields:
-            system_prompt += """,
-            "appearance": "A detailed physical description including height, build, distinctive features, clothing style, and overall visual impression"
-        """
+        try:
+            result, cache_status = generate_character_profile(
+                prompt, include_fields, use_local_model, temperature,
+                get_cache_mode(data, temperature)
+            )
+            return with_cache_status(jsonify({
+                "success": True,
+                "character": result
+            }), cache_status)
+        except LLMOverloaded:
+            raise
+        except Exception as e:
+            print(f"Error generating character: {str(e)}")
+            return jsonify({"success": False, "message": f"Error generating character: {str(e)}"}), 500
+
+def generate_character_profile(prompt, include_fields, use_local_model=False, temperature=0.7, cache_mode=CACHE_OFF):
+    """
+    Generate a character profile (used by /api/generate-character and character jobs).
+    
+    Args:
+        prompt (str): The user's description of the character
+        include_fields (list): Fields to generate besides description and personality
+        use_local_model (bool): Use the local model instead of OpenRouter
+        temperature (float): Controls randomness in the response
+        cache_mode (str): From response_cache.get_cache_mode()
+    
+    Returns:
+        tuple: (dict with every requested field, response cache status)
+    """
+    # Build system prompt for character generation
+    system_prompt = """You are a creative AI assistant specializing in character creation. 
+    Generate a detailed character profile based on the user's prompt.
+    Your response should be in JSON format with the following structure:
+    {
+        "description": "A detailed paragraph describing the character's background, appearance, and role",
+        "personality": "A detailed description of the character's personality traits, habits, likes, dislikes, quirks, strengths, and weaknesses"
+    """
+    
+    # Add additional fields as requested
+    if "speaking_style" in include_fields:
+        system_prompt += """,
+        "speaking_style": "A description of how the character speaks, their accent, vocabulary, catch phrases, speech patterns, and verbal mannerisms"
+    """
+    
+    if "appearance" in include_fields:
+        system_prompt += """,
+        "appearance": "A detailed physical description including height, build, distinctive features, clothing style, and overall visual impression"
+    """
+    
+    if "greeting" in include_fields:
+        system_prompt += """,
+        "greeting": "A short greeting message that the character would say when first meeting someone, reflecting their personality and speaking style"
+    """
+    
+    # Close the JSON description
+    system_prompt += """
+    }
+    Be creative, detailed, and consistent. Make the character feel like a well-rounded individual."""
+    
+    def request_character():
+        if use_local_model:
+            # Use local model
+            return local_model.generate(f"User prompt: {prompt}\n\nOutput JSON:", system_prompt,
+                                        temperature, max_tokens=2000)
         
-        if "greeting" in include_fields:
-            system_prompt += """,
-            "greeting": "A short greeting message that the character would say when first meeting someone, reflecting their personality and speaking style"
-        """
+        # Use OpenRouter API
+        headers = {
+            "Content-Type": "application/json",
+            "Authorization": f"Bearer {Config.OPENROUTER_API_KEY}"
+        }
         
-        # Close the JSON description
-        system_prompt += """
+        generation_data = {
+            "model": Config.DEFAULT_MODEL,
+            "messages": [
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": prompt}
+            ],
+            "temperature": temperature
         }
-        Be creative, detailed, and consistent. Make the character feel like a well-rounded individual."""
         
-        try:
-            # Decide which API to use
-            use_local_model = data.get("use_local_model", False)
+        with llm_slot(PROVIDER_OPENROUTER, Config.DEFAULT_MODEL):
+            response = http_client.post(http_client.OPENROUTER_CHAT_URL,
+                                     headers=headers,
+                                     json=generation_data)
+        
+        if response.status_code != 200:
+            raise Exception(f"Error from OpenRouter API: {response.text}")
+        
+        return response.json()["choices"][0]["message"]["content"]
+    
+    # Failed calls raise (and are shared with identical concurrent requests); a response
+    # without the JSON object is not cached, so generating again asks the model again
+    result_text, cache_status = cached_generate(
+        cache_mode, request_character,
+        model_id(use_local_model), system_prompt, prompt, temperature,
+        2000 if use_local_model else None,
+        validate=has_character_json
+    )
+    return parse_character_profile(result_text, include_fields), cache_status
+
+def has_character_json(result_text):
+    """Whether a response holds the JSON object parse_character_profile reads the fields from"""
+    json_start = result_text.find('{')
+    json_end = result_text.rfind('}') + 1
+    if json_start < 0 or json_end <= json_start:
+        return False
+    try:
+        return isinstance(json.loads(result_text[json_start:json_end]), dict)
+    except json.JSONDecodeError:
+        return False
+
+def parse_character_profile(result_text, include_fields):
+    """Extract the character fields from the model's response, even when it is not valid JSON"""
+    # Parse JSON response from the LLM
+    try:
+        # Extract JSON if the response contains extra text
+        json_start = result_text.find('{')
+        json_end = result_text.rfind('}') + 1
+        
+        if json_start >= 0 and json_end > json_start:
+            json_str = result_text[json_start:json_end]
+            result = json.loads(json_str)
+        else:
+            # Fallback if proper JSON format not found
+            result = {
+                "description": "Error parsing AI response. Please try again.",
+                "personality": "Error parsing AI response. Please try again."
+            }
+        
+        # Ensure all requested fields exist (even if empty)
+        for field in include_fields:
+            if field not in result:
+                result[field] = ""
             
-            if use_local_model:
-                # Use local model
-                generation_prompt = f"{system_prompt}\n\nUser prompt: {prompt}\n\nOutput JSON:"
-                
-                generation_data = {
-                    "prompt": generation_prompt,
-                    "max_tokens": 2000,
-                    "temperature": 0.7
-                }
-                
-                response = requests.post(Config.LOCAL_MODEL_URL, json=generation_data, timeout=30)
-                
-                if response.status_code != 200:
-                    return jsonify({"success": False, "message": f"Error generating character with local model: {response.text}"}), 500
+        return result
+    except json.JSONDecodeError:
+        # Handle case when LLM doesn't provide valid JSON
+        # Make a best effort to extract fields
+        result = {}
+        
+        # Try to identify sections based on field names in the text
+        for field in include_fields:
+            field_marker = f"{field.replace('_', ' ').title()}:"
+            field_index = result_text.lower().find(field_marker.lower())
+            
+            if field_index >= 0:
+                # Look for the next field marker to determine where this section ends
+                next_field_index = len(result_text)
+                for next_field in include_fields:
+                    if next_field != field:
+                        next_marker = f"{next_field.replace('_', ' ').title()}:"
+                        idx = result_text.lower().find(next_marker.lower(), field_index + len(field_marker))
+                        if idx >= 0 and idx < next_field_index:
+                            next_field_index = idx
                 
-                result_text = response.json().get("response", "")
+                # Extract the content between this field marker and the next
+                content = result_text[field_index + len(field_marker):next_field_index].strip()
+                result[field] = content
             else:
-                # Use OpenRouter API
-                headers = {
-                    "Content-Type": "application/json",
-                    "Authorization": f"Bearer {Config.OPENROUTER_API_KEY}"
-                }
-                
-                generation_data = {
-                    "model": Config.DEFAULT_MODEL,
-                    "messages": [
-                        {"role": "system", "content": system_prompt},
-                        {"role": "user", "content": prompt}
-                    ],
-                    "temperature": 0.7
-                }
-                
-                response = requests.post("https://openrouter.ai/api/v1/chat/completions",
-                                      headers=headers,
-                                      json=generation_data,
-                                      timeout=30)
-                
-                if response.status_code != 200:
-                    return jsonify({"success": False, "message": f"Error generating character with OpenRouter API: {response.text}"}), 500
-                
-                result_text = response.json()["choices"][0]["message"]["content"]
+                result[field] = ""
+        
+        # If we couldn't extract anything, provide defaults
+        if not result:
+            result = {field: "" for field in include_fields}
             
-            # Parse JSON response from the LLM
-            try:
-                # Extract JSON if the response contains extra text
-                json_start = result_text.find('{')
-                json_end = result_text.rfind('}') + 1
-                
-                if json_start >= 0 and json_end > json_start:
-                    json_str = result_text[json_start:json_end]
-                    result = json.loads(json_str)
-                else:
-                    # Fallback if proper JSON format not found
-                    result = {
-                        "description": "Error parsing AI response. Please try again.",
-                        "personality": "Error parsing AI response. Please try again."
-                    }
-                
-                # Ensure all requested fields exist (even if empty)
-                for field in include_fields:
-                    if field not in result:
-                        result[field] = ""
-                    
-                return jsonify({
-                    "success": True,
-                    "character": result
-                })
-            except json.JSONDecodeError:
-                # Handle case when LLM doesn't provide valid JSON
-                # Make a best effort to extract fields
-                result = {}
-                
-                # Try to identify sections based on field names in the text
-                for field in include_fields:
-                    field_marker = f"{field.replace('_', ' ').title()}:"
-                    field_index = result_text.lower().find(field_marker.lower())
-                    
-                    if field_index >= 0:
-                        # Look for the next field marker to determine where this section ends
-                        next_field_index = len(result_text)
-                        for next_field in include_fields:
-                            if next_field != field:
-                                next_marker = f"{next_field.replace('_', ' ').title()}:"
-                                idx = result_text.lower().find(next_marker.lower(), field_index + len(field_marker))
-                                if idx >= 0 and idx < next_field_index:
-                                    next_field_index = idx
-                        
-                        # Extract the content between this field marker and the next
-                        content = result_text[field_index + len(field_marker):next_field_index].strip()
-                        result[field] = content
-                    else:
-                        result[field] = ""
-                
-                # If we couldn't extract anything, provide defaults
-                if not result:
-                    result = {field: "" for field in include_fields}
-                    
-                    # Try to split by paragraphs as a last resort
-                    paragraphs = result_text.split('\n\n')
-                    for i, field in enumerate(include_fields):
-                        if i < len(paragraphs):
-                            result[field] = paragraphs[i]
-                
-                return jsonify({
-                    "success": True,
-                    "character": result
-                })
-                
-        except Exception as e:
-            print(f"Error generating character: {str(e)}")
-            return jsonify({"success": False, "message": f"Error generating character: {str(e)}"}), 500
+            # Try to split by paragraphs as a last resort
+            paragraphs = result_text.split('\n\n')
+            for i, field in enumerate(include_fields):
+                if i < len(paragraphs):
+                    result[field] = paragraphs[i]
+        
+        return result
 
 # Helper functions for API calls
 def get_openrouter_response(system_prompt, user_message, temperature=0.7):
@@ -189,12 +236,12 @@ def get_openrouter_response(system_prompt, user_message, temperature=0.7):
         "temperature": temperature
     }
     
-    response = requests.post(
-        "https://openrouter.ai/api/v1/chat/completions",
-        headers=headers,
-        json=generation_data,
-        timeout=30
-    )
+    with llm_slot(PROVIDER_OPENROUTER, Config.DEFAULT_MODEL):
+        response = http_client.post(
+            http_client.OPENROUTER_CHAT_URL,
+            headers=headers,
+            json=generation_data
+        )
     
     if response.status_code != 200:
         raise Exception(f"Error from OpenRouter API: {response.text}")
@@ -214,18 +261,4 @@ def get_local_model_response(system_prompt, user_message, temperature=0.7):
     Returns:
         str: The AI response
     """
-    generation_prompt = f"{system_prompt}\n\nUser prompt: {user_message}\n\nOutput:"
-    
-    generation_data = {
-        "prompt": generation_prompt,
-        "max_tokens": 2000,
-        "temperature": temperature
-    }
-    
-    response = requests.post(Config.LOCAL_MODEL_URL, json=generation_data, timeout=30)
-    
-    if response.status_code != 200:
-        raise Exception(f"Error from local model: {response.text}")
-    
-    result_text = response.json().get("response", "")
-    return result_text.strip()
\ No newline at end of file
+    return local_model.generate(f"User prompt: {user_message}\n\nOutput:", system_prompt, temperature, max_tokens=2000)
\ No newline at end of file
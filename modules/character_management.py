@@ -1,9 +1,8 @@
 from flask import jsonify, request
-import json
-import os
 import uuid
 from datetime import datetime
-from config import Config
+from .storage import get_storage
+from .prompt_prefix import precompute_prompt_prefixes
 
 def register_character_routes(app):
     """Register character management routes with the Flask app"""
@@ -11,22 +10,14 @@ def register_character_routes(app):
     @app.route('/api/characters', methods=['GET'])
     def get_characters():
         """Get list of all saved characters"""
-        characters = []
-        for filename in os.listdir(Config.CHARACTERS_FOLDER):
-            if filename.endswith('.json'):
-                character_path = os.path.join(Config.CHARACTERS_FOLDER, filename)
-                with open(character_path, 'r') as f:
-                    character = json.load(f)
-                    characters.append(character)
+        characters = get_storage().list_characters()
         return jsonify(characters)
 
     @app.route('/api/characters/<character_id>', methods=['GET'])
     def get_character(character_id):
         """Get a specific character by ID"""
-        character_path = os.path.join(Config.CHARACTERS_FOLDER, f"{character_id}.json")
-        if os.path.exists(character_path):
-            with open(character_path, 'r') as f:
-                character = json.load(f)
+        character = get_storage().get_character(character_id)
+        if character is not None:
             return jsonify(character)
         return jsonify({"error": "Character not found"}), 404
 
@@ -54,14 +45,8 @@ def register_character_routes(app):
             "location": "a nondescript room"
         }
         
-        character_path = os.path.join(Config.CHARACTERS_FOLDER, f"{character_id}.json")
-        with open(character_path, 'w') as f:
-            json.dump(character, f, indent=2)
-        
-        # Initialize memory file for this character
-        memory_path = os.path.join(Config.MEMORY_FOLDER, f"{character_id}.json")
-        with open(memory_path, 'w') as f:
-            json.dump({"memories": [], "conversations": []}, f, indent=2)
+        get_storage().save_character(character)
+        precompute_prompt_prefixes(character)
         
         return jsonify(character)
 
@@ -69,14 +54,12 @@ def register_character_routes(app):
     def update_character(character_id):
         """Update an existing character"""
         data = request.json
-        character_path = os.path.join(Config.CHARACTERS_FOLDER, f"{character_id}.json")
+        storage = get_storage()
         
-        if not os.path.exists(character_path):
+        character = storage.get_character(character_id)
+        if character is None:
             return jsonify({"error": "Character not found"}), 404
         
-        with open(character_path, 'r') as f:
-            character = json.load(f)
-        
         # Update all fields
         character["name"] = data.get("name", character["name"])
         character["description"] = data.get("description", character["description"])
@@ -87,22 +70,15 @@ def register_character_routes(app):
         character["speaking_style"] = data.get("speaking_style", character.get("speaking_style", ""))
         character["updated_at"] = datetime.now().isoformat()
         
-        with open(character_path, 'w') as f:
-            json.dump(character, f, indent=2)
+        storage.save_character(character)
+        precompute_prompt_prefixes(character)
         
         return jsonify(character)
 
     @app.route('/api/characters/<character_id>', methods=['DELETE'])
     def delete_character(character_id):
         """Delete a character"""
-        character_path = os.path.join(Config.CHARACTERS_FOLDER, f"{character_id}.json")
-        memory_path = os.path.join(Config.MEMORY_FOLDER, f"{character_id}.json")
-        
-        if os.path.exists(character_path):
-            os.remove(character_path)
-        
-        if os.path.exists(memory_path):
-            os.remove(memory_path)
+        get_storage().delete_character(character_id)
         
         return jsonify({"success": True})
 
@@ -0,0 +1,297 @@
+"""
+Chat index module for keeping a lightweight catalog of chat instance metadata.
+The chat list endpoint answers from this index instead of parsing every chat file.
+
+The index is a JSON snapshot plus an append-only log next to it: a chat
+update appends one line to the log instead of rewriting the snapshot. Once
+the log holds more records than the snapshot has chats, it is compacted
+into a new snapshot, so the cost of a write stays constant on average.
+"""
+
+import base64
+import json
+import os
+from config import Config
+from .chat_storage import read_recent_conversations, write_json_atomic
+from .chat_locks import resource_lock
+
+# Name of the lock serializing index writers across threads and processes
+INDEX_LOCK_NAME = "chat-index"
+
+# Length of the last message preview stored for each chat
+PREVIEW_LENGTH = 120
+
+# Log records appended before the log is compacted, at least
+COMPACT_MIN_RECORDS = 256
+
+# In-memory copy of the index, validated against the snapshot's mtime and size
+_index_entries = None
+_index_stamp = None
+# Bytes and records of the log already applied to the in-memory copy
+_log_offset = 0
+_log_records = 0
+
+
+def build_index_entry(chat_instance, last_entry=None):
+    """
+    Build the index entry (metadata only) for a chat instance.
+
+    Args:
+        chat_instance (dict): A chat header or a full chat instance
+        last_entry (dict): The chat's newest conversation entry, if the
+            chat_instance does not carry its conversations
+    """
+    conversations = chat_instance.get("conversations")
+    if conversations:
+        last_entry = conversations[-1]
+
+    if "turn_count" in chat_instance:
+        turn_count = chat_instance["turn_count"]
+    else:
+        turn_count = len(conversations or [])
+
+    last_message = ""
+    if last_entry:
+        last_message = last_entry.get("character_response") or ""
+
+    if len(last_message) > PREVIEW_LENGTH:
+        last_message = last_message[:PREVIEW_LENGTH - 3] + "..."
+
+    return {
+        "id": chat_instance["id"],
+        "character_id": chat_instance.get("character_id"),
+        "title": chat_instance.get("title", ""),
+        "location": chat_instance.get("location", ""),
+        "created_at": chat_instance.get("created_at", ""),
+        "updated_at": chat_instance.get("updated_at", ""),
+        "turn_count": turn_count,
+        "last_message": last_message
+    }
+
+
+def _file_stamp(path):
+    """Get a (mtime_ns, size) stamp used to detect changes by other processes"""
+    stat = os.stat(path)
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+def _log_path():
+    return Config.CHAT_INDEX_PATH + ".log"
+
+
+def _write_index(entries):
+    """Write the index snapshot to disk atomically, empty the log and refresh the in-memory copy"""
+    global _index_entries, _index_stamp, _log_offset, _log_records
+
+    write_json_atomic(Config.CHAT_INDEX_PATH, entries)
+    if os.path.exists(_log_path()):
+        os.remove(_log_path())
+    _index_entries = entries
+    _index_stamp = _file_stamp(Config.CHAT_INDEX_PATH)
+    _log_offset = 0
+    _log_records = 0
+
+
+def _scan_chat_files():
+    """Build index entries by reading every chat header (used only for rebuilds)"""
+    entries = {}
+    os.makedirs(Config.CHAT_INSTANCES_FOLDER, exist_ok=True)
+
+    for filename in os.listdir(Config.CHAT_INSTANCES_FOLDER):
+        if filename.endswith('.json'):
+            chat_path = os.path.join(Config.CHAT_INSTANCES_FOLDER, filename)
+            try:
+                with open(chat_path, 'r') as f:
+                    chat_instance = json.load(f)
+
+                last_entry = None
+                if "conversations" not in chat_instance:
+                    recent = read_recent_conversations(chat_instance["id"], 1)
+                    last_entry = recent[-1] if recent else None
+
+                entries[chat_instance["id"]] = build_index_entry(chat_instance, last_entry)
+            except Exception as e:
+                print(f"Skipping unreadable chat file {filename}: {str(e)}")
+
+    return entries
+
+
+def _apply_record(entries, record):
+    """Apply one log record (an entry replacement or a deletion)"""
+    if record.get("deleted"):
+        entries.pop(record["id"], None)
+    else:
+        entries[record["id"]] = record["entry"]
+
+
+def _read_log():
+    """Apply the log records written since the last read (complete lines only)"""
+    global _log_offset, _log_records
+
+    try:
+        with open(_log_path(), 'rb') as f:
+            f.seek(_log_offset)
+            data = f.read()
+    except OSError:
+        return
+
+    end = data.rfind(b"\n") + 1
+    for line in data[:end].splitlines():
+        try:
+            _apply_record(_index_entries, json.loads(line))
+        except (ValueError, KeyError):
+            continue
+        _log_records += 1
+    _log_offset += end
+
+
+def _load_index():
+    """Return the current index entries, rebuilding the index if it is missing"""
+    global _index_entries, _index_stamp, _log_offset, _log_records
+
+    try:
+        stamp = _file_stamp(Config.CHAT_INDEX_PATH)
+    except OSError:
+        print("Chat index not found. Rebuilding from chat files...")
+        _write_index(_scan_chat_files())
+        return _index_entries
+
+    # Reload the snapshot only if another writer compacted it since we last read it
+    if _index_entries is None or stamp != _index_stamp:
+        try:
+            with open(Config.CHAT_INDEX_PATH, 'r') as f:
+                _index_entries = json.load(f)
+            _index_stamp = stamp
+            _log_offset = 0
+            _log_records = 0
+        except (OSError, ValueError) as e:
+            print(f"Chat index is unreadable ({str(e)}). Rebuilding from chat files...")
+            _write_index(_scan_chat_files())
+            return _index_entries
+
+    _read_log()
+    return _index_entries
+
+
+def _append_record(record):
+    """Append a record to the log, compacting the log into the snapshot once it outgrows it"""
+    global _log_offset, _log_records
+
+    if _log_records >= max(COMPACT_MIN_RECORDS, len(_index_entries)):
+        _write_index(_index_entries)
+        return
+
+    with open(_log_path(), 'ab') as f:
+        # Drop a partial line left behind by an interrupted append
+        if f.tell() > _log_offset:
+            f.truncate(_log_offset)
+            f.seek(_log_offset)
+        f.write((json.dumps(record) + "\n").encode('utf-8'))
+        _log_offset = f.tell()
+    _log_records += 1
+
+
+def rebuild_chat_index():
+    """Rebuild the chat index from scratch by scanning all chat files"""
+    with resource_lock(INDEX_LOCK_NAME):
+        entries = _scan_chat_files()
+        _write_index(entries)
+        return len(entries)
+
+
+def update_chat_index(chat_instance, last_entry=None):
+    """Insert or replace the index entry for a chat instance"""
+    with resource_lock(INDEX_LOCK_NAME):
+        entries = _load_index()
+        previous = entries.get(chat_instance["id"])
+        entry = build_index_entry(chat_instance, last_entry)
+
+        # Header-only updates (e.g. a new title) keep the previous preview
+        if previous and last_entry is None and not chat_instance.get("conversations"):
+            entry["last_message"] = previous.get("last_message", "")
+
+        # Nothing the chat list shows changed
+        if entry == previous:
+            return
+
+        entries[chat_instance["id"]] = entry
+        _append_record({"id": chat_instance["id"], "entry": entry})
+
+
+def update_chat_index_entries(chat_entries):
+    """Insert or replace the index entries of many chats at once, writing the index a single time"""
+    with resource_lock(INDEX_LOCK_NAME):
+        entries = _load_index()
+        for chat_instance, last_entry in chat_entries:
+            entries[chat_instance["id"]] = build_index_entry(chat_instance, last_entry)
+        _write_index(entries)
+
+
+def remove_from_chat_index(chat_id):
+    """Remove a chat instance from the index"""
+    with resource_lock(INDEX_LOCK_NAME):
+        entries = _load_index()
+        if chat_id in entries:
+            del entries[chat_id]
+            _append_record({"id": chat_id, "deleted": True})
+
+
+def encode_cursor(entry):
+    """Encode the sort position of an entry as an opaque cursor"""
+    raw = f"{entry.get('updated_at', '')}|{entry['id']}"
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    """Decode a cursor into its (updated_at, id) sort key"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8')
+        updated_at, chat_id = raw.rsplit('|', 1)
+        return (updated_at, chat_id)
+    except Exception:
+        raise ValueError("Invalid cursor")
+
+
+def paginate_index_entries(entries, limit=None, cursor=None, character_id=None):
+    """
+    Filter, sort (newest first) and page a list of index entries.
+
+    Returns:
+        tuple: (list of index entries, next cursor or None)
+    """
+    if character_id:
+        entries = [e for e in entries if e.get("character_id") == character_id]
+
+    def sort_key(entry):
+        return (entry.get("updated_at", ""), entry["id"])
+
+    entries = sorted(entries, key=sort_key, reverse=True)
+
+    if cursor:
+        position = decode_cursor(cursor)
+        entries = [e for e in entries if sort_key(e) < position]
+
+    next_cursor = None
+    if limit is not None and len(entries) > limit:
+        entries = entries[:limit]
+        next_cursor = encode_cursor(entries[-1])
+
+    return entries, next_cursor
+
+
+def list_chat_index(limit=None, cursor=None, character_id=None):
+    """
+    List chat metadata from the index, newest first.
+
+    Args:
+        limit (int): Maximum number of entries to return (default: all)
+        cursor (str): Cursor returned by a previous call, to continue after it
+        character_id (str): Only return chats with this character
+
+    Returns:
+        tuple: (list of index entries, next cursor or None)
+    """
+    with resource_lock(INDEX_LOCK_NAME):
+        entries = list(_load_index().values())
+
+    return paginate_index_entries(entries, limit, cursor, character_id)
@@ -1,42 +1,68 @@
 from flask import jsonify, request
-import json
-import os
 import uuid
 from datetime import datetime
-from config import Config
+from .chat_locks import chat_lock
+from .storage import get_storage
+from .scene_generation import SCENE_MODES
+from .response_cache import get_cache_mode, with_cache_status
+from .conversation_search import index_conversation, remove_chat_from_search
+from .local_model import forget_chat
+from .chat_management import parse_page_args, get_chat_etag, conditional_json_response, get_conversation_page
 
 def register_chat_instance_routes(app):
     """Register chat instance management routes with the Flask app"""
 
     @app.route('/api/chats', methods=['GET'])
     def get_chat_instances():
-        """Get list of all chat instances"""
-        chat_instances = []
-        
-        # Ensure chat instances directory exists
-        os.makedirs(Config.CHAT_INSTANCES_FOLDER, exist_ok=True)
-        
-        for filename in os.listdir(Config.CHAT_INSTANCES_FOLDER):
-            if filename.endswith('.json'):
-                chat_path = os.path.join(Config.CHAT_INSTANCES_FOLDER, filename)
-                with open(chat_path, 'r') as f:
-                    chat_instance = json.load(f)
-                    chat_instances.append(chat_instance)
-                    
-        # Sort by updated_at in descending order (newest first)
-        chat_instances.sort(key=lambda x: x.get('updated_at', ''), reverse=True)
-        
-        return jsonify(chat_instances)
+        """
+        Get list of chat instances (metadata only), newest first.
+
+        Optional query parameters:
+        - limit: Maximum number of chats to return
+        - cursor: Continue after the cursor returned in the X-Next-Cursor header
+        - character_id: Only list chats with this character
+        """
+        try:
+            limit = request.args.get("limit", type=int)
+            chat_instances, next_cursor = get_storage().list_chats(
+                limit=limit,
+                cursor=request.args.get("cursor"),
+                character_id=request.args.get("character_id")
+            )
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+        response = jsonify(chat_instances)
+        if next_cursor:
+            response.headers["X-Next-Cursor"] = next_cursor
+        return response
 
     @app.route('/api/chats/<chat_id>', methods=['GET'])
     def get_chat_instance(chat_id):
-        """Get a specific chat instance by ID"""
-        chat_path = os.path.join(Config.CHAT_INSTANCES_FOLDER, f"{chat_id}.json")
-        if os.path.exists(chat_path):
-            with open(chat_path, 'r') as f:
-                chat_instance = json.load(f)
-            return jsonify(chat_instance)
-        return jsonify({"error": "Chat instance not found"}), 404
+        """
+        Get a specific chat instance by ID.
+        
+        Accepts the same limit/before/after parameters as the chat history
+        endpoint to return only part of the conversations, and supports
+        If-None-Match.
+        """
+        chat_instance = get_storage().get_chat(chat_id)
+        if chat_instance is None:
+            return jsonify({"error": "Chat instance not found"}), 404
+        
+        try:
+            page = parse_page_args(request.args)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        
+        def build_payload():
+            conversation_page = get_conversation_page(chat_instance, page)
+            chat_instance["conversations"] = conversation_page["conversations"]
+            chat_instance["has_more"] = conversation_page["has_more"]
+            return chat_instance
+        
+        etag = get_chat_etag(chat_instance, "instance", sorted(page.items()))
+        return conditional_json_response(etag, build_payload)
 
     @app.route('/api/chats', methods=['POST'])
     def create_chat_instance():
@@ -48,19 +74,28 @@ def register_chat_instance_routes(app):
             return jsonify({"error": "Character ID is required"}), 400
             
         # Get character data to extract name and initial state
-        character_path = os.path.join(Config.CHARACTERS_FOLDER, f"{character_id}.json")
-        if not os.path.exists(character_path):
+        character = get_storage().get_character(character_id)
+        if character is None:
             return jsonify({"error": "Character not found"}), 404
-            
-        with open(character_path, 'r') as f:
-            character = json.load(f)
         
         # Create a new chat instance
         chat_id = str(uuid.uuid4())
         timestamp = datetime.now().isoformat()
         
-        # Initialize with custom location if provided, otherwise use character's default
-        chat_location = data.get("location") or character.get("location", "a nondescript room")
+        scene_mode = data.get("scene_mode")
+        if scene_mode is not None and scene_mode not in SCENE_MODES:
+            return jsonify({"error": f"scene_mode must be one of: {', '.join(SCENE_MODES)}"}), 400
+        
+        # Optional scenario the chat takes place in
+        scenario = None
+        if data.get("scenario_id"):
+            scenario = get_storage().get_scenario(data["scenario_id"])
+            if scenario is None:
+                return jsonify({"error": "Scenario not found"}), 404
+        
+        # Initialize with custom location if provided, otherwise the scenario's starting location or the character's default
+        chat_location = (data.get("location") or (scenario or {}).get("starting_location")
+                         or character.get("location", "a nondescript room"))
         
         chat_instance = {
             "id": chat_id,
@@ -78,6 +113,13 @@ def register_chat_instance_routes(app):
             }
         }
         
+        # Per-chat scene mode; chats without one follow Config.SCENE_MODE
+        if scene_mode:
+            chat_instance["scene_mode"] = scene_mode
+        
+        if scenario is not None:
+            chat_instance["scenario_id"] = scenario["id"]
+        
         # Add a greeting message if character has one
         if character.get("greeting"):
             chat_instance["conversations"].append({
@@ -92,47 +134,66 @@ def register_chat_instance_routes(app):
             })
         
         # Save the chat instance
-        chat_path = os.path.join(Config.CHAT_INSTANCES_FOLDER, f"{chat_id}.json")
-        os.makedirs(os.path.dirname(chat_path), exist_ok=True)
-        
-        with open(chat_path, 'w') as f:
-            json.dump(chat_instance, f, indent=2)
+        with chat_lock(chat_id):
+            get_storage().create_chat(chat_instance)
+            for entry in chat_instance["conversations"]:
+                index_conversation(chat_instance, entry)
         
         return jsonify(chat_instance)
 
     @app.route('/api/chats/<chat_id>', methods=['PUT'])
     def update_chat_instance(chat_id):
-        """Update a chat instance (title, location, etc.)"""
+        """Update a chat instance (title, location, scene_mode, scenario_id, etc.)"""
         data = request.json
-        chat_path = os.path.join(Config.CHAT_INSTANCES_FOLDER, f"{chat_id}.json")
-        
-        if not os.path.exists(chat_path):
-            return jsonify({"error": "Chat instance not found"}), 404
-        
-        with open(chat_path, 'r') as f:
-            chat_instance = json.load(f)
-        
-        # Update allowed fields
-        if "title" in data:
-            chat_instance["title"] = data["title"]
+        if data.get("scene_mode") is not None and data["scene_mode"] not in SCENE_MODES:
+            return jsonify({"error": f"scene_mode must be one of: {', '.join(SCENE_MODES)}"}), 400
+        
+        storage = get_storage()
+        if data.get("scenario_id") and storage.get_scenario(data["scenario_id"]) is None:
+            return jsonify({"error": "Scenario not found"}), 404
+        with chat_lock(chat_id):
+            chat_instance = storage.get_chat(chat_id)
             
-        if "location" in data:
-            chat_instance["location"] = data["location"]
+            if chat_instance is None:
+                return jsonify({"error": "Chat instance not found"}), 404
             
-        chat_instance["updated_at"] = datetime.now().isoformat()
-        
-        with open(chat_path, 'w') as f:
-            json.dump(chat_instance, f, indent=2)
+            # Update allowed fields
+            if "title" in data:
+                chat_instance["title"] = data["title"]
+                
+            if "location" in data:
+                chat_instance["location"] = data["location"]
+            
+            if "scene_mode" in data:
+                # null clears the chat's own setting
+                if data["scene_mode"]:
+                    chat_instance["scene_mode"] = data["scene_mode"]
+                else:
+                    chat_instance.pop("scene_mode", None)
+            
+            if "scenario_id" in data:
+                # null removes the scenario
+                if data["scenario_id"]:
+                    chat_instance["scenario_id"] = data["scenario_id"]
+                else:
+                    chat_instance.pop("scenario_id", None)
+                
+            chat_instance["updated_at"] = datetime.now().isoformat()
+            
+            storage.save_chat(chat_instance)
         
         return jsonify(chat_instance)
 
     @app.route('/api/chats/<chat_id>', methods=['DELETE'])
     def delete_chat_instance(chat_id):
         """Delete a chat instance"""
-        chat_path = os.path.join(Config.CHAT_INSTANCES_FOLDER, f"{chat_id}.json")
+        with chat_lock(chat_id):
+            deleted = get_storage().delete_chat(chat_id)
+            if deleted:
+                remove_chat_from_search(chat_id)
+                forget_chat(chat_id)
         
-        if os.path.exists(chat_path):
-            os.remove(chat_path)
+        if deleted:
             return jsonify({"success": True})
         
         return jsonify({"error": "Chat instance not found"}), 404
@@ -148,17 +209,17 @@ def register_chat_instance_routes(app):
             return jsonify({"error": "Character ID is required"}), 400
             
         # Get character data for context
-        character_path = os.path.join(Config.CHARACTERS_FOLDER, f"{character_id}.json")
-        if not os.path.exists(character_path):
+        character = get_storage().get_character(character_id)
+        if character is None:
             return jsonify({"error": "Character not found"}), 404
             
-        with open(character_path, 'r') as f:
-            character = json.load(f)
-            
         # Import functions from scene_generation module
         from .scene_generation import generate_location_description
         
         # Generate simple location
-        location_data = generate_location_description(character, prompt)
+        temperature = float(data.get("temperature", 0.7))
+        location_data, cache_status = generate_location_description(
+            character, prompt, temperature, get_cache_mode(data, temperature)
+        )
         
-        return jsonify(location_data)
\ No newline at end of file
+        return with_cache_status(jsonify(location_data), cache_status)
\ No newline at end of file
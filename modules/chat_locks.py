@@ -0,0 +1,208 @@
+"""
+Lock manager for serializing writes to shared data files.
+
+Locks are keyed by name (e.g. one per chat_id) and combine an in-process
+threading lock with an OS file lock in the locks folder, so writers are
+serialized across threads and across worker processes. Different keys never
+block each other. A thread that already holds a lock may take it again.
+
+async_resource_lock is the same lock for asyncio code (the ASGI app): it
+waits without blocking the event loop, and blocking work done under it runs
+in worker threads that count as holding it.
+"""
+
+import asyncio
+import os
+import threading
+import time
+from contextlib import contextmanager, asynccontextmanager
+from config import Config
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+# Interval between attempts to take a contended file lock
+POLL_INTERVAL = 0.05
+
+
+class ChatLockTimeout(Exception):
+    """Raised when a lock could not be acquired before the wait timeout"""
+    pass
+
+
+# name -> [threading.Lock, number of threads holding or waiting for it]
+_thread_locks = {}
+_registry_lock = threading.Lock()
+
+# Names of the locks held by the current thread
+_held = threading.local()
+
+
+def _checkout_thread_lock(name):
+    """Get the thread lock for a name, registering this thread as a user"""
+    with _registry_lock:
+        entry = _thread_locks.get(name)
+        if entry is None:
+            entry = [threading.Lock(), 0]
+            _thread_locks[name] = entry
+        entry[1] += 1
+        return entry[0]
+
+
+def _return_thread_lock(name):
+    """Release this thread's claim on a name, dropping unused locks"""
+    with _registry_lock:
+        entry = _thread_locks.get(name)
+        if entry is not None:
+            entry[1] -= 1
+            if entry[1] <= 0:
+                del _thread_locks[name]
+
+
+def _try_file_lock(handle):
+    """Try once to take an exclusive lock on an open file"""
+    try:
+        if fcntl:
+            fcntl.flock(handle.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            handle.seek(0)
+            msvcrt.locking(handle.fileno(), msvcrt.LK_NBLCK, 1)
+        return True
+    except OSError:
+        return False
+
+
+def _release_file_lock(handle):
+    """Release a lock taken with _try_file_lock"""
+    if fcntl:
+        fcntl.flock(handle.fileno(), fcntl.LOCK_UN)
+    else:
+        handle.seek(0)
+        msvcrt.locking(handle.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+@contextmanager
+def resource_lock(name, timeout=None):
+    """
+    Hold an exclusive lock on a named resource.
+
+    Args:
+        name (str): Lock key; safe to use as a file name
+        timeout (float): Seconds to wait before giving up (default: Config.CHAT_LOCK_TIMEOUT)
+
+    Raises:
+        ChatLockTimeout: If the lock is still held elsewhere after the timeout
+    """
+    held_names = getattr(_held, "names", None)
+    if held_names is None:
+        held_names = _held.names = set()
+
+    if name in held_names:
+        yield
+        return
+
+    if timeout is None:
+        timeout = Config.CHAT_LOCK_TIMEOUT
+    deadline = time.monotonic() + timeout
+
+    thread_lock = _checkout_thread_lock(name)
+    try:
+        if not thread_lock.acquire(timeout=max(timeout, 0)):
+            raise ChatLockTimeout(f"Timed out waiting for lock '{name}'")
+
+        try:
+            os.makedirs(Config.LOCKS_FOLDER, exist_ok=True)
+            with open(os.path.join(Config.LOCKS_FOLDER, f"{name}.lock"), 'a+') as handle:
+                # Another process may hold the file lock; poll until the deadline
+                while not _try_file_lock(handle):
+                    if time.monotonic() >= deadline:
+                        raise ChatLockTimeout(f"Timed out waiting for lock '{name}'")
+                    time.sleep(POLL_INTERVAL)
+
+                held_names.add(name)
+                try:
+                    yield
+                finally:
+                    held_names.discard(name)
+                    _release_file_lock(handle)
+        finally:
+            thread_lock.release()
+    finally:
+        _return_thread_lock(name)
+
+
+def chat_lock(chat_id, timeout=None):
+    """Hold the write lock for a single chat instance"""
+    return resource_lock(f"chat-{chat_id}", timeout)
+
+
+class AsyncLockHold:
+    """A lock held by asyncio code; yielded by async_resource_lock"""
+
+    def __init__(self, name):
+        self.name = name
+
+    async def run(self, func, *args, **kwargs):
+        """Run blocking code in a worker thread that counts as holding the lock"""
+        return await asyncio.to_thread(_call_holding, self.name, func, args, kwargs)
+
+
+def _call_holding(name, func, args, kwargs):
+    held_names = getattr(_held, "names", None)
+    if held_names is None:
+        held_names = _held.names = set()
+    if name in held_names:
+        return func(*args, **kwargs)
+
+    held_names.add(name)
+    try:
+        return func(*args, **kwargs)
+    finally:
+        held_names.discard(name)
+
+
+@asynccontextmanager
+async def async_resource_lock(name, timeout=None):
+    """
+    asyncio version of resource_lock: polls for the lock instead of blocking
+    the event loop. Yields an AsyncLockHold; use its run() for blocking work
+    that may take the same lock again (e.g. storage calls).
+
+    Raises:
+        ChatLockTimeout: If the lock is still held elsewhere after the timeout
+    """
+    if timeout is None:
+        timeout = Config.CHAT_LOCK_TIMEOUT
+    deadline = time.monotonic() + timeout
+
+    thread_lock = _checkout_thread_lock(name)
+    try:
+        while not thread_lock.acquire(blocking=False):
+            if time.monotonic() >= deadline:
+                raise ChatLockTimeout(f"Timed out waiting for lock '{name}'")
+            await asyncio.sleep(POLL_INTERVAL)
+
+        try:
+            os.makedirs(Config.LOCKS_FOLDER, exist_ok=True)
+            with open(os.path.join(Config.LOCKS_FOLDER, f"{name}.lock"), 'a+') as handle:
+                while not _try_file_lock(handle):
+                    if time.monotonic() >= deadline:
+                        raise ChatLockTimeout(f"Timed out waiting for lock '{name}'")
+                    await asyncio.sleep(POLL_INTERVAL)
+
+                try:
+                    yield AsyncLockHold(name)
+                finally:
+                    _release_file_lock(handle)
+        finally:
+            thread_lock.release()
+    finally:
+        _return_thread_lock(name)
+
+
+def async_chat_lock(chat_id, timeout=None):
+    """Hold the write lock for a single chat instance from asyncio code"""
+    return async_resource_lock(f"chat-{chat_id}", timeout)
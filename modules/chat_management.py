@@ -1,14 +1,93 @@
-from flask import jsonify, request
+from flask import jsonify, request, make_response, Response, stream_with_context
+import hashlib
 import json
 import os
+from contextlib import ExitStack
 from datetime import datetime
 from config import Config
 
 # Import from other modules
-from .player_actions import handle_player_action_prompt
-from .memory_management import create_system_prompt
-from .scene_generation import generate_scene_description
-from .ai_integration import get_openrouter_response, get_local_model_response, process_llm_response
+from .player_actions import handle_player_action_prompt, parse_player_action
+from .memory_management import create_system_prompt_parts, format_conversation
+from .scene_generation import (
+    generate_scene_description, get_scene_mode, SCENE_PLACEHOLDER
+)
+from .scene_tasks import (
+    schedule_scene, get_scene, record_combined_scene, SCENE_PENDING, SCENE_READY, SCENE_FALLBACK
+)
+from .ai_integration import (
+    get_openrouter_response, get_local_model_response, process_llm_response,
+    stream_openrouter_response, stream_local_model_response
+)
+from .response_parser import ResponseParser
+from .chat_locks import chat_lock, ChatLockTimeout
+from .storage import get_storage
+from .conversation_search import index_conversation
+from .token_budget import PromptBudget, get_prompt_token_limit, estimate_tokens
+from .prompt_prefix import get_prompt_prefix, record_turn_prefix
+from .scenario_context import build_scenario_context
+from .llm_scheduler import llm_priority, PRIORITY_INTERACTIVE
+from .local_model import ChatContext
+from .conversation_summary import get_unsummarized_turns, schedule_summary
+
+
+def parse_page_args(args):
+    """
+    Parse the before/after/limit query parameters used to page through
+    conversation entries. Raises ValueError on invalid values.
+    """
+    page = {}
+    for name in ("before", "after", "limit"):
+        value = args.get(name)
+        if value is None or value == "":
+            continue
+        try:
+            page[name] = int(value)
+        except ValueError:
+            raise ValueError(f"'{name}' must be an integer")
+        if page[name] < 0:
+            raise ValueError(f"'{name}' must not be negative")
+    return page
+
+
+def get_chat_etag(chat_header, *extra):
+    """Build an ETag for a chat representation from its turn count and last update"""
+    raw = "|".join(str(part) for part in (
+        chat_header["id"],
+        chat_header.get("turn_count", 0),
+        chat_header.get("updated_at", ""),
+        *extra
+    ))
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+
+def conditional_json_response(etag, build_payload):
+    """Return 304 if the client already has this ETag, otherwise the JSON payload"""
+    if request.if_none_match.contains(etag):
+        response = make_response("", 304)
+    else:
+        response = jsonify(build_payload())
+    response.set_etag(etag)
+    # Let clients cache the response but always revalidate it
+    response.headers["Cache-Control"] = "no-cache"
+    return response
+
+
+def get_conversation_page(chat_header, page):
+    """Read a page of a chat's conversations along with paging metadata"""
+    conversations = get_storage().get_turns(chat_header["id"], **page)
+    turn_count = chat_header.get("turn_count", 0)
+
+    if "after" in page:
+        has_more = bool(conversations) and conversations[-1]["turn"] < turn_count
+    else:
+        has_more = bool(conversations) and conversations[0]["turn"] > 1
+
+    return {
+        "conversations": conversations,
+        "turn_count": turn_count,
+        "has_more": has_more
+    }
 
 
 def register_chat_routes(app):
@@ -16,254 +95,418 @@ def register_chat_routes(app):
 
     @app.route('/api/chat/history/<chat_id>', methods=['GET'])
     def get_chat_history(chat_id):
-        """Get the conversation history for a chat instance"""
-        chat_path = os.path.join(Config.CHAT_INSTANCES_FOLDER, f"{chat_id}.json")
-        if not os.path.exists(chat_path):
+        """
+        Get the conversation history for a chat instance.
+        
+        Optional query parameters (turn ids are returned on each entry):
+        - limit: Maximum number of turns; the newest are returned unless `after` is given
+        - before: Only turns older than this turn id (to page backwards)
+        - after: Only turns newer than this turn id (to fetch new turns)
+        
+        Supports If-None-Match, returning 304 while the chat is unchanged.
+        """
+        chat_header = get_storage().get_chat(chat_id)
+        if chat_header is None:
             return jsonify({"error": "Chat instance not found"}), 404
         
-        with open(chat_path, 'r') as f:
-            chat_instance = json.load(f)
+        try:
+            page = parse_page_args(request.args)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
         
-        return jsonify({"conversations": chat_instance.get("conversations", [])})
+        etag = get_chat_etag(chat_header, "history", sorted(page.items()))
+        return conditional_json_response(etag, lambda: get_conversation_page(chat_header, page))
 
     @app.route('/api/chat/<chat_id>', methods=['POST'])
     def chat(chat_id):
-        """Send a message to a chat instance and get a response with scene description"""
-        data = request.json
-        message = data.get("message", "")
-        use_local_model = data.get("use_local_model", False)
-        
-        # Check if this is a player action
-        is_player_action = data.get("is_player_action", False)
-        action_success = data.get("action_success", True) if is_player_action else None
-        
-        # Get chat instance data
-        chat_path = os.path.join(Config.CHAT_INSTANCES_FOLDER, f"{chat_id}.json")
-        if not os.path.exists(chat_path):
-            return jsonify({"error": "Chat instance not found"}), 404
+        """
+        Send a message to a chat instance and get a response with scene description.
         
-        with open(chat_path, 'r') as f:
-            chat_instance = json.load(f)
-        
-        # Get character data
-        character_id = chat_instance["character_id"]
-        character_path = os.path.join(Config.CHARACTERS_FOLDER, f"{character_id}.json")
-        if not os.path.exists(character_path):
-            return jsonify({"error": "Character not found"}), 404
-        
-        with open(character_path, 'r') as f:
-            character = json.load(f)
-        
-        # Use character state from chat instance (not the base character)
-        character_state = chat_instance.get("character_state", {})
-        if character_state:
-            # Override character properties with chat-specific state
-            character["mood"] = character_state.get("mood", character.get("mood", "neutral"))
-            character["emotions"] = character_state.get("emotions", character.get("emotions", {}))
-            character["opinion_of_user"] = character_state.get("opinion_of_user", character.get("opinion_of_user", "neutral"))
-            character["action"] = character_state.get("action", character.get("action", "standing idly"))
+        With `Accept: text/event-stream` the response is streamed as
+        Server-Sent Events instead (see stream_chat_turn).
+        """
+        data = request.json
+        if request.accept_mimetypes.best_match(["application/json", "text/event-stream"]) == "text/event-stream":
+            return stream_chat_response(chat_id, data)
+        with chat_lock(chat_id):
+            return process_chat_turn(chat_id, data)
+
+    @app.route('/api/chat/<chat_id>/scene/<int:turn>', methods=['GET'])
+    def get_turn_scene(chat_id, turn):
+        """
+        Get the scene description of a turn. Its status is "pending" while it
+        is being generated, then "ready", or "fallback" if the placeholder
+        text was used.
         
-        # Use location from chat instance
-        character["location"] = chat_instance.get("location", character.get("location", "a nondescript room"))
-            
-        # Ensure character emotions is a dictionary
-        if not isinstance(character.get("emotions"), dict):
-            character["emotions"] = {}
+        Optional query parameters:
+        - wait: Seconds to wait for a pending scene (long polling, capped at SCENE_DEADLINE)
+        """
+        wait = min(max(request.args.get("wait", 0, type=float), 0), Config.SCENE_DEADLINE)
+        scene = get_scene(chat_id, turn, wait=wait)
+        if scene is None:
+            return jsonify({"error": "Turn not found"}), 404
+        return jsonify(scene)
+
+    @app.route('/api/chat/<chat_id>/scene/<int:turn>/events', methods=['GET'])
+    def subscribe_turn_scene(chat_id, turn):
+        """Wait for the scene description of a turn as a single Server-Sent `scene` event"""
+        if get_scene(chat_id, turn) is None:
+            return jsonify({"error": "Turn not found"}), 404
         
-        # Check if chat has a scenario_id and prepare scenario context
-        scenario_id = chat_instance.get("scenario_id")
-        scenario_context = ""
-
-        if scenario_id:
-            # Get scenario data
-            scenario_path = os.path.join(Config.SCENARIOS_FOLDER, f"{scenario_id}.json")
-            if os.path.exists(scenario_path):
-                with open(scenario_path, 'r') as f:
-                    scenario = json.load(f)
-                
-                # Generate scenario context based on world size
-                world_size = scenario.get("world_size", "small")
-                
-                scenario_context = f"""
-This conversation takes place in a scenario called "{scenario.get('title')}".
-{scenario.get('description', '')}
-
-You are in {chat_instance.get('location', scenario.get('starting_location', 'an unknown location'))}.
-
-World Information:
-"""
-                
-                # Add locations
-                locations = scenario.get("locations", [])
-                if locations:
-                    scenario_context += "\nLocations in this world:"
-                    for loc in locations:
-                        if isinstance(loc, dict):
-                            scenario_context += f"\n- {loc.get('name', 'Unknown')}: {loc.get('description', '')}"
-                        else:
-                            scenario_context += f"\n- {loc}"
-                
-                # Add NPCs
-                npcs = scenario.get("npcs", [])
-                if npcs:
-                    scenario_context += "\n\nPeople in this world:"
-                    for npc in npcs:
-                        if isinstance(npc, dict):
-                            scenario_context += f"\n- {npc.get('name', 'Unknown')}: {npc.get('description', '')}. Role: {npc.get('role', 'Unknown')}"
-                        else:
-                            scenario_context += f"\n- {npc}"
-                
-                # Add history for medium and large worlds
-                if world_size in ["medium", "large"] and "history" in scenario:
-                    scenario_context += f"\n\nHistory: {scenario.get('history', '')}"
-                
-                # Add additional info for large worlds
-                if world_size == "large":
-                    if "political_structure" in scenario:
-                        scenario_context += f"\n\nPolitical Structure: {scenario.get('political_structure', '')}"
-                    
-                    if "economy" in scenario:
-                        scenario_context += f"\n\nEconomy: {scenario.get('economy', '')}"
-                    
-                    if "geography" in scenario:
-                        scenario_context += f"\n\nGeography: {scenario.get('geography', '')}"
-                
-                # Add special world rules if any
-                if "world_rules" in scenario:
-                    scenario_context += f"\n\nSpecial Rules: {scenario.get('world_rules', '')}"
+        def generate():
+            yield format_sse("scene", get_scene(chat_id, turn, wait=Config.SCENE_DEADLINE + 1))
         
-        # Create a system prompt based on character data and conversations
-        base_system_prompt = create_system_prompt(character, {"memories": [], "conversations": chat_instance.get("conversations", [])})
+        response = Response(stream_with_context(generate()), mimetype="text/event-stream")
+        response.headers["Cache-Control"] = "no-cache"
+        response.headers["X-Accel-Buffering"] = "no"
+        return response
+
+    @app.errorhandler(ChatLockTimeout)
+    def handle_chat_lock_timeout(error):
+        """Another request is still writing to the same chat"""
+        return jsonify({"error": "This chat is busy with another request. Please try again."}), 409
+
+
+def format_sse(event, data):
+    """Format one Server-Sent Event with a JSON payload"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def prepare_chat_turn(chat_id, data):
+    """
+    Load everything a chat turn needs and build its system prompt.
+    Callers must hold the chat's lock.
+    
+    Returns:
+        tuple: (turn, None) on success, or (None, error_response)
+    """
+    message = data.get("message", "")
+    use_local_model = data.get("use_local_model", False)
+    
+    # Check if this is a player action
+    is_player_action = data.get("is_player_action", False)
+    action_success = data.get("action_success", True) if is_player_action else None
+    
+    storage = get_storage()
+    
+    # Get chat instance state (the conversation log is read separately)
+    chat_instance = storage.get_chat(chat_id)
+    if chat_instance is None:
+        return None, (jsonify({"error": "Chat instance not found"}), 404)
+    
+    # Get character data
+    character_id = chat_instance["character_id"]
+    character = storage.get_character(character_id)
+    if character is None:
+        return None, (jsonify({"error": "Character not found"}), 404)
+    
+    # Use character state from chat instance (not the base character)
+    character_state = chat_instance.get("character_state", {})
+    if character_state:
+        # Override character properties with chat-specific state
+        character["mood"] = character_state.get("mood", character.get("mood", "neutral"))
+        character["emotions"] = character_state.get("emotions", character.get("emotions", {}))
+        character["opinion_of_user"] = character_state.get("opinion_of_user", character.get("opinion_of_user", "neutral"))
+        character["action"] = character_state.get("action", character.get("action", "standing idly"))
+    
+    # Use location from chat instance
+    character["location"] = chat_instance.get("location", character.get("location", "a nondescript room"))
         
-        # Include scenario context in system prompt if available
-        if scenario_context:
-            system_prompt = scenario_context + "\n\n" + base_system_prompt
+    # Ensure character emotions is a dictionary
+    if not isinstance(character.get("emotions"), dict):
+        character["emotions"] = {}
+    
+    # The turns not yet in the chat's summary go into the prompt, and pick the scenario's relevant places and people
+    recent_conversations = get_unsummarized_turns(chat_instance)
+    
+    # Check if chat has a scenario_id and prepare scenario context (compiled once per scenario version;
+    # only the locations and NPCs relevant to the current location and recent turns are included)
+    scenario_id = chat_instance.get("scenario_id")
+    scenario_context = ""
+
+    if scenario_id:
+        scenario = storage.get_scenario(scenario_id)
+        if scenario is not None:
+            recent_text = "\n".join(
+                [message] + [f"{convo.get('user_message') or ''}\n{convo.get('character_response') or ''}"
+                             for convo in recent_conversations]
+            )
+            scenario_context = build_scenario_context(scenario, chat_instance.get("location"), recent_text)
+    
+    # Player actions bring their own instructions, placed after the per-turn state
+    action_instructions = ""
+    action_data = None
+    if is_player_action:
+        # Parsed once, for the instructions, the message and the stored turn
+        action_data = parse_player_action(message)
+        action_instructions = handle_player_action_prompt("", message, action_success, action_data)
+        # Show the actual action text (if parsing failed, use the message as-is)
+        if action_data is not None:
+            message = f"*Attempts to {action_data['action']}*" + (" (Success)" if action_success else " (Failure)")
+    
+    # The static start of the prompt (character, templates and reply instructions); in combined
+    # mode it also asks for the scene, which then comes back in the same response
+    scene_mode = get_scene_mode(chat_instance)
+    prefix = get_prompt_prefix(character, is_player_action, scene_mode == "combined")
+    
+    # Fit the prompt into the model's context window: the message, prefix and state always go in,
+    # the rest is added by priority (see create_system_prompt)
+    budget = PromptBudget(get_prompt_token_limit(use_local_model))
+    budget.take("message", message)
+    budget.take("action_instructions", action_instructions)
+    
+    # Create a system prompt based on character data, the scenario, the chat's summary and memories,
+    # and the conversations since the summary
+    memory_data = {
+        "summary": chat_instance.get("summary", ""),
+        "memories": chat_instance.get("memories", []),
+        "conversations": recent_conversations
+    }
+    prefix_text, turn_prompt, conversations = create_system_prompt_parts(
+        character, memory_data, scenario_context, budget, prefix.text
+    )
+    system_prompt = prefix_text + turn_prompt + conversations + action_instructions
+    print(f"Prompt tokens for chat {chat_id} (prefix {prefix.hash}): {budget.describe()}")
+    # Shared with the local model's ChatContext, which updates it when it continues from the chat's context
+    prompt_tokens = budget.to_dict()
+    
+    return {
+        "chat_instance": chat_instance,
+        "character": character,
+        "system_prompt": system_prompt,
+        "message": message,
+        "use_local_model": use_local_model,
+        "is_player_action": is_player_action,
+        "action_success": action_success,
+        "player_action": action_data,
+        "scene_mode": scene_mode,
+        "prompt_tokens": prompt_tokens,
+        "prompt_prefix": prefix.hash,
+        # Lets the local model continue from the chat's previous turn instead of reading the prefix
+        # and earlier turns again; the per-turn part is sent every turn
+        "local_context": ChatContext(chat_id, chat_instance.get("turn_count", 0), prefix.hash,
+                                     turn_prompt + action_instructions, prompt_tokens),
+        "previous_prompt_prefix": recent_conversations[-1].get("prompt_prefix") if recent_conversations else None
+    }, None
+
+
+def clean_chat_response(processed_response):
+    """Make sure the parsed response has text to show"""
+    # Log the processed response for debugging
+    print(f"Processed response: {json.dumps(processed_response, indent=2)}")
+    
+    # Make sure we have a valid text response
+    if not processed_response.get("text", "").strip():
+        processed_response["text"] = "I'm not sure what to say right now."
+    return processed_response
+
+
+def turn_state(processed_response):
+    """The character's reply and state, sent as the `state` event before the turn is saved"""
+    return {
+        "response": processed_response["text"],
+        "mood": processed_response.get("mood", "neutral"),
+        "emotions": processed_response.get("emotions", {}),
+        "opinion_of_user": processed_response.get("opinion_of_user", "neutral"),
+        "action": processed_response.get("action", "standing still"),
+        "location": processed_response.get("location")
+    }
+
+
+def complete_chat_turn(turn, processed_response):
+    """
+    Persist the turn and produce its scene description: taken from the
+    response in "combined" scene mode, generated right away in "inline"
+    mode, otherwise left pending and generated in the background (see
+    scene_tasks). A combined response without a scene also falls back to
+    the background.
+    
+    Returns:
+        dict: The response payload sent to the client
+    """
+    storage = get_storage()
+    chat_instance = turn["chat_instance"]
+    character = turn["character"]
+    message = turn["message"]
+    is_player_action = turn["is_player_action"]
+    action_success = turn["action_success"]
+    
+    if turn["scene_mode"] == "inline":
+        scene_description = generate_scene_description(
+            character, processed_response, message, is_player_action, action_success,
+            use_local_model=turn["use_local_model"]
+        ).get("scene_description", "")
+        scene_status = SCENE_FALLBACK if scene_description in ("", SCENE_PLACEHOLDER) else SCENE_READY
+    else:
+        scene_description = ""
+        if turn["scene_mode"] == "combined":
+            combined_scene = processed_response.get("scene_description")
+            scene_description = combined_scene.strip() if isinstance(combined_scene, str) else ""
+            record_combined_scene(bool(scene_description))
+        scene_status = SCENE_READY if scene_description else SCENE_PENDING
+    
+    # Update character state in chat instance
+    chat_instance["character_state"] = {
+        "mood": processed_response.get("mood", character["mood"]),
+        "emotions": processed_response.get("emotions", character["emotions"]),
+        "opinion_of_user": processed_response.get("opinion_of_user", character["opinion_of_user"]),
+        "action": processed_response.get("action", character.get("action", "standing still"))
+    }
+    
+    # Update chat location if changed
+    new_location = processed_response.get("location")
+    if new_location and new_location != "current location" and new_location != character["location"]:
+        chat_instance["location"] = new_location
+    
+    # Update chat instance with this conversation
+    timestamp = datetime.now().isoformat()
+    conversation_entry = {
+        "timestamp": timestamp,
+        "user_message": message,
+        "character_response": processed_response["text"],
+        "mood": processed_response.get("mood", "neutral"),
+        "emotions": processed_response.get("emotions", {}),
+        "action": processed_response.get("action", "standing still"),
+        "location": chat_instance["location"],
+        "scene_description": scene_description,
+        "scene_status": scene_status
+    }
+    
+    # Add action-specific data to conversation
+    action_data = turn["player_action"]
+    if is_player_action and action_data is not None:
+        conversation_entry["is_player_action"] = True
+        conversation_entry["player_action"] = action_data["action"]
+        conversation_entry["action_success"] = action_success
+        conversation_entry["action_details"] = action_data.get("details", "")
+    
+    # Measured once here, so later prompts don't re-measure the turn
+    conversation_entry["tokens"] = estimate_tokens(format_conversation(conversation_entry))
+    # Which static prompt prefix the turn was generated with (for prefix cache hit rates)
+    conversation_entry["prompt_prefix"] = turn["prompt_prefix"]
+    # How the prompt's token budget was spent, by section (see PromptBudget)
+    conversation_entry["prompt_tokens"] = turn["prompt_tokens"]
+    record_turn_prefix(turn["prompt_prefix"], turn["previous_prompt_prefix"])
+    
+    # Append conversation to the chat's log
+    storage.append_turn(chat_instance, conversation_entry)
+    
+    # Update timestamp
+    chat_instance["updated_at"] = timestamp
+    
+    # Save updated chat state
+    storage.save_chat(chat_instance, conversation_entry)
+    index_conversation(chat_instance, conversation_entry)
+    
+    if scene_status == SCENE_PENDING:
+        schedule_scene(
+            chat_instance["id"], conversation_entry["turn"], character, dict(processed_response), message,
+            is_player_action, action_success, use_local_model=turn["use_local_model"]
+        )
+    
+    # Fold the chat's older turns into its summary once they add up (in the background)
+    schedule_summary(chat_instance, character)
+    
+    return {
+        "response": processed_response["text"],
+        "mood": processed_response.get("mood", "neutral"),
+        "emotions": processed_response.get("emotions", {}),
+        "opinion_of_user": processed_response.get("opinion_of_user", "neutral"),
+        "action": processed_response.get("action", "standing still"),
+        "location": chat_instance["location"],
+        "scene_description": scene_description,
+        "scene_status": scene_status,
+        "turn": conversation_entry["turn"]
+    }
+
+
+def process_chat_turn(chat_id, data):
+    """
+    Run one chat turn: build the prompt, get the character's response and
+    scene description, and persist the turn. Callers must hold the chat's lock.
+    """
+    turn, error = prepare_chat_turn(chat_id, data)
+    if error:
+        return error
+    
+    # The user is waiting on these calls (and on an inline scene), so they go ahead of background work
+    with llm_priority(PRIORITY_INTERACTIVE, chat_id):
+        # Get response from LLM
+        if turn["use_local_model"]:
+            response = get_local_model_response(turn["system_prompt"], turn["message"], chat=turn["local_context"])
         else:
-            system_prompt = base_system_prompt
+            response = get_openrouter_response(turn["system_prompt"], turn["message"])
         
-        # Modify the system prompt for player actions
-        if is_player_action:
-            system_prompt = handle_player_action_prompt(system_prompt, message, action_success)
-            # Parse the JSON string back to an object to get the actual action text
-            try:
-                action_data = json.loads(message)
-                message = f"*Attempts to {action_data['action']}*" + (" (Success)" if action_success else " (Failure)")
-            except:
-                # If parsing fails, use the message as-is
-                pass
-        else:
-            # Add instructions for action and location for regular messages
-            system_prompt += """\n\nIn addition to your regular response, please include:
-            - 'action': A brief description of what you're physically doing as you speak (e.g., "sipping coffee", "pacing nervously")
-            - 'location': Where you currently are (be specific, and maintain consistency with previous locations unless you're explicitly moving)
-            
-            Your action should reflect your personality and current emotional state.
+        return jsonify(complete_chat_turn(turn, clean_chat_response(process_llm_response(response))))
+
+
+def stream_chat_turn(turn):
+    """
+    Run one chat turn while streaming it as Server-Sent Events:
+    
+    - `token` events carry the character's text as it is generated
+    - a `state` event carries the final text, mood, emotions, opinion, action and location
+    - a `done` event carries the full response (as returned by the
+      non-streaming endpoint) once the turn has been saved
+    - a `scene` event follows with the scene description if it was
+      generated in the background (sent by stream_chat_response)
+    - an `error` event is sent instead if anything fails; nothing is saved then
+    """
+    parser = ResponseParser()
+    if turn["use_local_model"]:
+        stream = lambda system_prompt, message: stream_local_model_response(system_prompt, message, chat=turn["local_context"])
+    else:
+        stream = stream_openrouter_response
+    
+    try:
+        with llm_priority(PRIORITY_INTERACTIVE, turn["chat_instance"]["id"]):
+            for delta in stream(turn["system_prompt"], turn["message"]):
+                text = parser.feed(delta)
+                if text:
+                    yield format_sse("token", {"text": text})
             
-            Format your response as a JSON object as follows:
-            {
-            "text": "Your actual response to the user - this should be what you want to say directly",
-            "mood": "your current mood (happy, sad, angry, confused, etc.)",
-            "emotions": {"joy": 0.8, "curiosity": 0.6},
-            "opinion_of_user": "your opinion of the user (positive, negative, neutral, etc.)",
-            "action": "what you're physically doing as you speak",
-            "location": "where you currently are"
-            }
+            processed_response = clean_chat_response(parser.close())
+            yield format_sse("state", turn_state(processed_response))
             
-            Important: For "text", include ONLY what you want to say to the user, not any descriptions or metadata.
-            DO NOT include JSON syntax in the "text" field itself. The "text" field should contain only your natural dialogue.
-            """
-        
-        # Get response from LLM
-        if use_local_model:
-            response = get_local_model_response(system_prompt, message)
-        else:
-            response = get_openrouter_response(system_prompt, message)
-        
-        # Process response to extract mood, emotions, opinions, action, location
-        processed_response = process_llm_response(response)
-        
-        # Log the processed response for debugging
-        print(f"Processed response: {json.dumps(processed_response, indent=2)}")
-        
-        # Make sure text is really just text (not containing JSON)
-        text = processed_response.get("text", "")
-        # If text still looks like JSON, try to extract just the inner text part
-        if text.strip().startswith("{") and text.strip().endswith("}"):
-            try:
-                json_obj = json.loads(text)
-                if isinstance(json_obj, dict) and "text" in json_obj:
-                    text = json_obj.get("text", "")
-            except:
-                # If we can't parse it, leave it as is
-                pass
-        
-        # Make sure we have a valid text response
-        if not text or len(text.strip()) == 0:
-            text = "I'm not sure what to say right now."
-        
-        # Update processed_response with cleaned text
-        processed_response["text"] = text
-        
-        # Generate scene description
-        scene_description = generate_scene_description(character, processed_response, message, is_player_action, action_success)
-        
-        # Update character state in chat instance
-        chat_instance["character_state"] = {
-            "mood": processed_response.get("mood", character["mood"]),
-            "emotions": processed_response.get("emotions", character["emotions"]),
-            "opinion_of_user": processed_response.get("opinion_of_user", character["opinion_of_user"]),
-            "action": processed_response.get("action", character.get("action", "standing still"))
-        }
-        
-        # Update chat location if changed
-        new_location = processed_response.get("location")
-        if new_location and new_location != "current location" and new_location != character["location"]:
-            chat_instance["location"] = new_location
-        
-        # Update chat instance with this conversation
-        timestamp = datetime.now().isoformat()
-        conversation_entry = {
-            "timestamp": timestamp,
-            "user_message": message,
-            "character_response": processed_response["text"],
-            "mood": processed_response.get("mood", "neutral"),
-            "emotions": processed_response.get("emotions", {}),
-            "action": processed_response.get("action", "standing still"),
-            "location": chat_instance["location"],
-            "scene_description": scene_description.get("scene_description", "")
-        }
-        
-        # Add action-specific data to conversation
-        if is_player_action:
-            try:
-                action_data = json.loads(message)
-                conversation_entry["is_player_action"] = True
-                conversation_entry["player_action"] = action_data["action"]
-                conversation_entry["action_success"] = action_success
-                conversation_entry["action_details"] = action_data.get("details", "")
-            except:
-                pass
-        
-        # Add conversation to chat instance
-        if not chat_instance.get("conversations"):
-            chat_instance["conversations"] = []
-        
-        chat_instance["conversations"].append(conversation_entry)
-        
-        # Update timestamp
-        chat_instance["updated_at"] = timestamp
-        
-        # Save updated chat instance
-        with open(chat_path, 'w') as f:
-            json.dump(chat_instance, f, indent=2)
+            turn["result"] = complete_chat_turn(turn, processed_response)
+        yield format_sse("done", turn["result"])
+    except Exception as e:
+        print(f"Error streaming chat turn: {str(e)}")
+        yield format_sse("error", {"error": str(e)})
+
+
+def stream_chat_response(chat_id, data):
+    """
+    Build the streaming response for a chat turn. The chat's lock is taken
+    before the response starts (so a busy chat still gets a 409) and held
+    until the stream finishes or the client disconnects.
+    """
+    lock = ExitStack()
+    lock.enter_context(chat_lock(chat_id))
+    try:
+        turn, error = prepare_chat_turn(chat_id, data)
+    except Exception:
+        lock.close()
+        raise
+    if error:
+        lock.close()
+        return error
+    
+    def generate():
+        try:
+            yield from stream_chat_turn(turn)
+        finally:
+            lock.close()
         
-        # Return processed response
-        return jsonify({
-            "response": processed_response["text"],
-            "mood": processed_response.get("mood", "neutral"),
-            "emotions": processed_response.get("emotions", {}),
-            "opinion_of_user": processed_response.get("opinion_of_user", "neutral"),
-            "action": processed_response.get("action", "standing still"),
-            "location": chat_instance["location"],
-            "scene_description": scene_description.get("scene_description", "")
-        })
\ No newline at end of file
+        # The scene is saved under the chat's lock, so wait for it only after releasing it
+        result = turn.get("result")
+        if result and result["scene_status"] == SCENE_PENDING:
+            yield format_sse("scene", get_scene(chat_id, result["turn"], wait=Config.SCENE_DEADLINE + 1))
+    
+    response = Response(stream_with_context(generate()), mimetype="text/event-stream")
+    response.headers["Cache-Control"] = "no-cache"
+    # Stop reverse proxies from buffering the stream
+    response.headers["X-Accel-Buffering"] = "no"
+    # Release the lock even if the stream is never started
+    response.call_on_close(lock.close)
+    return response
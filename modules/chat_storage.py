@@ -0,0 +1,443 @@
+"""
+Chat storage module for persisting chat instances.
+
+Each chat is stored as two files in the chat instances folder:
+- <chat_id>.json: a small header with the chat's state (title, location,
+  character_state, timestamps, turn_count)
+- <chat_id>.jsonl: an append-only log with one conversation entry per line
+
+Entries are numbered with a 1-based "turn" id that matches their line in
+the log, which lets pages of history be located without parsing the lines
+that are skipped.
+
+Legacy chat files that still embed a "conversations" list are migrated to
+this layout the first time they are loaded.
+
+Whole-file writes go through a temp file and a rename, so readers never see
+a half-written file. Callers serialize writers with chat_locks.chat_lock.
+
+Entries are changed after the fact (e.g. when a background scene
+description arrives) by rewriting the end of the log from that entry on.
+The new tail is first saved to <chat_id>.jsonl.journal so an interrupted
+rewrite is completed by the next write.
+"""
+
+import json
+import os
+import tempfile
+from config import Config
+from .chat_locks import chat_lock
+
+# Block size used when reading the conversation log backwards
+READ_BLOCK_SIZE = 8192
+
+
+def get_chat_header_path(chat_id):
+    """Get the path of a chat's header file"""
+    return os.path.join(Config.CHAT_INSTANCES_FOLDER, f"{chat_id}.json")
+
+
+def get_chat_log_path(chat_id):
+    """Get the path of a chat's conversation log"""
+    return os.path.join(Config.CHAT_INSTANCES_FOLDER, f"{chat_id}.jsonl")
+
+
+def get_chat_journal_path(chat_id):
+    """Get the path of the journal used while rewriting the end of a chat's log"""
+    return os.path.join(Config.CHAT_INSTANCES_FOLDER, f"{chat_id}.jsonl.journal")
+
+
+def list_chat_ids():
+    """List the IDs of all stored chats"""
+    os.makedirs(Config.CHAT_INSTANCES_FOLDER, exist_ok=True)
+    return [
+        filename[:-len('.json')]
+        for filename in os.listdir(Config.CHAT_INSTANCES_FOLDER)
+        if filename.endswith('.json')
+    ]
+
+
+def chat_exists(chat_id):
+    """Check whether a chat instance exists"""
+    return os.path.exists(get_chat_header_path(chat_id))
+
+
+def _atomic_write(path, write_func):
+    """Write a file through a temp file in the same folder, then rename it into place"""
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+
+    fd, temp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, 'w') as f:
+            write_func(f)
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def write_json_atomic(path, data, indent=None):
+    """Atomically replace a JSON file"""
+    _atomic_write(path, lambda f: json.dump(data, f, indent=indent))
+
+
+def save_chat_header(chat_header):
+    """Save a chat header (without its conversations)"""
+    header = {k: v for k, v in chat_header.items() if k != "conversations"}
+    write_json_atomic(get_chat_header_path(header["id"]), header, indent=2)
+
+
+def _write_log(chat_id, conversations):
+    """Write a complete conversation log (used for creation and migration)"""
+    def write_entries(f):
+        for turn, entry in enumerate(conversations, start=1):
+            entry["turn"] = turn
+            f.write(json.dumps(entry) + "\n")
+
+    _atomic_write(get_chat_log_path(chat_id), write_entries)
+
+
+def _migrate_legacy_chat(chat_instance):
+    """Move the embedded conversations of a legacy chat file into a log"""
+    conversations = chat_instance.pop("conversations", None) or []
+    print(f"Migrating chat {chat_instance['id']} to append-only log ({len(conversations)} entries)")
+
+    _write_log(chat_instance["id"], conversations)
+    chat_instance["turn_count"] = len(conversations)
+    save_chat_header(chat_instance)
+    return chat_instance
+
+
+def load_chat_header(chat_id):
+    """
+    Load a chat header, migrating legacy chat files on first access.
+
+    Returns:
+        dict: The chat header, or None if the chat does not exist
+    """
+    header_path = get_chat_header_path(chat_id)
+    if not os.path.exists(header_path):
+        return None
+
+    with open(header_path, 'r') as f:
+        chat_header = json.load(f)
+
+    if "conversations" in chat_header:
+        with chat_lock(chat_id):
+            # Re-read under the lock in case another writer migrated it first
+            with open(header_path, 'r') as f:
+                chat_header = json.load(f)
+            if "conversations" in chat_header:
+                chat_header = _migrate_legacy_chat(chat_header)
+
+    return chat_header
+
+
+def create_chat(chat_instance):
+    """Create a new chat from a full chat instance (header plus conversations)"""
+    conversations = chat_instance.get("conversations", [])
+    chat_instance["turn_count"] = len(conversations)
+
+    os.makedirs(Config.CHAT_INSTANCES_FOLDER, exist_ok=True)
+    _write_log(chat_instance["id"], conversations)
+    save_chat_header(chat_instance)
+
+
+def import_chat(chat_header, entries):
+    """
+    Write an existing chat's header and log, streaming its entries (numbered
+    by their line, which keeps the ids of a complete chat).
+
+    Returns:
+        tuple: (the saved header, its last entry or None)
+    """
+    last = []
+
+    def write_entries(f):
+        for turn, entry in enumerate(entries, start=1):
+            entry["turn"] = turn
+            f.write(json.dumps(entry) + "\n")
+            last[:] = [entry]
+
+    _atomic_write(get_chat_log_path(chat_header["id"]), write_entries)
+    if os.path.exists(get_chat_journal_path(chat_header["id"])):
+        os.remove(get_chat_journal_path(chat_header["id"]))
+
+    header = {k: v for k, v in chat_header.items() if k != "conversations"}
+    header["turn_count"] = last[0]["turn"] if last else 0
+    save_chat_header(header)
+    return header, (last[0] if last else None)
+
+
+def delete_chat(chat_id):
+    """Delete a chat's header and log. Returns False if the chat did not exist."""
+    header_path = get_chat_header_path(chat_id)
+    if not os.path.exists(header_path):
+        return False
+
+    os.remove(header_path)
+    for path in (get_chat_log_path(chat_id), get_chat_journal_path(chat_id)):
+        if os.path.exists(path):
+            os.remove(path)
+    return True
+
+
+def append_conversation(chat_header, entry):
+    """
+    Append a conversation entry to a chat's log and bump its turn count.
+    The entry is numbered with the next turn id. The header itself is not
+    saved; callers save it after updating its state.
+    """
+    log_path = get_chat_log_path(chat_header["id"])
+    _finish_log_rewrite(chat_header["id"])
+
+    # Number the turn from the log itself so a stale header cannot reuse an id
+    last_entries = read_recent_conversations(chat_header["id"], 1)
+    entry["turn"] = last_entries[-1]["turn"] + 1 if last_entries else 1
+
+    with open(log_path, 'a+b') as f:
+        # Drop a partially written trailing line left behind by an interrupted append
+        size = f.seek(0, os.SEEK_END)
+        if size > 0:
+            f.seek(size - 1)
+            if f.read(1) != b"\n":
+                _truncate_partial_line(f, size)
+
+        f.write((json.dumps(entry) + "\n").encode('utf-8'))
+
+    chat_header["turn_count"] = entry["turn"]
+
+
+def update_conversation(chat_id, turn, changes):
+    """
+    Update fields of one conversation entry. Callers must hold the chat's lock.
+
+    The entry and any entries after it (usually none, as it is normally the
+    newest turn) are rewritten at the end of the log.
+
+    Returns:
+        dict: The updated entry, or None if the turn does not exist
+    """
+    log_path = get_chat_log_path(chat_id)
+    if not os.path.exists(log_path):
+        return None
+    _finish_log_rewrite(chat_id)
+
+    with open(log_path, 'r+b') as f:
+        size = f.seek(0, os.SEEK_END)
+        if size > 0:
+            f.seek(size - 1)
+            if f.read(1) != b"\n":
+                _truncate_partial_line(f, size)
+                size = f.seek(0, os.SEEK_END)
+
+        # Read backwards until the tail holds the entry's complete line
+        tail = b""
+        position = size
+        while position > 0:
+            start = max(0, position - READ_BLOCK_SIZE)
+            f.seek(start)
+            tail = f.read(position - start) + tail
+            position = start
+
+            lines = tail[:-1].split(b"\n")
+            # Unless the whole file has been read, the first piece may be partial
+            first = 0 if position == 0 else 1
+            found = None
+            for index in range(len(lines) - 1, first - 1, -1):
+                try:
+                    entry_turn = json.loads(lines[index]).get("turn")
+                except ValueError:
+                    continue
+                if entry_turn is None or entry_turn < turn:
+                    return None
+                if entry_turn == turn:
+                    found = index
+                    break
+            if found is not None:
+                break
+        else:
+            return None
+
+        entry = json.loads(lines[found])
+        entry.update(changes)
+        offset = position + sum(len(line) + 1 for line in lines[:found])
+        new_tail = b"\n".join([json.dumps(entry).encode('utf-8')] + lines[found + 1:]) + b"\n"
+
+    write_json_atomic(get_chat_journal_path(chat_id), {"offset": offset, "tail": new_tail.decode('utf-8')})
+    _finish_log_rewrite(chat_id)
+    return entry
+
+
+def _finish_log_rewrite(chat_id):
+    """Apply a pending log rewrite from the chat's journal, if there is one"""
+    journal_path = get_chat_journal_path(chat_id)
+    if not os.path.exists(journal_path):
+        return
+
+    with open(journal_path, 'r') as f:
+        journal = json.load(f)
+    with open(get_chat_log_path(chat_id), 'r+b') as f:
+        f.truncate(journal["offset"])
+        f.seek(journal["offset"])
+        f.write(journal["tail"].encode('utf-8'))
+    os.remove(journal_path)
+
+
+def _truncate_partial_line(f, size):
+    """Truncate an open log file back to the end of its last complete line"""
+    position = size
+    while position > 0:
+        start = max(0, position - READ_BLOCK_SIZE)
+        f.seek(start)
+        block = f.read(position - start)
+        newline = block.rfind(b"\n")
+        if newline >= 0:
+            f.truncate(start + newline + 1)
+            return
+        position = start
+    f.truncate(0)
+
+
+def _iter_log_lines_reversed(log_path):
+    """Yield the raw lines of a log file from last to first, reading backwards"""
+    with open(log_path, 'rb') as f:
+        position = f.seek(0, os.SEEK_END)
+        remainder = b""
+
+        while position > 0:
+            start = max(0, position - READ_BLOCK_SIZE)
+            f.seek(start)
+            block = f.read(position - start) + remainder
+            position = start
+
+            lines = block.split(b"\n")
+            # The first piece may be the tail of a line that starts in an earlier block
+            remainder = lines.pop(0)
+            for line in reversed(lines):
+                if line.strip():
+                    yield line
+
+        if remainder.strip():
+            yield remainder
+
+
+def read_recent_conversations(chat_id, count):
+    """
+    Read the last `count` conversation entries of a chat, oldest first.
+    Only the tail of the log is read, so the cost does not grow with history.
+    """
+    return read_conversation_page(chat_id, limit=count)
+
+
+def _read_entries_backwards(log_path, before, limit):
+    """Read up to `limit` entries older than turn `before`, newest first"""
+    entries = []
+    for line in _iter_log_lines_reversed(log_path):
+        try:
+            entry = json.loads(line)
+        except ValueError:
+            # Skip a partially written trailing line
+            continue
+
+        if "turn" not in entry:
+            # Logs written before turns were numbered: fall back to a full read
+            return None
+        if before is not None and entry["turn"] >= before:
+            continue
+
+        entries.append(entry)
+        if limit is not None and len(entries) >= limit:
+            break
+    return entries
+
+
+def _iter_entries_forwards(log_path, after=None):
+    """Yield the entries newer than turn `after`, oldest first"""
+    with open(log_path, 'rb') as f:
+        for position, line in enumerate(f, start=1):
+            # Line N holds turn N, so skipped lines never need to be parsed
+            if after is not None and position <= after:
+                continue
+            if not line.strip():
+                continue
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+
+            entry.setdefault("turn", position)
+            yield entry
+
+
+def _read_entries_forwards(log_path, after, limit):
+    """Read up to `limit` entries newer than turn `after`, oldest first"""
+    entries = []
+    for entry in _iter_entries_forwards(log_path, after):
+        entries.append(entry)
+        if limit is not None and len(entries) >= limit:
+            break
+    return entries
+
+
+def read_conversation_page(chat_id, before=None, after=None, limit=None):
+    """
+    Read a page of conversation entries, oldest first.
+
+    Args:
+        chat_id (str): The chat to read
+        before (int): Only return turns older than this turn id
+        after (int): Only return turns newer than this turn id
+        limit (int): Maximum number of entries. Without `after`, the newest
+            matching entries are returned; with `after`, the oldest ones.
+
+    Returns:
+        list: Conversation entries, each with its "turn" id
+    """
+    log_path = get_chat_log_path(chat_id)
+    if (limit is not None and limit <= 0) or not os.path.exists(log_path):
+        return []
+
+    if after is None:
+        entries = _read_entries_backwards(log_path, before, limit)
+        if entries is not None:
+            entries.reverse()
+            return entries
+        entries = _read_entries_forwards(log_path, None, None)
+        if before is not None:
+            entries = [e for e in entries if e["turn"] < before]
+        return entries[-limit:] if limit is not None else entries
+
+    entries = _read_entries_forwards(log_path, after, None if before is not None else limit)
+    if before is not None:
+        entries = [e for e in entries if e["turn"] < before]
+        if limit is not None:
+            entries = entries[:limit]
+    return entries
+
+
+def read_all_conversations(chat_id):
+    """Read every conversation entry of a chat, oldest first"""
+    log_path = get_chat_log_path(chat_id)
+    if not os.path.exists(log_path):
+        return []
+    return _read_entries_forwards(log_path, None, None)
+
+
+def iter_conversations(chat_id):
+    """Yield every conversation entry of a chat without loading the whole log"""
+    log_path = get_chat_log_path(chat_id)
+    if os.path.exists(log_path):
+        yield from _iter_entries_forwards(log_path)
+
+
+def load_chat_instance(chat_id):
+    """Load a full chat instance (header plus all conversations), or None"""
+    chat_instance = load_chat_header(chat_id)
+    if chat_instance is None:
+        return None
+
+    chat_instance["conversations"] = read_all_conversations(chat_id)
+    return chat_instance
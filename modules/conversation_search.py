@@ -0,0 +1,271 @@
+"""
+Full-text search across the conversations of all chat instances.
+
+Turns are indexed in a local SQLite database using FTS5. The index is kept
+up to date incrementally as turns are appended, and is rebuilt from the
+chat logs if the database is missing.
+"""
+
+from flask import jsonify, request
+import os
+import re
+import sqlite3
+import threading
+import time
+from config import Config
+from .chat_locks import resource_lock
+from .storage import get_storage
+
+# Name of the lock held while rebuilding the index
+REBUILD_LOCK_NAME = "search-index-rebuild"
+
+# Number of turns inserted per transaction during a rebuild
+REBUILD_BATCH_SIZE = 1000
+
+_local = threading.local()
+_schema_lock = threading.Lock()
+_schema_ready_for = None
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS turns (
+    id INTEGER PRIMARY KEY,
+    chat_id TEXT NOT NULL,
+    character_id TEXT,
+    turn INTEGER NOT NULL,
+    timestamp TEXT,
+    UNIQUE (chat_id, turn)
+);
+CREATE INDEX IF NOT EXISTS turns_character_time ON turns (character_id, timestamp);
+CREATE INDEX IF NOT EXISTS turns_time ON turns (timestamp);
+CREATE VIRTUAL TABLE IF NOT EXISTS turns_fts USING fts5 (
+    user_message,
+    character_response,
+    scene_description,
+    tokenize = 'porter unicode61'
+);
+"""
+
+
+def _get_connection():
+    """Get this thread's connection to the search database, creating the schema if needed"""
+    global _schema_ready_for
+
+    path = Config.SEARCH_INDEX_PATH
+    conn = getattr(_local, "conn", None)
+    if conn is not None and _local.path == path:
+        return conn
+
+    created = not os.path.exists(path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    conn = sqlite3.connect(path, timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    _local.conn = conn
+    _local.path = path
+
+    with _schema_lock:
+        if _schema_ready_for != path:
+            conn.executescript(SCHEMA)
+            _schema_ready_for = path
+
+    if created:
+        print("Search index not found. Rebuilding from chat logs...")
+        rebuild_search_index()
+
+    return conn
+
+
+def _index_entry(conn, chat_id, character_id, entry):
+    """Insert or replace one conversation entry (no commit)"""
+    row = conn.execute(
+        "SELECT id FROM turns WHERE chat_id = ? AND turn = ?",
+        (chat_id, entry["turn"])
+    ).fetchone()
+
+    if row:
+        rowid = row[0]
+        conn.execute("DELETE FROM turns_fts WHERE rowid = ?", (rowid,))
+        conn.execute(
+            "UPDATE turns SET character_id = ?, timestamp = ? WHERE id = ?",
+            (character_id, entry.get("timestamp", ""), rowid)
+        )
+    else:
+        rowid = conn.execute(
+            "INSERT INTO turns (chat_id, character_id, turn, timestamp) VALUES (?, ?, ?, ?)",
+            (chat_id, character_id, entry["turn"], entry.get("timestamp", ""))
+        ).lastrowid
+
+    conn.execute(
+        "INSERT INTO turns_fts (rowid, user_message, character_response, scene_description) VALUES (?, ?, ?, ?)",
+        (
+            rowid,
+            entry.get("user_message") or "",
+            entry.get("character_response") or "",
+            entry.get("scene_description") or ""
+        )
+    )
+
+
+def index_conversation(chat_header, entry):
+    """Add a newly appended conversation entry to the search index"""
+    try:
+        conn = _get_connection()
+        with conn:
+            _index_entry(conn, chat_header["id"], chat_header.get("character_id"), entry)
+    except Exception as e:
+        # Search is best effort; never fail a chat turn because of it
+        print(f"Error indexing conversation for search: {str(e)}")
+
+
+def remove_chat_from_search(chat_id):
+    """Remove every indexed turn of a chat"""
+    try:
+        conn = _get_connection()
+        with conn:
+            conn.execute(
+                "DELETE FROM turns_fts WHERE rowid IN (SELECT id FROM turns WHERE chat_id = ?)",
+                (chat_id,)
+            )
+            conn.execute("DELETE FROM turns WHERE chat_id = ?", (chat_id,))
+    except Exception as e:
+        print(f"Error removing chat from search index: {str(e)}")
+
+
+def rebuild_search_index():
+    """Rebuild the search index from every stored chat, streaming turns in batches"""
+    conn = _get_connection()
+    indexed = 0
+
+    with resource_lock(REBUILD_LOCK_NAME):
+        with conn:
+            conn.execute("DELETE FROM turns_fts")
+            conn.execute("DELETE FROM turns")
+
+        storage = get_storage()
+        pending = 0
+        conn.execute("BEGIN")
+        try:
+            for chat_header in storage.iter_chats():
+                for entry in storage.iter_turns(chat_header["id"]):
+                    _index_entry(conn, chat_header["id"], chat_header.get("character_id"), entry)
+                    indexed += 1
+                    pending += 1
+                    if pending >= REBUILD_BATCH_SIZE:
+                        conn.execute("COMMIT")
+                        conn.execute("BEGIN")
+                        pending = 0
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    print(f"Search index rebuilt with {indexed} turns")
+    return indexed
+
+
+def build_match_query(query):
+    """Turn free text into an FTS5 query that matches all of its words"""
+    terms = re.findall(r"\w+", query, re.UNICODE)
+    return " ".join(f'"{term}"' for term in terms)
+
+
+def search_conversations(query, character_id=None, since=None, until=None, limit=20, offset=0):
+    """
+    Search conversation turns, best matches first.
+
+    Args:
+        query (str): Free text; every word must match
+        character_id (str): Only search chats with this character
+        since (str): Only turns at or after this ISO date/time
+        until (str): Only turns before this ISO date/time
+        limit (int): Maximum number of results
+        offset (int): Number of results to skip
+
+    Returns:
+        list: Matches with chat_id, character_id, turn, timestamp, score and snippet
+    """
+    match_query = build_match_query(query)
+    if not match_query:
+        return []
+
+    sql = """
+        SELECT turns.chat_id, turns.character_id, turns.turn, turns.timestamp,
+               bm25(turns_fts) AS score,
+               snippet(turns_fts, -1, '<mark>', '</mark>', '...', 16) AS snippet
+        FROM turns_fts
+        JOIN turns ON turns.id = turns_fts.rowid
+        WHERE turns_fts MATCH ?
+    """
+    params = [match_query]
+
+    if character_id:
+        sql += " AND turns.character_id = ?"
+        params.append(character_id)
+    if since:
+        sql += " AND turns.timestamp >= ?"
+        params.append(since)
+    if until:
+        sql += " AND turns.timestamp < ?"
+        params.append(until)
+
+    sql += " ORDER BY score LIMIT ? OFFSET ?"
+    params.extend([limit, offset])
+
+    rows = _get_connection().execute(sql, params).fetchall()
+    return [
+        {
+            "chat_id": row[0],
+            "character_id": row[1],
+            "turn": row[2],
+            "timestamp": row[3],
+            # bm25() is lower for better matches; flip it so higher is better
+            "score": round(-row[4], 4),
+            "snippet": row[5]
+        }
+        for row in rows
+    ]
+
+
+def register_search_routes(app):
+    """Register conversation search routes with the Flask app"""
+
+    @app.route('/api/search', methods=['GET'])
+    def search():
+        """
+        Search all conversations.
+
+        Query parameters:
+        - q: Words to search for (required)
+        - character_id (optional): Only search chats with this character
+        - since / until (optional): ISO date or date-time bounds
+        - limit (optional): Maximum results (default 20, max 100)
+        - offset (optional): Results to skip for paging
+        """
+        query = request.args.get("q", "").strip()
+        if not query:
+            return jsonify({"error": "Query parameter 'q' is required"}), 400
+
+        limit = min(max(request.args.get("limit", 20, type=int), 1), 100)
+        offset = max(request.args.get("offset", 0, type=int), 0)
+
+        start = time.perf_counter()
+        results = search_conversations(
+            query,
+            character_id=request.args.get("character_id"),
+            since=request.args.get("since"),
+            until=request.args.get("until"),
+            limit=limit,
+            offset=offset
+        )
+
+        return jsonify({
+            "results": results,
+            "count": len(results),
+            "took_ms": round((time.perf_counter() - start) * 1000, 2)
+        })
+
+    @app.route('/api/search/rebuild', methods=['POST'])
+    def rebuild_search():
+        """Rebuild the search index from all chat logs"""
+        indexed = rebuild_search_index()
+        return jsonify({"success": True, "indexed_turns": indexed})
@@ -0,0 +1,258 @@
+"""
+Rolling summary of long chats.
+
+Each chat's prompt holds its running summary ("summary"), dated memories
+("memories") and the turns that are not summarized yet. The summary and
+memories are stored on the chat header, and "summarized_through" is the
+last turn folded into the summary. After each turn the unsummarized turns
+are checked in the background. The newest RECENT_CONVERSATION_COUNT turns
+always stay verbatim. Once the older ones add up to more than
+Config.SUMMARY_TRIGGER_TOKENS, they are folded into the summary by one
+model call. The call uses Config.SUMMARY_MODEL, or the local
+model when that is "local".
+
+The summary is kept under Config.SUMMARY_MAX_TOKENS and the memories to
+the newest Config.SUMMARY_MAX_MEMORIES, without repeats. The tail stays
+near the trigger size too. So a chat's prompt stops growing however long
+the chat runs.
+
+Summaries are off unless Config.SUMMARY_ENABLED is set; the prompt then
+holds only the newest RECENT_CONVERSATION_COUNT turns, so it stays flat
+without them. A summary that
+could not be saved because the chat stayed locked is kept and saved after
+the chat's next turn, rather than generated (and paid for) again.
+"""
+
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from config import Config
+from .ai_integration import get_openrouter_response, get_local_model_response, validate_json_response
+from .chat_locks import chat_lock, ChatLockTimeout
+from .llm_scheduler import llm_priority, PRIORITY_GENERATION
+from .memory_management import RECENT_CONVERSATION_COUNT, MAX_CONVERSATION_TURNS, conversation_tokens
+from .storage import get_storage
+from .token_budget import estimate_tokens, CHARS_PER_TOKEN
+
+# Most turns folded into the summary by one call
+MAX_FOLD_TURNS = 40
+
+SUMMARY_SYSTEM_PROMPT = """You keep the long-term memory of a roleplay conversation between the user and {name}.
+You are given the story so far and the conversation turns that follow it.
+
+Rewrite the story so far so that it also covers the new turns, in the third person and in at most {words} words.
+Keep names, places, relationships, promises, unresolved threads and how {name} feels about the user; leave out small talk.
+Also list the few events from the new turns that {name} would remember later, each with the date it happened.
+
+Respond with a JSON object only:
+{{"summary": "the updated story so far", "memories": [{{"date": "YYYY-MM-DD", "content": "one sentence"}}]}}"""
+
+_executor = None
+_executor_lock = threading.Lock()
+# Chats with a summary being generated in this process
+_pending = set()
+# chat id -> summary generated but not saved yet (the chat stayed locked), see summarize_chat
+_unsaved = {}
+_lock = threading.Lock()
+_stats = {
+    "scheduled": 0,
+    "below_threshold": 0,
+    "runs": 0,
+    "failed": 0,
+    "deferred": 0,
+    "turns_folded": 0,
+    "total_time_ms": 0.0
+}
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=Config.SUMMARY_WORKERS, thread_name_prefix="summary")
+    return _executor
+
+
+def get_unsummarized_turns(chat_header):
+    """
+    The chat's newest turns that are not in its summary yet, oldest first: at
+    most MAX_CONVERSATION_TURNS, or RECENT_CONVERSATION_COUNT when summaries
+    are off (nothing would fold the older ones away).
+    """
+    summarized_through = chat_header.get("summarized_through", 0)
+    if chat_header.get("turn_count", 0) <= summarized_through:
+        return []
+    limit = MAX_CONVERSATION_TURNS if Config.SUMMARY_ENABLED else RECENT_CONVERSATION_COUNT
+    turns = get_storage().get_turns(chat_header["id"], limit=limit)
+    return [entry for entry in turns if entry["turn"] > summarized_through]
+
+
+def schedule_summary(chat_header, character):
+    """Fold the chat's older turns into its summary in the background, if there are any"""
+    if not Config.SUMMARY_ENABLED:
+        return
+    chat_id = chat_header["id"]
+    foldable = chat_header.get("turn_count", 0) - chat_header.get("summarized_through", 0) - RECENT_CONVERSATION_COUNT
+    with _lock:
+        if foldable <= 0 and chat_id not in _unsaved:
+            return
+        if chat_id in _pending:
+            return
+        _pending.add(chat_id)
+        _stats["scheduled"] += 1
+
+    def run():
+        try:
+            with llm_priority(PRIORITY_GENERATION, f"summary:{chat_id}"):
+                summarize_chat(chat_id, character.get("name", "the character"))
+        except Exception as e:
+            with _lock:
+                _stats["failed"] += 1
+            print(f"Error summarizing chat {chat_id}: {str(e)}")
+        finally:
+            with _lock:
+                _pending.discard(chat_id)
+
+    _get_executor().submit(run)
+
+
+def summarize_chat(chat_id, name):
+    """
+    Fold a chat's older unsummarized turns into its summary, if they add up
+    to more than Config.SUMMARY_TRIGGER_TOKENS. A summary left unsaved by an
+    earlier run is saved first.
+
+    Returns:
+        bool: Whether the summary was updated
+    """
+    with _lock:
+        unsaved = _unsaved.pop(chat_id, None)
+    if unsaved is not None:
+        return _save_summary(chat_id, *unsaved)
+
+    storage = get_storage()
+    chat_header = storage.get_chat(chat_id)
+    if chat_header is None:
+        return False
+    summarized_through = chat_header.get("summarized_through", 0)
+    # The newest turns stay in the prompt as they are
+    foldable = min(chat_header.get("turn_count", 0) - RECENT_CONVERSATION_COUNT - summarized_through, MAX_FOLD_TURNS)
+    if foldable <= 0:
+        return False
+    fold = storage.get_turns(chat_id, after=summarized_through, limit=foldable)
+    if not fold or sum(conversation_tokens(entry) for entry in fold) <= Config.SUMMARY_TRIGGER_TOKENS:
+        with _lock:
+            _stats["below_threshold"] += 1
+        return False
+
+    started = time.perf_counter()
+    summary, memories = generate_summary(name, chat_header.get("summary", ""), fold)
+    return _save_summary(chat_id, summarized_through, fold, summary, memories, started)
+
+
+def _save_summary(chat_id, summarized_through, fold, summary, memories, started):
+    """Store a generated summary on the chat; kept for the next turn if the chat stays locked"""
+    storage = get_storage()
+    try:
+        with chat_lock(chat_id):
+            chat_header = storage.get_chat(chat_id)
+            # Deleted, or summarized by another process meanwhile
+            if chat_header is None or chat_header.get("summarized_through", 0) != summarized_through:
+                return False
+            chat_header["summary"] = summary
+            chat_header["memories"] = merge_memories(chat_header.get("memories", []), memories)
+            chat_header["summarized_through"] = fold[-1]["turn"]
+            chat_header["summary_updated_at"] = datetime.now().isoformat()
+            storage.save_chat(chat_header)
+    except ChatLockTimeout:
+        with _lock:
+            _unsaved[chat_id] = (summarized_through, fold, summary, memories, started)
+            _stats["deferred"] += 1
+        print(f"Chat {chat_id} is busy; its summary will be saved after the next turn")
+        return False
+
+    with _lock:
+        _stats["runs"] += 1
+        _stats["turns_folded"] += len(fold)
+        _stats["total_time_ms"] += (time.perf_counter() - started) * 1000
+    return True
+
+
+def _memory_key(content):
+    """Memory text compared case-, whitespace- and punctuation-insensitively"""
+    return " ".join(re.sub(r"[^\w\s]", " ", content.lower()).split())
+
+
+def merge_memories(memories, new_memories):
+    """Add new memories to a chat's memories: repeats are dropped and the newest Config.SUMMARY_MAX_MEMORIES kept"""
+    merged = {}
+    for memory in memories + new_memories:
+        key = _memory_key(memory["content"])
+        # A repeat moves to the end with its newest date
+        merged.pop(key, None)
+        merged[key] = memory
+    return list(merged.values())[-Config.SUMMARY_MAX_MEMORIES:]
+
+
+def generate_summary(name, summary, turns):
+    """
+    Ask the model for the summary updated with some turns.
+
+    Returns:
+        tuple: (summary, list of new memories {"timestamp", "content"})
+    """
+    lines = [f"Story so far:\n{summary or '(nothing yet)'}\n\nNew turns:"]
+    for entry in turns:
+        date = entry.get("timestamp", "")[:10]
+        lines.append(f"[{date}] User: {entry.get('user_message', '')}\n[{date}] {name}: {entry.get('character_response', '')}")
+    words = Config.SUMMARY_MAX_TOKENS * 3 // 4
+    system_prompt = SUMMARY_SYSTEM_PROMPT.format(name=name, words=words)
+    user_message = "\n".join(lines)
+
+    model = Config.SUMMARY_MODEL or Config.DEFAULT_MODEL
+    if model == "local":
+        response = get_local_model_response(system_prompt, user_message, temperature=0.3)
+    else:
+        response = get_openrouter_response(system_prompt, user_message, temperature=0.3, model=model)
+
+    last_date = turns[-1].get("timestamp", "")[:10]
+    try:
+        result = validate_json_response(response)
+    except ValueError:
+        # Not JSON: take the text as the summary
+        return bound_summary(response.strip()), []
+    if not isinstance(result, dict):
+        raise ValueError("The summary response is not a JSON object")
+
+    memories = []
+    for memory in result.get("memories") or []:
+        if isinstance(memory, dict) and isinstance(memory.get("content"), str) and memory["content"].strip():
+            date = memory.get("date") if isinstance(memory.get("date"), str) else last_date
+            memories.append({"timestamp": date or last_date, "content": memory["content"].strip()})
+    new_summary = result.get("summary")
+    if not isinstance(new_summary, str) or not new_summary.strip():
+        raise ValueError("The summary response has no summary")
+    return bound_summary(new_summary.strip()), memories
+
+
+def bound_summary(summary):
+    """Cut a summary to Config.SUMMARY_MAX_TOKENS, at the end of a sentence if there is one"""
+    if estimate_tokens(summary) <= Config.SUMMARY_MAX_TOKENS:
+        return summary
+    cut = summary[:Config.SUMMARY_MAX_TOKENS * CHARS_PER_TOKEN]
+    end = cut.rfind(". ")
+    return cut[:end + 1] if end > 0 else cut
+
+
+def get_summary_stats():
+    """Get counts of summary runs, turns folded and time spent"""
+    with _lock:
+        runs = _stats["runs"]
+        return {
+            **_stats,
+            "pending": len(_pending),
+            "avg_time_ms": round(_stats["total_time_ms"] / runs, 2) if runs else 0.0
+        }
@@ -0,0 +1,129 @@
+"""
+Process-wide read-through cache for rarely changing JSON data files
+(characters, scenarios and prompt templates).
+
+Entries are validated against the file's mtime and size on every read, so
+edits made outside the app are picked up automatically. Writers in the app
+also invalidate entries explicitly. The cache is bounded and evicts the
+least recently used entries first.
+"""
+
+import copy
+import json
+import os
+import threading
+from collections import OrderedDict
+from config import Config
+
+# path -> ((mtime_ns, size), parsed data)
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+_stats = {
+    "hits": 0,
+    "misses": 0,
+    "evictions": 0,
+    "invalidations": 0
+}
+
+
+def get_character_path(character_id):
+    """Get the path of a character's JSON file"""
+    return os.path.join(Config.CHARACTERS_FOLDER, f"{character_id}.json")
+
+
+def get_scenario_path(scenario_id):
+    """Get the path of a scenario's JSON file"""
+    return os.path.join(Config.SCENARIOS_FOLDER, f"{scenario_id}.json")
+
+
+def get_templates_path():
+    """Get the path of the prompt templates file"""
+    return os.path.join(Config.TEMPLATES_FOLDER, "prompt_templates.json")
+
+
+def load_json_cached(path):
+    """
+    Load a JSON file through the cache.
+
+    Returns:
+        The parsed data (a private copy the caller may modify), or None if
+        the file does not exist
+    """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        invalidate(path)
+        return None
+    stamp = (stat.st_mtime_ns, stat.st_size)
+
+    with _cache_lock:
+        cached = _cache.get(path)
+        if cached is not None and cached[0] == stamp:
+            _cache.move_to_end(path)
+            _stats["hits"] += 1
+            return copy.deepcopy(cached[1])
+        _stats["misses"] += 1
+
+    with open(path, 'r') as f:
+        data = json.load(f)
+
+    with _cache_lock:
+        _cache[path] = (stamp, data)
+        _cache.move_to_end(path)
+        while len(_cache) > Config.DATA_CACHE_MAX_ENTRIES:
+            _cache.popitem(last=False)
+            _stats["evictions"] += 1
+
+    return copy.deepcopy(data)
+
+
+def invalidate(path):
+    """Drop a file from the cache"""
+    with _cache_lock:
+        if _cache.pop(path, None) is not None:
+            _stats["invalidations"] += 1
+
+
+def load_character(character_id):
+    """Load a character by ID, or None if it does not exist"""
+    return load_json_cached(get_character_path(character_id))
+
+
+def invalidate_character(character_id):
+    """Drop a character from the cache after it was changed or deleted"""
+    invalidate(get_character_path(character_id))
+
+
+def load_scenario(scenario_id):
+    """Load a scenario by ID, or None if it does not exist"""
+    return load_json_cached(get_scenario_path(scenario_id))
+
+
+def invalidate_scenario(scenario_id):
+    """Drop a scenario from the cache after it was changed or deleted"""
+    invalidate(get_scenario_path(scenario_id))
+
+
+def load_templates():
+    """Load the prompt templates, falling back to the defaults if the file is missing"""
+    templates = load_json_cached(get_templates_path())
+    if templates is None:
+        return copy.deepcopy(Config.DEFAULT_TEMPLATES)
+    return templates
+
+
+def invalidate_templates():
+    """Drop the prompt templates from the cache after they were changed"""
+    invalidate(get_templates_path())
+
+
+def get_cache_stats():
+    """Get hit/miss counters and the current size of the cache"""
+    with _cache_lock:
+        lookups = _stats["hits"] + _stats["misses"]
+        return {
+            **_stats,
+            "entries": len(_cache),
+            "max_entries": Config.DATA_CACHE_MAX_ENTRIES,
+            "hit_ratio": round(_stats["hits"] / lookups, 4) if lookups else 0.0
+        }
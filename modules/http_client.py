@@ -0,0 +1,125 @@
+"""
+Shared HTTP client for every call to a model provider.
+
+One requests Session is shared by the whole process. Its connection pool
+keeps TLS connections to OpenRouter (and the local model server) alive
+between calls, so a chat turn does not pay a new handshake for each request.
+Requests' connection pools are thread-safe, so the session can be used from
+any request thread.
+"""
+
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from config import Config
+
+OPENROUTER_BASE_URL = "https://openrouter.ai/api/v1"
+OPENROUTER_CHAT_URL = f"{OPENROUTER_BASE_URL}/chat/completions"
+
+_session = None
+_session_lock = threading.Lock()
+_stats_lock = threading.Lock()
+_stats = {
+    "requests": 0,
+    "errors": 0,
+    "timeouts": 0,
+    "total_time_ms": 0.0
+}
+
+
+def get_session():
+    """Get the process-wide session, creating it on first use"""
+    global _session
+
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(
+                    pool_connections=Config.HTTP_POOL_CONNECTIONS,
+                    pool_maxsize=Config.HTTP_POOL_MAXSIZE
+                )
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                _session = session
+    return _session
+
+
+def default_timeout():
+    """(connect, read) timeout used when a call does not pass its own"""
+    return (Config.HTTP_CONNECT_TIMEOUT, Config.HTTP_READ_TIMEOUT)
+
+
+def request(method, url, timeout=None, **kwargs):
+    """
+    Send a request through the shared session.
+
+    Args:
+        method (str): HTTP method
+        url (str): Full URL
+        timeout: Seconds, or a (connect, read) tuple; defaults to the configured timeouts
+        **kwargs: Passed on to requests (json, headers, stream, ...)
+
+    Returns:
+        requests.Response
+    """
+    start = time.perf_counter()
+    try:
+        return get_session().request(method, url, timeout=timeout or default_timeout(), **kwargs)
+    except requests.exceptions.Timeout:
+        with _stats_lock:
+            _stats["timeouts"] += 1
+            _stats["errors"] += 1
+        raise
+    except requests.exceptions.RequestException:
+        with _stats_lock:
+            _stats["errors"] += 1
+        raise
+    finally:
+        with _stats_lock:
+            _stats["requests"] += 1
+            _stats["total_time_ms"] += (time.perf_counter() - start) * 1000
+
+
+def get(url, **kwargs):
+    """GET through the shared session"""
+    return request("GET", url, **kwargs)
+
+
+def post(url, **kwargs):
+    """POST through the shared session"""
+    return request("POST", url, **kwargs)
+
+
+def get_pool_stats():
+    """Get request counters and per-host connection pool usage"""
+    hosts = []
+    if _session is not None:
+        for adapter in set(_session.adapters.values()):
+            pools = adapter.poolmanager.pools
+            for key in list(pools.keys()):
+                pool = pools.get(key)
+                if pool is None:
+                    continue
+                hosts.append({
+                    "host": f"{pool.scheme}://{pool.host}:{pool.port}",
+                    "connections_opened": pool.num_connections,
+                    "requests": pool.num_requests,
+                    # The pool queue is pre-filled with None placeholders
+                    "idle_connections": sum(1 for conn in list(pool.pool.queue) if conn is not None) if pool.pool else 0
+                })
+
+    with _stats_lock:
+        stats = dict(_stats)
+
+    opened = sum(host["connections_opened"] for host in hosts)
+    stats["total_time_ms"] = round(stats["total_time_ms"], 2)
+    stats["avg_time_ms"] = round(stats["total_time_ms"] / stats["requests"], 2) if stats["requests"] else 0.0
+    stats["connections_opened"] = opened
+    stats["connection_reuse_ratio"] = (
+        max(round(1 - opened / stats["requests"], 4), 0.0) if stats["requests"] else 0.0
+    )
+    stats["pool_maxsize"] = Config.HTTP_POOL_MAXSIZE
+    stats["hosts"] = hosts
+    return stats
@@ -0,0 +1,449 @@
+"""
+Background jobs for long-running generation.
+
+Generating a whole character can take 30+ seconds; tied to an HTTP request,
+a proxy timeout throws the finished (and paid for) result away. Instead, a
+job is submitted to POST /api/jobs, which returns its id at once. The job
+runs on a bounded worker pool (Config.JOB_WORKERS) and clients poll
+GET /api/jobs/<id> or follow GET /api/jobs/<id>/events (Server-Sent Events)
+for progress and the result. Finished jobs are kept for
+Config.JOB_RESULT_TTL seconds.
+
+Jobs run in the process that accepted them. With Config.JOBS_PERSISTENT
+every job is also written to Config.JOBS_FOLDER, and jobs that were queued
+or running when the process stopped are run again when it starts (meant
+for a single server process; several would each pick them up). Recovery
+runs from the server's startup hook, so importing the app (tools, tests)
+never starts model calls.
+"""
+
+import json
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from flask import jsonify, request, Response, stream_with_context
+from config import Config
+from .ai_integration import generate_fields_concurrently
+from .character_generation import generate_character_profile, validate_include_fields
+from .chat_management import format_sse
+from .chat_storage import write_json_atomic
+from .llm_scheduler import llm_priority, PRIORITY_GENERATION
+from .response_cache import get_cache_mode
+
+# Values of a job's "status"
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_SUCCEEDED = "succeeded"
+JOB_FAILED = "failed"
+JOB_CANCELLED = "cancelled"
+FINISHED_STATUSES = (JOB_SUCCEEDED, JOB_FAILED, JOB_CANCELLED)
+
+# Seconds between keep-alive comments on an idle event stream
+KEEPALIVE_INTERVAL = 15
+
+_executor = None
+_executor_lock = threading.Lock()
+# job id -> Job, for jobs submitted to (or recovered by) this process
+_jobs = {}
+_jobs_lock = threading.Lock()
+_stats = {
+    "submitted": 0,
+    "rejected": 0,
+    "recovered": 0,
+    JOB_SUCCEEDED: 0,
+    JOB_FAILED: 0,
+    JOB_CANCELLED: 0,
+    "expired": 0
+}
+
+
+class JobCancelled(Exception):
+    """Raised inside a running job once it has been cancelled"""
+
+
+class Job:
+    """A unit of background work, its progress events and its result"""
+
+    def __init__(self, job_type, params, job_id=None):
+        self.id = job_id or str(uuid.uuid4())
+        self.type = job_type
+        self.params = params
+        self.status = JOB_QUEUED
+        self.created_at = datetime.now().isoformat()
+        self.started_at = None
+        self.finished_at = None
+        self.finished = None
+        self.progress = None
+        self.result = None
+        self.error = None
+        # (event, data) in order, replayed to every event stream
+        self.events = []
+        self._changed = threading.Condition()
+
+    def to_dict(self):
+        """The job as returned by the API (and saved when jobs are persistent)"""
+        return {
+            "id": self.id,
+            "type": self.type,
+            "status": self.status,
+            "params": self.params,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "progress": self.progress,
+            "result": self.result,
+            "error": self.error
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        job = cls(data["type"], data.get("params", {}), data["id"])
+        job.created_at = data.get("created_at", job.created_at)
+        job.status = data.get("status", JOB_QUEUED)
+        job.finished_at = data.get("finished_at")
+        job.progress = data.get("progress")
+        job.result = data.get("result")
+        job.error = data.get("error")
+        if job.finished_at:
+            job.finished = datetime.fromisoformat(job.finished_at).timestamp()
+        return job
+
+    def _emit(self, event, data):
+        """Record an event and wake up event streams (caller holds _changed)"""
+        self.events.append((event, data))
+        self._changed.notify_all()
+
+    def report(self, step, total, message, **data):
+        """
+        Record progress from a running job. Raises JobCancelled if the job
+        was cancelled, so long jobs stop between steps.
+        """
+        with self._changed:
+            if self.status == JOB_CANCELLED:
+                raise JobCancelled()
+            self.progress = {"step": step, "total": total, "message": message, **data}
+            self._emit("progress", self.progress)
+        _save(self)
+
+    def set_status(self, status, result=None, error=None):
+        """Move the job to a new status. Returns False if it had already finished."""
+        with self._changed:
+            if self.status in FINISHED_STATUSES:
+                return False
+            self.status = status
+            if status == JOB_RUNNING:
+                self.started_at = datetime.now().isoformat()
+            elif status in FINISHED_STATUSES:
+                self.finished = time.time()
+                self.finished_at = datetime.now().isoformat()
+                self.result = result
+                self.error = error
+            self._emit("status", self.to_dict())
+        if status in FINISHED_STATUSES:
+            with _jobs_lock:
+                _stats[status] += 1
+        _save(self)
+        return True
+
+    def wait_for_events(self, seen, timeout):
+        """
+        Wait until there are events after the first `seen` ones.
+
+        Returns:
+            tuple: (new events, whether the job has finished)
+        """
+        with self._changed:
+            if len(self.events) <= seen and self.status not in FINISHED_STATUSES:
+                self._changed.wait(timeout)
+            return self.events[seen:], self.status in FINISHED_STATUSES
+
+
+# --- Job types ---
+
+def _validate_character(params):
+    if not params.get("prompt"):
+        return "Prompt is required"
+    if "include_fields" in params:
+        return validate_include_fields(params["include_fields"])
+    return None
+
+
+def _run_character(job, params):
+    """Same as /api/generate-character"""
+    include_fields = params.get("include_fields", ["description", "personality"])
+    temperature = float(params.get("temperature", 0.7))
+    job.report(0, 1, "Generating character")
+    character, _ = generate_character_profile(
+        params["prompt"], include_fields, params.get("use_local_model", False), temperature,
+        get_cache_mode(params, temperature, headers={})
+    )
+    job.report(1, 1, "Character generated")
+    return {"character": character}
+
+
+def _validate_character_fields(params):
+    if not params.get("prompt"):
+        return "Prompt is required"
+    fields = params.get("fields")
+    if not isinstance(fields, list) or not fields or not all(isinstance(field, str) for field in fields):
+        return "A list of fields is required"
+    return None
+
+
+def _run_character_fields(job, params):
+    """Generate several fields of a character (as /api/generate-fields would)"""
+    fields = list(dict.fromkeys(params["fields"]))
+    temperature = float(params.get("temperature", 0.7))
+    results = generate_fields_concurrently(
+        fields, params["prompt"], params.get("use_local_model", False), temperature,
+        get_cache_mode(params, temperature, headers={})
+    )
+    contents, errors = {}, {}
+    job.report(0, len(fields), "Generating fields")
+    try:
+        for step, (field_type, content, error) in enumerate(results, start=1):
+            if error is None:
+                contents[field_type] = content
+                job.report(step, len(fields), f"Generated {field_type}", field_type=field_type, content=content)
+            else:
+                errors[field_type] = error
+                job.report(step, len(fields), f"Could not generate {field_type}", field_type=field_type, error=error)
+    finally:
+        results.close()
+    if not contents:
+        raise Exception(f"No field could be generated: {errors}")
+    return {"fields": contents, "errors": errors}
+
+
+# job type -> (validate(params) returning an error message or None, run(job, params) returning the result)
+JOB_TYPES = {
+    "character": (_validate_character, _run_character),
+    "character_fields": (_validate_character_fields, _run_character_fields)
+}
+
+
+# --- Queue ---
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=Config.JOB_WORKERS, thread_name_prefix="job")
+    return _executor
+
+
+def _job_path(job_id):
+    return os.path.join(Config.JOBS_FOLDER, f"{job_id}.json")
+
+
+def _save(job):
+    if not Config.JOBS_PERSISTENT:
+        return
+    try:
+        write_json_atomic(_job_path(job.id), job.to_dict())
+    except OSError as e:
+        print(f"Error saving job {job.id}: {str(e)}")
+
+
+def _run(job):
+    # Cancelled while it was queued
+    if not job.set_status(JOB_RUNNING):
+        return
+    _, run = JOB_TYPES[job.type]
+    try:
+        # The job's model calls share one flow, so a large job cannot crowd out the others
+        with llm_priority(PRIORITY_GENERATION, job.id):
+            result = run(job, job.params)
+    except JobCancelled:
+        return
+    except Exception as e:
+        print(f"Error running {job.type} job {job.id}: {str(e)}")
+        job.set_status(JOB_FAILED, error=str(e))
+        return
+    # A job cancelled during its last step keeps the cancelled status
+    job.set_status(JOB_SUCCEEDED, result=result)
+
+
+def _expire_finished():
+    """Forget finished jobs older than Config.JOB_RESULT_TTL"""
+    cutoff = time.time() - Config.JOB_RESULT_TTL
+    with _jobs_lock:
+        expired = [job for job in _jobs.values() if job.finished is not None and job.finished < cutoff]
+        for job in expired:
+            del _jobs[job.id]
+            _stats["expired"] += 1
+    for job in expired:
+        if Config.JOBS_PERSISTENT:
+            try:
+                os.remove(_job_path(job.id))
+            except OSError:
+                pass
+
+
+def submit_job(job_type, params):
+    """
+    Queue a job.
+
+    Returns:
+        tuple: (Job, None) or (None, (error message, HTTP status))
+    """
+    if job_type not in JOB_TYPES:
+        return None, (f"Unknown job type: {job_type}", 400)
+    validate, _ = JOB_TYPES[job_type]
+    error = validate(params)
+    if error:
+        return None, (error, 400)
+
+    _expire_finished()
+    job = Job(job_type, params)
+    with _jobs_lock:
+        queued = sum(1 for existing in _jobs.values() if existing.status == JOB_QUEUED)
+        if queued >= Config.JOB_QUEUE_LIMIT:
+            _stats["rejected"] += 1
+            return None, ("Too many queued jobs. Please try again later.", 503)
+        _jobs[job.id] = job
+        _stats["submitted"] += 1
+    with job._changed:
+        job._emit("status", job.to_dict())
+    _save(job)
+    _get_executor().submit(_run, job)
+    return job, None
+
+
+def get_job(job_id):
+    """Get a job of this process, or None if it is unknown or has expired"""
+    _expire_finished()
+    with _jobs_lock:
+        return _jobs.get(job_id)
+
+
+def cancel_job(job_id):
+    """
+    Cancel a queued or running job. A running job stops at its next progress
+    step; a model call already in flight finishes, but its result is dropped.
+
+    Returns:
+        Job: The job, or None if it is unknown
+    """
+    job = get_job(job_id)
+    if job is not None:
+        job.set_status(JOB_CANCELLED)
+    return job
+
+
+def recover_jobs():
+    """
+    Load persisted jobs and queue again those that had not finished. Called
+    once by the server process when it starts (app.on_startup), never on import.
+    """
+    if not Config.JOBS_PERSISTENT or not os.path.isdir(Config.JOBS_FOLDER):
+        return
+    for file_name in os.listdir(Config.JOBS_FOLDER):
+        if not file_name.endswith(".json"):
+            continue
+        try:
+            with open(os.path.join(Config.JOBS_FOLDER, file_name), 'r') as f:
+                job = Job.from_dict(json.load(f))
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Error loading job {file_name}: {str(e)}")
+            continue
+        if job.type not in JOB_TYPES:
+            continue
+
+        with _jobs_lock:
+            if job.id in _jobs:
+                continue
+            _jobs[job.id] = job
+        if job.status in FINISHED_STATUSES:
+            continue
+        # Interrupted jobs start over
+        job.status = JOB_QUEUED
+        job.progress = None
+        with _jobs_lock:
+            _stats["recovered"] += 1
+        with job._changed:
+            job._emit("status", job.to_dict())
+        _get_executor().submit(_run, job)
+    _expire_finished()
+
+
+def get_job_stats():
+    """Get job counters and the number of queued and running jobs"""
+    with _jobs_lock:
+        statuses = [job.status for job in _jobs.values()]
+        return {
+            **_stats,
+            "queued": statuses.count(JOB_QUEUED),
+            "running": statuses.count(JOB_RUNNING),
+            "workers": Config.JOB_WORKERS,
+            "persistent": Config.JOBS_PERSISTENT
+        }
+
+
+def register_job_routes(app):
+    """Register background job routes with the Flask app"""
+
+    @app.route('/api/jobs', methods=['POST'])
+    def create_job():
+        """
+        Submit a job. Expects JSON with:
+        - type: "character" (body of /api/generate-character) or
+          "character_fields" (prompt, fields, use_local_model, temperature; see /api/generate-fields)
+        - params: The job's parameters
+
+        Returns 202 with the job; poll /api/jobs/<id> or follow /api/jobs/<id>/events.
+        """
+        data = request.get_json(silent=True) or {}
+        job, error = submit_job(data.get("type"), data.get("params") or {})
+        if error:
+            message, status = error
+            return jsonify({"success": False, "message": message}), status
+        return jsonify({"success": True, "job": job.to_dict()}), 202
+
+    @app.route('/api/jobs/<job_id>', methods=['GET'])
+    def get_job_status(job_id):
+        """Get a job's status, progress and (once finished) result or error"""
+        job = get_job(job_id)
+        if job is None:
+            return jsonify({"success": False, "message": "Job not found"}), 404
+        return jsonify({"success": True, "job": job.to_dict()})
+
+    @app.route('/api/jobs/<job_id>/cancel', methods=['POST'])
+    def cancel_job_route(job_id):
+        """Cancel a queued or running job"""
+        job = cancel_job(job_id)
+        if job is None:
+            return jsonify({"success": False, "message": "Job not found"}), 404
+        return jsonify({"success": True, "job": job.to_dict()})
+
+    @app.route('/api/jobs/<job_id>/events', methods=['GET'])
+    def stream_job_events(job_id):
+        """
+        Follow a job as Server-Sent Events: `status` (with the job) on every
+        status change and `progress` for each step. Past events are replayed
+        first; the stream ends once the job has finished.
+        """
+        job = get_job(job_id)
+        if job is None:
+            return jsonify({"success": False, "message": "Job not found"}), 404
+
+        def generate():
+            seen = 0
+            while True:
+                events, finished = job.wait_for_events(seen, KEEPALIVE_INTERVAL)
+                for event, data in events:
+                    yield format_sse(event, data)
+                seen += len(events)
+                if finished and not events:
+                    return
+                if not events:
+                    yield ": keep-alive\n\n"
+
+        response = Response(stream_with_context(generate()), mimetype="text/event-stream")
+        response.headers["Cache-Control"] = "no-cache"
+        response.headers["X-Accel-Buffering"] = "no"
+        return response
@@ -0,0 +1,337 @@
+"""
+Scheduler in front of every model call.
+
+Each provider ("openrouter", "local") runs at most a configured number of
+calls at once (and optionally a number per model), started no faster than
+its token bucket allows. Calls over the limit wait in a queue that is
+served by priority class first:
+
+    interactive chat > scene descriptions > generation > diagnostics
+
+and, within a class, round-robin across flows (a chat id or a job id), so
+one chat or one bulk job cannot starve the others. Once a provider has
+Config.LLM_QUEUE_LIMIT calls waiting, new calls are rejected with
+LLMOverloaded (a 429 for the client), as are calls that wait longer than
+Config.LLM_QUEUE_TIMEOUT seconds.
+
+Callers wrap the request in llm_slot() (or llm_slot_async() in asyncio
+code), holding it until the response, or the stream, is finished. The
+priority and flow come from llm_priority(), set by whoever starts the work
+(a chat route, the scene workers, a job); calls outside it count as
+generation without a flow.
+"""
+
+import asyncio
+import contextvars
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager, contextmanager
+from config import Config
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_SCENE = 1
+PRIORITY_GENERATION = 2
+PRIORITY_DIAGNOSTIC = 3
+PRIORITY_NAMES = ("interactive", "scene", "generation", "diagnostic")
+
+PROVIDER_OPENROUTER = "openrouter"
+PROVIDER_LOCAL = "local"
+
+_priority = contextvars.ContextVar("llm_priority", default=PRIORITY_GENERATION)
+_flow = contextvars.ContextVar("llm_flow", default=None)
+
+_lock = threading.Lock()
+_providers = {}
+
+
+class LLMOverloaded(Exception):
+    """A provider's queue is full, or a call waited too long for a slot"""
+
+    def __init__(self, message, retry_after=1):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+@contextmanager
+def llm_priority(priority, flow=None):
+    """Run the model calls made inside the block with this priority class and flow (chat id, job id)"""
+    priority_token = _priority.set(priority)
+    flow_token = _flow.set(flow)
+    try:
+        yield
+    finally:
+        _flow.reset(flow_token)
+        _priority.reset(priority_token)
+
+
+def provider_name(use_local_model):
+    return PROVIDER_LOCAL if use_local_model else PROVIDER_OPENROUTER
+
+
+def _limits(provider):
+    """(max concurrent calls, calls per second or 0 for no limit) of a provider"""
+    if provider == PROVIDER_LOCAL:
+        return Config.LLM_MAX_CONCURRENCY_LOCAL, Config.LLM_RATE_LIMIT_LOCAL
+    return Config.LLM_MAX_CONCURRENCY_OPENROUTER, Config.LLM_RATE_LIMIT_OPENROUTER
+
+
+class _Waiter:
+    """A call waiting for a slot"""
+
+    def __init__(self, model, priority, flow, loop=None):
+        self.model = model
+        self.priority = priority
+        # Calls without a flow are each their own flow
+        self.flow = flow if flow is not None else self
+        self.enqueued_at = time.monotonic()
+        self.granted = False
+        self.loop = loop
+        if loop is None:
+            self.event = threading.Event()
+        else:
+            self.future = loop.create_future()
+
+    def grant(self):
+        """Give the call its slot (caller holds _lock)"""
+        self.granted = True
+        if self.loop is None:
+            self.event.set()
+        else:
+            self.loop.call_soon_threadsafe(_resolve, self.future)
+
+
+def _resolve(future):
+    if not future.done():
+        future.set_result(None)
+
+
+class _Provider:
+    """Slots, token bucket and queues of one provider"""
+
+    def __init__(self, name):
+        self.name = name
+        self.active = 0
+        self.model_active = {}
+        # One queue per priority class: flow -> waiters, served round-robin
+        self.queues = [OrderedDict() for _ in PRIORITY_NAMES]
+        self.queued = 0
+        self.tokens = float(Config.LLM_RATE_BURST)
+        self.refilled_at = time.monotonic()
+        self.timer = None
+        self.stats = {"started": 0, "shed": 0, "timeouts": 0}
+        self.waits = [{"count": 0, "total_ms": 0.0, "max_ms": 0.0} for _ in PRIORITY_NAMES]
+
+    def take_token(self, rate):
+        """Take a start from the token bucket; returns seconds until one is available if there is none"""
+        if rate <= 0:
+            return 0
+        now = time.monotonic()
+        self.tokens = min(float(Config.LLM_RATE_BURST), self.tokens + (now - self.refilled_at) * rate)
+        self.refilled_at = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / rate
+
+    def model_full(self, model):
+        limit = Config.LLM_MAX_CONCURRENCY_PER_MODEL
+        return limit > 0 and self.model_active.get(model, 0) >= limit
+
+    def start(self, model, priority, enqueued_at):
+        self.active += 1
+        self.model_active[model] = self.model_active.get(model, 0) + 1
+        self.stats["started"] += 1
+        wait_ms = (time.monotonic() - enqueued_at) * 1000
+        waits = self.waits[priority]
+        waits["count"] += 1
+        waits["total_ms"] += wait_ms
+        waits["max_ms"] = max(waits["max_ms"], wait_ms)
+
+    def next_waiter(self):
+        """Take the next waiter: highest priority first, round-robin across flows"""
+        for queue in self.queues:
+            for flow, waiters in queue.items():
+                if self.model_full(waiters[0].model):
+                    continue
+                waiter = waiters.popleft()
+                if waiters:
+                    queue.move_to_end(flow)
+                else:
+                    del queue[flow]
+                self.queued -= 1
+                return waiter
+        return None
+
+    def remove(self, waiter):
+        """Take a waiter that gave up out of its queue"""
+        queue = self.queues[waiter.priority]
+        waiters = queue.get(waiter.flow)
+        if waiters is not None and waiter in waiters:
+            waiters.remove(waiter)
+            if not waiters:
+                del queue[waiter.flow]
+            self.queued -= 1
+
+    def dispatch(self):
+        """Start queued calls while there are free slots and tokens (caller holds _lock)"""
+        max_concurrency, rate = _limits(self.name)
+        while self.queued and self.active < max_concurrency:
+            delay = self.take_token(rate)
+            if delay:
+                self._dispatch_later(delay)
+                return
+            waiter = self.next_waiter()
+            if waiter is None:
+                # Every queued call is waiting for a busy model; give the token back
+                if rate > 0:
+                    self.tokens += 1
+                return
+            self.start(waiter.model, waiter.priority, waiter.enqueued_at)
+            waiter.grant()
+
+    def _dispatch_later(self, delay):
+        if self.timer is not None:
+            return
+
+        def run():
+            with _lock:
+                self.timer = None
+                self.dispatch()
+
+        self.timer = threading.Timer(delay, run)
+        self.timer.daemon = True
+        self.timer.start()
+
+
+def _get_provider(provider):
+    """Get a provider's state (caller holds _lock)"""
+    state = _providers.get(provider)
+    if state is None:
+        state = _providers[provider] = _Provider(provider)
+    return state
+
+
+def _enter(provider, model, loop=None):
+    """
+    Take a slot right away, or queue for one.
+
+    Returns:
+        _Waiter to wait on, or None if the slot was taken right away
+    """
+    priority, flow = _priority.get(), _flow.get()
+    with _lock:
+        state = _get_provider(provider)
+        max_concurrency, rate = _limits(provider)
+        if not state.queued and state.active < max_concurrency and not state.model_full(model):
+            if not state.take_token(rate):
+                state.start(model, priority, time.monotonic())
+                return None
+        if state.queued >= Config.LLM_QUEUE_LIMIT:
+            state.stats["shed"] += 1
+            raise LLMOverloaded(f"Too many requests waiting for the {provider} model. Please try again shortly.")
+        waiter = _Waiter(model, priority, flow, loop)
+        state.queues[priority].setdefault(waiter.flow, deque()).append(waiter)
+        state.queued += 1
+        state.dispatch()
+        return waiter
+
+
+def _give_up(provider, waiter):
+    """
+    A waiter timed out or was cancelled.
+
+    Returns:
+        bool: Whether it had been granted its slot meanwhile (the caller then owns it)
+    """
+    with _lock:
+        if waiter.granted:
+            return True
+        state = _get_provider(provider)
+        state.remove(waiter)
+        state.stats["timeouts"] += 1
+        return False
+
+
+def _release(provider, model):
+    with _lock:
+        state = _get_provider(provider)
+        state.active -= 1
+        state.model_active[model] -= 1
+        state.dispatch()
+
+
+def _timeout_error(provider):
+    return LLMOverloaded(f"Timed out waiting for the {provider} model. Please try again shortly.")
+
+
+@contextmanager
+def llm_slot(provider, model=None, timeout=None):
+    """
+    Hold one of a provider's call slots for the duration of the block.
+
+    Args:
+        provider (str): "openrouter" or "local"
+        model (str): Model name, for the per-model limit
+        timeout (float): Seconds to wait for a slot (default: Config.LLM_QUEUE_TIMEOUT)
+
+    Raises:
+        LLMOverloaded: The queue is full, or no slot became free in time
+    """
+    waiter = _enter(provider, model)
+    if waiter is not None:
+        if not waiter.event.wait(Config.LLM_QUEUE_TIMEOUT if timeout is None else timeout):
+            if not _give_up(provider, waiter):
+                raise _timeout_error(provider)
+    try:
+        yield
+    finally:
+        _release(provider, model)
+
+
+@asynccontextmanager
+async def llm_slot_async(provider, model=None, timeout=None):
+    """asyncio version of llm_slot (waits without holding a thread)"""
+    waiter = _enter(provider, model, asyncio.get_running_loop())
+    if waiter is not None:
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter.future),
+                                   Config.LLM_QUEUE_TIMEOUT if timeout is None else timeout)
+        except asyncio.TimeoutError:
+            if not _give_up(provider, waiter):
+                raise _timeout_error(provider)
+        except asyncio.CancelledError:
+            if _give_up(provider, waiter):
+                _release(provider, model)
+            raise
+    try:
+        yield
+    finally:
+        _release(provider, model)
+
+
+def get_llm_scheduler_stats():
+    """Get slots in use, queue depths, shed calls and queue wait times per provider and priority class"""
+    providers = {}
+    with _lock:
+        for name, state in _providers.items():
+            max_concurrency, rate = _limits(name)
+            providers[name] = {
+                "active": state.active,
+                "max_concurrency": max_concurrency,
+                "rate_limit": rate,
+                "queued": state.queued,
+                "queue_limit": Config.LLM_QUEUE_LIMIT,
+                **state.stats,
+                "priorities": {
+                    PRIORITY_NAMES[priority]: {
+                        "queued": sum(len(waiters) for waiters in state.queues[priority].values()),
+                        "flows": len(state.queues[priority]),
+                        "started": waits["count"],
+                        "avg_wait_ms": round(waits["total_ms"] / waits["count"], 2) if waits["count"] else 0.0,
+                        "max_wait_ms": round(waits["max_ms"], 2)
+                    }
+                    for priority, waits in enumerate(state.waits)
+                }
+            }
+    return providers
@@ -0,0 +1,276 @@
+"""
+Local model provider for Ollama's native API.
+
+Plain calls (generate endpoints, character and scene generation) go to
+/api/chat or /api/generate. Chat turns go to /api/generate and carry the
+chat's "context": the tokens Ollama returned for the chat's previous turn.
+The first turn sends the whole system prompt. Later turns with the same
+static prefix (see prompt_prefix) send the per-turn part of the system
+prompt (state, scenario, summary, memories and a player action's
+instructions, which can change every turn) and the message. The prefix and
+earlier turns are already in the context and are not sent or evaluated
+again; the turn's prompt token breakdown is updated to match. A chat starts over with the full prompt when any of these
+happens:
+
+- its prefix changes
+- a turn was added or removed elsewhere
+- the context would no longer fit in num_ctx
+
+Every request streams (so long generations never hit the read timeout),
+asks Ollama to keep the model loaded for Config.LOCAL_MODEL_KEEP_ALIVE and
+sets num_ctx to Config.LOCAL_MODEL_CONTEXT_LENGTH, the window the prompt
+budget is fitted to. With Config.LOCAL_MODEL_WARM_UP set, start_warm_up()
+loads the model when the server starts, so the first request does not
+wait for it.
+"""
+
+import json
+import threading
+from array import array
+from collections import OrderedDict, namedtuple
+import requests
+from config import Config
+from . import http_client, async_http_client
+from .llm_scheduler import llm_slot, llm_slot_async, PROVIDER_LOCAL
+from .token_budget import estimate_tokens
+
+# Chats whose context is kept in memory
+MAX_CONTEXTS = 64
+
+# What a chat turn needs for context reuse: the chat, the number of turns it
+# has before this one, the static prefix at the start of the system prompt,
+# the per-turn part of the system prompt (sent even when the context is
+# reused) and the turn's prompt token breakdown (PromptBudget.to_dict(), or None)
+ChatContext = namedtuple("ChatContext", ["chat_id", "turn_count", "prefix_hash", "turn_prompt", "prompt_tokens"])
+
+# chat id -> (turn count after the turn, prefix hash, context tokens)
+_contexts = OrderedDict()
+_lock = threading.Lock()
+_stats = {
+    "requests": 0,
+    "chat_turns": 0,
+    "context_reused": 0,
+    "context_reset": 0,
+    "prompt_tokens": 0,
+    "generated_tokens": 0,
+    "warm_up": "not started"
+}
+
+
+def _url(path):
+    return Config.LOCAL_MODEL_ENDPOINT.rstrip("/") + path
+
+
+def _keep_alive():
+    """Config.LOCAL_MODEL_KEEP_ALIVE as Ollama expects it (a number of seconds, or a duration string)"""
+    value = Config.LOCAL_MODEL_KEEP_ALIVE
+    return int(value) if value.lstrip("-").isdigit() else value
+
+
+def _options(temperature, max_tokens=None):
+    options = {"temperature": temperature, "num_ctx": Config.LOCAL_MODEL_CONTEXT_LENGTH}
+    if max_tokens:
+        options["num_predict"] = max_tokens
+    return options
+
+
+def chat_request(system_prompt, user_message, temperature=0.7, max_tokens=None):
+    """URL and payload of an /api/chat request"""
+    return _url("/api/chat"), {
+        "model": Config.LOCAL_MODEL_NAME,
+        "messages": [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_message}
+        ],
+        "stream": True,
+        "keep_alive": _keep_alive(),
+        "options": _options(temperature, max_tokens)
+    }
+
+
+def generate_request(prompt, system=None, temperature=0.7, max_tokens=None, context=None):
+    """URL and payload of an /api/generate request"""
+    data = {
+        "model": Config.LOCAL_MODEL_NAME,
+        "prompt": prompt,
+        "stream": True,
+        "keep_alive": _keep_alive(),
+        "options": _options(temperature, max_tokens)
+    }
+    if system:
+        data["system"] = system
+    if context:
+        data["context"] = list(context)
+    return _url("/api/generate"), data
+
+
+def turn_request(chat, system_prompt, user_message, temperature=0.7, max_tokens=None):
+    """URL and payload of a chat turn, continuing from the chat's context when it can"""
+    context = None
+    if Config.LOCAL_MODEL_CONTEXT_REUSE:
+        with _lock:
+            stored = _contexts.get(chat.chat_id)
+        if stored is not None:
+            turn_count, prefix_hash, tokens = stored
+            needed = len(tokens) + estimate_tokens(chat.turn_prompt) + estimate_tokens(user_message) \
+                + Config.RESPONSE_TOKEN_RESERVE
+            if turn_count == chat.turn_count and prefix_hash == chat.prefix_hash \
+                    and needed <= Config.LOCAL_MODEL_CONTEXT_LENGTH:
+                context = tokens
+                # The prefix and earlier turns are already in the context
+                system_prompt = chat.turn_prompt
+                _record_reuse(chat.prompt_tokens, len(tokens))
+    with _lock:
+        _stats["chat_turns"] += 1
+        _stats["context_reused" if context is not None else "context_reset"] += 1
+    return generate_request(user_message, system_prompt, temperature, max_tokens, context)
+
+
+def _record_reuse(prompt_tokens, context_tokens):
+    """Make a turn's prompt token breakdown show what was sent when its chat's context was reused"""
+    if prompt_tokens is None:
+        return
+    sections = prompt_tokens["sections"]
+    prompt_tokens["used"] -= sections.pop("prefix", 0) + sections.pop("conversations", 0)
+    prompt_tokens["reused_context"] = context_tokens
+
+
+def _remember(chat, context):
+    """Keep the context returned for a chat turn, for the chat's next turn"""
+    if not context or not Config.LOCAL_MODEL_CONTEXT_REUSE:
+        return
+    with _lock:
+        _contexts[chat.chat_id] = (chat.turn_count + 1, chat.prefix_hash, array("l", context))
+        _contexts.move_to_end(chat.chat_id)
+        while len(_contexts) > MAX_CONTEXTS:
+            _contexts.popitem(last=False)
+
+
+def forget_chat(chat_id):
+    """Drop a chat's context (the chat was deleted)"""
+    with _lock:
+        _contexts.pop(chat_id, None)
+
+
+def _read_chunk(line, chat):
+    """Text of one streamed chunk; the last chunk's context and token counts are recorded"""
+    if not line:
+        return None
+    try:
+        chunk = json.loads(line)
+    except json.JSONDecodeError:
+        return None
+    if "error" in chunk:
+        raise Exception(str(chunk["error"]))
+    if chunk.get("done"):
+        with _lock:
+            _stats["prompt_tokens"] += chunk.get("prompt_eval_count", 0)
+            _stats["generated_tokens"] += chunk.get("eval_count", 0)
+        if chat is not None:
+            _remember(chat, chunk.get("context"))
+    if "message" in chunk:
+        return chunk["message"].get("content") or None
+    return chunk.get("response") or None
+
+
+def _error_detail(response):
+    try:
+        return str(response.json()["error"])
+    except (ValueError, KeyError, TypeError):
+        return response.text
+
+
+def stream(url, data, chat=None, timeout=None):
+    """
+    Stream a request to Ollama, holding a local model slot until it is done.
+
+    Yields:
+        str: The generated text in pieces
+    """
+    with _lock:
+        _stats["requests"] += 1
+    try:
+        with llm_slot(PROVIDER_LOCAL, data["model"]), \
+                http_client.post(url, json=data, stream=True, timeout=timeout) as response:
+            if response.status_code != 200:
+                raise Exception(f"Local model API request failed: {response.status_code} {_error_detail(response)}")
+            response.encoding = "utf-8"
+            for line in response.iter_lines(decode_unicode=True):
+                text = _read_chunk(line, chat)
+                if text:
+                    yield text
+    except requests.exceptions.RequestException as e:
+        raise Exception(f"Local model API request failed: {str(e)}")
+
+
+async def stream_async(url, data, chat=None):
+    """asyncio version of stream (an async generator)"""
+    with _lock:
+        _stats["requests"] += 1
+    try:
+        async with llm_slot_async(PROVIDER_LOCAL, data["model"]), \
+                async_http_client.stream("POST", url, json=data) as response:
+            if response.status_code != 200:
+                await response.read()
+                raise Exception(f"Local model API request failed: {response.status_code} {_error_detail(response)}")
+            async for line in response.aiter_lines():
+                text = _read_chunk(line, chat)
+                if text:
+                    yield text
+    except (OSError, async_http_client.HTTPStatusError) as e:
+        raise Exception(f"Local model API request failed: {str(e)}")
+
+
+def stream_chat(system_prompt, user_message, temperature=0.7, max_tokens=None, chat=None):
+    """Stream a reply to a system prompt and message; with a ChatContext, continue from the chat's context"""
+    if chat is not None:
+        url, data = turn_request(chat, system_prompt, user_message, temperature, max_tokens)
+    else:
+        url, data = chat_request(system_prompt, user_message, temperature, max_tokens)
+    return stream(url, data, chat)
+
+
+def stream_chat_async(system_prompt, user_message, temperature=0.7, max_tokens=None, chat=None):
+    """asyncio version of stream_chat"""
+    if chat is not None:
+        url, data = turn_request(chat, system_prompt, user_message, temperature, max_tokens)
+    else:
+        url, data = chat_request(system_prompt, user_message, temperature, max_tokens)
+    return stream_async(url, data, chat)
+
+
+def generate(prompt, system=None, temperature=0.7, max_tokens=None, timeout=None):
+    """Generate a completion of a prompt with /api/generate"""
+    url, data = generate_request(prompt, system, temperature, max_tokens)
+    return "".join(stream(url, data, timeout=timeout)).strip()
+
+
+def warm_up():
+    """Load the model into memory (an empty prompt only loads it)"""
+    try:
+        response = http_client.post(_url("/api/generate"), json={
+            "model": Config.LOCAL_MODEL_NAME,
+            "keep_alive": _keep_alive(),
+            "options": {"num_ctx": Config.LOCAL_MODEL_CONTEXT_LENGTH}
+        })
+        status = "loaded" if response.status_code == 200 else f"failed: {response.status_code} {_error_detail(response)}"
+    except Exception as e:
+        status = f"failed: {str(e)}"
+    with _lock:
+        _stats["warm_up"] = status
+    print(f"Local model {Config.LOCAL_MODEL_NAME} warm-up {status}")
+
+
+def start_warm_up():
+    """Warm the local model up in the background (if Config.LOCAL_MODEL_WARM_UP is set); called at server startup"""
+    if not Config.LOCAL_MODEL_WARM_UP or not Config.LOCAL_MODEL_ENDPOINT:
+        return
+    with _lock:
+        _stats["warm_up"] = "loading"
+    threading.Thread(target=warm_up, name="local-model-warm-up", daemon=True).start()
+
+
+def get_local_model_stats():
+    """Get request counts, context reuse on chat turns, token counts and the warm-up status"""
+    with _lock:
+        return {**_stats, "model": Config.LOCAL_MODEL_NAME, "contexts": len(_contexts)}
@@ -1,35 +1,60 @@
 import json
-import os
 from config import Config
+from .prompt_templates import get_templates
+from .token_budget import PromptBudget, estimate_tokens
+from .prompt_prefix import get_prompt_prefix
 
-def create_system_prompt(character, memory_data):
-    """Create a system prompt for the LLM based on character data, memories, and templates"""
-    # Get templates
-    templates_path = os.path.join(Config.TEMPLATES_FOLDER, "prompt_templates.json")
-    if os.path.exists(templates_path):
-        with open(templates_path, 'r') as f:
-            templates = json.load(f)
-    else:
-        templates = Config.DEFAULT_TEMPLATES
-    
-    # Format base prompt
-    prompt = templates["base_prompt"].format(
-        name=character['name'],
-        description=character.get('description', ''),
-        personality=character.get('personality', '')
-    ) + "\n\n"
-    
-    # Add speaking style if available
-    if character.get('speaking_style') and "speaking_style" in templates:
-        prompt += templates["speaking_style"].format(
-            speaking_style=character.get('speaking_style', '')
-        ) + "\n\n"
-    
-    # Add appearance if available
-    if character.get('appearance') and "appearance" in templates:
-        prompt += templates["appearance"].format(
-            appearance=character.get('appearance', '')
-        ) + "\n\n"
+# Newest conversation entries that always stay in the prompt as they are (never summarized)
+RECENT_CONVERSATION_COUNT = 5
+
+# Most unsummarized conversation entries included in the system prompt (with summaries on, see conversation_summary)
+MAX_CONVERSATION_TURNS = 20
+
+def format_conversation(convo):
+    """A conversation entry as it appears in the system prompt"""
+    return (f"User: {convo['user_message']}\n"
+            f"You ({convo.get('mood', 'neutral')}): {convo['character_response']}\n\n")
+
+def conversation_tokens(convo):
+    """Estimated prompt tokens of a conversation entry (stored on the entry when it is written)"""
+    tokens = convo.get("tokens")
+    if tokens is None:
+        tokens = estimate_tokens(format_conversation(convo))
+    return tokens
+
+def create_system_prompt(character, memory_data, scenario_context="", budget=None, prefix=None):
+    """
+    Create a system prompt for the LLM based on character data, memories, and templates.
+    
+    The prompt starts with the static prefix (see prompt_prefix), followed by
+    the per-turn state and then the conversations (see create_system_prompt_parts). With a PromptBudget, the per-turn sections are added
+    by priority (state, scenario, the chat's summary, memories, then the
+    conversations not summarized yet from newest to oldest) until the budget
+    is used up; the budget then holds the per-section token counts.
+    
+    memory_data holds "conversations" and optionally "summary" and
+    "memories" (see conversation_summary).
+    """
+    return "".join(create_system_prompt_parts(character, memory_data, scenario_context, budget, prefix))
+
+def create_system_prompt_parts(character, memory_data, scenario_context="", budget=None, prefix=None):
+    """
+    The system prompt in three parts, which join into create_system_prompt():
+    the static prefix, the per-turn part (scenario, state, summary and
+    memories) and the recent conversations. A local model continuing from a
+    chat's context is sent the per-turn part alone (see local_model).
+    
+    Returns:
+        tuple: (prefix, per-turn part, conversations)
+    """
+    if budget is None:
+        budget = PromptBudget()
+    if prefix is None:
+        prefix = get_prompt_prefix(character).text
+    budget.take("prefix", prefix)
+    
+    # Get the compiled templates
+    templates = get_templates()
     
     # Add mood and emotions
     emotions = character.get('emotions', {})
@@ -46,100 +71,55 @@ def create_system_prompt(character, memory_data):
         if isinstance(emotions, dict) and emotions:
             emotions_str = ", ".join([f"{k}: {v}" for k, v in emotions.items()])
     
+    parts = []
     if "mood_emotions" in templates:
-        prompt += templates["mood_emotions"].format(
+        parts += templates.pieces(
+            "mood_emotions",
             mood=character.get('mood', 'neutral'),
             emotions_str=emotions_str
-        ) + "\n"
+        )
+        parts.append("\n")
     
     # Add opinion of user
     if "opinion" in templates:
-        prompt += templates["opinion"].format(
-            opinion_of_user=character.get('opinion_of_user', 'neutral')
-        ) + "\n\n"
+        parts += templates.pieces("opinion", opinion_of_user=character.get('opinion_of_user', 'neutral'))
+        parts.append("\n\n")
     
     # Add action and location if available
-    prompt += f"Current action: {character.get('action', 'standing still')}\n"
-    prompt += f"Current location: {character.get('location', 'current location')}\n\n"
+    parts += ["Current action: ", str(character.get('action', 'standing still')), "\n",
+              "Current location: ", str(character.get('location', 'current location')), "\n\n"]
+    state = budget.take("state", "".join(parts))
+    
+    # Include scenario context if available (cut to whole lines when it is too large)
+    if scenario_context:
+        scenario_context = budget.take_truncated("scenario", scenario_context)
+    
+    # The chat's running summary of its older turns
+    summary = ""
+    if memory_data.get('summary'):
+        summary = budget.take_truncated("summary", f"Story so far:\n{memory_data['summary']}\n\n")
     
     # Add important memories
+    memories = ""
     if memory_data.get('memories'):
-        prompt += "Important memories:\n"
+        memories = "Important memories:\n"
         for memory in memory_data['memories']:
-            prompt += f"- {memory['content']} ({memory['timestamp']})\n"
+            memories += f"- {memory['content']} ({memory['timestamp']})\n"
+        memories = budget.take_truncated("memories", memories)
     
-    # Add recent conversations (last 5)
+    # Add recent conversations, newest first, while they fit
+    conversations = ""
     if memory_data.get('conversations'):
-        prompt += "\nRecent conversations:\n"
-        recent_convos = memory_data['conversations'][-5:]
-        for convo in recent_convos:
-            prompt += f"User: {convo['user_message']}\n"
-            prompt += f"You ({convo.get('mood', 'neutral')}): {convo['character_response']}\n\n"
-    
-    # Add roleplaying instructions
-    if "roleplaying_instructions" in templates:
-        prompt += templates["roleplaying_instructions"]
-    
-    # Add response format instructions
-    if "response_format" in templates:
-        prompt += templates["response_format"]
-    
-    return prompt
-
-def summarize_conversations(memory_data):
-    """Summarize older conversations to keep memory manageable"""
-    # Keep last 10 conversations as is
-    recent = memory_data["conversations"][-10:]
-    older = memory_data["conversations"][:-10]
-    
-    # Group older conversations by day
-    by_day = {}
-    for convo in older:
-        day = convo["timestamp"].split("T")[0]
-        if day not in by_day:
-            by_day[day] = []
-        by_day[day].append(convo)
-    
-    # Create summaries and track player actions
-    for day, convos in by_day.items():
-        # Count player actions
-        action_count = sum(1 for convo in convos if convo.get("is_player_action", False))
-        success_count = sum(1 for convo in convos if convo.get("is_player_action", False) and convo.get("action_success", False))
-        
-        action_summary = ""
-        if action_count > 0:
-            action_summary = f" The user attempted {action_count} actions, succeeding on {success_count} of them."
-        
-        summary = {
-            "timestamp": f"{day}T00:00:00Z",
-            "summary": f"Summary of {len(convos)} conversations on {day}.{action_summary}",
-            "user_message": "Multiple messages",
-            "character_response": "Multiple responses",
-            "mood": "mixed",
-            "emotions": {},
-            "action": "various actions",
-            "location": "various locations"
-        }
-        
-        # Extract key emotions from the day
-        all_emotions = {}
-        for convo in convos:
-            for emotion, intensity in convo.get("emotions", {}).items():
-                if emotion not in all_emotions:
-                    all_emotions[emotion] = []
-                all_emotions[emotion].append(intensity)
-        
-        # Average emotions
-        for emotion, intensities in all_emotions.items():
-            summary["emotions"][emotion] = sum(intensities) / len(intensities)
-        
-        # Add to memories
-        memory_data["memories"].append({
-            "timestamp": summary["timestamp"],
-            "content": summary["summary"]
-        })
-    
-    # Replace with summarized version
-    memory_data["conversations"] = recent
-    
-    return memory_data
\ No newline at end of file
+        recent_convos = memory_data['conversations'][-MAX_CONVERSATION_TURNS:]
+        included = []
+        for convo in reversed(recent_convos):
+            if not budget.take_if_fits("conversations", None, conversation_tokens(convo)):
+                break
+            included.append(convo)
+        if included:
+            conversations = "\nRecent conversations:\n"
+            conversations += "".join(format_conversation(convo) for convo in reversed(included))
+    
+    if scenario_context:
+        return prefix, "".join(("\n\n", scenario_context, "\n\n", state, summary, memories)), conversations
+    return prefix, "".join((state, summary, memories)), conversations
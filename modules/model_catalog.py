@@ -0,0 +1,219 @@
+"""
+Cached catalog of the models available through OpenRouter.
+
+The full model list is large and rarely changes, so it is kept in memory
+and in Config.MODEL_CATALOG_PATH (so restarts don't need to fetch it). Once
+it is older than Config.MODEL_CATALOG_TTL it is still served immediately
+while a background refresh fetches a new copy (stale-while-revalidate).
+Only one refresh runs at a time; concurrent callers share its result.
+Other subsystems can look up a model's metadata (context_length, pricing)
+with get_model_info() without fetching anything.
+"""
+
+import json
+import threading
+import time
+from config import Config
+from . import http_client
+from .chat_storage import write_json_atomic
+
+# Served when no API key is configured or the catalog could not be fetched
+DEFAULT_MODELS = [
+    {"id": "openai/gpt-3.5-turbo", "name": "GPT-3.5 Turbo"},
+    {"id": "openai/gpt-4", "name": "GPT-4"},
+    {"id": "anthropic/claude-3-opus", "name": "Claude 3 Opus"},
+    {"id": "anthropic/claude-3-sonnet", "name": "Claude 3 Sonnet"},
+    {"id": "anthropic/claude-3-haiku", "name": "Claude 3 Haiku"}
+]
+LOCAL_MODEL = {"id": "local", "name": "Local Model"}
+
+# {"fetched_at": timestamp, "models": [...]}, or None until loaded or fetched
+_catalog = None
+_by_id = {}
+_loaded = False
+# Set while a refresh is running; waiters block on it
+_refreshing = None
+_last_error = None
+_lock = threading.Lock()
+_stats = {
+    "fresh_hits": 0,
+    "stale_hits": 0,
+    "refreshes": 0,
+    "refresh_errors": 0,
+    # Refreshes requested while one was already running (they share its result)
+    "coalesced": 0
+}
+
+
+def fetch_models():
+    """
+    Download the model list from OpenRouter.
+
+    Returns:
+        list: {"id", "name", "context_length", "pricing"} for each model
+    """
+    headers = {
+        "Authorization": f"Bearer {Config.OPENROUTER_API_KEY}",
+        "HTTP-Referer": "https://localhost:5000",  # Add referer to reduce API errors
+        "X-Title": "AI Character Chat",  # Identify your application
+        "Content-Type": "application/json"
+    }
+
+    response = http_client.get(f"{http_client.OPENROUTER_BASE_URL}/models", headers=headers)
+    if response.status_code != 200:
+        raise Exception(f"OpenRouter API returned status code {response.status_code}: {response.text}")
+
+    models = []
+    for model in response.json().get("data", []):
+        model_id = model.get("id")
+        # Include models that at least have an ID
+        if model_id:
+            models.append({
+                "id": model_id,
+                "name": model.get("name", model_id),
+                "context_length": model.get("context_length"),
+                "pricing": model.get("pricing", {})
+            })
+    return models
+
+
+def _set_catalog(catalog):
+    """Install a catalog (caller holds _lock)"""
+    global _catalog, _by_id
+    _catalog = catalog
+    _by_id = {model["id"]: model for model in catalog["models"]}
+
+
+def _ensure_loaded():
+    """Load the catalog saved by an earlier run, once (caller holds _lock)"""
+    global _loaded
+    if _loaded:
+        return
+    _loaded = True
+    try:
+        with open(Config.MODEL_CATALOG_PATH, 'r') as f:
+            catalog = json.load(f)
+        if isinstance(catalog.get("models"), list):
+            _set_catalog(catalog)
+    except (OSError, ValueError, AttributeError):
+        pass
+
+
+def _run_refresh(done):
+    global _refreshing, _last_error
+    try:
+        catalog = {"fetched_at": time.time(), "models": fetch_models()}
+        with _lock:
+            _set_catalog(catalog)
+            _last_error = None
+            _stats["refreshes"] += 1
+        print(f"Model catalog refreshed: {len(catalog['models'])} models")
+        try:
+            write_json_atomic(Config.MODEL_CATALOG_PATH, catalog)
+        except OSError as e:
+            print(f"Error saving model catalog: {str(e)}")
+    except Exception as e:
+        print(f"Error fetching models: {str(e)}")
+        with _lock:
+            _last_error = str(e)
+            _stats["refresh_errors"] += 1
+    finally:
+        with _lock:
+            _refreshing = None
+        done.set()
+
+
+def refresh_catalog(wait=True):
+    """
+    Fetch a new copy of the catalog, unless a refresh is already running.
+
+    Args:
+        wait (bool): Block until the (new or running) refresh has finished
+    """
+    global _refreshing
+    with _lock:
+        done = _refreshing
+        start = done is None
+        if start:
+            done = _refreshing = threading.Event()
+        else:
+            _stats["coalesced"] += 1
+
+    if start and wait:
+        _run_refresh(done)
+    elif start:
+        threading.Thread(target=_run_refresh, args=(done,), daemon=True, name="model-catalog").start()
+    elif wait:
+        done.wait(Config.HTTP_CONNECT_TIMEOUT + Config.HTTP_READ_TIMEOUT)
+
+
+def _current_catalog():
+    """Get the catalog, starting a background refresh if it is stale (None if there is none)"""
+    with _lock:
+        _ensure_loaded()
+        catalog = _catalog
+        if catalog is None:
+            return None
+        stale = time.time() - catalog["fetched_at"] > Config.MODEL_CATALOG_TTL
+        _stats["stale_hits" if stale else "fresh_hits"] += 1
+    if stale:
+        refresh_catalog(wait=False)
+    return catalog
+
+
+def get_model_catalog():
+    """
+    Get the list of selectable models, as returned by /api/models.
+
+    Returns:
+        dict: "success", "models" (always ending with the local model) and,
+        on failure, "message"
+    """
+    if not Config.OPENROUTER_API_KEY:
+        return {"success": True, "models": DEFAULT_MODELS + [LOCAL_MODEL]}
+
+    catalog = _current_catalog()
+    if catalog is None:
+        # Nothing cached yet: this caller has to wait for the first fetch
+        refresh_catalog(wait=True)
+        with _lock:
+            catalog = _catalog
+            error = _last_error
+        if catalog is None:
+            return {
+                "success": False,
+                "message": f"Error fetching models: {error}",
+                "models": DEFAULT_MODELS + [LOCAL_MODEL]
+            }
+
+    return {"success": True, "models": catalog["models"] + [LOCAL_MODEL]}
+
+
+def get_model_info(model_id):
+    """
+    Get the cached metadata (name, context_length, pricing) of a model.
+    Never waits for a fetch; returns None if the model is not in the catalog.
+    """
+    if model_id == LOCAL_MODEL["id"]:
+        return dict(LOCAL_MODEL)
+    if Config.OPENROUTER_API_KEY:
+        catalog = _current_catalog()
+        if catalog is None:
+            refresh_catalog(wait=False)
+    with _lock:
+        model = _by_id.get(model_id)
+    return dict(model) if model is not None else None
+
+
+def get_model_catalog_stats():
+    """Get hit/refresh counters and the age of the cached catalog"""
+    with _lock:
+        catalog = _catalog
+        return {
+            **_stats,
+            "models": len(catalog["models"]) if catalog else 0,
+            "age_seconds": round(time.time() - catalog["fetched_at"], 1) if catalog else None,
+            "ttl_seconds": Config.MODEL_CATALOG_TTL,
+            "refreshing": _refreshing is not None,
+            "last_error": _last_error
+        }
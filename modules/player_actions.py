@@ -1,30 +1,13 @@
 import json
+from .prompt_templates import compile_template
 
-def handle_player_action_prompt(system_prompt, message, action_success):
-    """Modify the system prompt to handle player actions"""
-    try:
-        # Parse the action data from message
-        action_data = json.loads(message)
-        action_text = action_data["action"]
-        relevant_stat = action_data.get("relevantStat", "strength")
-        roll_value = action_data.get("rollValue", 0)
-        difficulty_class = action_data.get("difficultyClass", 10)
-        details = action_data.get("details", "")
-    except:
-        # If parsing fails, use defaults
-        action_text = message
-        relevant_stat = "strength"
-        roll_value = 0
-        difficulty_class = 10
-        details = ""
-    
-    # Build player action context
-    player_action_context = f"""
+# Instructions for a player action turn, compiled once
+PLAYER_ACTION_TEMPLATE = compile_template("""
     The user is attempting to perform an action rather than speaking. Respond accordingly.
     
-    Player Action: {action_text}
-    Action Outcome: {"Success" if action_success else "Failure"}
-    Relevant Ability: {relevant_stat.capitalize()}
+    Player Action: {action}
+    Action Outcome: {outcome}
+    Relevant Ability: {stat}
     Action Difficulty (DC): {difficulty_class}
     Roll Result: {roll_value}
     Details: {details}
@@ -63,9 +46,45 @@ def handle_player_action_prompt(system_prompt, message, action_success):
     
     Important: For "text", include ONLY what you want to say to the user, not any descriptions or metadata.
     DO NOT include JSON syntax in the "text" field itself. The "text" field should contain only your natural dialogue.
-    """
+    """, ("action", "outcome", "stat", "difficulty_class", "roll_value", "details"))
+
+def parse_player_action(message):
+    """Parse a player action message (JSON sent by the client); None if it isn't one"""
+    try:
+        action_data = json.loads(message)
+        action_data["action"]
+        return action_data
+    except:
+        return None
+
+def handle_player_action_prompt(system_prompt, message, action_success, action_data=None):
+    """Modify the system prompt to handle player actions (action_data: the already parsed message)"""
+    if action_data is None:
+        action_data = parse_player_action(message)
+    if action_data is not None:
+        action_text = action_data["action"]
+        relevant_stat = action_data.get("relevantStat", "strength")
+        roll_value = action_data.get("rollValue", 0)
+        difficulty_class = action_data.get("difficultyClass", 10)
+        details = action_data.get("details", "")
+    else:
+        # If parsing fails, use defaults
+        action_text = message
+        relevant_stat = "strength"
+        roll_value = 0
+        difficulty_class = 10
+        details = ""
     
-    # Append to the existing system prompt
-    enhanced_prompt = system_prompt + "\n\n" + player_action_context
+    # Build player action context
+    parts = PLAYER_ACTION_TEMPLATE.pieces({
+        "action": action_text,
+        "outcome": "Success" if action_success else "Failure",
+        "stat": relevant_stat.capitalize(),
+        "difficulty_class": difficulty_class,
+        "roll_value": roll_value,
+        "details": details
+    })
     
-    return enhanced_prompt
\ No newline at end of file
+    # Append to the existing system prompt
+    parts[0] = system_prompt + "\n\n" + parts[0]
+    return "".join(parts)
\ No newline at end of file
@@ -1,7 +1,8 @@
 from flask import jsonify, request
-import json
-import os
 from config import Config
+from .storage import get_storage
+from .prompt_prefix import refresh_prompt_prefixes
+from .prompt_templates import TemplateError, compile_templates, set_templates
 
 def register_prompt_routes(app):
     """Register prompt template management routes with the Flask app"""
@@ -9,20 +10,8 @@ def register_prompt_routes(app):
     @app.route('/api/prompts', methods=['GET'])
     def get_prompts():
         """Get all prompt templates"""
-        # Ensure templates directory exists
-        os.makedirs(Config.TEMPLATES_FOLDER, exist_ok=True)
-        
-        # Get templates file path
-        templates_path = os.path.join(Config.TEMPLATES_FOLDER, "prompt_templates.json")
-        
-        # If templates file doesn't exist, create it with defaults
-        if not os.path.exists(templates_path):
-            with open(templates_path, 'w') as f:
-                json.dump(Config.DEFAULT_TEMPLATES, f, indent=2)
-        
-        # Read templates from file
-        with open(templates_path, 'r') as f:
-            templates = json.load(f)
+        # Read templates from storage (defaults if none were saved)
+        templates = get_storage().get_templates()
         
         return jsonify(templates)
 
@@ -36,29 +25,25 @@ def register_prompt_routes(app):
         """Update prompt templates"""
         data = request.json
         
-        # Ensure templates directory exists
-        os.makedirs(Config.TEMPLATES_FOLDER, exist_ok=True)
+        # Compile first, so broken templates are rejected instead of failing every chat turn
+        try:
+            compiled = compile_templates(data)
+        except TemplateError as e:
+            return jsonify({"error": str(e)}), 400
         
-        # Get templates file path
-        templates_path = os.path.join(Config.TEMPLATES_FOLDER, "prompt_templates.json")
-        
-        # Save updated templates
-        with open(templates_path, 'w') as f:
-            json.dump(data, f, indent=2)
+        # Save updated templates and start using them
+        get_storage().save_templates(data)
+        set_templates(compiled)
+        refresh_prompt_prefixes()
         
         return jsonify({"success": True, "message": "Prompt templates updated successfully"})
 
     @app.route('/api/prompts/reset', methods=['POST'])
     def reset_prompts():
         """Reset prompt templates to default"""
-        # Ensure templates directory exists
-        os.makedirs(Config.TEMPLATES_FOLDER, exist_ok=True)
-        
-        # Get templates file path
-        templates_path = os.path.join(Config.TEMPLATES_FOLDER, "prompt_templates.json")
-        
         # Save default templates
-        with open(templates_path, 'w') as f:
-            json.dump(Config.DEFAULT_TEMPLATES, f, indent=2)
+        get_storage().save_templates(Config.DEFAULT_TEMPLATES)
+        set_templates(compile_templates(Config.DEFAULT_TEMPLATES))
+        refresh_prompt_prefixes()
         
-        return jsonify({"success": True, "message": "Prompt templates reset to default"})
\ No newline at end of file
+        return jsonify({"success": True, "message": "Prompt templates reset to default"})
@@ -0,0 +1,193 @@
+"""
+Byte-stable static prefix of the chat system prompt.
+
+Everything in the system prompt that depends only on the character and the
+prompt templates (description, personality, speaking style, appearance,
+roleplaying, response format and reply instructions) comes first, always
+in the same order and with the same bytes. The per-turn state (scenario,
+mood, location, memories, recent conversations) follows it. Providers
+that cache prompt prefixes, and local models' KV caches, can then reuse
+the work done for the prefix on every turn.
+
+Prefixes are built when a character or the templates are saved and kept in
+memory, keyed by the character's and the templates' versions (hashes of
+their content), so every worker process produces the same prefix for the
+same inputs. Each turn records the hash of its prefix as "prompt_prefix";
+get_prompt_prefix_stats() reports how often a chat's prefix stayed the same
+from one turn to the next.
+"""
+
+import hashlib
+import json
+import threading
+from collections import OrderedDict, namedtuple
+from .scene_generation import get_combined_scene_instructions
+from .storage import get_storage
+from .prompt_templates import get_templates
+
+# Character fields that go into the prefix
+PREFIX_FIELDS = ("name", "description", "personality", "speaking_style", "appearance")
+
+# Prefixes kept in memory
+MAX_PREFIXES = 512
+
+# (is_player_action, combined scene mode) of the prefixes built ahead of time
+VARIANTS = ((False, False), (False, True), (True, False), (True, True))
+
+# Reply instructions for regular messages
+MESSAGE_INSTRUCTIONS = """\n\nIn addition to your regular response, please include:
+        - 'action': A brief description of what you're physically doing as you speak (e.g., "sipping coffee", "pacing nervously")
+        - 'location': Where you currently are (be specific, and maintain consistency with previous locations unless you're explicitly moving)
+
+        Your action should reflect your personality and current emotional state.
+
+        Format your response as a JSON object as follows:
+        {
+        "text": "Your actual response to the user - this should be what you want to say directly",
+        "mood": "your current mood (happy, sad, angry, confused, etc.)",
+        "emotions": {"joy": 0.8, "curiosity": 0.6},
+        "opinion_of_user": "your opinion of the user (positive, negative, neutral, etc.)",
+        "action": "what you're physically doing as you speak",
+        "location": "where you currently are"
+        }
+
+        Important: For "text", include ONLY what you want to say to the user, not any descriptions or metadata.
+        DO NOT include JSON syntax in the "text" field itself. The "text" field should contain only your natural dialogue.
+        """
+
+PromptPrefix = namedtuple("PromptPrefix", ["text", "hash"])
+
+# (character version, template version, is_player_action, combined) -> PromptPrefix
+_prefixes = OrderedDict()
+_lock = threading.Lock()
+_stats = {
+    "hits": 0,
+    "misses": 0,
+    "precomputed": 0,
+    # Chat turns, and those whose prefix was the same as the chat's previous turn
+    "turns": 0,
+    "same_as_previous": 0
+}
+
+
+def character_version(character):
+    """Hash of the character fields used by the prefix"""
+    data = {field: character.get(field) or "" for field in PREFIX_FIELDS}
+    return hashlib.sha256(json.dumps(data, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+
+
+def build_prompt_prefix(character, templates, is_player_action=False, combined=False):
+    """Build the static prefix text from compiled templates (see get_prompt_prefix for the cached version)"""
+    # Base prompt
+    parts = templates.pieces(
+        "base_prompt",
+        name=character['name'],
+        description=character.get('description', ''),
+        personality=character.get('personality', '')
+    )
+    parts.append("\n\n")
+
+    # Add speaking style if available
+    if character.get('speaking_style') and "speaking_style" in templates:
+        parts += templates.pieces("speaking_style", speaking_style=character['speaking_style'])
+        parts.append("\n\n")
+
+    # Add appearance if available
+    if character.get('appearance') and "appearance" in templates:
+        parts += templates.pieces("appearance", appearance=character['appearance'])
+        parts.append("\n\n")
+
+    # Add roleplaying instructions and response format instructions
+    parts.append(templates.get("roleplaying_instructions"))
+    parts.append(templates.get("response_format"))
+
+    # Player actions get their instructions with the action itself, after the per-turn state
+    if not is_player_action:
+        parts.append(MESSAGE_INSTRUCTIONS)
+    if combined:
+        parts.append("\n")
+        parts.append(get_combined_scene_instructions(is_player_action))
+    return "".join(parts)
+
+
+def _store(key, text):
+    """Remember a prefix (caller holds _lock)"""
+    prefix = PromptPrefix(text, hashlib.sha256(text.encode("utf-8")).hexdigest()[:16])
+    _prefixes[key] = prefix
+    _prefixes.move_to_end(key)
+    while len(_prefixes) > MAX_PREFIXES:
+        _prefixes.popitem(last=False)
+    return prefix
+
+
+def get_prompt_prefix(character, is_player_action=False, combined=False, templates=None):
+    """
+    Get the static prefix of a character's system prompt.
+
+    Args:
+        character (dict): The character
+        is_player_action (bool): The turn is a player action
+        combined (bool): The chat uses the "combined" scene mode
+        templates (CompiledTemplates): Prompt templates (default: the ones in use)
+
+    Returns:
+        PromptPrefix: (text, hash)
+    """
+    if templates is None:
+        templates = get_templates()
+    key = (character_version(character), templates.version, is_player_action, combined)
+    with _lock:
+        prefix = _prefixes.get(key)
+        if prefix is not None:
+            _prefixes.move_to_end(key)
+            _stats["hits"] += 1
+            return prefix
+        _stats["misses"] += 1
+
+    text = build_prompt_prefix(character, templates, is_player_action, combined)
+    with _lock:
+        return _store(key, text)
+
+
+def precompute_prompt_prefixes(character, templates=None):
+    """Build every variant of a character's prefix (when the character is saved)"""
+    try:
+        if templates is None:
+            templates = get_templates()
+        versions = (character_version(character), templates.version)
+        built = [(versions + variant, build_prompt_prefix(character, templates, *variant)) for variant in VARIANTS]
+    except (KeyError, ValueError) as e:
+        # Broken saved templates fail the chat turn later, with the same error
+        print(f"Error building prompt prefix for {character.get('id')}: {str(e)}")
+        return
+    with _lock:
+        for key, text in built:
+            _store(key, text)
+        _stats["precomputed"] += len(built)
+
+
+def refresh_prompt_prefixes():
+    """Rebuild the prefixes of every character (when the templates are saved)"""
+    templates = get_templates()
+    with _lock:
+        _prefixes.clear()
+    for character in get_storage().list_characters():
+        precompute_prompt_prefixes(character, templates)
+
+
+def record_turn_prefix(prefix_hash, previous_hash):
+    """Count a chat turn and whether its prefix matched the chat's previous turn"""
+    with _lock:
+        _stats["turns"] += 1
+        if prefix_hash == previous_hash:
+            _stats["same_as_previous"] += 1
+
+
+def get_prompt_prefix_stats():
+    """Get prefix cache counters and how often turns reused the previous turn's prefix"""
+    with _lock:
+        return {
+            **_stats,
+            "cached": len(_prefixes),
+            "reuse_ratio": round(_stats["same_as_previous"] / _stats["turns"], 4) if _stats["turns"] else 0.0
+        }
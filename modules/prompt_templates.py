@@ -0,0 +1,233 @@
+"""
+Compiled, versioned prompt templates.
+
+The templates are parsed once into lists of literal text and placeholders,
+and rendered with a single join instead of a str.format call per template
+and a chain of concatenations per prompt. Templates are checked when they
+are compiled: a template may only use the placeholders the code fills in
+for it (TEMPLATE_FIELDS), so PUT /api/prompts rejects a broken template
+instead of every chat turn failing later.
+
+The compiled set is swapped atomically when the templates are updated or
+reset. Its version is a hash of the templates, so it identifies the same
+templates in every process; other processes (and edits made outside the
+app) are picked up by re-reading the saved templates every
+Config.TEMPLATE_RELOAD_INTERVAL seconds and recompiling only if their
+version changed.
+"""
+
+import hashlib
+import json
+import operator
+import string
+import threading
+import time
+from config import Config
+from .storage import get_storage
+
+# Placeholders each template is rendered with. Templates not listed here
+# are used as plain text (braces and all).
+TEMPLATE_FIELDS = {
+    "base_prompt": ("name", "description", "personality"),
+    "introduction": ("greeting",),
+    "speaking_style": ("speaking_style",),
+    "appearance": ("appearance",),
+    "personality": ("personality",),
+    "mood_emotions": ("mood", "emotions_str"),
+    "opinion": ("opinion_of_user",),
+    "location": ("location",),
+    "action": ("action",),
+    "player_action_success": ("action", "stat", "roll_value"),
+    "player_action_failure": ("action", "stat", "roll_value"),
+    "location_description": ("location",)
+}
+
+# Templates every chat turn needs
+REQUIRED_TEMPLATES = ("base_prompt",)
+
+_formatter = string.Formatter()
+
+
+class TemplateError(ValueError):
+    """A template that cannot be compiled"""
+
+
+class CompiledTemplate:
+    """A template parsed into literal text and placeholders"""
+
+    def __init__(self, text, fields=()):
+        self.text = text
+        # Literal text alternating with an empty slot for each placeholder:
+        # [text, slot, text, slot, ..., text]
+        self.parts = [text]
+        # (field, conversion, format_spec) for each slot
+        self.slots = []
+        self.fields = set()
+        if fields is None:
+            return
+        self.parts = []
+        literals = []
+        for literal, field, format_spec, conversion in _formatter.parse(text):
+            # Escaped braces split the literal text; keep it in one part
+            literals.append(literal)
+            if field is None:
+                continue
+            if field not in fields:
+                raise TemplateError(f"unknown placeholder {{{field}}} (allowed: {', '.join(fields) or 'none'})")
+            if format_spec and "{" in format_spec:
+                raise TemplateError(f"nested placeholder in {{{field}:{format_spec}}}")
+            self.fields.add(field)
+            self.slots.append((field, conversion, format_spec))
+            self.parts += ["".join(literals), ""]
+            literals = []
+        self.parts.append("".join(literals))
+        # Plain placeholders (no conversion or format spec) are filled in one step
+        self._plain = all(not conversion and not format_spec for _, conversion, format_spec in self.slots)
+        names = [field for field, _, _ in self.slots]
+        self._values = operator.itemgetter(*names) if len(names) > 1 else lambda values: (values[names[0]],)
+
+    def pieces(self, values):
+        """The rendered parts of the template, for joining into a larger text"""
+        out = self.parts[:]
+        if not self.slots:
+            return out
+        if self._plain:
+            out[1::2] = map(str, self._values(values))
+            return out
+        for index, (field, conversion, format_spec) in enumerate(self.slots):
+            value = values[field]
+            if conversion:
+                value = _formatter.convert_field(value, conversion)
+            out[2 * index + 1] = format(value, format_spec) if format_spec else str(value)
+        return out
+
+    def render(self, **values):
+        return "".join(self.pieces(values))
+
+
+def compile_template(text, fields=()):
+    """Compile one template; fields are the allowed placeholders (None: plain text)"""
+    try:
+        return CompiledTemplate(text, fields)
+    except ValueError as e:
+        # str.format syntax errors (unmatched braces) are ValueErrors too
+        raise TemplateError(str(e))
+
+
+def template_version(templates):
+    """Hash of the prompt templates"""
+    return hashlib.sha256(json.dumps(templates, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+
+
+class CompiledTemplates:
+    """Every prompt template, compiled, with the version of the set"""
+
+    def __init__(self, templates):
+        if not isinstance(templates, dict):
+            raise TemplateError("templates must be an object of name: text")
+        errors = []
+        for name in REQUIRED_TEMPLATES:
+            if not templates.get(name):
+                errors.append(f"{name}: missing")
+        compiled = {}
+        for name, text in templates.items():
+            if not isinstance(text, str):
+                errors.append(f"{name}: must be a string")
+                continue
+            try:
+                compiled[name] = compile_template(text, TEMPLATE_FIELDS.get(name))
+            except TemplateError as e:
+                errors.append(f"{name}: {str(e)}")
+        if errors:
+            raise TemplateError("Invalid prompt templates: " + "; ".join(errors))
+        self.source = templates
+        self.version = template_version(templates)
+        self._compiled = compiled
+
+    def __contains__(self, name):
+        return name in self._compiled
+
+    def get(self, name, default=""):
+        """The text of a template, as is"""
+        template = self._compiled.get(name)
+        return default if template is None else template.text
+
+    def pieces(self, template_name, /, **values):
+        """The rendered parts of a template (none if it doesn't exist)"""
+        template = self._compiled.get(template_name)
+        return [] if template is None else template.pieces(values)
+
+    def render(self, template_name, /, **values):
+        return "".join(self.pieces(template_name, **values))
+
+
+def compile_templates(templates):
+    """Validate and compile a set of templates, raising TemplateError if any is invalid"""
+    return CompiledTemplates(templates)
+
+
+# The compiled templates in use, and when they were last checked against storage
+_current = None
+_checked_at = 0.0
+_lock = threading.Lock()
+_stats = {
+    "compiles": 0,
+    "swaps": 0,
+    "reload_checks": 0,
+    "compile_errors": 0
+}
+
+
+def set_templates(compiled):
+    """Start using a compiled set of templates (after it was saved)"""
+    global _current, _checked_at
+    with _lock:
+        _current = compiled
+        _checked_at = time.time()
+        _stats["swaps"] += 1
+
+
+def _load():
+    """Compile the saved templates unless they are the version in use"""
+    global _checked_at
+    templates = get_storage().get_templates()
+    current = _current
+    if current is not None and template_version(templates) == current.version:
+        with _lock:
+            _checked_at = time.time()
+        return current
+    try:
+        compiled = compile_templates(templates)
+    except TemplateError as e:
+        # Saved before validation existed, or edited by hand: fail the turn, as before
+        with _lock:
+            _stats["compile_errors"] += 1
+        print(f"Error compiling prompt templates: {str(e)}")
+        raise
+    with _lock:
+        _stats["compiles"] += 1
+    set_templates(compiled)
+    return compiled
+
+
+def get_templates():
+    """
+    Get the compiled prompt templates.
+
+    Returns:
+        CompiledTemplates: The templates in use (compiled from storage when
+        first needed, and re-checked every Config.TEMPLATE_RELOAD_INTERVAL seconds)
+    """
+    current = _current
+    if current is not None and time.time() - _checked_at < Config.TEMPLATE_RELOAD_INTERVAL:
+        return current
+    with _lock:
+        _stats["reload_checks"] += 1
+    return _load()
+
+
+def get_template_stats():
+    """Get compile/swap counters and the version in use"""
+    current = _current
+    with _lock:
+        return {**_stats, "version": current.version if current is not None else None}
@@ -0,0 +1,316 @@
+"""
+Content-addressed cache for one-shot generation responses.
+
+The generate endpoints (text, json, field, character, location) are often
+called again with exactly the same prompt, e.g. when a user clicks
+"regenerate" in the character editor. A response is stored under a hash of
+everything that determines it: the model, system prompt, user prompt,
+temperature and max_tokens.
+
+There are two tiers: a bounded in-memory LRU and an on-disk tier in
+Config.RESPONSE_CACHE_FOLDER that survives restarts and is shared by
+worker processes. Both are bounded in bytes, and entries expire after
+Config.RESPONSE_CACHE_TTL seconds.
+
+Caching is opt-in per request: "cache": true in the request body, or on by
+default when the temperature is 0 (where the response is deterministic
+anyway); "cache": false turns it off. An "X-Cache-Bypass: 1" header skips
+the lookup and replaces the cached response with a fresh one.
+
+Whatever the cache mode, identical requests that arrive while the model
+call is still running share that call (see single_flight).
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from flask import request
+from config import Config
+from .chat_storage import write_json_atomic
+from . import single_flight
+
+# Values of the X-Response-Cache header
+CACHE_OFF = "off"
+CACHE_HIT = "hit"
+CACHE_MISS = "miss"
+CACHE_BYPASS = "bypass"
+
+BYPASS_HEADER = "X-Cache-Bypass"
+
+# key -> (created, text); ordered from least to most recently used
+_memory = OrderedDict()
+_memory_bytes = 0
+# key -> size of its file; ordered from oldest to newest, built on first use
+_disk = None
+_disk_bytes = 0
+_lock = threading.Lock()
+_stats = {
+    "memory_hits": 0,
+    "disk_hits": 0,
+    "misses": 0,
+    "bypasses": 0,
+    "stores": 0,
+    "expirations": 0,
+    "memory_evictions": 0,
+    "disk_evictions": 0
+}
+
+
+def cache_key(model, system_prompt, user_prompt, temperature, max_tokens=None):
+    """Hash of everything that determines a generation response"""
+    material = json.dumps(
+        [model, system_prompt, user_prompt, float(temperature), max_tokens],
+        ensure_ascii=False
+    )
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+
+def model_id(use_local_model=False):
+    """Name of the model a generate call goes to, as used in cache keys"""
+    if use_local_model:
+        return f"local:{Config.LOCAL_MODEL_ENDPOINT}/{Config.LOCAL_MODEL_NAME}"
+    return Config.DEFAULT_MODEL or "openai/gpt-3.5-turbo"
+
+
+def get_cache_mode(data, temperature, headers=None):
+    """
+    Decide how a generate request uses the cache.
+
+    Args:
+        data (dict): The request body; its optional "cache" flag wins
+        temperature (float): Temperature of the generation
+        headers: Request headers (default: those of the current Flask request)
+
+    Returns:
+        str: CACHE_OFF, CACHE_BYPASS (regenerate and store), or CACHE_MISS (look up first)
+    """
+    if not Config.RESPONSE_CACHE_ENABLED:
+        return CACHE_OFF
+    requested = data.get("cache")
+    if requested is None:
+        requested = float(temperature) == 0
+    if not requested:
+        return CACHE_OFF
+    if headers is None:
+        headers = request.headers
+    if headers.get(BYPASS_HEADER, "").lower() in ("1", "true", "yes"):
+        return CACHE_BYPASS
+    return CACHE_MISS
+
+
+def cached_generate(mode, generate, model, system_prompt, user_prompt, temperature,
+                    max_tokens=None, validate=None):
+    """
+    Return a cached response, or call generate() and cache its result.
+
+    Args:
+        mode (str): From get_cache_mode()
+        generate (callable): Makes the model call and returns the response text
+        model, system_prompt, user_prompt, temperature, max_tokens: The cache key
+        validate (callable): Optional check; responses it rejects are not stored
+
+    Returns:
+        tuple: (response text, cache status for the X-Response-Cache header)
+    """
+    key = cache_key(model, system_prompt, user_prompt, temperature, max_tokens)
+    if mode == CACHE_OFF:
+        return single_flight.do("generate", key, generate), CACHE_OFF
+
+    if mode == CACHE_BYPASS:
+        with _lock:
+            _stats["bypasses"] += 1
+    else:
+        text = get_cached(key)
+        if text is not None:
+            return text, CACHE_HIT
+
+    text = single_flight.do("generate", key, generate)
+    if validate is None or validate(text):
+        store(key, text)
+    return text, mode
+
+
+async def cached_generate_async(mode, generate, model, system_prompt, user_prompt, temperature,
+                                max_tokens=None, validate=None):
+    """asyncio version of cached_generate; generate() returns an awaitable"""
+    key = cache_key(model, system_prompt, user_prompt, temperature, max_tokens)
+    if mode == CACHE_OFF:
+        return await single_flight.do_async("generate", key, generate), CACHE_OFF
+
+    if mode == CACHE_BYPASS:
+        with _lock:
+            _stats["bypasses"] += 1
+    else:
+        text = await asyncio.to_thread(get_cached, key)
+        if text is not None:
+            return text, CACHE_HIT
+
+    text = await single_flight.do_async("generate", key, generate)
+    if validate is None or validate(text):
+        await asyncio.to_thread(store, key, text)
+    return text, mode
+
+
+def with_cache_status(response, status):
+    """Tag a Flask response with how the cache was used"""
+    response.headers["X-Response-Cache"] = status
+    return response
+
+
+def _entry_path(key):
+    return os.path.join(Config.RESPONSE_CACHE_FOLDER, key[:2], f"{key}.json")
+
+
+def _is_expired(created):
+    return time.time() - created > Config.RESPONSE_CACHE_TTL
+
+
+def _forget_memory(key):
+    """Drop an entry from the memory tier (caller holds _lock)"""
+    global _memory_bytes
+    previous = _memory.pop(key, None)
+    if previous is not None:
+        _memory_bytes -= len(previous[1].encode("utf-8"))
+
+
+def _remember(key, created, text):
+    """Put an entry in the memory tier (caller holds _lock)"""
+    global _memory_bytes
+    _forget_memory(key)
+    size = len(text.encode("utf-8"))
+    if size > Config.RESPONSE_CACHE_MEMORY_BYTES:
+        return
+    _memory[key] = (created, text)
+    _memory_bytes += size
+    while _memory_bytes > Config.RESPONSE_CACHE_MEMORY_BYTES:
+        _, (_, evicted) = _memory.popitem(last=False)
+        _memory_bytes -= len(evicted.encode("utf-8"))
+        _stats["memory_evictions"] += 1
+
+
+def _load_disk_index():
+    """Scan the disk tier once so it can be kept within its byte bound (caller holds _lock)"""
+    global _disk, _disk_bytes
+    entries = []
+    folder = Config.RESPONSE_CACHE_FOLDER
+    if os.path.isdir(folder):
+        for root, _, files in os.walk(folder):
+            for name in files:
+                if not name.endswith(".json"):
+                    continue
+                try:
+                    stat = os.stat(os.path.join(root, name))
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, name[:-5], stat.st_size))
+    entries.sort()
+    _disk = OrderedDict((key, size) for _, key, size in entries)
+    _disk_bytes = sum(_disk.values())
+
+
+def _forget_file(key):
+    """Delete an entry from the disk tier (caller holds _lock)"""
+    global _disk_bytes
+    if _disk is not None and key in _disk:
+        _disk_bytes -= _disk.pop(key)
+    try:
+        os.remove(_entry_path(key))
+    except OSError:
+        pass
+
+
+def get_cached(key):
+    """Get a cached response by key, or None on a miss"""
+    with _lock:
+        entry = _memory.get(key)
+        if entry is not None:
+            if not _is_expired(entry[0]):
+                _memory.move_to_end(key)
+                _stats["memory_hits"] += 1
+                return entry[1]
+            # The disk copy has the same age and is dropped (and counted) below
+            _forget_memory(key)
+
+    try:
+        with open(_entry_path(key), "r", encoding="utf-8") as f:
+            stored = json.load(f)
+    except (OSError, ValueError):
+        stored = None
+
+    with _lock:
+        if stored is None:
+            _stats["misses"] += 1
+            return None
+        if _is_expired(stored.get("created", 0)):
+            _forget_file(key)
+            _stats["expirations"] += 1
+            _stats["misses"] += 1
+            return None
+        _remember(key, stored["created"], stored["text"])
+        _stats["disk_hits"] += 1
+        return stored["text"]
+
+
+def store(key, text):
+    """Store a response in both tiers"""
+    global _disk_bytes
+    created = time.time()
+    entry = {"created": created, "text": text}
+    path = _entry_path(key)
+
+    with _lock:
+        _remember(key, created, text)
+        _stats["stores"] += 1
+        if _disk is None:
+            _load_disk_index()
+
+    try:
+        write_json_atomic(path, entry)
+        size = os.path.getsize(path)
+    except OSError as e:
+        print(f"Error writing response cache entry: {str(e)}")
+        return
+
+    with _lock:
+        if key in _disk:
+            _disk_bytes -= _disk.pop(key)
+        _disk[key] = size
+        _disk_bytes += size
+        while _disk_bytes > Config.RESPONSE_CACHE_DISK_BYTES and _disk:
+            oldest = next(iter(_disk))
+            _forget_file(oldest)
+            _stats["disk_evictions"] += 1
+
+
+def clear():
+    """Drop every cached response from both tiers"""
+    global _memory_bytes
+    with _lock:
+        _memory.clear()
+        _memory_bytes = 0
+        if _disk is None:
+            _load_disk_index()
+        for key in list(_disk):
+            _forget_file(key)
+
+
+def get_response_cache_stats():
+    """Get hit/miss counters and the size of both tiers"""
+    with _lock:
+        hits = _stats["memory_hits"] + _stats["disk_hits"]
+        lookups = hits + _stats["misses"]
+        return {
+            **_stats,
+            "hit_ratio": round(hits / lookups, 4) if lookups else 0.0,
+            "memory_entries": len(_memory),
+            "memory_bytes": _memory_bytes,
+            "max_memory_bytes": Config.RESPONSE_CACHE_MEMORY_BYTES,
+            "disk_entries": len(_disk) if _disk is not None else None,
+            "disk_bytes": _disk_bytes if _disk is not None else None,
+            "max_disk_bytes": Config.RESPONSE_CACHE_DISK_BYTES,
+            "ttl_seconds": Config.RESPONSE_CACHE_TTL
+        }
@@ -0,0 +1,382 @@
+"""
+Single-pass, incremental parser for the character's JSON response.
+
+The model is asked to answer with an object like
+{"text": ..., "mood": ..., "emotions": {...}, "opinion_of_user": ...,
+"action": ..., "location": ...}, but real outputs come wrapped in code
+fences, preceded or followed by prose, with raw newlines inside strings,
+trailing commas, or cut off part-way. ResponseParser reads the output one
+character at a time (as it streams in, or all at once), emits the "text"
+field progressively, and recovers the fields that were complete when the
+output ends (and the text, even if it was cut off).
+"""
+
+import json
+import re
+
+# Fields of the expected response object and their defaults
+DEFAULT_RESPONSE = {
+    "text": "",
+    "mood": "neutral",
+    "emotions": {},
+    "opinion_of_user": "neutral",
+    "action": "standing still",
+    "location": "current location",
+    "scene_description": ""
+}
+
+# Fields whose cut-off value is still kept when the output is truncated (besides
+# the text field); a cut-off mood or location would be stored as real state
+PARTIAL_FIELDS = ("scene_description",)
+
+_ESCAPES = {'"': '"', '\\': '\\', '/': '/', 'b': '\b', 'f': '\f', 'n': '\n', 'r': '\r', 't': '\t'}
+_TRAILING_COMMA = re.compile(r',\s*([}\]])')
+# Runs of characters inside a string that need no special handling
+_STRING_RUN = re.compile(r'[^"\\]+')
+# Runs of prose before a JSON object
+_PROSE_RUN = re.compile(r'[^{]+')
+
+
+class ResponseParser:
+    """
+    Parse a (possibly streamed) model response.
+
+    Call feed() with each chunk as it arrives; it returns the newly
+    available part of the "text" field. Call close() once the response has
+    ended to get the parsed fields, in the shape of DEFAULT_RESPONSE.
+    Responses that do not start with a JSON object (or a code fence around
+    one) are treated as plain prose and passed through by feed().
+    """
+
+    def __init__(self, text_field="text"):
+        self.text_field = text_field
+        self.fields = {}
+        self._chunks = []
+        self._mode = "start"        # start, fence, prose, seek, object, done
+        self._depth = 0
+        self._in_string = False
+        self._escape = None         # None, "" right after a backslash, or "u" + hex digits
+        self._expect_key = False
+        self._key_chars = None      # decoded characters of the key being read
+        self._key = None            # key whose value is being read at depth 1
+        self._value = None          # characters of the current depth-1 value
+        self._value_is_string = False
+        self._emitting = False
+        self._text_done = False
+
+    @property
+    def raw(self):
+        """Everything received so far"""
+        return "".join(self._chunks)
+
+    def feed(self, chunk):
+        """Consume a chunk of the response and return any new text of the text field"""
+        self._chunks.append(chunk)
+        out = []
+        step = self._step
+        i = 0
+        length = len(chunk)
+        while i < length:
+            # Copy plain runs in one go instead of character by character
+            run = None
+            if self._mode == "object" and self._in_string and self._escape is None:
+                run = _STRING_RUN.match(chunk, i)
+            elif self._mode == "prose":
+                run = _PROSE_RUN.match(chunk, i)
+            if run:
+                self._take_run(run.group(), out)
+                i = run.end()
+                continue
+            step(chunk[i], out)
+            i += 1
+        return "".join(out)
+
+    def _take_run(self, text, out):
+        if self._mode == "prose":
+            out.append(text)
+        elif self._key_chars is not None:
+            self._key_chars.append(text)
+        elif self._value is not None:
+            self._value.append(text)
+            if self._emitting:
+                out.append(text)
+
+    def close(self):
+        """Finish parsing and return the response fields"""
+        if self._mode == "object" and (self._key == self.text_field or self._key in PARTIAL_FIELDS):
+            # Truncated output: keep the text that was being written; other
+            # cut-off values are dropped so their defaults are used
+            self._commit_value(partial=True)
+
+        text = self.fields.get(self.text_field)
+        if not isinstance(text, str):
+            return heuristic_response(self.raw)
+
+        result = dict(DEFAULT_RESPONSE)
+        for name in DEFAULT_RESPONSE:
+            value = self.fields.get(name)
+            if value is not None:
+                result[name] = value
+        result["text"] = _unwrap_text(text)
+        if not isinstance(result["emotions"], dict):
+            result["emotions"] = {}
+        return result
+
+    def _start_object(self):
+        self._mode = "object"
+        self._depth = 1
+        self._expect_key = True
+        self._key = None
+        self._value = None
+
+    def _commit_value(self, partial=False):
+        """Store the depth-1 value that has just ended"""
+        if self._value is not None and self._key is not None:
+            if self._value_is_string:
+                self.fields[self._key] = "".join(self._value)
+            else:
+                value = parse_json_value("".join(self._value), partial)
+                if value is not None:
+                    self.fields[self._key] = value
+        self._value = None
+        self._emitting = False
+
+    def _step(self, char, out):
+        mode = self._mode
+        if mode == "object":
+            self._object_step(char, out)
+        elif mode == "start":
+            if char.isspace():
+                return
+            if char == "`":
+                self._mode = "fence"
+            elif char == "{":
+                self._start_object()
+            else:
+                self._mode = "prose"
+                out.append(char)
+        elif mode == "prose":
+            if char == "{":
+                self._start_object()
+            else:
+                out.append(char)
+        elif mode in ("fence", "seek"):
+            if char == "{":
+                self._start_object()
+
+    def _object_step(self, char, out):
+        value = self._value
+
+        if self._in_string:
+            decoded = self._key_chars is not None or (self._depth == 1 and self._value_is_string)
+            if not decoded:
+                # Nested string: keep it verbatim for json.loads later
+                if value is not None:
+                    value.append(char)
+                if self._escape is not None:
+                    self._escape = None
+                elif char == "\\":
+                    self._escape = ""
+                elif char == '"':
+                    self._in_string = False
+                return
+
+            if self._escape is not None:
+                if self._escape == "":
+                    if char == "u":
+                        self._escape = "u"
+                        return
+                    char = _ESCAPES.get(char, char)
+                    self._escape = None
+                else:
+                    self._escape += char
+                    if len(self._escape) < 5:
+                        return
+                    try:
+                        char = chr(int(self._escape[1:], 16))
+                    except ValueError:
+                        char = ""
+                    self._escape = None
+            elif char == "\\":
+                self._escape = ""
+                return
+            elif char == '"':
+                self._in_string = False
+                if self._key_chars is not None:
+                    self._key = "".join(self._key_chars)
+                    self._key_chars = None
+                else:
+                    self._commit_value()
+                return
+
+            if self._key_chars is not None:
+                self._key_chars.append(char)
+            else:
+                value.append(char)
+                if self._emitting:
+                    out.append(char)
+            return
+
+        if self._depth == 1:
+            if value is None and not self._expect_key:
+                if char.isspace() or char == ":":
+                    return
+                if char not in ",}":
+                    # First character of a value
+                    self._value = value = []
+                    self._value_is_string = char == '"'
+                    if self._value_is_string:
+                        self._in_string = True
+                        if self._key == self.text_field and not self._text_done:
+                            self._emitting = True
+                            self._text_done = True
+                        return
+            if char == '"' and self._expect_key:
+                self._in_string = True
+                self._key_chars = []
+                return
+            if char == ":":
+                self._expect_key = False
+                return
+            if char == ",":
+                self._commit_value()
+                self._expect_key = True
+                self._key = None
+                return
+            if char == "}":
+                self._commit_value()
+                self._depth = 0
+                # Keep looking if this object was not the response (e.g. an example)
+                self._mode = "done" if self.text_field in self.fields else "seek"
+                return
+
+        if value is not None:
+            value.append(char)
+        if char == '"':
+            self._in_string = True
+        elif char in "{[":
+            self._depth += 1
+        elif char in "}]":
+            self._depth -= 1
+
+
+def parse_json_value(raw, partial=False):
+    """
+    Parse a raw JSON value, repairing trailing commas and, for truncated
+    output, unclosed strings, objects and arrays. Returns None if nothing
+    usable is left.
+    """
+    raw = raw.strip()
+    if not raw:
+        return None
+    try:
+        return json.loads(raw, strict=False)
+    except json.JSONDecodeError:
+        pass
+
+    repaired = _TRAILING_COMMA.sub(r'\1', raw)
+    for _ in range(8 if partial else 1):
+        candidate = _close_brackets(repaired) if partial else repaired
+        try:
+            return json.loads(candidate, strict=False)
+        except json.JSONDecodeError:
+            pass
+        # Drop the last, incomplete member and try again
+        cut = repaired.rfind(",")
+        if cut <= 0:
+            break
+        repaired = repaired[:cut]
+    return None
+
+
+def _close_brackets(raw):
+    """Close any string, object or array left open at the end of raw"""
+    stack = []
+    in_string = False
+    escape = False
+    for char in raw:
+        if in_string:
+            if escape:
+                escape = False
+            elif char == "\\":
+                escape = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char in "{[":
+            stack.append("}" if char == "{" else "]")
+        elif char in "}]" and stack:
+            stack.pop()
+    closed = raw + ('"' if in_string else "")
+    closed = closed.rstrip().rstrip(",:")
+    return closed + "".join(reversed(stack))
+
+
+def _unwrap_text(text):
+    """Unwrap a text field that itself contains the whole JSON response"""
+    stripped = text.strip()
+    if stripped.startswith("{") and stripped.endswith("}"):
+        try:
+            inner = json.loads(stripped)
+            if isinstance(inner, dict) and isinstance(inner.get("text"), str):
+                return inner["text"]
+        except json.JSONDecodeError:
+            pass
+    return text
+
+
+def heuristic_response(response_text):
+    """Best-effort fields for a response that contains no usable JSON object"""
+    result = dict(DEFAULT_RESPONSE)
+    result["text"] = response_text
+
+    # Remove any JSON-like structures or code blocks from the text
+    cleaned_text = re.sub(r'\{[\s\S]*?\}', '', response_text)
+    cleaned_text = re.sub(r'```[\s\S]*?```', '', cleaned_text)
+    cleaned_text = cleaned_text.strip()
+    if cleaned_text:
+        result["text"] = cleaned_text
+
+    # Look for actions enclosed in asterisks or parentheses
+    action_match = re.search(r'\*(.*?)\*|\((.*?)\)', response_text)
+    if action_match:
+        action = action_match.group(1) or action_match.group(2)
+        if action:
+            result["action"] = action.strip()
+
+    # Check for location mentions
+    location_match = re.search(r'at (the|a) ([^\.]*)', response_text)
+    if location_match:
+        location = location_match.group(2)
+        if location:
+            result["location"] = location.strip()
+
+    # Infer mood from language
+    if re.search(r'laugh|chuckle|grin|smile|happy|joy', response_text, re.IGNORECASE):
+        result["mood"] = "happy"
+    elif re.search(r'frown|sigh|sad|upset|depress', response_text, re.IGNORECASE):
+        result["mood"] = "sad"
+    elif re.search(r'angry|furious|mad|rage', response_text, re.IGNORECASE):
+        result["mood"] = "angry"
+
+    return result
+
+
+def parse_response(response_text):
+    """Parse a complete model response in one pass"""
+    stripped = response_text.strip()
+    if stripped.startswith("{") and stripped.endswith("}"):
+        # Well-formed responses are the common case; let the C parser take them
+        try:
+            parsed = json.loads(stripped)
+        except json.JSONDecodeError:
+            parsed = None
+        if isinstance(parsed, dict) and isinstance(parsed.get("text"), str):
+            parser = ResponseParser()
+            parser.fields = parsed
+            return parser.close()
+
+    parser = ResponseParser()
+    parser.feed(response_text)
+    return parser.close()
@@ -0,0 +1,262 @@
+"""
+Scenario world context for the chat system prompt.
+
+A scenario is compiled once per version (a hash of its content): the
+header, the world sections for its size (history, politics, economy,
+geography, rules), one rendered line per location and NPC, the graph of
+connected locations and a single pattern matching every location and NPC
+name. Each turn then only picks lines:
+
+- locations: the chat's current location, the ones connected to it (a
+  location's "connections" lists location names; links work both ways)
+  and the ones mentioned in the message or the recent turns
+- NPCs: those whose "location" is the current location, and those
+  mentioned in the message, the recent turns or the current location's
+  description
+
+Everything else is only listed by name, so a large world no longer adds
+every description to every prompt. Small scenarios (SMALL_SCENARIO_ENTRIES
+locations and NPCs or fewer) are included in full.
+"""
+
+import hashlib
+import json
+import re
+import threading
+from collections import OrderedDict
+
+# Scenarios with this many locations and NPCs or fewer are included in full
+SMALL_SCENARIO_ENTRIES = 8
+
+# Names listed for the locations and NPCs left out of a prompt
+MAX_OTHER_NAMES = 20
+
+# Compiled scenarios kept in memory
+MAX_COMPILED = 128
+
+WORLD_SIZES = ("small", "medium", "large")
+
+# (scenario id, version) -> CompiledScenario
+_compiled = OrderedDict()
+_lock = threading.Lock()
+_stats = {
+    "hits": 0,
+    "misses": 0,
+    "turns": 0,
+    "locations_total": 0,
+    "locations_included": 0,
+    "npcs_total": 0,
+    "npcs_included": 0
+}
+
+
+def _key(name):
+    """Normalized name for matching"""
+    key = " ".join(str(name).lower().split())
+    if key.startswith("the "):
+        key = key[4:]
+    return key
+
+
+def scenario_version(scenario):
+    """Hash of a scenario's content"""
+    return hashlib.sha256(json.dumps(scenario, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+
+
+class CompiledScenario:
+    """A scenario's context, rendered once, with what is needed to pick the relevant parts"""
+
+    def __init__(self, scenario):
+        self.version = scenario_version(scenario)
+        self.starting_location = scenario.get('starting_location', 'an unknown location')
+        self.header = f"""
+This conversation takes place in a scenario called "{scenario.get('title')}".
+{scenario.get('description', '')}
+
+"""
+
+        # (key, name, line) per location, in scenario order
+        self.locations = []
+        for loc in scenario.get("locations", []):
+            if isinstance(loc, dict):
+                name = loc.get('name', 'Unknown')
+                line = f"\n- {name}: {loc.get('description', '')}"
+            else:
+                name, line = loc, f"\n- {loc}"
+            self.locations.append((_key(name), str(name), line))
+
+        self.location_keys = {key for key, _, _ in self.locations if key}
+
+        # One pattern for every name, longest first so "Old Mill Road" wins over "Old Mill"
+        npc_names = [_key(npc.get('name', 'Unknown') if isinstance(npc, dict) else npc) for npc in scenario.get("npcs", [])]
+        names = sorted(self.location_keys | {key for key in npc_names if key}, key=len, reverse=True)
+        self.name_pattern = re.compile(
+            r"\b(?:" + "|".join(re.escape(name) for name in names) + r")\b", re.IGNORECASE
+        ) if names else None
+
+        # Connected locations, both ways
+        self.connections = {}
+        for loc in scenario.get("locations", []):
+            if isinstance(loc, dict):
+                a = _key(loc.get('name', 'Unknown'))
+                for other in loc.get("connections") or []:
+                    b = _key(other)
+                    self.connections.setdefault(a, set()).add(b)
+                    self.connections.setdefault(b, set()).add(a)
+
+        # (key, name, line, keys of the locations the NPC is at) per NPC
+        self.npcs = []
+        for npc in scenario.get("npcs", []):
+            if isinstance(npc, dict):
+                name = npc.get('name', 'Unknown')
+                line = f"\n- {name}: {npc.get('description', '')}. Role: {npc.get('role', 'Unknown')}"
+                at = self.current_locations(npc.get("location"))
+            else:
+                name, line, at = npc, f"\n- {npc}", set()
+            self.npcs.append((_key(name), str(name), line, at))
+
+        # Location descriptions, to find the NPCs they mention
+        self.descriptions = {
+            _key(loc.get('name', 'Unknown')): loc.get('description', '')
+            for loc in scenario.get("locations", []) if isinstance(loc, dict)
+        }
+
+        self.small = len(self.locations) + len(self.npcs) <= SMALL_SCENARIO_ENTRIES
+
+        # World sections, the same for every turn
+        world_size = scenario.get("world_size", "small")
+        sections = []
+        if world_size in ["medium", "large"] and "history" in scenario:
+            sections.append(f"\n\nHistory: {scenario.get('history', '')}")
+        if world_size == "large":
+            if "political_structure" in scenario:
+                sections.append(f"\n\nPolitical Structure: {scenario.get('political_structure', '')}")
+            if "economy" in scenario:
+                sections.append(f"\n\nEconomy: {scenario.get('economy', '')}")
+            if "geography" in scenario:
+                sections.append(f"\n\nGeography: {scenario.get('geography', '')}")
+        if "world_rules" in scenario:
+            sections.append(f"\n\nSpecial Rules: {scenario.get('world_rules', '')}")
+        self.world = "".join(sections)
+
+    def mentioned(self, text):
+        """Keys of the locations and NPCs named in a text"""
+        if not text or self.name_pattern is None:
+            return set()
+        return {_key(match) for match in self.name_pattern.findall(text)}
+
+    def current_locations(self, location):
+        """Keys of the scenario locations that a location ("the back room of the Gilded Hart") refers to"""
+        location = _key(location or "")
+        if not location:
+            return set()
+        named = self.mentioned(location) & self.location_keys
+        if named:
+            return named
+        # A shorter name for a location ("the Hart" for "Gilded Hart")
+        pattern = re.compile(r"\b" + re.escape(location) + r"\b")
+        return {key for key in self.location_keys if pattern.search(key)}
+
+    def render(self, location, recent_text=""):
+        """
+        The scenario context for a turn.
+
+        Returns:
+            tuple: (text, locations included, NPCs included)
+        """
+        parts = [self.header, f"You are in {location or self.starting_location}.\n\nWorld Information:\n"]
+
+        if self.small:
+            relevant_locations = {key for key, _, _ in self.locations}
+            relevant_npcs = {key for key, *_ in self.npcs}
+        else:
+            here = self.current_locations(location)
+            mentioned = self.mentioned(recent_text)
+            for key in here:
+                mentioned |= self.mentioned(self.descriptions.get(key))
+            relevant_locations = here | (mentioned & self.location_keys)
+            for key in here:
+                relevant_locations |= self.connections.get(key, set())
+            relevant_npcs = {key for key, _, _, at in self.npcs if key in mentioned or at & here}
+
+        locations_included = self._add_entries(
+            parts, self.locations, relevant_locations, "\n", "Locations in this world:", "Other locations in this world: "
+        )
+        npcs_included = self._add_entries(
+            parts, self.npcs, relevant_npcs, "\n\n", "People in this world:", "Other people in this world: "
+        )
+        parts.append(self.world)
+        return "".join(parts), locations_included, npcs_included
+
+    @staticmethod
+    def _add_entries(parts, entries, relevant, lead, title, others_title):
+        """Add the relevant entries in full and the others by name; returns how many were added in full"""
+        included = [entry[2] for entry in entries if entry[0] in relevant]
+        others = [entry[1] for entry in entries if entry[0] not in relevant]
+        if included:
+            parts += [lead, title, *included]
+            lead = "\n\n"
+        if others:
+            listed = ", ".join(others[:MAX_OTHER_NAMES])
+            if len(others) > MAX_OTHER_NAMES:
+                listed += f" and {len(others) - MAX_OTHER_NAMES} more"
+            parts += [lead, others_title, listed]
+        return len(included)
+
+
+def compile_scenario(scenario):
+    """Compile a scenario (cached by id and version)"""
+    key = (scenario.get("id"), scenario_version(scenario))
+    with _lock:
+        compiled = _compiled.get(key)
+        if compiled is not None:
+            _compiled.move_to_end(key)
+            _stats["hits"] += 1
+            return compiled
+        _stats["misses"] += 1
+
+    compiled = CompiledScenario(scenario)
+    with _lock:
+        # Older versions of the scenario are no longer needed
+        for old in [old for old in _compiled if old[0] == key[0]]:
+            del _compiled[old]
+        _compiled[key] = compiled
+        while len(_compiled) > MAX_COMPILED:
+            _compiled.popitem(last=False)
+    return compiled
+
+
+def forget_scenario(scenario_id):
+    """Drop a deleted scenario's compiled context"""
+    with _lock:
+        for old in [old for old in _compiled if old[0] == scenario_id]:
+            del _compiled[old]
+
+
+def build_scenario_context(scenario, location, recent_text=""):
+    """
+    Build the scenario part of a chat's system prompt.
+
+    Args:
+        scenario (dict): The chat's scenario
+        location (str): The chat's current location
+        recent_text (str): The message and recent turns, for finding the places and people they mention
+
+    Returns:
+        str: The scenario context
+    """
+    compiled = compile_scenario(scenario)
+    text, locations_included, npcs_included = compiled.render(location, recent_text)
+    with _lock:
+        _stats["turns"] += 1
+        _stats["locations_total"] += len(compiled.locations)
+        _stats["locations_included"] += locations_included
+        _stats["npcs_total"] += len(compiled.npcs)
+        _stats["npcs_included"] += npcs_included
+    return text
+
+
+def get_scenario_context_stats():
+    """Get compile counters and how much of the scenarios' locations and NPCs went into prompts"""
+    with _lock:
+        return {**_stats, "compiled": len(_compiled)}
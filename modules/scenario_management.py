@@ -0,0 +1,109 @@
+from flask import jsonify, request
+import uuid
+from datetime import datetime
+from .storage import get_storage
+from .scenario_context import WORLD_SIZES, compile_scenario, forget_scenario
+
+# Text fields of a scenario; the world sections are only used when present
+TEXT_FIELDS = ("title", "description", "starting_location", "history", "political_structure",
+               "economy", "geography", "world_rules")
+
+
+def validate_scenario(data):
+    """Check the fields of a scenario sent by the client; returns an error message or None"""
+    if not isinstance(data, dict):
+        return "Scenario data is required"
+    for field in TEXT_FIELDS:
+        if field in data and not isinstance(data[field], str):
+            return f"{field} must be a string"
+    if "world_size" in data and data["world_size"] not in WORLD_SIZES:
+        return f"world_size must be one of: {', '.join(WORLD_SIZES)}"
+    for field in ("locations", "npcs"):
+        entries = data.get(field, [])
+        if not isinstance(entries, list):
+            return f"{field} must be a list"
+        for entry in entries:
+            if isinstance(entry, str):
+                continue
+            if not isinstance(entry, dict) or not isinstance(entry.get("name"), str):
+                return f"Each of {field} must be a name or an object with a name"
+            if field == "locations" and not isinstance(entry.get("connections", []), list):
+                return "A location's connections must be a list of location names"
+    return None
+
+
+def register_scenario_routes(app):
+    """Register scenario management routes with the Flask app"""
+
+    @app.route('/api/scenarios', methods=['GET'])
+    def get_scenarios():
+        """Get list of all saved scenarios"""
+        return jsonify(get_storage().list_scenarios())
+
+    @app.route('/api/scenarios/<scenario_id>', methods=['GET'])
+    def get_scenario(scenario_id):
+        """Get a specific scenario by ID"""
+        scenario = get_storage().get_scenario(scenario_id)
+        if scenario is not None:
+            return jsonify(scenario)
+        return jsonify({"error": "Scenario not found"}), 404
+
+    @app.route('/api/scenarios', methods=['POST'])
+    def create_scenario():
+        """Create a new scenario"""
+        data = request.json
+        error = validate_scenario(data)
+        if error:
+            return jsonify({"error": error}), 400
+
+        timestamp = datetime.now().isoformat()
+        scenario = {
+            "id": str(uuid.uuid4()),
+            "title": data.get("title", "New Scenario"),
+            "description": data.get("description", ""),
+            "world_size": data.get("world_size", "small"),
+            "locations": data.get("locations", []),
+            "npcs": data.get("npcs", []),
+            "created_at": timestamp,
+            "updated_at": timestamp
+        }
+        for field in TEXT_FIELDS:
+            if field in data and field not in scenario:
+                scenario[field] = data[field]
+
+        get_storage().save_scenario(scenario)
+        compile_scenario(scenario)
+
+        return jsonify(scenario)
+
+    @app.route('/api/scenarios/<scenario_id>', methods=['PUT'])
+    def update_scenario(scenario_id):
+        """Update an existing scenario (only the fields sent are changed)"""
+        data = request.json
+        error = validate_scenario(data)
+        if error:
+            return jsonify({"error": error}), 400
+
+        storage = get_storage()
+        scenario = storage.get_scenario(scenario_id)
+        if scenario is None:
+            return jsonify({"error": "Scenario not found"}), 404
+
+        for field in TEXT_FIELDS + ("world_size", "locations", "npcs"):
+            if field in data:
+                scenario[field] = data[field]
+        scenario["updated_at"] = datetime.now().isoformat()
+
+        storage.save_scenario(scenario)
+        compile_scenario(scenario)
+
+        return jsonify(scenario)
+
+    @app.route('/api/scenarios/<scenario_id>', methods=['DELETE'])
+    def delete_scenario(scenario_id):
+        """Delete a scenario"""
+        if not get_storage().delete_scenario(scenario_id):
+            return jsonify({"error": "Scenario not found"}), 404
+        forget_scenario(scenario_id)
+
+        return jsonify({"success": True})
@@ -1,10 +1,48 @@
 import json
-import requests
 from config import Config
+from . import http_client, local_model
+from .response_cache import cached_generate, model_id, CACHE_OFF
+from .llm_scheduler import llm_slot, PROVIDER_OPENROUTER
 
+# Scene description used when none could be generated in time
+SCENE_PLACEHOLDER = "The scene unfolds naturally as the conversation continues."
 
-def generate_location_description(character, prompt=""):
-    """Generate a simple location name appropriate for the character"""
+# How a chat's scene descriptions are produced (see Config.SCENE_MODE):
+# "background" and "inline" make a second call to generate_scene_description,
+# "combined" asks for the scene in the same JSON object as the reply
+SCENE_MODES = ("background", "inline", "combined")
+
+
+def get_scene_mode(chat_instance):
+    """Get the scene mode of a chat: its own setting, otherwise the global default"""
+    mode = chat_instance.get("scene_mode") or Config.SCENE_MODE
+    return mode if mode in SCENE_MODES else "background"
+
+
+def get_combined_scene_instructions(is_player_action=False):
+    """System prompt addition asking for the scene description in the character's JSON response"""
+    instructions = """
+    In the same JSON object, after all the other fields, also include:
+    - "scene_description": A vivid, novelist-style paragraph describing this moment, written in
+      third-person present tense. Include environmental details of the location, your character's
+      actions, expressions and body language, the mood and atmosphere of the scene, and the user's
+      presence and actions. Quote your character's dialogue from "text" word for word.
+      DO NOT create new dialogue for your character or for the user.
+    """
+    if is_player_action:
+        instructions += """  The scene should visually describe the user's action as it takes place, its outcome,
+      and how your character reacts to it.
+    """
+    return instructions
+
+
+def generate_location_description(character, prompt="", temperature=0.7, cache_mode=CACHE_OFF):
+    """
+    Generate a simple location name appropriate for the character.
+    
+    Returns:
+        tuple: ({"location": ...}, response cache status)
+    """
     
     system_prompt = f"""You are a location name generator for a roleplaying app.
     Given a character description, generate a simple, appropriate location name where this character
@@ -33,44 +71,51 @@ def generate_location_description(character, prompt=""):
     if prompt:
         user_prompt += f"\nDesired location type: {prompt}"
     
+    # Use the same API endpoint chosen by the user
+    use_local_model = Config.DEFAULT_MODEL == "local"
+    
+    def request_location():
+        if use_local_model:
+            try:
+                return local_model.generate(user_prompt, system_prompt, temperature, max_tokens=100)
+            except Exception as e:
+                print(f"Error from local model: {str(e)}")
+                return None
+        
+        headers = {
+            "Content-Type": "application/json",
+            "Authorization": f"Bearer {Config.OPENROUTER_API_KEY}"
+        }
+        
+        data = {
+            "model": Config.DEFAULT_MODEL,
+            "messages": [
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": user_prompt}
+            ],
+            "temperature": temperature
+        }
+        
+        with llm_slot(PROVIDER_OPENROUTER, Config.DEFAULT_MODEL):
+            response = http_client.post(http_client.OPENROUTER_CHAT_URL,
+                                      headers=headers, 
+                                      json=data)
+        
+        if response.status_code != 200:
+            return None
+        
+        return response.json()["choices"][0]["message"]["content"]
+    
     try:
-        # Use the same API endpoint chosen by the user
-        if Config.DEFAULT_MODEL == "local":
-            data = {
-                "prompt": f"{system_prompt}\n\n{user_prompt}\n\nAssistant: ",
-                "max_tokens": 100,
-                "temperature": 0.7
-            }
-            
-            response = requests.post(Config.LOCAL_MODEL_URL, json=data)
-            
-            if response.status_code != 200:
-                return {"location": "Nondescript Room"}
-            
-            location_text = response.json().get("response", "")
-        else:
-            headers = {
-                "Content-Type": "application/json",
-                "Authorization": f"Bearer {Config.OPENROUTER_API_KEY}"
-            }
-            
-            data = {
-                "model": Config.DEFAULT_MODEL,
-                "messages": [
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_prompt}
-                ],
-                "temperature": 0.7
-            }
-            
-            response = requests.post("https://openrouter.ai/api/v1/chat/completions", 
-                                   headers=headers, 
-                                   json=data)
-            
-            if response.status_code != 200:
-                return {"location": "Nondescript Room"}
-            
-            location_text = response.json()["choices"][0]["message"]["content"]
+        # Failed calls come back as None and are not cached
+        location_text, cache_status = cached_generate(
+            cache_mode, request_location,
+            model_id(use_local_model), system_prompt, user_prompt, temperature,
+            100 if use_local_model else None,
+            validate=lambda text: text is not None
+        )
+        if location_text is None:
+            return {"location": "Nondescript Room"}, cache_status
         
         # Extract the JSON from the response
         try:
@@ -78,25 +123,35 @@ def generate_location_description(character, prompt=""):
             json_match = re.search(r'(\{.*\})', location_text, re.DOTALL)
             if json_match:
                 location_json = json.loads(json_match.group(1))
-                return location_json
+                return location_json, cache_status
             else:
                 # If no JSON found, extract text that might be a location
                 location_match = re.search(r'"location":\s*"([^"]+)"', location_text)
                 if location_match:
-                    return {"location": location_match.group(1)}
+                    return {"location": location_match.group(1)}, cache_status
                     
                 # Last resort, use any text as location
-                return {"location": location_text.strip()}
+                return {"location": location_text.strip()}, cache_status
         except:
             # If JSON parsing fails, provide a simple response
-            return {"location": "Nondescript Room"}
+            return {"location": "Nondescript Room"}, cache_status
             
     except Exception as e:
         print(f"Error generating location: {str(e)}")
-        return {"location": "Nondescript Room"}
+        return {"location": "Nondescript Room"}, CACHE_OFF
 
-def generate_scene_description(character, character_response, user_message, is_player_action=False, action_success=None):
-    """Generate a novelist-style scene description based on the character's response"""
+def generate_scene_description(character, character_response, user_message, is_player_action=False, action_success=None,
+                               use_local_model=None):
+    """
+    Generate a novelist-style scene description based on the character's response.
+    
+    `use_local_model` should match the model used for the turn; when omitted
+    the local model is used only if it is the configured default.
+    """
+    if use_local_model is None:
+        use_local_model = Config.DEFAULT_MODEL == "local"
+    # Scenes are dropped after SCENE_DEADLINE anyway, so don't wait longer than that
+    timeout = (Config.HTTP_CONNECT_TIMEOUT, Config.SCENE_DEADLINE)
     
     system_prompt = f"""You are a skilled novelist writing a scene between the character {character["name"]} and a user.
     Your task is to create a vivid, engaging scene description that captures the interaction. 
@@ -156,20 +211,9 @@ def generate_scene_description(character, character_response, user_message, is_p
     """
     
     try:
-        # Use the same API endpoint chosen by the user
-        if Config.DEFAULT_MODEL == "local":
-            data = {
-                "prompt": f"{system_prompt}\n\n{prompt}\n\nAssistant: ",
-                "max_tokens": 1000,
-                "temperature": 0.7
-            }
-            
-            response = requests.post(Config.LOCAL_MODEL_URL, json=data)
-            
-            if response.status_code != 200:
-                return {"scene_description": "The scene unfolds naturally as the conversation continues."}
-            
-            scene_text = response.json().get("response", "")
+        # Use the same model as the turn
+        if use_local_model:
+            scene_text = local_model.generate(prompt, system_prompt, 0.7, max_tokens=1000, timeout=timeout)
         else:
             headers = {
                 "Content-Type": "application/json",
@@ -185,12 +229,14 @@ def generate_scene_description(character, character_response, user_message, is_p
                 "temperature": 0.7
             }
             
-            response = requests.post("https://openrouter.ai/api/v1/chat/completions", 
-                                   headers=headers, 
-                                   json=data)
+            with llm_slot(PROVIDER_OPENROUTER, Config.DEFAULT_MODEL):
+                response = http_client.post(http_client.OPENROUTER_CHAT_URL,
+                                          headers=headers, 
+                                          json=data,
+                                          timeout=timeout)
             
             if response.status_code != 200:
-                return {"scene_description": "The scene unfolds naturally as the conversation continues."}
+                return {"scene_description": SCENE_PLACEHOLDER}
             
             scene_text = response.json()["choices"][0]["message"]["content"]
         
@@ -210,4 +256,4 @@ def generate_scene_description(character, character_response, user_message, is_p
             
     except Exception as e:
         print(f"Error generating scene description: {str(e)}")
-        return {"scene_description": "The scene unfolds naturally as the conversation continues."}
\ No newline at end of file
+        return {"scene_description": SCENE_PLACEHOLDER}
\ No newline at end of file
@@ -0,0 +1,214 @@
+"""
+Background generation of scene descriptions.
+
+A chat turn is saved and returned as soon as the character's reply is ready.
+Its scene description is generated afterwards on a small worker pool and
+written onto the stored turn when it arrives. If it has not arrived within
+Config.SCENE_DEADLINE seconds, the placeholder text is stored instead.
+Clients fetch or wait for a turn's scene by its turn id.
+"""
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from config import Config
+from .chat_locks import chat_lock
+from .conversation_search import index_conversation
+from .llm_scheduler import llm_priority, PRIORITY_SCENE
+from .scene_generation import generate_scene_description, SCENE_PLACEHOLDER
+from .storage import get_storage
+
+# Values of a turn's "scene_status"
+SCENE_PENDING = "pending"
+SCENE_READY = "ready"
+SCENE_FALLBACK = "fallback"
+
+# Seconds between storage checks while waiting for a scene generated elsewhere
+POLL_INTERVAL = 0.25
+
+_executor = None
+_executor_lock = threading.Lock()
+# (chat_id, turn) -> SceneTask, for scenes being generated in this process
+_pending = {}
+_pending_lock = threading.Lock()
+_stats = {
+    "scheduled": 0,
+    "ready": 0,
+    "fallback": 0,
+    "total_time_ms": 0.0,
+    # Turns in "combined" mode whose response did / did not include the scene
+    "combined": 0,
+    "combined_missing": 0
+}
+
+
+class SceneTask:
+    """A scene description being generated for one turn"""
+
+    def __init__(self, chat_id, turn):
+        self.chat_id = chat_id
+        self.turn = turn
+        self.started = time.perf_counter()
+        self.done = threading.Event()
+        self.result = None
+        self._resolve_lock = threading.Lock()
+
+    def resolve(self, scene_description, status):
+        """Store the scene on the turn and wake up waiters. Only the first call counts."""
+        with self._resolve_lock:
+            if self.done.is_set():
+                return False
+
+            try:
+                _save_scene(self.chat_id, self.turn, scene_description, status)
+            except Exception as e:
+                print(f"Error saving scene description for {self.chat_id} turn {self.turn}: {str(e)}")
+
+            self.result = scene_result(self.turn, scene_description, status)
+            with _pending_lock:
+                _pending.pop((self.chat_id, self.turn), None)
+                _stats[status] += 1
+                _stats["total_time_ms"] += (time.perf_counter() - self.started) * 1000
+            self.done.set()
+        return True
+
+
+def scene_result(turn, scene_description, status):
+    """The scene payload returned to clients"""
+    return {"turn": turn, "scene_description": scene_description, "status": status}
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=Config.SCENE_WORKERS, thread_name_prefix="scene")
+    return _executor
+
+
+def _save_scene(chat_id, turn, scene_description, status):
+    """Write the scene onto the stored turn and bump the chat so cached history is refreshed"""
+    storage = get_storage()
+    with chat_lock(chat_id):
+        entry = storage.update_turn(chat_id, turn, {
+            "scene_description": scene_description,
+            "scene_status": status
+        })
+        chat_header = storage.get_chat(chat_id)
+        if entry is None or chat_header is None:
+            return
+        chat_header["updated_at"] = datetime.now().isoformat()
+        storage.save_chat(chat_header)
+    index_conversation(chat_header, entry)
+
+
+def _generate(task, character, character_response, user_message, is_player_action, action_success, use_local_model):
+    try:
+        with llm_priority(PRIORITY_SCENE, task.chat_id):
+            scene = generate_scene_description(
+                character, character_response, user_message, is_player_action, action_success,
+                use_local_model=use_local_model
+            )
+        scene_description = scene.get("scene_description") or SCENE_PLACEHOLDER
+    except Exception as e:
+        print(f"Error generating scene description: {str(e)}")
+        scene_description = SCENE_PLACEHOLDER
+
+    status = SCENE_FALLBACK if scene_description == SCENE_PLACEHOLDER else SCENE_READY
+    task.resolve(scene_description, status)
+
+
+def schedule_scene(chat_id, turn, character, character_response, user_message,
+                   is_player_action=False, action_success=None, use_local_model=None):
+    """
+    Start generating the scene description of a saved turn in the background.
+    The turn should have been stored with scene_status "pending".
+    """
+    task = SceneTask(chat_id, turn)
+    with _pending_lock:
+        _pending[(chat_id, turn)] = task
+        _stats["scheduled"] += 1
+
+    deadline = threading.Timer(Config.SCENE_DEADLINE, task.resolve, args=(SCENE_PLACEHOLDER, SCENE_FALLBACK))
+    deadline.daemon = True
+    deadline.start()
+
+    def run():
+        try:
+            _generate(task, character, character_response, user_message,
+                      is_player_action, action_success, use_local_model)
+        finally:
+            deadline.cancel()
+
+    _get_executor().submit(run)
+    return task
+
+
+def _read_turn(chat_id, turn):
+    entries = get_storage().get_turns(chat_id, after=turn - 1, limit=1)
+    if entries and entries[0]["turn"] == turn:
+        return entries[0]
+    return None
+
+
+def _is_overdue(entry):
+    """Whether a pending turn is past its deadline (e.g. its worker was restarted)"""
+    try:
+        created = datetime.fromisoformat(entry.get("timestamp", ""))
+    except ValueError:
+        return True
+    return (datetime.now() - created).total_seconds() > Config.SCENE_DEADLINE + 5
+
+
+def get_scene(chat_id, turn, wait=0):
+    """
+    Get the scene description of a turn, waiting up to `wait` seconds for a
+    pending one.
+
+    Returns:
+        dict: turn, scene_description and status, or None if the turn does not exist
+    """
+    stop_at = time.monotonic() + wait
+    while True:
+        with _pending_lock:
+            task = _pending.get((chat_id, turn))
+        if task is not None:
+            # Generated in this process: wait for it directly
+            if task.done.wait(max(stop_at - time.monotonic(), 0)):
+                return task.result
+            return scene_result(turn, "", SCENE_PENDING)
+
+        entry = _read_turn(chat_id, turn)
+        if entry is None:
+            return None
+
+        status = entry.get("scene_status", SCENE_READY)
+        if status != SCENE_PENDING:
+            return scene_result(turn, entry.get("scene_description", ""), status)
+        if _is_overdue(entry):
+            return scene_result(turn, SCENE_PLACEHOLDER, SCENE_FALLBACK)
+        if time.monotonic() >= stop_at:
+            return scene_result(turn, "", SCENE_PENDING)
+        # Being generated by another worker process: poll the stored turn
+        time.sleep(POLL_INTERVAL)
+
+
+def record_combined_scene(found):
+    """Count a combined-mode turn, and whether its response included the scene"""
+    with _pending_lock:
+        _stats["combined" if found else "combined_missing"] += 1
+
+
+def get_scene_stats():
+    """Get counters for background scene generation"""
+    with _pending_lock:
+        finished = _stats["ready"] + _stats["fallback"]
+        return {
+            **_stats,
+            "total_time_ms": round(_stats["total_time_ms"], 2),
+            "avg_time_ms": round(_stats["total_time_ms"] / finished, 2) if finished else 0.0,
+            "pending": len(_pending),
+            "deadline_seconds": Config.SCENE_DEADLINE
+        }
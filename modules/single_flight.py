@@ -0,0 +1,114 @@
+"""
+Single-flight coalescing of identical concurrent upstream calls.
+
+When several requests need the same upstream call at the same time (many
+tabs loading /api/diagnostic, a double-clicked generate button), only the
+first one makes it; the others wait for it and share its result or its
+exception. Calls are identified by a group name (used for the counters)
+and a key; nothing is kept once a call has finished, so this never serves
+stale data (see response_cache for that).
+"""
+
+import asyncio
+import threading
+
+# (group, key) -> _Call of the running thread call
+_calls = {}
+# (group, key) -> asyncio.Task of the running coroutine call
+_async_calls = {}
+_lock = threading.Lock()
+# group -> {"calls", "coalesced", "errors"}
+_stats = {}
+
+
+class _Call:
+    """A running call that other threads can wait on"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+def _count(group, counter):
+    """Bump a counter (caller holds _lock)"""
+    stats = _stats.setdefault(group, {"calls": 0, "coalesced": 0, "errors": 0})
+    stats[counter] += 1
+
+
+def do(group, key, func):
+    """
+    Call func(), or wait for an identical call that is already running.
+
+    Args:
+        group (str): Kind of call, e.g. "generate"
+        key: Hashable identity of the call within the group
+        func (callable): Makes the upstream call
+
+    Returns:
+        The result of func(), shared by every caller that joined the call
+        (raises its exception the same way)
+    """
+    call_key = (group, key)
+    with _lock:
+        call = _calls.get(call_key)
+        leader = call is None
+        if leader:
+            call = _calls[call_key] = _Call()
+        _count(group, "calls" if leader else "coalesced")
+
+    if not leader:
+        call.done.wait()
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+    try:
+        call.result = func()
+        return call.result
+    except BaseException as e:
+        call.error = e
+        with _lock:
+            _count(group, "errors")
+        raise
+    finally:
+        with _lock:
+            del _calls[call_key]
+        call.done.set()
+
+
+async def do_async(group, key, func):
+    """
+    asyncio version of do(); func() returns an awaitable.
+
+    The call runs as its own task, so if the caller that started it goes
+    away (client disconnect) the others still get the result.
+    """
+    loop = asyncio.get_running_loop()
+    call_key = (group, key)
+    with _lock:
+        task = _async_calls.get(call_key)
+        leader = task is None or task.get_loop() is not loop
+        if leader:
+            task = _async_calls[call_key] = loop.create_task(func())
+            task.add_done_callback(lambda finished: _finish_async(group, call_key, finished))
+        _count(group, "calls" if leader else "coalesced")
+    return await asyncio.shield(task)
+
+
+def _finish_async(group, call_key, task):
+    with _lock:
+        if _async_calls.get(call_key) is task:
+            del _async_calls[call_key]
+        # Reading the exception also keeps asyncio from logging it when every caller is gone
+        if not task.cancelled() and task.exception() is not None:
+            _count(group, "errors")
+
+
+def get_single_flight_stats():
+    """Get call, coalesced and error counters per group"""
+    with _lock:
+        return {
+            "in_flight": len(_calls) + len(_async_calls),
+            "groups": {group: dict(stats) for group, stats in _stats.items()}
+        }
@@ -0,0 +1,678 @@
+"""
+Storage backends for characters, chats, conversation turns, prompt templates
+and scenarios.
+
+Modules access persisted data through get_storage(), which returns the
+backend selected by Config.STORAGE_BACKEND:
+- "filesystem": the JSON files under the data folder (default)
+- "sqlite": a single SQLite database in WAL mode
+- "memory": in-process dictionaries, for tests and benchmarks
+
+Every backend returns private copies of its data, so callers may modify
+what they read. Callers still serialize chat writes with chat_locks.chat_lock.
+"""
+
+import copy
+import json
+import os
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from config import Config
+from .chat_index import (
+    build_index_entry, update_chat_index, update_chat_index_entries, remove_from_chat_index,
+    list_chat_index, paginate_index_entries, decode_cursor, encode_cursor
+)
+from .chat_storage import (
+    load_chat_header, save_chat_header, create_chat, delete_chat, list_chat_ids,
+    append_conversation, update_conversation, read_conversation_page, iter_conversations,
+    write_json_atomic, import_chat
+)
+from .data_cache import (
+    load_character, invalidate_character, get_character_path,
+    load_scenario, invalidate_scenario, get_scenario_path,
+    load_templates, invalidate_templates, get_templates_path
+)
+
+
+class StorageBackend(ABC):
+    """Interface implemented by every storage backend"""
+
+    name = "base"
+
+    # Characters
+
+    @abstractmethod
+    def get_character(self, character_id):
+        """Get a character by ID, or None"""
+
+    @abstractmethod
+    def list_characters(self):
+        """List all characters"""
+
+    @abstractmethod
+    def save_character(self, character):
+        """Create or replace a character"""
+
+    @abstractmethod
+    def delete_character(self, character_id):
+        """Delete a character. Returns False if it did not exist."""
+
+    # Chats
+
+    @abstractmethod
+    def get_chat(self, chat_id):
+        """Get a chat header (state without conversations) by ID, or None"""
+
+    @abstractmethod
+    def create_chat(self, chat_instance):
+        """Create a chat from a full chat instance, numbering its initial turns"""
+
+    @abstractmethod
+    def save_chat(self, chat_header, last_entry=None):
+        """Save a chat header; pass the newest turn if one was just appended"""
+
+    @abstractmethod
+    def delete_chat(self, chat_id):
+        """Delete a chat and its turns. Returns False if it did not exist."""
+
+    @abstractmethod
+    def list_chats(self, limit=None, cursor=None, character_id=None):
+        """List chat metadata newest first. Returns (entries, next cursor)."""
+
+    @abstractmethod
+    def iter_chats(self):
+        """Yield every chat header"""
+
+    # Conversation turns
+
+    @abstractmethod
+    def append_turn(self, chat_header, entry):
+        """Append a turn, setting entry["turn"] and chat_header["turn_count"]"""
+
+    @abstractmethod
+    def get_turns(self, chat_id, before=None, after=None, limit=None):
+        """Get a page of turns, oldest first (see chat_storage.read_conversation_page)"""
+
+    @abstractmethod
+    def iter_turns(self, chat_id):
+        """Yield every turn of a chat, oldest first"""
+
+    @abstractmethod
+    def update_turn(self, chat_id, turn, changes):
+        """Update fields of a stored turn, returning the updated turn (or None if missing)"""
+
+    def import_chat(self, chat_header, entries):
+        """Store an existing chat and its turns, keeping their turn ids"""
+        header = dict(chat_header, conversations=[])
+        self.create_chat(header)
+        last_entry = None
+        for entry in entries:
+            self.append_turn(header, entry)
+            last_entry = entry
+        self.save_chat(header, last_entry)
+
+    def import_chats(self, chats):
+        """Store many existing chats, given as (chat header, turns) pairs"""
+        for chat_header, entries in chats:
+            self.import_chat(chat_header, entries)
+
+    # Prompt templates
+
+    @abstractmethod
+    def get_templates(self):
+        """Get the prompt templates (the defaults if none were saved)"""
+
+    @abstractmethod
+    def save_templates(self, templates):
+        """Replace the prompt templates"""
+
+    # Scenarios
+
+    @abstractmethod
+    def get_scenario(self, scenario_id):
+        """Get a scenario by ID, or None"""
+
+    @abstractmethod
+    def list_scenarios(self):
+        """List all scenarios"""
+
+    @abstractmethod
+    def save_scenario(self, scenario):
+        """Create or replace a scenario"""
+
+    @abstractmethod
+    def delete_scenario(self, scenario_id):
+        """Delete a scenario. Returns False if it did not exist."""
+
+
+class FileSystemStorage(StorageBackend):
+    """The JSON file layout under Config.DATA_DIR"""
+
+    name = "filesystem"
+
+    @staticmethod
+    def _list_ids(folder):
+        os.makedirs(folder, exist_ok=True)
+        return [f[:-len('.json')] for f in os.listdir(folder) if f.endswith('.json')]
+
+    def get_character(self, character_id):
+        return load_character(character_id)
+
+    def list_characters(self):
+        characters = []
+        for character_id in self._list_ids(Config.CHARACTERS_FOLDER):
+            character = load_character(character_id)
+            if character is not None:
+                characters.append(character)
+        return characters
+
+    def save_character(self, character):
+        write_json_atomic(get_character_path(character["id"]), character, indent=2)
+        invalidate_character(character["id"])
+
+        # Initialize the memory file for new characters
+        memory_path = os.path.join(Config.MEMORY_FOLDER, f"{character['id']}.json")
+        if not os.path.exists(memory_path):
+            write_json_atomic(memory_path, {"memories": [], "conversations": []}, indent=2)
+
+    def delete_character(self, character_id):
+        character_path = get_character_path(character_id)
+        memory_path = os.path.join(Config.MEMORY_FOLDER, f"{character_id}.json")
+        existed = os.path.exists(character_path)
+
+        if existed:
+            os.remove(character_path)
+        if os.path.exists(memory_path):
+            os.remove(memory_path)
+
+        invalidate_character(character_id)
+        return existed
+
+    def get_chat(self, chat_id):
+        return load_chat_header(chat_id)
+
+    def create_chat(self, chat_instance):
+        create_chat(chat_instance)
+        update_chat_index(chat_instance)
+
+    def save_chat(self, chat_header, last_entry=None):
+        save_chat_header(chat_header)
+        update_chat_index(chat_header, last_entry)
+
+    def delete_chat(self, chat_id):
+        deleted = delete_chat(chat_id)
+        if deleted:
+            remove_from_chat_index(chat_id)
+        return deleted
+
+    def list_chats(self, limit=None, cursor=None, character_id=None):
+        return list_chat_index(limit, cursor, character_id)
+
+    def import_chat(self, chat_header, entries):
+        self.import_chats([(chat_header, entries)])
+
+    def import_chats(self, chats):
+        # Write the chat index once for all the chats, not once per chat
+        imported = [import_chat(chat_header, entries) for chat_header, entries in chats]
+        update_chat_index_entries(imported)
+
+    def iter_chats(self):
+        for chat_id in list_chat_ids():
+            chat_header = load_chat_header(chat_id)
+            if chat_header is not None:
+                yield chat_header
+
+    def append_turn(self, chat_header, entry):
+        append_conversation(chat_header, entry)
+
+    def get_turns(self, chat_id, before=None, after=None, limit=None):
+        return read_conversation_page(chat_id, before=before, after=after, limit=limit)
+
+    def iter_turns(self, chat_id):
+        return iter_conversations(chat_id)
+
+    def update_turn(self, chat_id, turn, changes):
+        return update_conversation(chat_id, turn, changes)
+
+    def get_templates(self):
+        return load_templates()
+
+    def save_templates(self, templates):
+        write_json_atomic(get_templates_path(), templates, indent=2)
+        invalidate_templates()
+
+    def get_scenario(self, scenario_id):
+        return load_scenario(scenario_id)
+
+    def list_scenarios(self):
+        scenarios = []
+        for scenario_id in self._list_ids(Config.SCENARIOS_FOLDER):
+            scenario = load_scenario(scenario_id)
+            if scenario is not None:
+                scenarios.append(scenario)
+        return scenarios
+
+    def save_scenario(self, scenario):
+        write_json_atomic(get_scenario_path(scenario["id"]), scenario, indent=2)
+        invalidate_scenario(scenario["id"])
+
+    def delete_scenario(self, scenario_id):
+        scenario_path = get_scenario_path(scenario_id)
+        if not os.path.exists(scenario_path):
+            return False
+        os.remove(scenario_path)
+        invalidate_scenario(scenario_id)
+        return True
+
+
+class SQLiteStorage(StorageBackend):
+    """A single SQLite database in WAL mode"""
+
+    name = "sqlite"
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS characters (
+        id TEXT PRIMARY KEY,
+        data TEXT NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS chats (
+        id TEXT PRIMARY KEY,
+        character_id TEXT,
+        updated_at TEXT NOT NULL DEFAULT '',
+        last_message TEXT NOT NULL DEFAULT '',
+        data TEXT NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS chats_updated ON chats (updated_at, id);
+    CREATE INDEX IF NOT EXISTS chats_character_updated ON chats (character_id, updated_at, id);
+    CREATE TABLE IF NOT EXISTS turns (
+        chat_id TEXT NOT NULL,
+        turn INTEGER NOT NULL,
+        data TEXT NOT NULL,
+        PRIMARY KEY (chat_id, turn)
+    ) WITHOUT ROWID;
+    CREATE TABLE IF NOT EXISTS templates (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        data TEXT NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS scenarios (
+        id TEXT PRIMARY KEY,
+        data TEXT NOT NULL
+    );
+    """
+
+    # Number of turns inserted per statement batch when importing a chat
+    IMPORT_BATCH_SIZE = 1000
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn().executescript(self.SCHEMA)
+
+    def _conn(self):
+        """Get this thread's connection"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _get_json(self, table, row_id):
+        row = self._conn().execute(f"SELECT data FROM {table} WHERE id = ?", (row_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def _list_json(self, table):
+        return [json.loads(row[0]) for row in self._conn().execute(f"SELECT data FROM {table}")]
+
+    def _put_json(self, table, row_id, data):
+        conn = self._conn()
+        with conn:
+            conn.execute(
+                f"INSERT INTO {table} (id, data) VALUES (?, ?) "
+                "ON CONFLICT(id) DO UPDATE SET data = excluded.data",
+                (row_id, json.dumps(data))
+            )
+
+    def _delete_row(self, table, row_id):
+        conn = self._conn()
+        with conn:
+            return conn.execute(f"DELETE FROM {table} WHERE id = ?", (row_id,)).rowcount > 0
+
+    def get_character(self, character_id):
+        return self._get_json("characters", character_id)
+
+    def list_characters(self):
+        return self._list_json("characters")
+
+    def save_character(self, character):
+        self._put_json("characters", character["id"], character)
+
+    def delete_character(self, character_id):
+        return self._delete_row("characters", character_id)
+
+    def get_chat(self, chat_id):
+        return self._get_json("chats", chat_id)
+
+    def _write_chat_row(self, conn, chat_header, last_entry):
+        header = {k: v for k, v in chat_header.items() if k != "conversations"}
+        preview = None
+        if last_entry is not None:
+            preview = build_index_entry(header, last_entry)["last_message"]
+
+        conn.execute(
+            "INSERT INTO chats (id, character_id, updated_at, last_message, data) "
+            "VALUES (?, ?, ?, COALESCE(?, ''), ?) "
+            "ON CONFLICT(id) DO UPDATE SET character_id = excluded.character_id, "
+            "updated_at = excluded.updated_at, data = excluded.data, "
+            "last_message = COALESCE(?, last_message)",
+            (header["id"], header.get("character_id"), header.get("updated_at", ""),
+             preview, json.dumps(header), preview)
+        )
+
+    def _insert_turns(self, conn, chat_id, entries):
+        conn.executemany(
+            "INSERT OR REPLACE INTO turns (chat_id, turn, data) VALUES (?, ?, ?)",
+            [(chat_id, entry["turn"], json.dumps(entry)) for entry in entries]
+        )
+
+    def create_chat(self, chat_instance):
+        conversations = chat_instance.get("conversations", [])
+        for turn, entry in enumerate(conversations, start=1):
+            entry["turn"] = turn
+        chat_instance["turn_count"] = len(conversations)
+
+        conn = self._conn()
+        with conn:
+            self._write_chat_row(conn, chat_instance, conversations[-1] if conversations else None)
+            self._insert_turns(conn, chat_instance["id"], conversations)
+
+    def save_chat(self, chat_header, last_entry=None):
+        conn = self._conn()
+        with conn:
+            self._write_chat_row(conn, chat_header, last_entry)
+
+    def delete_chat(self, chat_id):
+        conn = self._conn()
+        with conn:
+            conn.execute("DELETE FROM turns WHERE chat_id = ?", (chat_id,))
+            return conn.execute("DELETE FROM chats WHERE id = ?", (chat_id,)).rowcount > 0
+
+    def list_chats(self, limit=None, cursor=None, character_id=None):
+        sql = "SELECT data, last_message FROM chats"
+        conditions = []
+        params = []
+
+        if character_id:
+            conditions.append("character_id = ?")
+            params.append(character_id)
+        if cursor:
+            conditions.append("(updated_at, id) < (?, ?)")
+            params.extend(decode_cursor(cursor))
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+
+        # Fetch one extra row to know whether another page exists
+        sql += " ORDER BY updated_at DESC, id DESC LIMIT ?"
+        params.append(limit + 1 if limit is not None else -1)
+
+        entries = []
+        for data, last_message in self._conn().execute(sql, params):
+            entry = build_index_entry(json.loads(data))
+            entry["last_message"] = last_message
+            entries.append(entry)
+
+        next_cursor = None
+        if limit is not None and len(entries) > limit:
+            entries = entries[:limit]
+            next_cursor = encode_cursor(entries[-1])
+        return entries, next_cursor
+
+    def iter_chats(self):
+        for row in self._conn().execute("SELECT data FROM chats"):
+            yield json.loads(row[0])
+
+    def append_turn(self, chat_header, entry):
+        conn = self._conn()
+        with conn:
+            row = conn.execute(
+                "SELECT MAX(turn) FROM turns WHERE chat_id = ?", (chat_header["id"],)
+            ).fetchone()
+            entry["turn"] = (row[0] or 0) + 1
+            self._insert_turns(conn, chat_header["id"], [entry])
+        chat_header["turn_count"] = entry["turn"]
+
+    def get_turns(self, chat_id, before=None, after=None, limit=None):
+        if limit is not None and limit <= 0:
+            return []
+
+        sql = "SELECT data FROM turns WHERE chat_id = ?"
+        params = [chat_id]
+        if before is not None:
+            sql += " AND turn < ?"
+            params.append(before)
+        if after is not None:
+            sql += " AND turn > ?"
+            params.append(after)
+
+        # Without `after` the newest turns are wanted, so read them backwards
+        sql += " ORDER BY turn ASC" if after is not None else " ORDER BY turn DESC"
+        sql += " LIMIT ?"
+        params.append(limit if limit is not None else -1)
+
+        entries = [json.loads(row[0]) for row in self._conn().execute(sql, params)]
+        if after is None:
+            entries.reverse()
+        return entries
+
+    def iter_turns(self, chat_id):
+        cursor = self._conn().execute(
+            "SELECT data FROM turns WHERE chat_id = ? ORDER BY turn", (chat_id,)
+        )
+        for row in cursor:
+            yield json.loads(row[0])
+
+    def update_turn(self, chat_id, turn, changes):
+        conn = self._conn()
+        with conn:
+            row = conn.execute(
+                "SELECT data FROM turns WHERE chat_id = ? AND turn = ?", (chat_id, turn)
+            ).fetchone()
+            if row is None:
+                return None
+            entry = json.loads(row[0])
+            entry.update(changes)
+            conn.execute(
+                "UPDATE turns SET data = ? WHERE chat_id = ? AND turn = ?",
+                (json.dumps(entry), chat_id, turn)
+            )
+        return entry
+
+    def import_chat(self, chat_header, entries):
+        header = {k: v for k, v in chat_header.items() if k != "conversations"}
+        conn = self._conn()
+        batch = []
+        last_entry = None
+        turn_count = 0
+
+        with conn:
+            for entry in entries:
+                batch.append(entry)
+                last_entry = entry
+                turn_count = max(turn_count, entry["turn"])
+                if len(batch) >= self.IMPORT_BATCH_SIZE:
+                    self._insert_turns(conn, header["id"], batch)
+                    batch = []
+            self._insert_turns(conn, header["id"], batch)
+
+            header["turn_count"] = turn_count
+            self._write_chat_row(conn, header, last_entry)
+
+    def get_templates(self):
+        row = self._conn().execute("SELECT data FROM templates WHERE id = 1").fetchone()
+        return json.loads(row[0]) if row else copy.deepcopy(Config.DEFAULT_TEMPLATES)
+
+    def save_templates(self, templates):
+        self._put_json("templates", 1, templates)
+
+    def get_scenario(self, scenario_id):
+        return self._get_json("scenarios", scenario_id)
+
+    def list_scenarios(self):
+        return self._list_json("scenarios")
+
+    def save_scenario(self, scenario):
+        self._put_json("scenarios", scenario["id"], scenario)
+
+    def delete_scenario(self, scenario_id):
+        return self._delete_row("scenarios", scenario_id)
+
+
+class MemoryStorage(StorageBackend):
+    """In-process dictionaries; nothing is persisted"""
+
+    name = "memory"
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._characters = {}
+        self._chats = {}
+        self._previews = {}
+        self._turns = {}
+        self._templates = None
+        self._scenarios = {}
+
+    def get_character(self, character_id):
+        return copy.deepcopy(self._characters.get(character_id))
+
+    def list_characters(self):
+        return copy.deepcopy(list(self._characters.values()))
+
+    def save_character(self, character):
+        self._characters[character["id"]] = copy.deepcopy(character)
+
+    def delete_character(self, character_id):
+        return self._characters.pop(character_id, None) is not None
+
+    def get_chat(self, chat_id):
+        return copy.deepcopy(self._chats.get(chat_id))
+
+    def create_chat(self, chat_instance):
+        conversations = chat_instance.get("conversations", [])
+        for turn, entry in enumerate(conversations, start=1):
+            entry["turn"] = turn
+        chat_instance["turn_count"] = len(conversations)
+
+        with self._lock:
+            self._turns[chat_instance["id"]] = copy.deepcopy(conversations)
+        self.save_chat(chat_instance, conversations[-1] if conversations else None)
+
+    def save_chat(self, chat_header, last_entry=None):
+        header = copy.deepcopy({k: v for k, v in chat_header.items() if k != "conversations"})
+        with self._lock:
+            self._chats[header["id"]] = header
+            if last_entry is not None:
+                self._previews[header["id"]] = build_index_entry(header, last_entry)["last_message"]
+
+    def delete_chat(self, chat_id):
+        with self._lock:
+            self._turns.pop(chat_id, None)
+            self._previews.pop(chat_id, None)
+            return self._chats.pop(chat_id, None) is not None
+
+    def list_chats(self, limit=None, cursor=None, character_id=None):
+        with self._lock:
+            entries = []
+            for chat_id, header in self._chats.items():
+                entry = build_index_entry(header)
+                entry["last_message"] = self._previews.get(chat_id, "")
+                entries.append(entry)
+        return paginate_index_entries(entries, limit, cursor, character_id)
+
+    def iter_chats(self):
+        for header in list(self._chats.values()):
+            yield copy.deepcopy(header)
+
+    def append_turn(self, chat_header, entry):
+        with self._lock:
+            turns = self._turns.setdefault(chat_header["id"], [])
+            entry["turn"] = turns[-1]["turn"] + 1 if turns else 1
+            turns.append(copy.deepcopy(entry))
+        chat_header["turn_count"] = entry["turn"]
+
+    def get_turns(self, chat_id, before=None, after=None, limit=None):
+        if limit is not None and limit <= 0:
+            return []
+        with self._lock:
+            entries = [
+                e for e in self._turns.get(chat_id, [])
+                if (before is None or e["turn"] < before) and (after is None or e["turn"] > after)
+            ]
+        if limit is not None:
+            entries = entries[:limit] if after is not None else entries[-limit:]
+        return copy.deepcopy(entries)
+
+    def iter_turns(self, chat_id):
+        for entry in list(self._turns.get(chat_id, [])):
+            yield copy.deepcopy(entry)
+
+    def update_turn(self, chat_id, turn, changes):
+        with self._lock:
+            for entry in self._turns.get(chat_id, []):
+                if entry["turn"] == turn:
+                    entry.update(copy.deepcopy(changes))
+                    return copy.deepcopy(entry)
+        return None
+
+    def get_templates(self):
+        if self._templates is None:
+            return copy.deepcopy(Config.DEFAULT_TEMPLATES)
+        return copy.deepcopy(self._templates)
+
+    def save_templates(self, templates):
+        self._templates = copy.deepcopy(templates)
+
+    def get_scenario(self, scenario_id):
+        return copy.deepcopy(self._scenarios.get(scenario_id))
+
+    def list_scenarios(self):
+        return copy.deepcopy(list(self._scenarios.values()))
+
+    def save_scenario(self, scenario):
+        self._scenarios[scenario["id"]] = copy.deepcopy(scenario)
+
+    def delete_scenario(self, scenario_id):
+        return self._scenarios.pop(scenario_id, None) is not None
+
+
+def create_storage(backend_name, sqlite_path=None):
+    """Create a storage backend by name ("filesystem", "sqlite" or "memory")"""
+    if backend_name == "filesystem":
+        return FileSystemStorage()
+    if backend_name == "sqlite":
+        return SQLiteStorage(sqlite_path or Config.SQLITE_STORAGE_PATH)
+    if backend_name == "memory":
+        return MemoryStorage()
+    raise ValueError(f"Unknown storage backend: {backend_name}")
+
+
+_storage = None
+_storage_lock = threading.Lock()
+
+
+def get_storage():
+    """Get the storage backend configured by Config.STORAGE_BACKEND"""
+    global _storage
+    if _storage is None:
+        with _storage_lock:
+            if _storage is None:
+                _storage = create_storage(Config.STORAGE_BACKEND)
+    return _storage
+
+
+def set_storage(storage):
+    """Replace the active storage backend (e.g. with a MemoryStorage in tests)"""
+    global _storage
+    _storage = storage
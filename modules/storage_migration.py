@@ -0,0 +1,78 @@
+"""
+Command-line tool for copying stored data from one storage backend to another.
+
+Chats are streamed one at a time and their turns are read lazily, so large
+data folders can be migrated without loading everything into memory.
+
+Usage:
+    python -m modules.storage_migration --source filesystem --target sqlite
+    python -m modules.storage_migration --target sqlite --sqlite-path /path/to/storage.db
+"""
+
+import argparse
+import time
+from config import Config
+from .storage import create_storage
+
+
+def migrate_storage(source, target, progress_every=1000):
+    """
+    Copy characters, templates, scenarios, chats and turns from `source` to `target`.
+
+    Returns:
+        dict: Number of migrated items per kind
+    """
+    counts = {"characters": 0, "scenarios": 0, "chats": 0, "turns": 0}
+
+    for character in source.list_characters():
+        target.save_character(character)
+        counts["characters"] += 1
+
+    target.save_templates(source.get_templates())
+
+    for scenario in source.list_scenarios():
+        target.save_scenario(scenario)
+        counts["scenarios"] += 1
+
+    def counted(entries):
+        for entry in entries:
+            counts["turns"] += 1
+            yield entry
+
+    def chats():
+        for chat_header in source.iter_chats():
+            yield chat_header, counted(source.iter_turns(chat_header["id"]))
+            counts["chats"] += 1
+            if progress_every and counts["chats"] % progress_every == 0:
+                print(f"Migrated {counts['chats']} chats ({counts['turns']} turns)...")
+
+    target.import_chats(chats())
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Copy stored data between storage backends")
+    parser.add_argument("--source", default="filesystem", choices=["filesystem", "sqlite"])
+    parser.add_argument("--target", default="sqlite", choices=["filesystem", "sqlite"])
+    parser.add_argument("--sqlite-path", default=Config.SQLITE_STORAGE_PATH,
+                        help="SQLite database used by the sqlite side of the migration")
+    args = parser.parse_args()
+
+    if args.source == args.target:
+        parser.error("Source and target backends must differ")
+
+    source = create_storage(args.source, args.sqlite_path)
+    target = create_storage(args.target, args.sqlite_path)
+
+    start = time.perf_counter()
+    counts = migrate_storage(source, target)
+    elapsed = time.perf_counter() - start
+
+    print(f"Migrated {counts['characters']} characters, {counts['scenarios']} scenarios, "
+          f"{counts['chats']} chats and {counts['turns']} turns in {elapsed:.1f}s")
+    if args.target == "sqlite":
+        print(f"Set STORAGE_BACKEND=sqlite and SQLITE_STORAGE_PATH={args.sqlite_path} to use it.")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,9 +1,22 @@
 from flask import jsonify, request
 import json
 import os
-import requests
 from datetime import datetime
 from config import Config
+from . import http_client, async_http_client, single_flight
+from .conversation_summary import get_summary_stats
+from .data_cache import get_cache_stats
+from .jobs import get_job_stats
+from .local_model import get_local_model_stats
+from .llm_scheduler import (LLMOverloaded, llm_priority, llm_slot, get_llm_scheduler_stats,
+                            PRIORITY_DIAGNOSTIC, PROVIDER_OPENROUTER, PROVIDER_LOCAL)
+from .model_catalog import get_model_catalog, get_model_catalog_stats
+from .prompt_prefix import get_prompt_prefix_stats
+from .prompt_templates import get_template_stats
+from .scenario_context import get_scenario_context_stats
+from .response_cache import get_response_cache_stats
+from .scene_tasks import get_scene_stats
+from .storage import get_storage
 
 def register_system_routes(app):
     """Register system management routes with the Flask app"""
@@ -11,14 +24,8 @@ def register_system_routes(app):
     @app.route('/api/config', methods=['GET'])
     def get_public_config():
         """Get public configuration (no sensitive data)"""
-        # Get models from the models endpoint
-        # This requires a bit of hackery since we're calling another endpoint
-        from .ai_integration import get_models
-        models_response = get_models()
-        models_data = json.loads(models_response.get_data(as_text=True))
-        
-        # Extract just the models list
-        models = models_data.get("models", [])
+        # Served from the cached model catalog, so this doesn't wait on OpenRouter
+        models = get_model_catalog()["models"]
         
         # Format for the dropdown
         available_models = []
@@ -44,10 +51,13 @@ def register_system_routes(app):
             try:
                 local_url = data.get("localModelUrl", Config.LOCAL_MODEL_URL)
                 test_data = {
+                    "model": Config.LOCAL_MODEL_NAME,
                     "prompt": "Say hello",
-                    "max_tokens": 5
+                    "stream": False,
+                    "options": {"num_predict": 5}
                 }
-                response = requests.post(local_url, json=test_data, timeout=5)
+                with llm_priority(PRIORITY_DIAGNOSTIC), llm_slot(PROVIDER_LOCAL, timeout=5):
+                    response = http_client.post(local_url, json=test_data, timeout=5)
                 if response.status_code == 200:
                     return jsonify({"success": True, "message": "Successfully connected to local model"})
                 else:
@@ -68,10 +78,11 @@ def register_system_routes(app):
                     ]
                 }
                 
-                response = requests.post("https://openrouter.ai/api/v1/chat/completions", 
-                                       headers=headers, 
-                                       json=data,
-                                       timeout=5)
+                with llm_priority(PRIORITY_DIAGNOSTIC), llm_slot(PROVIDER_OPENROUTER, model, timeout=5):
+                    response = http_client.post(http_client.OPENROUTER_CHAT_URL,
+                                              headers=headers, 
+                                              json=data,
+                                              timeout=5)
                 
                 if response.status_code == 200:
                     return jsonify({"success": True, "message": "API key is valid"})
@@ -92,32 +103,17 @@ def register_system_routes(app):
         
         if Config.OPENROUTER_API_KEY:
             try:
-                headers = {
-                    "Authorization": f"Bearer {Config.OPENROUTER_API_KEY}",
-                    "HTTP-Referer": "https://localhost:5000",
-                    "X-Title": "AI Character Chat",
-                    "Content-Type": "application/json"
-                }
-                
-                test_response = requests.get("https://openrouter.ai/api/v1/auth/key", headers=headers, timeout=5)
-                
-                if test_response.status_code == 200:
-                    openrouter_status = "Connected"
-                    try:
-                        credit_info = test_response.json()
-                        openrouter_message = f"Credits: {credit_info.get('credit', 'unknown')}"
-                    except:
-                        openrouter_message = "Could not parse credit information"
-                else:
-                    openrouter_status = "Error"
-                    openrouter_message = f"Status {test_response.status_code}: {test_response.text}"
+                # Tabs opened together all ask at once; they share one upstream check
+                openrouter_status, openrouter_message = single_flight.do(
+                    "auth_key", Config.OPENROUTER_API_KEY, check_openrouter_key
+                )
             except Exception as e:
                 openrouter_status = "Error"
                 openrouter_message = str(e)
         
-        # Check characters folder
+        # Check character storage
         try:
-            character_count = len([f for f in os.listdir(Config.CHARACTERS_FOLDER) if f.endswith('.json')])
+            character_count = len(get_storage().list_characters())
             characters_status = f"Found {character_count} characters"
         except Exception as e:
             characters_status = f"Error: {str(e)}"
@@ -128,6 +124,7 @@ def register_system_routes(app):
             "config": {
                 "api_key": api_key_status,
                 "default_model": Config.DEFAULT_MODEL,
+                "storage_backend": get_storage().name,
                 "characters_folder": Config.CHARACTERS_FOLDER,
                 "memory_folder": Config.MEMORY_FOLDER,
                 "debug_mode": Config.DEBUG
@@ -140,4 +137,57 @@ def register_system_routes(app):
                 "status": characters_status
             },
             "server_time": datetime.now().isoformat()
-        })
\ No newline at end of file
+        })
+
+    @app.route('/api/metrics', methods=['GET'])
+    def get_metrics():
+        """Get runtime counters for caches and other shared subsystems"""
+        return jsonify({
+            "async_http_pool": async_http_client.get_pool_stats(),
+            "data_cache": get_cache_stats(),
+            "http_pool": http_client.get_pool_stats(),
+            "jobs": get_job_stats(),
+            "llm_scheduler": get_llm_scheduler_stats(),
+            "local_model": get_local_model_stats(),
+            "model_catalog": get_model_catalog_stats(),
+            "prompt_prefix": get_prompt_prefix_stats(),
+            "prompt_templates": get_template_stats(),
+            "scenario_context": get_scenario_context_stats(),
+            "response_cache": get_response_cache_stats(),
+            "scenes": get_scene_stats(),
+            "single_flight": single_flight.get_single_flight_stats(),
+            "summaries": get_summary_stats(),
+            "server_time": datetime.now().isoformat()
+        })
+
+    @app.errorhandler(LLMOverloaded)
+    def handle_llm_overloaded(error):
+        """Too many model calls are waiting; the client should retry later"""
+        response = jsonify({"success": False, "error": str(error), "message": str(error)})
+        response.headers["Retry-After"] = str(error.retry_after)
+        return response, 429
+
+
+def check_openrouter_key():
+    """
+    Ask OpenRouter about the configured API key.
+
+    Returns:
+        tuple: (status, message) for the diagnostic endpoint
+    """
+    headers = {
+        "Authorization": f"Bearer {Config.OPENROUTER_API_KEY}",
+        "HTTP-Referer": "https://localhost:5000",
+        "X-Title": "AI Character Chat",
+        "Content-Type": "application/json"
+    }
+    
+    test_response = http_client.get(f"{http_client.OPENROUTER_BASE_URL}/auth/key", headers=headers, timeout=5)
+    
+    if test_response.status_code != 200:
+        return "Error", f"Status {test_response.status_code}: {test_response.text}"
+    try:
+        credit_info = test_response.json()
+        return "Connected", f"Credits: {credit_info.get('credit', 'unknown')}"
+    except:
+        return "Connected", "Could not parse credit information"
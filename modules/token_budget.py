@@ -0,0 +1,108 @@
+"""
+Token budgeting for the chat system prompt.
+
+The prompt has to fit the model's context window next to the user's message
+and the reply, and on big models it should not grow without limit either
+(every prompt token is paid for on every turn). Its sections are added in
+priority order (character core, state, scenario, recent turns) until the
+budget runs out; the required ones (character core and the response
+instructions) are always kept.
+
+Token counts are estimates (about four characters per token for English
+text); no tokenizer is needed and they are good enough to stay clear of the
+limit. Conversation entries store their count when they are written, so
+building a prompt does not re-measure old turns.
+"""
+
+from config import Config
+from .model_catalog import get_model_info
+
+# Average characters per token of English text in common tokenizers
+CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(text):
+    """Estimate the number of tokens in a text"""
+    if not text:
+        return 0
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def get_context_length(use_local_model=False):
+    """Context window of the chat model: from the model catalog, or the configured defaults"""
+    if use_local_model:
+        return Config.LOCAL_MODEL_CONTEXT_LENGTH
+    model = get_model_info(Config.DEFAULT_MODEL)
+    return (model or {}).get("context_length") or Config.DEFAULT_CONTEXT_LENGTH
+
+
+def get_prompt_token_limit(use_local_model=False):
+    """
+    Tokens available to the system prompt and the user's message: the
+    context window minus room for the reply, capped at Config.PROMPT_TOKEN_BUDGET.
+    """
+    available = get_context_length(use_local_model) - Config.RESPONSE_TOKEN_RESERVE
+    return max(min(Config.PROMPT_TOKEN_BUDGET, available), 0)
+
+
+class PromptBudget:
+    """Tokens used by each section of one prompt, against a limit"""
+
+    def __init__(self, limit=None):
+        # None: no limit, every section fits
+        self.limit = limit
+        self.used = 0
+        # section -> tokens, in the order the sections were added
+        self.sections = {}
+        self.dropped = {}
+
+    @property
+    def remaining(self):
+        return None if self.limit is None else self.limit - self.used
+
+    def _count(self, section, tokens):
+        self.used += tokens
+        self.sections[section] = self.sections.get(section, 0) + tokens
+
+    def take(self, section, text, tokens=None):
+        """Add a required section, whether or not it fits"""
+        self._count(section, estimate_tokens(text) if tokens is None else tokens)
+        return text
+
+    def take_if_fits(self, section, text, tokens=None):
+        """Add an optional section if it fits; returns whether it was added"""
+        tokens = estimate_tokens(text) if tokens is None else tokens
+        if self.limit is not None and tokens > self.remaining:
+            self.dropped[section] = self.dropped.get(section, 0) + 1
+            return False
+        self._count(section, tokens)
+        return True
+
+    def take_truncated(self, section, text):
+        """Add as many whole lines of a section as fit; returns them"""
+        if self.take_if_fits(section, text):
+            return text
+        kept = []
+        remaining = self.remaining
+        for line in text.split("\n"):
+            tokens = estimate_tokens(line + "\n")
+            if tokens > remaining:
+                break
+            kept.append(line)
+            remaining -= tokens
+        text = "\n".join(kept)
+        self._count(section, estimate_tokens(text))
+        return text
+
+    def describe(self):
+        """One-line breakdown for the logs"""
+        parts = [f"{section}={tokens}" for section, tokens in self.sections.items()]
+        line = ", ".join(parts) + f" | total={self.used}"
+        if self.limit is not None:
+            line += f"/{self.limit}"
+        if self.dropped:
+            line += " | dropped " + ", ".join(f"{section} x{count}" for section, count in self.dropped.items())
+        return line
+
+    def to_dict(self):
+        return {"limit": self.limit, "used": self.used, "sections": dict(self.sections), "dropped": dict(self.dropped)}
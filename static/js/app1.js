@@ -3105,7 +3105,9 @@ async function savePromptTemplates() {
         });
         
         if (!response.ok) {
-            throw new Error(`Failed to save prompt templates: ${response.statusText}`);
+            // Invalid templates are rejected with the reason
+            const data = await response.json().catch(() => ({}));
+            throw new Error(data.error || `Failed to save prompt templates: ${response.statusText}`);
         }
         
         // Update state
@@ -3114,7 +3116,7 @@ async function savePromptTemplates() {
         showNotification('Prompt templates saved successfully!', 'success');
     } catch (error) {
         console.error('Error saving prompt templates:', error);
-        showNotification('Failed to save prompt templates. Please try again.', 'error');
+        showNotification(`Failed to save prompt templates: ${error.message}`, 'error');
     } finally {
         hideLoading();
     }
@@ -3910,7 +3912,9 @@ if (document.readyState === 'complete' || document.readyState === 'interactive')
             });
             
             if (!response.ok) {
-                throw new Error(`Failed to save prompt templates: ${response.statusText}`);
+                // Invalid templates are rejected with the reason
+                const data = await response.json().catch(() => ({}));
+                throw new Error(data.error || `Failed to save prompt templates: ${response.statusText}`);
             }
             
             // Update state
@@ -3919,7 +3923,7 @@ if (document.readyState === 'complete' || document.readyState === 'interactive')
             showNotification('Prompt templates saved successfully!', 'success');
         } catch (error) {
             console.error('Error saving prompt templates:', error);
-            showNotification('Failed to save prompt templates. Please try again.', 'error');
+            showNotification(`Failed to save prompt templates: ${error.message}`, 'error');
         } finally {
             hideLoading();
         }
@@ -105,7 +105,7 @@ async function sendMessage() {
         }
         
         // Add character response to UI
-        addCharacterMessage(responseData.response, {
+        const messageDiv = addCharacterMessage(responseData.response, {
             mood: responseData.mood,
             emotions: responseData.emotions,
             action: responseData.action,
@@ -113,6 +113,9 @@ async function sendMessage() {
             scene_description: responseData.scene_description
         });
         
+        // The scene description may still be generated in the background
+        waitForScene(window.state.currentChat.id, responseData, messageDiv);
+        
         // Scroll to bottom
         window.utils.scrollToBottom();
     } catch (error) {
@@ -227,50 +230,7 @@ function addCharacterMessage(text, metadata) {
     
     // Add scene description if available
     if (metadata.scene_description) {
-        const sceneDiv = document.createElement('div');
-        sceneDiv.className = 'scene-description';
-        
-        sceneDiv.innerHTML = `
-            <div class="scene-toggle">
-                <span>View Scene Description</span>
-                <i class="fas fa-chevron-down"></i>
-            </div>
-            <div class="scene-content">
-                <p>${metadata.scene_description}</p>
-            </div>
-        `;
-        
-        window.elements.chatMessages.appendChild(sceneDiv);
-        
-        // Add toggle functionality for scene description
-        const sceneToggle = sceneDiv.querySelector('.scene-toggle');
-        const sceneContent = sceneDiv.querySelector('.scene-content');
-        
-        sceneToggle.addEventListener('click', () => {
-            sceneToggle.classList.toggle('active');
-            sceneContent.classList.toggle('active');
-            
-            // Update toggle text
-            const toggleText = sceneToggle.querySelector('span');
-            if (sceneContent.classList.contains('active')) {
-                toggleText.textContent = 'Hide Scene Description';
-            } else {
-                toggleText.textContent = 'View Scene Description';
-            }
-            
-            // Scroll to make sure the expanded content is visible
-            if (sceneContent.classList.contains('active')) {
-                setTimeout(() => {
-                    sceneContent.scrollIntoView({ behavior: 'smooth', block: 'nearest' });
-                }, 300);
-            }
-        });
-        
-        // In novel or cinematic modes, open scene descriptions by default
-        const currentMode = window.state.settings.interactionMode || 'simple';
-        if (currentMode === 'novel' || currentMode === 'cinematic') {
-            sceneToggle.click();
-        }
+        addSceneDescription(messageDiv, metadata.scene_description);
     }
     
     window.utils.scrollToBottom();
@@ -280,6 +240,87 @@ function addCharacterMessage(text, metadata) {
         detail: { type: 'character', text: text, metadata: metadata }
     });
     document.dispatchEvent(event);
+    
+    return messageDiv;
+}
+
+// Add a collapsible scene description below a character message
+function addSceneDescription(messageDiv, sceneDescription) {
+    messageDiv.classList.add('with-scene');
+    
+    const sceneDiv = document.createElement('div');
+    sceneDiv.className = 'scene-description';
+    
+    sceneDiv.innerHTML = `
+        <div class="scene-toggle">
+            <span>View Scene Description</span>
+            <i class="fas fa-chevron-down"></i>
+        </div>
+        <div class="scene-content">
+            <p>${sceneDescription}</p>
+        </div>
+    `;
+    
+    // Right after its message, even if newer messages were added meanwhile
+    messageDiv.after(sceneDiv);
+    
+    // Add toggle functionality for scene description
+    const sceneToggle = sceneDiv.querySelector('.scene-toggle');
+    const sceneContent = sceneDiv.querySelector('.scene-content');
+    
+    sceneToggle.addEventListener('click', () => {
+        sceneToggle.classList.toggle('active');
+        sceneContent.classList.toggle('active');
+        
+        // Update toggle text
+        const toggleText = sceneToggle.querySelector('span');
+        if (sceneContent.classList.contains('active')) {
+            toggleText.textContent = 'Hide Scene Description';
+        } else {
+            toggleText.textContent = 'View Scene Description';
+        }
+        
+        // Scroll to make sure the expanded content is visible
+        if (sceneContent.classList.contains('active')) {
+            setTimeout(() => {
+                sceneContent.scrollIntoView({ behavior: 'smooth', block: 'nearest' });
+            }, 300);
+        }
+    });
+    
+    // In novel or cinematic modes, open scene descriptions by default
+    const currentMode = window.state.settings.interactionMode || 'simple';
+    if (currentMode === 'novel' || currentMode === 'cinematic') {
+        sceneToggle.click();
+    }
+}
+
+// Fetch a scene description still being generated in the background (scene_status "pending")
+// and add it below its message once it arrives
+async function waitForScene(chatId, responseData, messageDiv) {
+    if (!messageDiv || responseData.scene_status !== 'pending' || !responseData.turn) return;
+    
+    const sceneUrl = `${window.API.BASE_URL}${window.API.CHAT}/${chatId}/scene/${responseData.turn}`;
+    
+    try {
+        // The server holds each request until the scene is ready or the wait runs out
+        for (let attempt = 0; attempt < 5; attempt++) {
+            const response = await fetch(`${sceneUrl}?wait=20`);
+            if (!response.ok) {
+                throw new Error(`API responded with status ${response.status}`);
+            }
+            
+            const scene = await response.json();
+            if (scene.status === 'pending') continue;
+            
+            if (scene.scene_description && messageDiv.isConnected) {
+                addSceneDescription(messageDiv, scene.scene_description);
+            }
+            return;
+        }
+    } catch (error) {
+        console.error('Error fetching scene description:', error);
+    }
 }
 
 // Get icon for action based on the action text
@@ -529,6 +570,7 @@ window.chat = {
     sendMessage: sendMessage,
     addUserMessage: addUserMessage,
     addCharacterMessage: addCharacterMessage,
+    waitForScene: waitForScene,
     updateCharacterMoodUI: updateCharacterMoodUI,
     saveConversation: saveConversation,
     clearConversation: clearConversation,
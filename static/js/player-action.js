@@ -924,7 +924,7 @@ async function sendActionToAI(actionText, actionResult) {
         }
         
         // Add character response to UI
-        window.chat.addCharacterMessage(responseData.response, {
+        const messageDiv = window.chat.addCharacterMessage(responseData.response, {
             mood: responseData.mood,
             emotions: responseData.emotions,
             action: responseData.action,
@@ -932,6 +932,9 @@ async function sendActionToAI(actionText, actionResult) {
             scene_description: responseData.scene_description
         });
         
+        // The scene description may still be generated in the background
+        window.chat.waitForScene(window.state.currentChat.id, responseData, messageDiv);
+        
         // Scroll to bottom
         window.utils.scrollToBottom();
     } catch (error) {
@@ -0,0 +1,38 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import Config  # noqa: E402
+from modules import chat_index, storage  # noqa: E402
+
+
+@pytest.fixture
+def data_dir(tmp_path, monkeypatch):
+    """Redirect every data path to a scratch folder"""
+    folder = str(tmp_path)
+    paths = {
+        "DATA_DIR": folder,
+        "CHARACTERS_FOLDER": os.path.join(folder, "characters"),
+        "MEMORY_FOLDER": os.path.join(folder, "memory"),
+        "TEMPLATES_FOLDER": os.path.join(folder, "templates"),
+        "CHAT_INSTANCES_FOLDER": os.path.join(folder, "chat_instances"),
+        "SCENARIOS_FOLDER": os.path.join(folder, "scenarios"),
+        "CHAT_INDEX_PATH": os.path.join(folder, "chat_index.json"),
+        "LOCKS_FOLDER": os.path.join(folder, "locks"),
+        "SQLITE_STORAGE_PATH": os.path.join(folder, "storage.db"),
+        "SEARCH_INDEX_PATH": os.path.join(folder, "search_index.db"),
+        "RESPONSE_CACHE_FOLDER": os.path.join(folder, "response_cache"),
+        "MODEL_CATALOG_PATH": os.path.join(folder, "model_catalog.json"),
+        "JOBS_FOLDER": os.path.join(folder, "jobs"),
+    }
+    for name, path in paths.items():
+        monkeypatch.setattr(Config, name, path)
+    monkeypatch.setattr(chat_index, "_index_entries", None)
+    monkeypatch.setattr(chat_index, "_index_stamp", None)
+    monkeypatch.setattr(chat_index, "_log_offset", 0)
+    monkeypatch.setattr(chat_index, "_log_records", 0)
+    monkeypatch.setattr(storage, "_storage", None)
+    return folder
@@ -0,0 +1,149 @@
+import asyncio
+import re
+import time
+
+import pytest
+from flask import Flask, Response, request, stream_with_context
+
+import asgi
+from modules.llm_scheduler import LLMOverloaded
+
+
+def call(path, method="POST", body=b"{}"):
+    """Run one request through the ASGI app; returns the messages it sent"""
+    return asyncio.run(call_async(path, method, body))
+
+
+async def call_async(path, method="POST", body=b"{}", query_string=b""):
+    sent = []
+
+    async def receive():
+        return {"type": "http.request", "body": body, "more_body": False}
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {"type": "http", "method": method, "path": path, "headers": [],
+             "query_string": query_string, "server": ("testserver", 80)}
+    await asgi.app(scope, receive, send)
+    return sent
+
+
+def route(monkeypatch, handler):
+    monkeypatch.setattr(asgi, "ASYNC_ROUTES", [("POST", re.compile(r"^/test$"), handler)])
+
+
+def starts(sent):
+    return [m for m in sent if m["type"] == "http.response.start"]
+
+
+def test_error_before_response_is_a_500(monkeypatch):
+    async def handler(request, send):
+        raise RuntimeError("boom")
+
+    route(monkeypatch, handler)
+    sent = call("/test")
+    assert [m["status"] for m in starts(sent)] == [500]
+    assert b"boom" in sent[-1]["body"]
+
+
+def test_overload_is_a_429_with_retry_after(monkeypatch):
+    async def handler(request, send):
+        raise LLMOverloaded("busy", retry_after=3)
+
+    route(monkeypatch, handler)
+    sent = call("/test")
+    assert [m["status"] for m in starts(sent)] == [429]
+    assert (b"retry-after", b"3") in sent[0]["headers"]
+
+
+def test_error_mid_stream_ends_the_stream_with_an_error_event(monkeypatch):
+    async def handler(request, send):
+        await asgi.start_response(send, 200, "text/event-stream")
+        await send({"type": "http.response.body", "body": b"event: token\ndata: {}\n\n", "more_body": True})
+        raise RuntimeError("upstream died")
+
+    route(monkeypatch, handler)
+    sent = call("/test")
+    assert [m["status"] for m in starts(sent)] == [200]
+    assert sent[-1]["body"].startswith(b"event: error")
+    assert b"upstream died" in sent[-1]["body"]
+    assert not sent[-1].get("more_body")
+
+
+def test_error_mid_json_response_is_left_to_the_server(monkeypatch):
+    async def handler(request, send):
+        await asgi.start_response(send, 200, "application/json")
+        raise RuntimeError("boom")
+
+    route(monkeypatch, handler)
+    with pytest.raises(RuntimeError):
+        call("/test")
+
+
+def test_flask_routes_are_served(monkeypatch):
+    route(monkeypatch, None)
+    sent = call("/api/check-routes", method="GET")
+    assert [m["status"] for m in starts(sent)] == [200]
+    assert b'"success"' in b"".join(m.get("body", b"") for m in sent)
+
+
+def test_concurrent_flask_event_streams_keep_their_request_context(monkeypatch):
+    flask_app = Flask(__name__)
+
+    @flask_app.route("/events")
+    def events():
+        def generate():
+            for i in range(5):
+                # Reads the request in every chunk, as the job and scene event routes do
+                yield f"event: tick\ndata: {request.args['n']}-{i}\n\n"
+                time.sleep(0.005)
+
+        return Response(stream_with_context(generate()), mimetype="text/event-stream")
+
+    monkeypatch.setattr(asgi, "flask_app", flask_app)
+
+    async def run():
+        return await asyncio.gather(*(
+            call_async("/events", "GET", query_string=f"n={n}".encode()) for n in range(8)
+        ))
+
+    for n, sent in enumerate(asyncio.run(run())):
+        assert [m["status"] for m in starts(sent)] == [200]
+        body = b"".join(m.get("body", b"") for m in sent).decode()
+        assert body == "".join(f"event: tick\ndata: {n}-{i}\n\n" for i in range(5))
+        assert not sent[-1].get("more_body")
+
+
+def test_flask_stream_stops_when_the_client_goes_away(monkeypatch):
+    flask_app = Flask(__name__)
+    closed = []
+
+    @flask_app.route("/events")
+    def events():
+        def generate():
+            try:
+                for i in range(1000):
+                    yield f"data: {i}\n\n"
+            finally:
+                closed.append(True)
+
+        return Response(stream_with_context(generate()), mimetype="text/event-stream")
+
+    monkeypatch.setattr(asgi, "flask_app", flask_app)
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        if message["type"] == "http.response.body":
+            raise OSError("client disconnected")
+
+    scope = {"type": "http", "method": "GET", "path": "/events", "headers": [],
+             "query_string": b"", "server": ("testserver", 80)}
+    with pytest.raises(OSError):
+        asyncio.run(asgi.app(scope, receive, send))
+    deadline = time.monotonic() + 5
+    while not closed:
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
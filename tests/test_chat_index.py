@@ -0,0 +1,100 @@
+import json
+import os
+
+from config import Config
+from modules import chat_index
+from modules.chat_index import (
+    update_chat_index, remove_from_chat_index, list_chat_index, rebuild_chat_index
+)
+
+
+def make_header(chat_id, updated_at="2025-01-01T00:00:00", title="Chat"):
+    return {"id": chat_id, "character_id": "c1", "title": title,
+            "updated_at": updated_at, "turn_count": 0}
+
+
+def reload_from_disk():
+    """Forget the in-memory copy, as another process would see the index"""
+    chat_index._index_entries = None
+    chat_index._index_stamp = None
+    chat_index._log_offset = 0
+    chat_index._log_records = 0
+
+
+def log_lines():
+    path = Config.CHAT_INDEX_PATH + ".log"
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        return f.read().splitlines()
+
+
+def test_update_appends_to_log_without_rewriting_snapshot(data_dir):
+    update_chat_index(make_header("a"))
+    with open(Config.CHAT_INDEX_PATH) as f:
+        snapshot = f.read()
+
+    update_chat_index(make_header("b", "2025-01-02T00:00:00"))
+    update_chat_index(make_header("a", "2025-01-03T00:00:00"), {"character_response": "Hello"})
+
+    with open(Config.CHAT_INDEX_PATH) as f:
+        assert f.read() == snapshot
+    assert len(log_lines()) == 3
+
+    reload_from_disk()
+    entries, _ = list_chat_index()
+    assert [e["id"] for e in entries] == ["a", "b"]
+    assert entries[0]["last_message"] == "Hello"
+
+
+def test_unchanged_entry_is_not_written(data_dir):
+    update_chat_index(make_header("a"), {"character_response": "Hello"})
+    lines = len(log_lines())
+
+    # A header-only save keeps the preview, so nothing the list shows changed
+    update_chat_index(make_header("a"))
+    assert len(log_lines()) == lines
+
+
+def test_remove_is_logged(data_dir):
+    update_chat_index(make_header("a"))
+    update_chat_index(make_header("b"))
+    remove_from_chat_index("a")
+
+    reload_from_disk()
+    entries, _ = list_chat_index()
+    assert [e["id"] for e in entries] == ["b"]
+
+
+def test_log_is_compacted_into_snapshot(data_dir, monkeypatch):
+    monkeypatch.setattr(chat_index, "COMPACT_MIN_RECORDS", 4)
+    for i in range(10):
+        update_chat_index(make_header("a", f"2025-01-01T00:00:{i:02d}"))
+
+    assert len(log_lines()) < 5
+    reload_from_disk()
+    entries, _ = list_chat_index()
+    assert entries[0]["updated_at"] == "2025-01-01T00:00:09"
+
+
+def test_partial_log_line_is_ignored_and_overwritten(data_dir):
+    update_chat_index(make_header("a"))
+    with open(Config.CHAT_INDEX_PATH + ".log", "ab") as f:
+        f.write(b'{"id": "x", "entr')
+
+    reload_from_disk()
+    update_chat_index(make_header("b"))
+
+    for line in log_lines():
+        json.loads(line)
+    reload_from_disk()
+    entries, _ = list_chat_index()
+    assert sorted(e["id"] for e in entries) == ["a", "b"]
+
+
+def test_rebuild_empties_log(data_dir):
+    update_chat_index(make_header("a"))
+    update_chat_index(make_header("b"))
+    assert rebuild_chat_index() == 0
+    assert log_lines() == []
+    assert list_chat_index()[0] == []
@@ -0,0 +1,104 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from modules.chat_locks import chat_lock, async_chat_lock, ChatLockTimeout
+
+
+def hold_in_thread(chat_id, release):
+    """Take a chat's lock in another thread until `release` is set"""
+    taken = threading.Event()
+
+    def run():
+        with chat_lock(chat_id):
+            taken.set()
+            release.wait(5)
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    taken.wait(5)
+    return thread
+
+
+def test_lock_is_reentrant(data_dir):
+    with chat_lock("a"):
+        with chat_lock("a", timeout=0):
+            pass
+
+
+def test_contended_lock_times_out(data_dir):
+    release = threading.Event()
+    thread = hold_in_thread("a", release)
+    try:
+        started = time.monotonic()
+        with pytest.raises(ChatLockTimeout):
+            with chat_lock("a", timeout=0.2):
+                pass
+        assert time.monotonic() - started >= 0.2
+    finally:
+        release.set()
+        thread.join()
+
+
+def test_different_chats_do_not_block(data_dir):
+    release = threading.Event()
+    thread = hold_in_thread("a", release)
+    try:
+        with chat_lock("b", timeout=0.2):
+            pass
+    finally:
+        release.set()
+        thread.join()
+
+
+def test_writers_are_serialized(data_dir):
+    inside = []
+    overlaps = []
+
+    def write():
+        for _ in range(20):
+            with chat_lock("a"):
+                inside.append(1)
+                if len(inside) > 1:
+                    overlaps.append(1)
+                time.sleep(0.001)
+                inside.pop()
+
+    threads = [threading.Thread(target=write) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert overlaps == []
+
+
+def test_async_lock_waits_for_thread_holder(data_dir):
+    release = threading.Event()
+    thread = hold_in_thread("a", release)
+
+    async def take():
+        async with async_chat_lock("a", timeout=0.2):
+            pass
+
+    try:
+        with pytest.raises(ChatLockTimeout):
+            asyncio.run(take())
+    finally:
+        release.set()
+        thread.join()
+    asyncio.run(take())
+
+
+def test_async_lock_hold_runs_blocking_code_holding_the_lock(data_dir):
+    def blocking():
+        # A re-entry, not a wait for the async holder
+        with chat_lock("a", timeout=0):
+            return "ok"
+
+    async def run():
+        async with async_chat_lock("a") as hold:
+            return await hold.run(blocking)
+
+    assert asyncio.run(run()) == "ok"
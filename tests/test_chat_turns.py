@@ -0,0 +1,90 @@
+import pytest
+
+from config import Config
+from modules import local_model
+from modules.chat_management import complete_chat_turn, prepare_chat_turn
+from modules.local_model import turn_request
+from modules.storage import get_storage
+
+
+@pytest.fixture
+def chat(data_dir, monkeypatch):
+    monkeypatch.setattr(Config, "SCENE_MODE", "combined")
+    monkeypatch.setattr(Config, "SUMMARY_ENABLED", False)
+    monkeypatch.setattr(Config, "LOCAL_MODEL_CONTEXT_LENGTH", 4096)
+    storage = get_storage()
+    storage.save_character({
+        "id": "c1", "name": "Ada", "description": "An inventor", "personality": "curious",
+        "mood": "neutral", "emotions": {}, "opinion_of_user": "neutral", "location": "the workshop"
+    })
+    storage.create_chat({
+        "id": "chat1", "character_id": "c1", "title": "Chat", "location": "the workshop",
+        "updated_at": "2025-01-01T00:00:00", "conversations": []
+    })
+    return storage
+
+
+def test_prompt_token_breakdown_is_saved_with_the_turn(chat):
+    turn, error = prepare_chat_turn("chat1", {"message": "Hello there", "use_local_model": True})
+    assert error is None
+    complete_chat_turn(turn, {"text": "Hi!", "mood": "happy", "scene_description": "Sparks fly."})
+
+    saved = chat.get_turns("chat1")[-1]
+    assert saved["prompt_tokens"] == turn["prompt_tokens"]
+    assert saved["prompt_tokens"]["limit"] == 4096 - Config.RESPONSE_TOKEN_RESERVE
+    assert saved["prompt_tokens"]["sections"]["message"] > 0
+    assert saved["prompt_tokens"]["used"] == sum(saved["prompt_tokens"]["sections"].values())
+
+
+def add_turns(storage, count):
+    header = storage.get_chat("chat1")
+    for i in range(1, count + 1):
+        entry = {"user_message": f"message {i}", "character_response": f"reply {i}"}
+        storage.append_turn(header, entry)
+    storage.save_chat(header, entry)
+
+
+def prompt_turns(system_prompt, count):
+    return [i for i in range(1, count + 1) if f"User: message {i}\n" in system_prompt]
+
+
+def test_prompt_keeps_the_recent_window_when_summaries_are_off(chat):
+    add_turns(chat, 12)
+    turn, _ = prepare_chat_turn("chat1", {"message": "Hello", "use_local_model": True})
+    assert prompt_turns(turn["system_prompt"], 12) == [8, 9, 10, 11, 12]
+
+
+def test_prompt_holds_the_unsummarized_turns_when_summaries_are_on(chat, monkeypatch):
+    monkeypatch.setattr(Config, "SUMMARY_ENABLED", True)
+    add_turns(chat, 12)
+    turn, _ = prepare_chat_turn("chat1", {"message": "Hello", "use_local_model": True})
+    assert prompt_turns(turn["system_prompt"], 12) == list(range(1, 13))
+
+
+def test_reused_local_context_gets_the_new_state(chat, monkeypatch):
+    monkeypatch.setattr(Config, "LOCAL_MODEL_CONTEXT_REUSE", True)
+    monkeypatch.setattr(local_model, "_contexts", local_model.OrderedDict())
+
+    first, _ = prepare_chat_turn("chat1", {"message": "Hello", "use_local_model": True})
+    _, data = turn_request(first["local_context"], first["system_prompt"], first["message"])
+    assert "context" not in data
+    # What Ollama returns at the end of the turn
+    local_model._remember(first["local_context"], [1, 2, 3])
+    complete_chat_turn(first, {"text": "Hi!", "mood": "furious", "location": "the harbor",
+                               "scene_description": "Waves."})
+
+    second, _ = prepare_chat_turn("chat1", {"message": "Why so angry?", "use_local_model": True})
+    _, data = turn_request(second["local_context"], second["system_prompt"], second["message"])
+    assert data["context"] == [1, 2, 3]
+    assert "furious" in data["system"]
+    assert "Current location: the harbor" in data["system"]
+    # The prefix and the earlier turn are in the context already
+    assert not data["system"].startswith(first["system_prompt"][:100])
+    assert "User: Hello" not in data["system"]
+    assert data["system"] in second["system_prompt"]
+
+    complete_chat_turn(second, {"text": "Hmph.", "scene_description": "Gulls."})
+    saved = chat.get_turns("chat1")[-1]["prompt_tokens"]
+    assert saved["reused_context"] == 3
+    assert "prefix" not in saved["sections"]
+    assert saved["used"] == sum(saved["sections"].values())
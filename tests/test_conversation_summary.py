@@ -0,0 +1,101 @@
+import threading
+
+import pytest
+
+from config import Config
+from modules import conversation_summary
+from modules.chat_locks import chat_lock
+from modules.conversation_summary import merge_memories, schedule_summary, summarize_chat
+from modules.storage import get_storage
+
+
+@pytest.fixture
+def chat(data_dir, monkeypatch):
+    """A chat with enough older turns to summarize; model calls are counted instead of made"""
+    monkeypatch.setattr(conversation_summary, "_unsaved", {})
+    monkeypatch.setattr(Config, "SUMMARY_TRIGGER_TOKENS", 10)
+    calls = []
+
+    def generate_summary(name, summary, turns):
+        calls.append([entry["turn"] for entry in turns])
+        return "They met at the harbor.", [{"timestamp": "2025-01-02", "content": "The user saved Ada's boat."}]
+
+    monkeypatch.setattr(conversation_summary, "generate_summary", generate_summary)
+    get_storage().create_chat({
+        "id": "chat1", "character_id": "c1", "title": "Chat", "updated_at": "2025-01-01T00:00:00",
+        "memories": [{"timestamp": "2025-01-01", "content": "the user SAVED Ada's boat!"}],
+        "conversations": [
+            {"user_message": f"message {i} " * 10, "character_response": f"reply {i} " * 10} for i in range(1, 9)
+        ]
+    })
+    return calls
+
+
+def memory(content, timestamp="2025-01-01"):
+    return {"timestamp": timestamp, "content": content}
+
+
+def test_repeated_memories_are_merged():
+    merged = merge_memories(
+        [memory("Ada lost her key."), memory("The user is a sailor.")],
+        [memory("  ada lost her KEY ", "2025-02-01")]
+    )
+    assert merged == [memory("The user is a sailor."), memory("  ada lost her KEY ", "2025-02-01")]
+
+
+def test_memories_are_capped(monkeypatch):
+    monkeypatch.setattr(Config, "SUMMARY_MAX_MEMORIES", 3)
+    merged = merge_memories([memory(f"event {i}") for i in range(3)], [memory("event 3"), memory("event 4")])
+    assert [m["content"] for m in merged] == ["event 2", "event 3", "event 4"]
+
+
+def test_older_turns_are_folded_into_the_summary(chat):
+    assert summarize_chat("chat1", "Ada")
+    header = get_storage().get_chat("chat1")
+    assert chat == [[1, 2, 3]]
+    assert header["summarized_through"] == 3
+    assert header["summary"] == "They met at the harbor."
+    assert [m["content"] for m in header["memories"]] == ["The user saved Ada's boat."]
+
+
+def test_summary_is_saved_after_the_next_turn_when_the_chat_stays_locked(chat, monkeypatch):
+    monkeypatch.setattr(Config, "CHAT_LOCK_TIMEOUT", 0.05)
+    holding, release = threading.Event(), threading.Event()
+
+    def hold():
+        with chat_lock("chat1"):
+            holding.set()
+            release.wait(5)
+
+    holder = threading.Thread(target=hold)
+    holder.start()
+    holding.wait(5)
+    try:
+        assert not summarize_chat("chat1", "Ada")
+    finally:
+        release.set()
+        holder.join()
+    assert "summary" not in get_storage().get_chat("chat1")
+
+    assert summarize_chat("chat1", "Ada")
+    assert get_storage().get_chat("chat1")["summarized_through"] == 3
+    # The summary was generated (and paid for) once
+    assert chat == [[1, 2, 3]]
+
+
+class FakeExecutor:
+    def __init__(self):
+        self.submitted = []
+
+    def submit(self, fn):
+        self.submitted.append(fn)
+
+
+@pytest.mark.parametrize("enabled", [False, True])
+def test_summaries_run_only_when_enabled(chat, monkeypatch, enabled):
+    executor = FakeExecutor()
+    monkeypatch.setattr(Config, "SUMMARY_ENABLED", enabled)
+    monkeypatch.setattr(conversation_summary, "_get_executor", lambda: executor)
+    monkeypatch.setattr(conversation_summary, "_pending", set())
+    schedule_summary(get_storage().get_chat("chat1"), {"name": "Ada"})
+    assert len(executor.submitted) == int(enabled)
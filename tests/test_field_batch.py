@@ -0,0 +1,64 @@
+import threading
+import time
+
+import pytest
+
+from config import Config
+from modules import ai_integration
+from modules.ai_integration import generate_fields_concurrently
+
+
+@pytest.fixture
+def fields(monkeypatch):
+    """Replace the model calls; returns the field types called for and the peak number running"""
+    calls = []
+    peak = [0]
+    running = []
+    lock = threading.Lock()
+    monkeypatch.setattr(ai_integration, "_field_executor", None)
+    monkeypatch.setattr(Config, "FIELD_BATCH_CONCURRENCY", 2)
+
+    def generate(field_type, prompt, *args):
+        with lock:
+            calls.append(field_type)
+            running.append(field_type)
+            peak[0] = max(peak[0], len(running))
+        time.sleep(0.02)
+        with lock:
+            running.remove(field_type)
+        if field_type == "broken":
+            raise ValueError("no luck")
+        return f"{field_type} for {prompt}", None
+
+    monkeypatch.setattr(ai_integration, "generate_field_content", generate)
+    return calls, peak
+
+
+def test_fields_are_generated_once_each(fields):
+    results = sorted(generate_fields_concurrently(["name", "greeting", "name", "broken"], "a pirate"))
+    assert results == [
+        ("broken", None, "no luck"),
+        ("greeting", "greeting for a pirate", None),
+        ("name", "name for a pirate", None),
+    ]
+    assert sorted(fields[0]) == ["broken", "greeting", "name"]
+
+
+def test_requests_share_one_bounded_pool(fields):
+    batches = [threading.Thread(target=lambda: list(generate_fields_concurrently(["a", "b", "c"], "x")))
+               for _ in range(3)]
+    for batch in batches:
+        batch.start()
+    for batch in batches:
+        batch.join()
+    # No more than FIELD_BATCH_CONCURRENCY calls ran at once, across all requests
+    assert fields[1][0] <= 2
+    assert ai_integration._field_executor._max_workers == 2
+
+
+def test_stopping_early_skips_fields_not_started(fields):
+    results = generate_fields_concurrently([f"field{i}" for i in range(10)], "x")
+    next(results)
+    results.close()
+    ai_integration._field_executor.submit(lambda: None).result()
+    assert len(fields[0]) < 10
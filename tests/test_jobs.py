@@ -0,0 +1,129 @@
+import json
+import os
+import threading
+import time
+
+import pytest
+from flask import Flask
+
+from config import Config
+from modules import jobs
+from modules.jobs import (
+    JOB_CANCELLED, JOB_FAILED, JOB_QUEUED, JOB_SUCCEEDED,
+    cancel_job, recover_jobs, register_job_routes, submit_job
+)
+
+
+@pytest.fixture(autouse=True)
+def no_jobs(data_dir, monkeypatch):
+    monkeypatch.setattr(jobs, "_jobs", {})
+    monkeypatch.setattr(Config, "JOBS_PERSISTENT", False)
+
+
+@pytest.fixture
+def fake_job(monkeypatch):
+    """A "fake" job type: reports `steps` steps, waiting on `gate` before each one"""
+    gate = threading.Event()
+    gate.set()
+
+    def run(job, params):
+        if params.get("fail"):
+            raise ValueError("job failed")
+        steps = params.get("steps", 2)
+        for step in range(1, steps + 1):
+            gate.wait(5)
+            job.report(step, steps, f"step {step}")
+        return {"done": True}
+
+    monkeypatch.setitem(jobs.JOB_TYPES, "fake", (lambda params: None, run))
+    return gate
+
+
+def wait_finished(job, timeout=5):
+    deadline = time.monotonic() + timeout
+    while job.finished is None:
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+    return job
+
+
+def test_job_runs_and_reports_progress(fake_job):
+    job, error = submit_job("fake", {"steps": 3})
+    assert error is None
+    wait_finished(job)
+    assert job.status == JOB_SUCCEEDED
+    assert job.result == {"done": True}
+    assert [data["step"] for event, data in job.events if event == "progress"] == [1, 2, 3]
+
+
+def test_failed_job(fake_job):
+    job, _ = submit_job("fake", {"fail": True})
+    wait_finished(job)
+    assert job.status == JOB_FAILED
+    assert job.error == "job failed"
+
+
+def test_running_job_stops_when_cancelled(fake_job):
+    fake_job.clear()
+    job, _ = submit_job("fake", {"steps": 5})
+    cancel_job(job.id)
+    fake_job.set()
+    wait_finished(job)
+    assert job.status == JOB_CANCELLED
+    assert not any(event == "progress" for event, _ in job.events)
+
+
+def test_queue_limit(fake_job, monkeypatch):
+    monkeypatch.setattr(Config, "JOB_QUEUE_LIMIT", 0)
+    job, error = submit_job("fake", {})
+    assert job is None
+    assert error[1] == 503
+
+
+@pytest.mark.parametrize("job_type, params", [
+    ("unknown", {"prompt": "x"}),
+    ("character", {}),
+    ("character", {"prompt": "x", "include_fields": ["description", "backstory"]}),
+    ("character", {"prompt": "x", "include_fields": "greeting"}),
+    ("character_fields", {"prompt": "x", "fields": []}),
+    ("character_fields", {"prompt": "x", "fields": ["name", 3]}),
+])
+def test_invalid_jobs_are_rejected(job_type, params):
+    job, error = submit_job(job_type, params)
+    assert job is None
+    assert error[1] == 400
+
+
+def test_job_route_rejects_unknown_include_fields():
+    app = Flask(__name__)
+    register_job_routes(app)
+    response = app.test_client().post("/api/jobs", json={
+        "type": "character", "params": {"prompt": "a pirate", "include_fields": ["backstory"]}
+    })
+    assert response.status_code == 400
+    assert "backstory" in response.get_json()["message"]
+
+
+def persist(job_id, status, job_type="fake"):
+    os.makedirs(Config.JOBS_FOLDER, exist_ok=True)
+    with open(os.path.join(Config.JOBS_FOLDER, f"{job_id}.json"), "w") as f:
+        json.dump({"id": job_id, "type": job_type, "status": status, "params": {"steps": 1}}, f)
+
+
+def test_registering_routes_does_not_recover_jobs(fake_job, monkeypatch):
+    monkeypatch.setattr(Config, "JOBS_PERSISTENT", True)
+    persist("interrupted", JOB_QUEUED)
+    register_job_routes(Flask(__name__))
+    assert jobs.get_job("interrupted") is None
+
+
+def test_recover_jobs_runs_unfinished_jobs_again(fake_job, monkeypatch):
+    monkeypatch.setattr(Config, "JOBS_PERSISTENT", True)
+    persist("interrupted", "running")
+    persist("finished", JOB_SUCCEEDED)
+    recover_jobs()
+
+    wait_finished(jobs.get_job("interrupted"))
+    assert jobs.get_job("interrupted").status == JOB_SUCCEEDED
+    assert jobs.get_job("finished").status == JOB_SUCCEEDED
+    assert jobs.get_job("finished").events == []
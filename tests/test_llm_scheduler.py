@@ -0,0 +1,131 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from config import Config
+from modules import llm_scheduler
+from modules.llm_scheduler import (
+    PRIORITY_GENERATION, PRIORITY_INTERACTIVE, PRIORITY_SCENE, PROVIDER_LOCAL,
+    LLMOverloaded, get_llm_scheduler_stats, llm_priority, llm_slot, llm_slot_async
+)
+
+
+@pytest.fixture(autouse=True)
+def one_slot(monkeypatch):
+    monkeypatch.setattr(llm_scheduler, "_providers", {})
+    monkeypatch.setattr(Config, "LLM_MAX_CONCURRENCY_LOCAL", 1)
+    monkeypatch.setattr(Config, "LLM_MAX_CONCURRENCY_PER_MODEL", 0)
+    monkeypatch.setattr(Config, "LLM_RATE_LIMIT_LOCAL", 0)
+    monkeypatch.setattr(Config, "LLM_QUEUE_LIMIT", 64)
+    monkeypatch.setattr(Config, "LLM_QUEUE_TIMEOUT", 5)
+
+
+def stats():
+    return get_llm_scheduler_stats()[PROVIDER_LOCAL]
+
+
+def wait_queued(count):
+    deadline = time.monotonic() + 5
+    while stats()["queued"] < count:
+        assert time.monotonic() < deadline
+        time.sleep(0.005)
+
+
+def queue_call(order, name, priority, flow=None):
+    """Start a thread that takes a slot (once it is queued) and records its name"""
+    def run():
+        with llm_priority(priority, flow):
+            with llm_slot(PROVIDER_LOCAL):
+                order.append(name)
+
+    queued = stats()["queued"] if PROVIDER_LOCAL in llm_scheduler._providers else 0
+    thread = threading.Thread(target=run)
+    thread.start()
+    wait_queued(queued + 1)
+    return thread
+
+
+def test_queued_calls_run_by_priority_then_round_robin_across_flows():
+    order = []
+    with llm_slot(PROVIDER_LOCAL):
+        threads = [
+            queue_call(order, "bulk 1", PRIORITY_GENERATION, "job"),
+            queue_call(order, "bulk 2", PRIORITY_GENERATION, "job"),
+            queue_call(order, "other", PRIORITY_GENERATION, "other job"),
+            queue_call(order, "scene", PRIORITY_SCENE, "chat"),
+            queue_call(order, "chat", PRIORITY_INTERACTIVE, "chat"),
+        ]
+    for thread in threads:
+        thread.join()
+    assert order == ["chat", "scene", "bulk 1", "other", "bulk 2"]
+    assert stats()["priorities"]["generation"]["started"] == 4
+
+
+def test_full_queue_sheds_new_calls(monkeypatch):
+    monkeypatch.setattr(Config, "LLM_QUEUE_LIMIT", 1)
+    order = []
+    with llm_slot(PROVIDER_LOCAL):
+        waiting = queue_call(order, "queued", PRIORITY_GENERATION)
+        with pytest.raises(LLMOverloaded) as error:
+            with llm_slot(PROVIDER_LOCAL):
+                pass
+        assert error.value.retry_after >= 1
+    waiting.join()
+    assert order == ["queued"]
+    assert stats()["shed"] == 1
+
+
+def test_call_that_waits_too_long_is_rejected_and_dequeued():
+    with llm_slot(PROVIDER_LOCAL):
+        with pytest.raises(LLMOverloaded):
+            with llm_slot(PROVIDER_LOCAL, timeout=0.05):
+                pass
+        assert stats()["queued"] == 0
+        assert stats()["timeouts"] == 1
+    assert stats()["active"] == 0
+
+
+def test_per_model_limit(monkeypatch):
+    monkeypatch.setattr(Config, "LLM_MAX_CONCURRENCY_LOCAL", 2)
+    monkeypatch.setattr(Config, "LLM_MAX_CONCURRENCY_PER_MODEL", 1)
+    with llm_slot(PROVIDER_LOCAL, "a"):
+        with llm_slot(PROVIDER_LOCAL, "b", timeout=0.05):
+            assert stats()["active"] == 2
+        with pytest.raises(LLMOverloaded):
+            with llm_slot(PROVIDER_LOCAL, "a", timeout=0.05):
+                pass
+
+
+def test_async_waiters_get_freed_slots():
+    order = []
+
+    async def call(name, hold):
+        async with llm_slot_async(PROVIDER_LOCAL):
+            order.append(name)
+            await asyncio.sleep(hold)
+
+    async def run():
+        first = asyncio.ensure_future(call("first", 0.02))
+        await asyncio.sleep(0)
+        await asyncio.gather(first, call("second", 0))
+
+    asyncio.run(run())
+    assert order == ["first", "second"]
+    assert stats()["active"] == 0
+
+
+def test_cancelled_async_waiter_leaves_the_queue():
+    async def run():
+        async with llm_slot_async(PROVIDER_LOCAL):
+            waiter = asyncio.ensure_future(llm_slot_async(PROVIDER_LOCAL).__aenter__())
+            await asyncio.sleep(0.01)
+            assert stats()["queued"] == 1
+            waiter.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await waiter
+            assert stats()["queued"] == 0
+
+    asyncio.run(run())
+    assert stats()["active"] == 0
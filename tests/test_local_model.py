@@ -0,0 +1,87 @@
+import pytest
+
+from config import Config
+from modules import local_model
+from modules.local_model import ChatContext, turn_request
+
+PREFIX = "PREFIX "
+TURN_PROMPT = "Current mood: calm\n"
+SYSTEM_PROMPT = PREFIX + TURN_PROMPT + "User: earlier turn\n"
+
+
+@pytest.fixture(autouse=True)
+def no_contexts(monkeypatch):
+    monkeypatch.setattr(local_model, "_contexts", local_model.OrderedDict())
+    monkeypatch.setattr(Config, "LOCAL_MODEL_CONTEXT_REUSE", True)
+    monkeypatch.setattr(Config, "LOCAL_MODEL_CONTEXT_LENGTH", 4096)
+
+
+def chat_context(turn_count, prefix_hash="p1", turn_prompt=TURN_PROMPT, chat_id="chat1", prompt_tokens=None):
+    return ChatContext(chat_id, turn_count, prefix_hash, turn_prompt, prompt_tokens)
+
+
+def after_first_turn(context=(1, 2, 3)):
+    local_model._remember(chat_context(0), list(context))
+
+
+def test_first_turn_sends_the_whole_prompt():
+    _, data = turn_request(chat_context(0), SYSTEM_PROMPT, "Hello")
+    assert data["system"] == SYSTEM_PROMPT
+    assert data["prompt"] == "Hello"
+    assert "context" not in data
+
+
+def test_reused_context_sends_the_per_turn_part_and_the_message():
+    after_first_turn()
+    _, data = turn_request(chat_context(1), SYSTEM_PROMPT, "And then?")
+    assert data["context"] == [1, 2, 3]
+    assert data["system"] == TURN_PROMPT
+    assert data["prompt"] == "And then?"
+
+
+def test_reused_context_updates_the_prompt_token_breakdown():
+    after_first_turn()
+    prompt_tokens = {"limit": 3000, "used": 110, "dropped": {},
+                     "sections": {"message": 5, "prefix": 80, "state": 10, "conversations": 15}}
+    turn_request(chat_context(1, prompt_tokens=prompt_tokens), SYSTEM_PROMPT, "And then?")
+    assert prompt_tokens["sections"] == {"message": 5, "state": 10}
+    assert prompt_tokens["used"] == 15
+    assert prompt_tokens["reused_context"] == 3
+
+
+@pytest.mark.parametrize("chat", [
+    chat_context(2),                   # a turn was added elsewhere
+    chat_context(1, prefix_hash="p2"),  # the prefix changed
+    chat_context(1, chat_id="chat2"),   # another chat
+])
+def test_context_is_not_reused_when_it_does_not_match(chat):
+    after_first_turn()
+    _, data = turn_request(chat, SYSTEM_PROMPT, "Hello")
+    assert "context" not in data
+    assert data["system"] == SYSTEM_PROMPT
+
+
+def test_context_that_would_overflow_is_not_reused():
+    after_first_turn(range(4096))
+    _, data = turn_request(chat_context(1), SYSTEM_PROMPT, "Hello")
+    assert "context" not in data
+
+
+def test_importing_the_app_does_not_warm_up():
+    import app  # noqa: F401
+    assert local_model.get_local_model_stats()["warm_up"] == "not started"
+
+
+@pytest.mark.parametrize("enabled", [False, True])
+def test_warm_up_only_when_enabled(monkeypatch, enabled):
+    started = []
+    monkeypatch.setattr(Config, "LOCAL_MODEL_WARM_UP", enabled)
+    monkeypatch.setattr(local_model, "_stats", dict(local_model._stats))
+    monkeypatch.setattr(local_model.threading, "Thread", lambda **kwargs: started.append(kwargs) or StartedThread())
+    local_model.start_warm_up()
+    assert len(started) == int(enabled)
+
+
+class StartedThread:
+    def start(self):
+        pass
@@ -0,0 +1,153 @@
+import asyncio
+from collections import OrderedDict
+
+import pytest
+
+from config import Config
+from modules import local_model, response_cache
+from modules.character_generation import generate_character_profile
+from modules.response_cache import (
+    CACHE_BYPASS, CACHE_HIT, CACHE_MISS, CACHE_OFF,
+    cache_key, cached_generate, cached_generate_async, get_cache_mode, get_cached, store
+)
+
+
+@pytest.fixture(autouse=True)
+def empty_cache(data_dir, monkeypatch):
+    monkeypatch.setattr(Config, "RESPONSE_CACHE_ENABLED", True)
+    monkeypatch.setattr(response_cache, "_memory", OrderedDict())
+    monkeypatch.setattr(response_cache, "_memory_bytes", 0)
+    monkeypatch.setattr(response_cache, "_disk", None)
+    monkeypatch.setattr(response_cache, "_disk_bytes", 0)
+
+
+def counting(text="answer"):
+    calls = []
+
+    def generate():
+        calls.append(1)
+        return f"{text} {len(calls)}"
+
+    return generate, calls
+
+
+def test_key_covers_everything_that_determines_the_response():
+    base = cache_key("m", "system", "user", 0.7, 100)
+    assert base == cache_key("m", "system", "user", 0.7, 100)
+    assert len({
+        base,
+        cache_key("other", "system", "user", 0.7, 100),
+        cache_key("m", "other", "user", 0.7, 100),
+        cache_key("m", "system", "other", 0.7, 100),
+        cache_key("m", "system", "user", 0.8, 100),
+        cache_key("m", "system", "user", 0.7, 200),
+    }) == 6
+
+
+def test_cache_mode():
+    assert get_cache_mode({}, 0, headers={}) == CACHE_MISS
+    assert get_cache_mode({}, 0.7, headers={}) == CACHE_OFF
+    assert get_cache_mode({"cache": True}, 0.7, headers={}) == CACHE_MISS
+    assert get_cache_mode({"cache": False}, 0, headers={}) == CACHE_OFF
+    assert get_cache_mode({"cache": True}, 0.7, headers={"X-Cache-Bypass": "1"}) == CACHE_BYPASS
+
+
+def test_cache_mode_when_disabled(monkeypatch):
+    monkeypatch.setattr(Config, "RESPONSE_CACHE_ENABLED", False)
+    assert get_cache_mode({"cache": True}, 0, headers={}) == CACHE_OFF
+
+
+def test_miss_then_hit():
+    generate, calls = counting()
+    assert cached_generate(CACHE_MISS, generate, "m", "s", "u", 0) == ("answer 1", CACHE_MISS)
+    assert cached_generate(CACHE_MISS, generate, "m", "s", "u", 0) == ("answer 1", CACHE_HIT)
+    assert len(calls) == 1
+
+
+def test_off_never_stores():
+    generate, _ = counting()
+    cached_generate(CACHE_OFF, generate, "m", "s", "u", 0)
+    assert cached_generate(CACHE_OFF, generate, "m", "s", "u", 0) == ("answer 2", CACHE_OFF)
+
+
+def test_bypass_replaces_cached_response():
+    generate, _ = counting()
+    cached_generate(CACHE_MISS, generate, "m", "s", "u", 0)
+    assert cached_generate(CACHE_BYPASS, generate, "m", "s", "u", 0) == ("answer 2", CACHE_BYPASS)
+    assert cached_generate(CACHE_MISS, generate, "m", "s", "u", 0) == ("answer 2", CACHE_HIT)
+
+
+def test_rejected_response_is_not_stored():
+    generate, calls = counting()
+    cached_generate(CACHE_MISS, generate, "m", "s", "u", 0, validate=lambda text: False)
+    cached_generate(CACHE_MISS, generate, "m", "s", "u", 0)
+    assert len(calls) == 2
+
+
+def test_disk_tier_survives_restart():
+    store("k", "kept")
+    response_cache._memory.clear()
+    response_cache._memory_bytes = 0
+    assert get_cached("k") == "kept"
+    assert response_cache.get_response_cache_stats()["disk_hits"] == 1
+
+
+def test_expired_entries_are_dropped(monkeypatch):
+    store("k", "old")
+    monkeypatch.setattr(Config, "RESPONSE_CACHE_TTL", -1)
+    assert get_cached("k") is None
+    monkeypatch.setattr(Config, "RESPONSE_CACHE_TTL", 3600)
+    assert get_cached("k") is None
+
+
+def test_memory_tier_is_bounded(monkeypatch):
+    monkeypatch.setattr(Config, "RESPONSE_CACHE_MEMORY_BYTES", 10)
+    store("a", "12345")
+    store("b", "12345")
+    store("c", "12345")
+    assert list(response_cache._memory) == ["b", "c"]
+    assert response_cache._memory_bytes == 10
+
+
+def test_disk_tier_is_bounded(monkeypatch):
+    store("a", "x" * 100)
+    size = response_cache._disk["a"]
+    # Room for two entries; the slack absorbs timestamps of different lengths
+    monkeypatch.setattr(Config, "RESPONSE_CACHE_DISK_BYTES", size * 2 + size // 2)
+    store("b", "x" * 100)
+    store("c", "x" * 100)
+    assert list(response_cache._disk) == ["b", "c"]
+
+    response_cache._memory.clear()
+    assert get_cached("a") is None
+    assert get_cached("c") == "x" * 100
+
+
+def test_async_miss_then_hit():
+    calls = []
+
+    async def generate():
+        calls.append(1)
+        return "async answer"
+
+    async def run():
+        first = await cached_generate_async(CACHE_MISS, generate, "m", "s", "u", 0)
+        second = await cached_generate_async(CACHE_MISS, generate, "m", "s", "u", 0)
+        return first, second
+
+    assert asyncio.run(run()) == (("async answer", CACHE_MISS), ("async answer", CACHE_HIT))
+    assert len(calls) == 1
+
+
+def test_unparseable_character_is_not_cached(monkeypatch):
+    responses = iter(["Sorry, I can't do that.", '{"description": "A pirate", "personality": "bold"}'])
+    monkeypatch.setattr(local_model, "generate", lambda *args, **kwargs: next(responses))
+
+    profile, status = generate_character_profile("a pirate", [], use_local_model=True, cache_mode=CACHE_MISS)
+    assert profile["description"] == "Error parsing AI response. Please try again."
+    assert status == CACHE_MISS
+
+    # Generating again asks the model again, and the good answer is kept
+    profile, status = generate_character_profile("a pirate", [], use_local_model=True, cache_mode=CACHE_MISS)
+    assert profile["description"] == "A pirate"
+    assert generate_character_profile("a pirate", [], use_local_model=True, cache_mode=CACHE_MISS) == (profile, CACHE_HIT)
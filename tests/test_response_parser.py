@@ -0,0 +1,84 @@
+import pytest
+
+from modules.response_parser import DEFAULT_RESPONSE, ResponseParser, parse_response
+
+
+def feed_in_chunks(response, size):
+    parser = ResponseParser()
+    streamed = "".join(parser.feed(response[i:i + size]) for i in range(0, len(response), size))
+    return streamed, parser.close()
+
+
+def test_well_formed_response():
+    result = parse_response('{"text": "Hello", "mood": "happy", "emotions": {"joy": 0.8}}')
+    assert result["text"] == "Hello"
+    assert result["mood"] == "happy"
+    assert result["emotions"] == {"joy": 0.8}
+    assert result["location"] == DEFAULT_RESPONSE["location"]
+
+
+@pytest.mark.parametrize("size", [1, 3, 7, 1000])
+def test_streamed_text_matches_parsed_text(size):
+    response = '```json\n{"mood": "calm", "text": "Line one\\nLine \\"two\\" \\u00e9", "action": "waves"}\n```'
+    streamed, result = feed_in_chunks(response, size)
+    assert streamed == "Line one\nLine \"two\" é"
+    assert result["text"] == streamed
+    assert result["mood"] == "calm"
+    assert result["action"] == "waves"
+
+
+def test_trailing_commas_and_raw_newlines():
+    result = parse_response('{"text": "a\nb", "emotions": {"joy": 0.5,}, "mood": "sad",}')
+    assert result["text"] == "a\nb"
+    assert result["emotions"] == {"joy": 0.5}
+    assert result["mood"] == "sad"
+
+
+def test_example_object_before_response_is_skipped():
+    result = parse_response('Example: {"mood": "x"} Answer: {"text": "Hi", "mood": "shy"}')
+    assert result["text"] == "Hi"
+    assert result["mood"] == "shy"
+
+
+def test_plain_prose_is_passed_through():
+    parser = ResponseParser()
+    assert parser.feed("Just talking") == "Just talking"
+    assert parser.close()["text"] == "Just talking"
+
+
+def test_truncated_text_is_kept():
+    result = parse_response('{"mood": "happy", "text": "I was about to say')
+    assert result["text"] == "I was about to say"
+    assert result["mood"] == "happy"
+
+
+@pytest.mark.parametrize("field, fragment", [
+    ("mood", '"hap'),
+    ("location", '"the old ta'),
+    ("opinion_of_user", '"pos'),
+    ("action", '"leaning on the'),
+    ("emotions", '{"joy": 0.8, "curio'),
+])
+def test_truncated_state_field_falls_back_to_default(field, fragment):
+    result = parse_response('{"text": "Hello", "' + field + '": ' + fragment)
+    assert result["text"] == "Hello"
+    assert result[field] == DEFAULT_RESPONSE[field]
+
+
+def test_truncated_scene_description_is_kept():
+    result = parse_response('{"text": "Hello", "scene_description": "Rain streaks the')
+    assert result["scene_description"] == "Rain streaks the"
+
+
+def test_complete_fields_before_truncation_are_kept():
+    result = parse_response('{"text": "Hello", "mood": "happy", "emotions": {"joy": 1}, "location": "the ')
+    assert result["mood"] == "happy"
+    assert result["emotions"] == {"joy": 1}
+    assert result["location"] == DEFAULT_RESPONSE["location"]
+
+
+def test_response_without_text_field_uses_heuristics():
+    result = parse_response("*smiles* I'm at the harbor.")
+    assert result["action"] == "smiles"
+    assert result["location"] == "harbor"
+    assert result["mood"] == "happy"
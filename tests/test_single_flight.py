@@ -0,0 +1,107 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from modules import single_flight
+
+
+def run_concurrently(count, target):
+    results = [None] * count
+    errors = [None] * count
+
+    def run(i):
+        try:
+            results[i] = target()
+        except Exception as e:
+            errors[i] = e
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(count)]
+    for thread in threads:
+        thread.start()
+    return threads, results, errors
+
+
+def wait_for_coalesced(group, count):
+    """Wait until `count` callers have joined a running call of the group"""
+    deadline = time.monotonic() + 5
+    while single_flight.get_single_flight_stats()["groups"].get(group, {}).get("coalesced", 0) < count:
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def test_concurrent_identical_calls_share_one_call():
+    release = threading.Event()
+    calls = []
+
+    def upstream():
+        calls.append(1)
+        release.wait(5)
+        return "result"
+
+    threads, results, _ = run_concurrently(5, lambda: single_flight.do("test", "same", upstream))
+    # Let every thread join the running call before it finishes
+    wait_for_coalesced("test", 4)
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert calls == [1]
+    assert results == ["result"] * 5
+
+
+def test_errors_are_shared_and_not_kept():
+    release = threading.Event()
+
+    def failing():
+        release.wait(5)
+        raise ValueError("upstream failed")
+
+    threads, _, errors = run_concurrently(3, lambda: single_flight.do("test-error", "k", failing))
+    wait_for_coalesced("test-error", 2)
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert all(isinstance(e, ValueError) for e in errors)
+    # The next call starts afresh
+    assert single_flight.do("test-error", "k", lambda: "recovered") == "recovered"
+
+
+def test_different_keys_are_not_coalesced():
+    assert single_flight.do("test", "a", lambda: 1) == 1
+    assert single_flight.do("test", "b", lambda: 2) == 2
+
+
+def test_async_calls_share_one_task():
+    calls = []
+
+    async def upstream():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return "result"
+
+    async def run():
+        return await asyncio.gather(*(single_flight.do_async("test-async", "k", upstream) for _ in range(5)))
+
+    assert asyncio.run(run()) == ["result"] * 5
+    assert calls == [1]
+
+
+def test_async_call_survives_its_first_caller_going_away():
+    async def upstream():
+        await asyncio.sleep(0.05)
+        return "result"
+
+    async def run():
+        first = asyncio.ensure_future(single_flight.do_async("test-cancel", "k", upstream))
+        await asyncio.sleep(0)
+        second = asyncio.ensure_future(single_flight.do_async("test-cancel", "k", upstream))
+        await asyncio.sleep(0)
+        first.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        return await second
+
+    assert asyncio.run(run()) == "result"
@@ -0,0 +1,158 @@
+import pytest
+
+from config import Config
+from modules import chat_index
+from modules.storage import StorageBackend, create_storage
+from modules.storage_migration import migrate_storage
+
+BACKENDS = ["filesystem", "sqlite", "memory"]
+
+
+@pytest.fixture(params=BACKENDS)
+def storage(request, data_dir):
+    return create_storage(request.param)
+
+
+def make_chat(chat_id, updated_at="2025-01-01T00:00:00", turns=0, character_id="c1"):
+    return {
+        "id": chat_id,
+        "character_id": character_id,
+        "title": f"Chat {chat_id}",
+        "updated_at": updated_at,
+        "conversations": [
+            {"user_message": f"hi {i}", "character_response": f"reply {i}"} for i in range(1, turns + 1)
+        ]
+    }
+
+
+def test_base_class_is_abstract():
+    with pytest.raises(TypeError):
+        StorageBackend()
+
+
+def test_character_crud(storage):
+    storage.save_character({"id": "c1", "name": "Ada"})
+    assert storage.get_character("c1")["name"] == "Ada"
+    assert [c["id"] for c in storage.list_characters()] == ["c1"]
+    assert storage.delete_character("c1")
+    assert storage.get_character("c1") is None
+    assert not storage.delete_character("c1")
+
+
+def test_returned_data_is_a_copy(storage):
+    storage.save_character({"id": "c1", "name": "Ada"})
+    storage.get_character("c1")["name"] = "Changed"
+    assert storage.get_character("c1")["name"] == "Ada"
+
+
+def test_turns_are_numbered_and_paged(storage):
+    chat = make_chat("a", turns=2)
+    storage.create_chat(chat)
+    header = storage.get_chat("a")
+    assert header["turn_count"] == 2
+    assert "conversations" not in header
+
+    for i in range(3, 11):
+        entry = {"user_message": f"hi {i}", "character_response": f"reply {i}"}
+        storage.append_turn(header, entry)
+        assert entry["turn"] == i
+    storage.save_chat(header, entry)
+
+    assert storage.get_chat("a")["turn_count"] == 10
+    # Without `after` the newest turns, with it the oldest after that turn
+    assert [e["turn"] for e in storage.get_turns("a", limit=3)] == [8, 9, 10]
+    assert [e["turn"] for e in storage.get_turns("a", after=2, limit=3)] == [3, 4, 5]
+    assert [e["turn"] for e in storage.get_turns("a", before=4)] == [1, 2, 3]
+    assert storage.get_turns("a", limit=0) == []
+    assert [e["turn"] for e in storage.iter_turns("a")] == list(range(1, 11))
+
+
+def test_update_turn(storage):
+    storage.create_chat(make_chat("a", turns=3))
+    updated = storage.update_turn("a", 2, {"scene_description": "Rain"})
+    assert updated["scene_description"] == "Rain"
+    assert storage.get_turns("a", after=1, limit=1)[0]["scene_description"] == "Rain"
+    assert storage.update_turn("a", 9, {"scene_description": "x"}) is None
+
+
+def test_list_chats_pages_newest_first(storage):
+    for i in range(5):
+        storage.create_chat(make_chat(f"chat{i}", f"2025-01-0{i + 1}T00:00:00", turns=1,
+                                      character_id="c1" if i % 2 else "c2"))
+
+    page, cursor = storage.list_chats(limit=2)
+    assert [e["id"] for e in page] == ["chat4", "chat3"]
+    assert page[0]["last_message"] == "reply 1"
+    page, cursor = storage.list_chats(limit=2, cursor=cursor)
+    assert [e["id"] for e in page] == ["chat2", "chat1"]
+    page, cursor = storage.list_chats(limit=2, cursor=cursor)
+    assert [e["id"] for e in page] == ["chat0"]
+    assert cursor is None
+
+    assert [e["id"] for e in storage.list_chats(character_id="c1")[0]] == ["chat3", "chat1"]
+
+
+def test_header_save_keeps_preview(storage):
+    storage.create_chat(make_chat("a", turns=1))
+    header = storage.get_chat("a")
+    header["title"] = "Renamed"
+    storage.save_chat(header)
+
+    entry = storage.list_chats()[0][0]
+    assert entry["title"] == "Renamed"
+    assert entry["last_message"] == "reply 1"
+
+
+def test_delete_chat(storage):
+    storage.create_chat(make_chat("a", turns=2))
+    assert storage.delete_chat("a")
+    assert storage.get_chat("a") is None
+    assert storage.get_turns("a") == []
+    assert storage.list_chats()[0] == []
+    assert not storage.delete_chat("a")
+
+
+def test_import_chats(storage):
+    def turns(count):
+        for i in range(1, count + 1):
+            yield {"turn": i, "user_message": "hi", "character_response": f"reply {i}"}
+
+    storage.import_chats((make_chat(f"chat{i}", f"2025-01-0{i + 1}T00:00:00"), turns(i + 1))
+                         for i in range(3))
+
+    assert storage.get_chat("chat2")["turn_count"] == 3
+    assert [e["turn"] for e in storage.get_turns("chat2")] == [1, 2, 3]
+    entries = storage.list_chats()[0]
+    assert [e["id"] for e in entries] == ["chat2", "chat1", "chat0"]
+    assert entries[0]["last_message"] == "reply 3"
+
+
+def test_filesystem_import_writes_index_once(data_dir, monkeypatch):
+    storage = create_storage("filesystem")
+    writes = []
+    write_index = chat_index._write_index
+    monkeypatch.setattr(chat_index, "_write_index", lambda entries: writes.append(1) or write_index(entries))
+    monkeypatch.setattr(chat_index, "_append_record", lambda record: pytest.fail("appended per chat"))
+
+    storage.import_chats((make_chat(f"chat{i}"), iter([])) for i in range(50))
+
+    # One write for the missing index, one for the import
+    assert len(writes) <= 2
+    assert len(storage.list_chats()[0]) == 50
+
+
+def test_migrate_filesystem_to_sqlite(data_dir):
+    source = create_storage("filesystem")
+    source.save_character({"id": "c1", "name": "Ada"})
+    source.save_scenario({"id": "s1", "name": "Harbor"})
+    for i in range(3):
+        source.create_chat(make_chat(f"chat{i}", f"2025-01-0{i + 1}T00:00:00", turns=i + 1))
+
+    target = create_storage("sqlite", Config.SQLITE_STORAGE_PATH)
+    counts = migrate_storage(source, target, progress_every=0)
+
+    assert counts == {"characters": 1, "scenarios": 1, "chats": 3, "turns": 6}
+    assert target.get_character("c1")["name"] == "Ada"
+    assert target.get_scenario("s1")["name"] == "Harbor"
+    assert [e["turn"] for e in target.get_turns("chat2")] == [1, 2, 3]
+    assert target.list_chats()[0][0]["last_message"] == "reply 3"